@@ -0,0 +1,3 @@
+"""
+Cross-cutting infrastructure shared by services and routers
+"""
@@ -0,0 +1,113 @@
+"""
+Batch audit of invoice amounts
+
+Rechecks the stored tax breakdown of every indexed invoice at once, for
+audits and GST rate changes. The amount columns are checked as NumPy arrays
+when the optional ``numpy`` package is installed (a million invoices take
+well under a second); otherwise row by row.
+"""
+import math
+from typing import Any, Dict, List, Sequence
+
+from app.core.tax import GST_RATE
+
+try:
+    import numpy
+except ImportError:  # Optional dependency
+    numpy = None
+
+
+# Checks in report order:
+#   missing_breakdown  taxable amount, CGST or SGST not recorded
+#   negative           an amount below zero
+#   cgst / sgst        not half the GST rate of the taxable amount
+#   split              CGST and SGST differ
+#   exceeds_total      taxable amount plus GST above the invoice total
+CHECKS = ('missing_breakdown', 'negative', 'cgst', 'sgst', 'split', 'exceeds_total')
+
+AMOUNT_COLUMNS = ('total_amount', 'taxable_amount', 'cgst', 'sgst')
+
+# Slack for float storage of amounts rounded to the paisa
+_EPSILON = 1e-6
+
+
+def _nan(value: Any) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _flags_numpy(columns: Dict[str, Sequence], rate: float, tolerance: float) -> Dict[str, Any]:
+    total, taxable, cgst, sgst = (numpy.asarray(columns[name], dtype=float) for name in AMOUNT_COLUMNS)
+    limit = tolerance + _EPSILON
+    half_gst = taxable * (rate / 2)
+    with numpy.errstate(invalid='ignore'):
+        return {
+            'missing_breakdown': numpy.isnan(taxable) | numpy.isnan(cgst) | numpy.isnan(sgst),
+            'negative': (total < 0) | (taxable < 0) | (cgst < 0) | (sgst < 0),
+            'cgst': numpy.abs(cgst - half_gst) > limit,
+            'sgst': numpy.abs(sgst - half_gst) > limit,
+            'split': numpy.abs(cgst - sgst) > limit,
+            'exceeds_total': taxable + cgst + sgst > total + limit,
+        }
+
+
+def _flags_python(columns: Dict[str, Sequence], rate: float, tolerance: float) -> Dict[str, List[bool]]:
+    limit = tolerance + _EPSILON
+    flags: Dict[str, List[bool]] = {check: [] for check in CHECKS}
+    for values in zip(*(columns[name] for name in AMOUNT_COLUMNS)):
+        total, taxable, cgst, sgst = (_nan(value) for value in values)
+        half_gst = taxable * (rate / 2)
+        # NaN compares False, like the NumPy version
+        flags['missing_breakdown'].append(math.isnan(taxable) or math.isnan(cgst) or math.isnan(sgst))
+        flags['negative'].append(total < 0 or taxable < 0 or cgst < 0 or sgst < 0)
+        flags['cgst'].append(abs(cgst - half_gst) > limit)
+        flags['sgst'].append(abs(sgst - half_gst) > limit)
+        flags['split'].append(abs(cgst - sgst) > limit)
+        flags['exceeds_total'].append(taxable + cgst + sgst > total + limit)
+    return flags
+
+
+def audit_amounts(
+    columns: Dict[str, Sequence],
+    gst_rate: float = float(GST_RATE),
+    tolerance: float = 0.01,
+    max_examples: int = 100
+) -> Dict[str, Any]:
+    """
+    Check the tax breakdown of many invoices
+
+    Args:
+        columns: 'id' plus AMOUNT_COLUMNS, one equal-length sequence each
+            (None for amounts that were not recorded)
+        gst_rate: GST rate the amounts should follow, split equally into
+            CGST and SGST
+        tolerance: Allowed difference in rupees
+        max_examples: Invoice IDs listed per failed check
+
+    Returns:
+        checked (invoice count), mismatches (count per check), examples
+        (invoice IDs per failed check) and the engine used
+    """
+    ids = columns['id']
+    if numpy is not None:
+        flags = _flags_numpy(columns, gst_rate, tolerance)
+        positions = {check: numpy.flatnonzero(flags[check]) for check in CHECKS}
+        counts = {check: int(len(found)) for check, found in positions.items()}
+        examples = {check: [ids[i] for i in found[:max_examples]] for check, found in positions.items()}
+        engine = 'numpy'
+    else:
+        flags = _flags_python(columns, gst_rate, tolerance)
+        counts = {check: sum(flags[check]) for check in CHECKS}
+        examples = {
+            check: [ids[i] for i, flagged in enumerate(flags[check]) if flagged][:max_examples]
+            for check in CHECKS
+        }
+        engine = 'python'
+
+    return {
+        'checked': len(ids),
+        'gst_rate': gst_rate,
+        'tolerance': tolerance,
+        'mismatches': {check: count for check, count in counts.items() if count},
+        'examples': {check: found for check, found in examples.items() if found},
+        'engine': engine,
+    }
@@ -0,0 +1,113 @@
+"""
+Conditional GET helpers for file downloads
+
+Strong ETags and Last-Modified validators, If-None-Match/If-Modified-Since
+304 handling and Cache-Control policy. Range requests (including If-Range)
+are served by Starlette's FileResponse using the ETag set here.
+"""
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from functools import lru_cache
+from typing import Optional
+
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+
+# Separate-mode invoices never change once written
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+# Master-mode files change with every invoice; clients must revalidate
+REVALIDATE = "private, no-cache"
+
+
+def stat_etag(stat_result: os.stat_result) -> str:
+    """Strong ETag from inode, modification time and size"""
+    return f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+@lru_cache(maxsize=1024)
+def _hash_file(path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def content_etag(path: str, stat_result: Optional[os.stat_result] = None) -> str:
+    """Strong ETag from the file's SHA-256 (cached per mtime/size)"""
+    stat_result = stat_result or os.stat(path)
+    return f'"{_hash_file(path, stat_result.st_mtime_ns, stat_result.st_size)}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for GET)"""
+    if header.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def is_not_modified(headers: Headers, etag: str, mtime: float) -> bool:
+    """Whether the client's cached copy is still current"""
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        # If-Modified-Since is ignored when If-None-Match is present
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def file_response(
+    request: Request,
+    path: str,
+    filename: str,
+    media_type: str,
+    immutable: bool = False,
+    use_content_hash: bool = False
+) -> Response:
+    """
+    FileResponse with validators, 304 handling and cache policy
+
+    Args:
+        request: Incoming request (for conditional and Range headers)
+        path: File to serve
+        filename: Download filename
+        media_type: Content type
+        immutable: Whether the file never changes once written
+        use_content_hash: Derive the ETag from the file contents instead of
+            inode/mtime/size, so identical rebuilds keep the same ETag
+    """
+    stat_result = os.stat(path)
+    etag = content_etag(path, stat_result) if use_content_hash else stat_etag(stat_result)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(stat_result.st_mtime, usegmt=True),
+        'Cache-Control': IMMUTABLE if immutable else REVALIDATE,
+    }
+
+    if request.method in ('GET', 'HEAD') and is_not_modified(request.headers, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(
+        path=path,
+        filename=filename,
+        media_type=media_type,
+        headers=headers,
+        stat_result=stat_result
+    )
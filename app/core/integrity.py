@@ -0,0 +1,514 @@
+"""
+Workbook integrity checks and repair
+
+Saves go through xlsx.atomic_write, so a crash can no longer leave a
+truncated master workbook behind. For files damaged some other way (a full
+disk before that change, a bad copy or sync), this module confirms a
+workbook is sane without loading it into openpyxl, and rebuilds a valid
+workbook from the sheets that can still be read.
+
+Usage:
+    python -m app.core.integrity check generated_invoices/all_invoices.xlsx
+    python -m app.core.integrity repair broken.xlsx repaired.xlsx
+"""
+import argparse
+import io
+import json
+import re
+import struct
+import sys
+import zipfile
+import zlib
+from typing import Any, Dict, List, Optional, Set
+from xml.etree import ElementTree
+from xml.parsers import expat
+
+from app.core.xlsx import (
+    _DEFINED_NAME_RE, _OVERRIDE_RE, _SHEET_RE, _filter_relationships,
+    atomic_write, list_sheets, read_relationships, rels_path, resolve_target, workbook_part,
+)
+
+CHUNK_SIZE = 64 * 1024
+
+# Package parts without which no sheet can be opened
+REQUIRED_PARTS = ('[Content_Types].xml', '_rels/.rels')
+
+# Workbook parts that sheets depend on; if one is lost the structure is rebuilt
+_SHARED_BOOK_RELS = ('styles', 'sharedStrings')
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_LOCAL_SIGNATURE = b'PK\x03\x04'
+_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+
+
+class WorkbookUnrecoverableError(ValueError):
+    """Raised when not even the workbook structure can be salvaged"""
+
+
+def _is_xml(name: str) -> bool:
+    return name.endswith(('.xml', '.rels'))
+
+
+def _xml_error(stream) -> Optional[str]:
+    """Why a stream is not well-formed XML (parsed incrementally, no tree built)"""
+    parser = expat.ParserCreate()
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            parser.Parse(chunk, not chunk)
+            if not chunk:
+                return None
+    except expat.ExpatError as e:
+        return f"malformed XML: {e}"
+
+
+def _member_error(zf: zipfile.ZipFile, name: str) -> Optional[str]:
+    """Why a zip member cannot be used (bad CRC, bad deflate data, bad XML)"""
+    try:
+        with zf.open(name) as stream:
+            if _is_xml(name):
+                return _xml_error(stream)
+            while stream.read(CHUNK_SIZE):
+                pass
+    except (zipfile.BadZipFile, zlib.error, EOFError, OSError) as e:
+        return f"unreadable: {e}"
+    return None
+
+
+def check_workbook(path: str, deep: bool = True) -> Dict[str, Any]:
+    """
+    Check a workbook without loading it
+
+    The quick check reads the zip central directory and the workbook part
+    and confirms every sheet part is present. The deep check also streams
+    every member, which verifies its CRC and that XML parts are well-formed.
+
+    Returns:
+        ok, errors (problems outside the sheets) and sheets (name, part, ok
+        and error of each sheet)
+    """
+    report: Dict[str, Any] = {'ok': False, 'errors': [], 'sheets': []}
+    try:
+        zf = zipfile.ZipFile(path)
+    except (zipfile.BadZipFile, OSError) as e:
+        report['errors'].append(f"not a readable zip file: {e}")
+        return report
+
+    with zf:
+        members = set(zf.namelist())
+        report['errors'] += [f"{part}: missing" for part in REQUIRED_PARTS if part not in members]
+        try:
+            book = workbook_part(zf)
+            sheets = list_sheets(zf)
+        except (KeyError, ElementTree.ParseError, zipfile.BadZipFile, zlib.error) as e:
+            report['errors'].append(f"workbook part unreadable: {e}")
+            return report
+
+        sheet_parts = set()
+        for name, _, part in sheets:
+            if part not in members:
+                error = 'missing'
+            else:
+                error = _member_error(zf, part) if deep else None
+            sheet_parts.add(part)
+            report['sheets'].append({'name': name, 'part': part, 'ok': error is None, 'error': error})
+
+        if deep:
+            for name in sorted(members - sheet_parts):
+                error = _member_error(zf, name)
+                if error:
+                    report['errors'].append(f"{name}: {error}")
+
+    report['ok'] = not report['errors'] and bool(sheets) and all(sheet['ok'] for sheet in report['sheets'])
+    return report
+
+
+def _scan_local_members(data: bytes) -> Dict[str, bytes]:
+    """
+    Members found by walking local file headers
+
+    Used when the central directory at the end of the file is gone. Only
+    complete members whose CRC matches are returned.
+    """
+    members: Dict[str, bytes] = {}
+    offset = data.find(_LOCAL_SIGNATURE)
+    while offset >= 0 and offset + _LOCAL_HEADER.size <= len(data):
+        (_, _, flags, method, _, _, crc, compressed_size, _,
+         name_length, extra_length) = _LOCAL_HEADER.unpack_from(data, offset)
+        name_start = offset + _LOCAL_HEADER.size
+        name = data[name_start:name_start + name_length].decode('utf-8' if flags & 0x800 else 'cp437')
+        start = name_start + name_length + extra_length
+        content, end = None, None
+
+        if flags & 0x08 and method == zipfile.ZIP_DEFLATED:
+            # Sizes and CRC follow the data; find its end by inflating it
+            inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+            try:
+                content = inflater.decompress(data[start:])
+            except zlib.error:
+                content = None
+            if content is not None and inflater.eof:
+                end = len(data) - len(inflater.unused_data)
+                if data[end:end + 4] == _DESCRIPTOR_SIGNATURE:
+                    end += 4
+                if end + 12 <= len(data):
+                    crc = struct.unpack_from('<I', data, end)[0]
+                    end += 12
+                else:
+                    content = None
+        elif not flags & 0x08 and method in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) \
+                and compressed_size != 0xFFFFFFFF and start + compressed_size <= len(data):
+            end = start + compressed_size
+            raw = data[start:end]
+            try:
+                content = raw if method == zipfile.ZIP_STORED else zlib.decompress(raw, -zlib.MAX_WBITS)
+            except zlib.error:
+                content = None
+
+        if content is not None and zlib.crc32(content) == crc:
+            members[name] = content
+        offset = data.find(_LOCAL_SIGNATURE, end if end is not None else offset + 4)
+    return members
+
+
+def salvage_members(path: str) -> Dict[str, bytes]:
+    """
+    Every member of a zip file that can still be read intact
+
+    Uses the central directory when it is readable, else scans the file's
+    local headers; members with a bad CRC or bad deflate data are left out.
+    """
+    try:
+        zf = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        with open(path, 'rb') as f:
+            return _scan_local_members(f.read())
+
+    members = {}
+    with zf:
+        for info in zf.infolist():
+            try:
+                members[info.filename] = zf.read(info)
+            except (zipfile.BadZipFile, zlib.error, EOFError, OSError):
+                continue
+    return members
+
+
+def _broken_references(zf: zipfile.ZipFile, start: str, members: Set[str]) -> List[str]:
+    """Internal parts reachable from start that are missing"""
+    missing, seen, pending = [], set(), [start]
+    while pending:
+        part = pending.pop()
+        if part in seen:
+            continue
+        seen.add(part)
+        if part not in members:
+            missing.append(part)
+            continue
+        for rel in read_relationships(zf, part):
+            if not rel['external']:
+                pending.append(resolve_target(part, rel['target']))
+    return missing
+
+
+def _closure(zf: zipfile.ZipFile, start: str) -> Set[str]:
+    """A part plus every internal part reachable through its relationships"""
+    parts, pending = set(), [start]
+    while pending:
+        part = pending.pop()
+        if part in parts:
+            continue
+        parts.add(part)
+        parts.add(rels_path(part))
+        for rel in read_relationships(zf, part):
+            if not rel['external']:
+                pending.append(resolve_target(part, rel['target']))
+    return parts
+
+
+def _rebuilt_workbook_xml(xml: str, keep: List[int], keep_rel_ids: Set[str]) -> str:
+    """Workbook part listing only the kept sheets (indices in the original tab order)"""
+    xml = _SHEET_RE.sub(
+        lambda m: m.group(0) if any(f'"{rel_id}"' in m.group(0) for rel_id in keep_rel_ids) else '',
+        xml
+    )
+    positions = {old: new for new, old in enumerate(keep)}
+
+    def defined_name(match):
+        attributes, value = match.group(1), match.group(2)
+        local = re.search(r'\blocalSheetId="(\d+)"', attributes)
+        if local:
+            if int(local.group(1)) not in positions:
+                return ''
+            attributes = attributes.replace(local.group(0), f'localSheetId="{positions[int(local.group(1))]}"')
+        return f"<definedName{attributes}>{value}</definedName>"
+
+    xml = _DEFINED_NAME_RE.sub(defined_name, xml)
+    xml = re.sub(r'<definedNames>\s*</definedNames>', '', xml)
+    xml = re.sub(r'\b(activeTab|firstSheet)="\d+"', r'\1="0"', xml)
+    # calcChain is dropped, so let Excel rebuild it
+    if '<calcPr' in xml and 'fullCalcOnLoad' not in xml:
+        xml = xml.replace('<calcPr', '<calcPr fullCalcOnLoad="1"', 1)
+    return xml
+
+
+_CONTENT_TYPES = [
+    (re.compile(r'xl/workbook\.xml$'), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml'),
+    (re.compile(r'xl/worksheets/sheet\d+\.xml$'), 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'),
+    (re.compile(r'xl/styles\.xml$'), 'application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml'),
+    (re.compile(r'xl/sharedStrings\.xml$'), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml'),
+    (re.compile(r'xl/theme/theme\d+\.xml$'), 'application/vnd.openxmlformats-officedocument.theme+xml'),
+    (re.compile(r'xl/drawings/drawing\d+\.xml$'), 'application/vnd.openxmlformats-officedocument.drawing+xml'),
+    (re.compile(r'docProps/core\.xml$'), 'application/vnd.openxmlformats-package.core-properties+xml'),
+    (re.compile(r'docProps/app\.xml$'), 'application/vnd.openxmlformats-officedocument.extended-properties+xml'),
+]
+
+_DEFAULT_CONTENT_TYPES = {
+    'rels': 'application/vnd.openxmlformats-package.relationships+xml',
+    'xml': 'application/xml',
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'jpg': 'image/jpeg',
+    'gif': 'image/gif',
+}
+
+_MINIMAL_STYLES = (
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+_SHEET_PART_RE = re.compile(r'xl/worksheets/sheet(\d+)\.xml$')
+_STYLED_TAG_RE = re.compile(r'<(?:c|row|col)\b[^>]*>')
+_STYLE_ATTRIBUTE_RE = re.compile(r'\s(?:s|style|customFormat)="[^"]*"')
+_REL_ELEMENT_RE = re.compile(
+    r'<(drawing|legacyDrawing|legacyDrawingHF|picture|tableParts)\b[^>]*?(?:/>|>.*?</\1>)'
+    r'|<hyperlink\b[^>]*\br:id="[^"]*"[^>]*?(?:/>|>.*?</hyperlink>)',
+    re.DOTALL
+)
+_EMPTY_HYPERLINKS_RE = re.compile(r'<hyperlinks>\s*</hyperlinks>')
+_RELATIONSHIP_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+
+def _relationships_xml(relationships: List[tuple]) -> str:
+    items = ''.join(
+        f'<Relationship Id="{rel_id}" Type="{rel_type}" Target="{target}"/>'
+        for rel_id, rel_type, target in relationships
+    )
+    return f'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{items}</Relationships>'
+
+
+def _content_types_xml(names: Set[str]) -> str:
+    defaults = ''.join(
+        f'<Default Extension="{extension}" ContentType="{content_type}"/>'
+        for extension, content_type in _DEFAULT_CONTENT_TYPES.items()
+    )
+    overrides = ''.join(
+        f'<Override PartName="/{name}" ContentType="{content_type}"/>'
+        for name in sorted(names)
+        for pattern, content_type in _CONTENT_TYPES if pattern.match(name)
+    )
+    return f'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">{defaults}{overrides}</Types>'
+
+
+def _rebuild_package(members: Dict[str, bytes]) -> Dict[str, bytes]:
+    """
+    New workbook, package and content-type parts around salvaged sheets
+
+    A save cut short loses the parts written last, which are exactly these
+    (plus styles; cells are unstyled then). Sheets are named "Recovered N"
+    in part order, since the names were only stored in the workbook part.
+    """
+    members = dict(members)
+    has_styles = 'xl/styles.xml' in members
+    if not has_styles:
+        members['xl/styles.xml'] = _MINIMAL_STYLES.encode('utf-8')
+
+    sheets = sorted(
+        (int(match.group(1)), name) for name in members
+        for match in [_SHEET_PART_RE.match(name)] if match
+    )
+    book_rels, sheet_elements = [], []
+    for position, (number, part) in enumerate(sheets, start=1):
+        xml = members[part].decode('utf-8')
+        if not has_styles:
+            xml = _STYLED_TAG_RE.sub(lambda m: _STYLE_ATTRIBUTE_RE.sub('', m.group(0)), xml)
+        members[part] = xml.encode('utf-8')
+        book_rels.append((f"rId{position}", f"{_RELATIONSHIP_TYPE}/worksheet", f"worksheets/sheet{number}.xml"))
+        sheet_elements.append(f'<sheet name="Recovered {position}" sheetId="{position}" r:id="rId{position}"/>')
+    shared = [
+        ('styles', 'xl/styles.xml'), ('sharedStrings', 'xl/sharedStrings.xml'), ('theme', 'xl/theme/theme1.xml'),
+    ]
+    for rel_type, part in shared:
+        if part in members:
+            book_rels.append((f"rId{len(book_rels) + 1}", f"{_RELATIONSHIP_TYPE}/{rel_type}", part[3:]))
+
+    members['xl/workbook.xml'] = (
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        f'xmlns:r="{_RELATIONSHIP_TYPE}"><sheets>{"".join(sheet_elements)}</sheets>'
+        '<calcPr fullCalcOnLoad="1"/></workbook>'
+    ).encode('utf-8')
+    members['xl/_rels/workbook.xml.rels'] = _relationships_xml(book_rels).encode('utf-8')
+    package_rels = [('rId1', f"{_RELATIONSHIP_TYPE}/officeDocument", 'xl/workbook.xml')]
+    if 'docProps/core.xml' in members:
+        package_rels.append((
+            'rId2', 'http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties',
+            'docProps/core.xml'
+        ))
+    if 'docProps/app.xml' in members:
+        package_rels.append(('rId3', f"{_RELATIONSHIP_TYPE}/extended-properties", 'docProps/app.xml'))
+    members['_rels/.rels'] = _relationships_xml(package_rels).encode('utf-8')
+    members['[Content_Types].xml'] = _content_types_xml(set(members)).encode('utf-8')
+    return members
+
+
+def _detached(sheet_xml: bytes) -> bytes:
+    """Sheet without the elements that point into its relationships part"""
+    xml = _REL_ELEMENT_RE.sub('', sheet_xml.decode('utf-8'))
+    return _EMPTY_HYPERLINKS_RE.sub('', xml).encode('utf-8')
+
+
+def _staged(members: Dict[str, bytes]) -> zipfile.ZipFile:
+    """Salvaged parts as an in-memory zip, so the package helpers can navigate them"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as staged:
+        for name, content in members.items():
+            staged.writestr(name, content)
+    return zipfile.ZipFile(buffer)
+
+
+def _structure_intact(members: Dict[str, bytes]) -> bool:
+    """Whether the package, workbook and shared parts survived"""
+    if any(part not in members for part in REQUIRED_PARTS):
+        return False
+    with _staged(members) as zf:
+        book = workbook_part(zf)
+        if book not in members or rels_path(book) not in members:
+            return False
+        return all(
+            resolve_target(book, rel['target']) in members
+            for rel in read_relationships(zf, book) if rel['type'] in _SHARED_BOOK_RELS
+        )
+
+
+def repair_workbook(source: str, destination: str) -> Dict[str, Any]:
+    """
+    Write a valid workbook holding every sheet of source that can be read
+
+    Sheets whose part is lost or damaged are dropped from the workbook;
+    sheets that only lost a referenced part (a drawing or image) keep their
+    cells without it. When the workbook structure itself was lost (a save cut
+    short), it is rebuilt around the intact sheet parts.
+
+    Returns:
+        recovered, dropped and detached (kept without drawings) sheet names,
+        and whether the structure was rebuilt
+
+    Raises:
+        WorkbookUnrecoverableError: No sheet could be recovered
+    """
+    members = salvage_members(source)
+    for name in [name for name in members if _is_xml(name)]:
+        if _xml_error(io.BytesIO(members[name])):
+            del members[name]
+    rebuilt = not _structure_intact(members)
+    if rebuilt:
+        members = _rebuild_package(members)
+
+    detached = []
+    with _staged(members) as zf:
+        for name, _, part in list_sheets(zf):
+            if part in members and _broken_references(zf, part, set(members)):
+                members[part] = _detached(members[part])
+                members.pop(rels_path(part), None)
+                detached.append(name)
+
+    with _staged(members) as zf:
+        names = set(members)
+        book = workbook_part(zf)
+        book_rels = read_relationships(zf, book)
+
+        recovered, dropped, keep = [], [], []
+        keep_rel_ids = set()
+        for index, (name, rel_id, part) in enumerate(list_sheets(zf)):
+            if part in names:
+                recovered.append(name)
+                keep.append(index)
+                keep_rel_ids.add(rel_id)
+            else:
+                dropped.append(name)
+        if not recovered:
+            raise WorkbookUnrecoverableError("No sheet could be recovered")
+
+        sheet_rel_ids = {rel['id'] for rel in book_rels if rel['type'] in ('worksheet', 'chartsheet')}
+        keep_book_rels = keep_rel_ids | {
+            rel['id'] for rel in book_rels
+            if rel['id'] not in sheet_rel_ids and rel['type'] != 'calcChain'
+            and (rel['external'] or resolve_target(book, rel['target']) in names)
+        }
+
+        parts = {'[Content_Types].xml', rels_path(''), book, rels_path(book)}
+        for rel in read_relationships(zf, ''):
+            if rel['type'] != 'officeDocument' and not rel['external']:
+                parts |= _closure(zf, resolve_target('', rel['target']))
+        for rel in book_rels:
+            if rel['id'] in keep_book_rels and not rel['external']:
+                parts |= _closure(zf, resolve_target(book, rel['target']))
+        parts &= names
+
+        rewritten = {
+            book: _rebuilt_workbook_xml(zf.read(book).decode('utf-8'), keep, keep_rel_ids),
+            rels_path(book): _filter_relationships(zf.read(rels_path(book)).decode('utf-8'), keep_book_rels),
+            rels_path(''): _filter_relationships(
+                zf.read(rels_path('')).decode('utf-8'),
+                {rel['id'] for rel in read_relationships(zf, '')
+                 if rel['external'] or resolve_target('', rel['target']) in parts}
+            ),
+            '[Content_Types].xml': _OVERRIDE_RE.sub(
+                lambda m: m.group(0) if m.group(1).lstrip('/') in parts else '',
+                zf.read('[Content_Types].xml').decode('utf-8')
+            ),
+        }
+
+    order = ['[Content_Types].xml', rels_path(''), book, rels_path(book)]
+    order += sorted(parts - set(order))
+    with atomic_write(destination) as tmp_path:
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as out:
+            for name in order:
+                out.writestr(name, rewritten[name].encode('utf-8') if name in rewritten else members[name])
+
+    return {'recovered': recovered, 'dropped': dropped, 'detached': detached, 'rebuilt_structure': rebuilt}
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check or repair an xlsx workbook")
+    commands = parser.add_subparsers(dest='command', required=True)
+    check = commands.add_parser('check', help="Check a workbook")
+    check.add_argument('path')
+    check.add_argument('--quick', action='store_true', help="Skip reading every part")
+    repair = commands.add_parser('repair', help="Rebuild a workbook from its readable sheets")
+    repair.add_argument('source')
+    repair.add_argument('destination')
+    args = parser.parse_args(argv)
+
+    if args.command == 'check':
+        report = check_workbook(args.path, deep=not args.quick)
+        print(json.dumps(report, indent=2))
+        return 0 if report['ok'] else 1
+    try:
+        report = repair_workbook(args.source, args.destination)
+    except WorkbookUnrecoverableError as e:
+        print(f"Cannot repair {args.source}: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+Invoice ledger
+
+A CSV file next to the master workbook with one row per invoice sheet
+(number, date, customer, taxable amount, CGST, SGST, total). Each invoice
+appends a single row, so the ledger never requires opening the other sheets;
+the xlsx version is streamed from the CSV on demand.
+"""
+import csv
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List
+
+from app.core.tax import compute
+
+COLUMNS = [
+    'invoice_number', 'invoice_date', 'sheet_name', 'customer_name',
+    'taxable_amount', 'cgst', 'sgst', 'total_amount', 'recorded_at',
+]
+
+HEADINGS = [
+    'Invoice No.', 'Date', 'Sheet', 'Customer',
+    'Taxable Amount', 'CGST', 'SGST', 'Total', 'Recorded At',
+]
+
+_AMOUNT_COLUMNS = ('taxable_amount', 'cgst', 'sgst', 'total_amount')
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def ledger_entry(
+    invoice_number: Any = None,
+    invoice_date: Any = None,
+    sheet_name: str = '',
+    customer_name: Any = None,
+    gross_amount: Any = None,
+    total_amount: Any = None
+) -> Dict[str, Any]:
+    """
+    Ledger row for one invoice
+
+    Values a template does not map are left blank (amounts as 0).
+
+    Args:
+        gross_amount: Service amount including GST (the template's G18); the
+            taxable amount and CGST/SGST are derived from it by the tax
+            engine, the way the template's formulas do
+        total_amount: Invoice total (F33)
+    """
+    amounts = compute(gross_amount, total_amount or 0).amounts()
+    return {
+        'invoice_number': invoice_number or '',
+        'invoice_date': invoice_date or '',
+        'sheet_name': sheet_name,
+        'customer_name': customer_name or '',
+        'taxable_amount': amounts['taxable_amount'],
+        'cgst': amounts['cgst'],
+        'sgst': amounts['sgst'],
+        'total_amount': amounts['total_amount'],
+        'recorded_at': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+class Ledger:
+    """Append-only CSV ledger of invoice sheets"""
+
+    _locks: Dict[str, threading.Lock] = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._locks_guard:
+            self._lock = self._locks.setdefault(os.path.abspath(path), threading.Lock())
+
+    @classmethod
+    def for_master(cls, master_file: str) -> 'Ledger':
+        """Ledger stored beside a master workbook (all_invoices_ledger.csv)"""
+        return cls(f"{os.path.splitext(master_file)[0]}_ledger.csv")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def append(self, entry: Dict[str, Any]):
+        """Append one row (writing the header first for a new ledger)"""
+        self.extend([entry])
+
+    def extend(self, entries: List[Dict[str, Any]]):
+        """Append several rows"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock, open(self.path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction='ignore')
+            if f.tell() == 0:
+                writer.writeheader()
+            writer.writerows(entries)
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        """Ledger rows in order, with amounts as numbers"""
+        if not self.exists():
+            return
+        with open(self.path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                for column in _AMOUNT_COLUMNS:
+                    row[column] = _to_float(row.get(column))
+                yield row
+
+    def rebuild(self, master_file: str, cells: Dict[str, str]) -> int:
+        """
+        Recreate the ledger from every sheet of a master workbook
+
+        Only needed once, for master files written before the ledger existed.
+        The workbook is read in read-only mode, one sheet at a time.
+
+        Args:
+            master_file: Master workbook
+            cells: Cell reference of the ledger_entry() arguments the
+                template maps
+
+        Returns:
+            Number of rows written
+        """
+        import openpyxl
+        from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+        positions = {}
+        for name, ref in cells.items():
+            column, row = coordinate_from_string(ref)
+            positions[name] = (row, column_index_from_string(column))
+
+        entries = []
+        # Without an invoice number cell, invoice sheets cannot be told from
+        # unfilled template copies
+        if 'invoice_number' in positions:
+            min_row = min(row for row, _ in positions.values())
+            max_row = max(row for row, _ in positions.values())
+            max_col = max(col for _, col in positions.values())
+            wb = openpyxl.load_workbook(master_file, read_only=True, data_only=False)
+            try:
+                for ws in wb.worksheets:
+                    grid = list(ws.iter_rows(min_row=min_row, max_row=max_row, max_col=max_col, values_only=True))
+                    values = {}
+                    for name, (row, col) in positions.items():
+                        line = grid[row - min_row] if row - min_row < len(grid) else ()
+                        values[name] = line[col - 1] if col - 1 < len(line) else None
+                    # Unfilled template copies have no invoice number
+                    if values.get('invoice_number'):
+                        entries.append(ledger_entry(sheet_name=ws.title, **values))
+            finally:
+                wb.close()
+
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(entries)
+            os.replace(tmp_path, self.path)
+        return len(entries)
+
+    def xlsx(self) -> str:
+        """
+        Path of the ledger as a workbook, rebuilt only when the CSV has changed
+
+        The workbook is written beside the CSV (all_invoices_ledger.xlsx).
+        """
+        path = f"{os.path.splitext(self.path)[0]}.xlsx"
+        source = os.stat(self.path)
+        try:
+            if os.stat(path).st_mtime_ns >= source.st_mtime_ns:
+                return path
+        except FileNotFoundError:
+            pass
+
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        self.export_xlsx(tmp_path)
+        os.replace(tmp_path, path)
+        # Stamp with the CSV's mtime so a row appended meanwhile triggers a rebuild
+        os.utime(path, ns=(source.st_atime_ns, source.st_mtime_ns))
+        return path
+
+    def export_xlsx(self, destination: str):
+        """Write the ledger as a workbook, streaming rows (write-only mode)"""
+        import openpyxl
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet('Ledger')
+        ws.freeze_panes = 'A2'
+        for letter, width in zip('ABCDEFGHI', (18, 12, 18, 32, 15, 12, 12, 14, 20)):
+            ws.column_dimensions[letter].width = width
+
+        bold = Font(bold=True)
+        header = []
+        for heading in HEADINGS:
+            cell = WriteOnlyCell(ws, value=heading)
+            cell.font = bold
+            header.append(cell)
+        ws.append(header)
+        for row in self.rows():
+            ws.append([row.get(column) for column in COLUMNS])
+        wb.save(destination)
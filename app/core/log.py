@@ -0,0 +1,151 @@
+"""
+Structured, leveled logging with request IDs
+
+Records are handed to a queue on the request thread and formatted and written
+by a background listener, so log I/O never blocks invoice processing.
+Customer details are masked unless LOG_CUSTOMER_DATA is enabled.
+
+Usage:
+    from app.core.log import get_logger
+    logger = get_logger(__name__)
+    logger.info("Invoice sheet added", extra={'sheet': sheet_name})
+"""
+import atexit
+import copy
+import json
+import logging
+import queue
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from config import settings
+
+
+LOGGER_ROOT = 'hilldrive'
+
+request_id_var: ContextVar[str] = ContextVar('request_id', default='-')
+
+# LogRecord attributes that are not user-supplied structured fields
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+_listener: Optional[QueueListener] = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request ID to every record"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves formatting to the listener thread
+
+    The stock QueueHandler formats the full record (timestamp, fields,
+    traceback) on the calling thread; here only the message arguments are
+    merged, on a copy (as QueueHandler does) so other handlers still see the
+    caller's record unchanged.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        return record
+
+
+class StructuredFormatter(logging.Formatter):
+    """Render records as JSON lines or key=value text"""
+
+    def __init__(self, fmt: str = 'text'):
+        super().__init__()
+        self.json = fmt == 'json'
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {key: value for key, value in vars(record).items() if key not in _RESERVED}
+        timestamp = datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds')
+        request_id = getattr(record, 'request_id', '-')
+
+        if self.json:
+            entry = {
+                'ts': timestamp,
+                'level': record.levelname,
+                'logger': record.name,
+                'request_id': request_id,
+                'msg': record.getMessage(),
+                **fields
+            }
+            if record.exc_info:
+                entry['exc'] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str, ensure_ascii=False)
+
+        line = f"{timestamp} {record.levelname:<7} {record.name} [{request_id}] {record.getMessage()}"
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value!r}" for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None):
+    """Install the queue-backed handler on the application logger (idempotent)"""
+    global _listener
+
+    logger = logging.getLogger(LOGGER_ROOT)
+    logger.setLevel((level or settings.log_level).upper())
+    logger.propagate = False
+
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(StructuredFormatter(fmt or settings.log_format))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    logger.addHandler(handler)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Application logger for a module"""
+    setup_logging()
+    if name == '__main__' or not name:
+        name = 'main'
+    return logging.getLogger(f"{LOGGER_ROOT}.{name}")
+
+
+def mask(value: Any) -> Any:
+    """Mask a customer value unless customer data logging is enabled"""
+    if value is None or settings.log_customer_data:
+        return value
+    text = str(value)
+    if len(text) <= 4:
+        return '***'
+    return f"{text[:2]}***{text[-2:]}"
+
+
+def customer_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Customer fields for debug logging, masked by default"""
+    return {
+        field: mask(data.get(field))
+        for field in ('customer_name', 'company_name', 'address', 'mobile_number', 'phone_number')
+    }
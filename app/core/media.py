@@ -0,0 +1,138 @@
+"""
+Content-addressed store of processed document images
+
+Document scans (Aadhaar, driving licence) are flattened, resized and
+re-encoded as PNG before they are embedded in an invoice. Repeat customers
+send the same scans with every booking, so the processed image is kept
+under the SHA-256 of the original bytes and reused instead of being decoded
+and resampled again. Reading an image marks it as recently used; once the
+store outgrows its size limit, the least recently used images are removed.
+"""
+import hashlib
+import os
+import struct
+import threading
+from typing import List, Optional, Tuple
+
+from app.core.xlsx import atomic_write
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def media_key(data: bytes, variant: str = '') -> str:
+    """
+    Store key of an original image
+
+    Args:
+        data: Image bytes as uploaded
+        variant: Processing settings; a change of size or format gets new keys
+    """
+    digest = hashlib.sha256(data)
+    digest.update(variant.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def png_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) of PNG bytes, from the header alone"""
+    if len(data) < 24 or not data.startswith(_PNG_SIGNATURE) or data[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', data[16:24])
+
+
+class MediaStore:
+    """Processed images on disk, one file per key"""
+
+    # Pruning removes images down to this share of max_bytes, so it does not
+    # run again on the next put
+    PRUNE_TO = 0.8
+
+    def __init__(self, root: str, max_bytes: int = 0):
+        """
+        Args:
+            root: Store directory
+            max_bytes: Size above which least recently used images are removed (0: no limit)
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Bytes stored, counted on the first put
+        self._size: Optional[int] = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.png")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Stored PNG bytes, or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # A damaged entry is treated as missing and rewritten
+        if not png_size(data):
+            return None
+        if self.max_bytes:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store PNG bytes under key (written atomically)"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+
+        if self.max_bytes:
+            with self._lock:
+                if self._size is None:
+                    self._size = sum(size for _, size, _ in self._entries())
+                else:
+                    self._size += len(data)
+                if self._size > self.max_bytes:
+                    self._size = self.prune(int(self.max_bytes * self.PRUNE_TO))
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """(last used, size, path) of every stored image"""
+        entries = []
+        try:
+            directories = os.listdir(self.root)
+        except FileNotFoundError:
+            return entries
+        for directory in directories:
+            directory = os.path.join(self.root, directory)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith('.png'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def prune(self, max_bytes: int) -> int:
+        """
+        Remove least recently used images until at most max_bytes are stored
+
+        Returns:
+            Bytes stored afterwards
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        return total
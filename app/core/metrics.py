@@ -0,0 +1,162 @@
+"""
+In-process metrics with Prometheus text exposition
+
+Pipeline stages are timed with ``stage()``; each span is recorded in a
+histogram served on /metrics and, when a request has opened a
+``stage_breakdown()``, added to that request's per-stage timings.
+No external collector or client library is required.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+
+# Invoice pipeline stages
+STAGES = (
+    'ocr',            # OCR.space request
+    'preprocess',     # Image normalisation before OCR
+    'extract',        # Booking data extraction (AI or pattern matching)
+    'provider',       # LLM provider request inside extraction
+    'template_load',  # Loading the template/master workbook and cloning the sheet
+    'fill',           # Writing booking data into cells
+    'embed',          # Resizing and embedding document images
+    'save',           # Serialising the workbook to disk
+    'storage',        # Handing the file to the storage backend
+)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[Tuple[str, str], ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """Record one observation (seconds)"""
+        key = tuple((name, str(labels.get(name, ''))) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [bucket counts..., sum, count]
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> str:
+        """Prometheus text exposition of all series"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+
+        for key in sorted(series):
+            values = series[key]
+            for bound, count in zip(self.buckets, values):
+                bucket_labels = _format_labels(key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            inf_labels = _format_labels(key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {values[-1]}")
+        return '\n'.join(lines)
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together on /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+registry = MetricsRegistry()
+
+stage_duration = registry.histogram(
+    'hilldrive_stage_duration_seconds',
+    'Time spent in each invoice pipeline stage',
+    labelnames=('stage',)
+)
+
+invoice_duration = registry.histogram(
+    'hilldrive_invoice_duration_seconds',
+    'End-to-end invoice creation time',
+    labelnames=('endpoint',)
+)
+
+upload_duration = registry.histogram(
+    'hilldrive_storage_upload_seconds',
+    'Time to upload an invoice file to the storage backend, per attempt',
+    labelnames=('backend', 'outcome')
+)
+
+_breakdown: ContextVar[Optional[Dict[str, float]]] = ContextVar('stage_breakdown', default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_duration.observe(elapsed, stage=name)
+        breakdown = _breakdown.get()
+        if breakdown is not None:
+            breakdown[name] = breakdown.get(name, 0.0) + elapsed * 1000
+
+
+@contextmanager
+def stage_breakdown() -> Iterator[Dict[str, float]]:
+    """
+    Collect the stages timed during a request
+
+    Yields:
+        Dictionary of stage name to accumulated milliseconds, filled in as
+        stages complete
+    """
+    breakdown: Dict[str, float] = {}
+    token = _breakdown.set(breakdown)
+    try:
+        yield breakdown
+    finally:
+        _breakdown.reset(token)
+
+
+def rounded(breakdown: Dict[str, float]) -> Dict[str, float]:
+    """Stage timings rounded for API responses"""
+    return {name: round(ms, 1) for name, ms in breakdown.items()}
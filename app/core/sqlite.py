@@ -0,0 +1,86 @@
+"""
+SQLite-backed service state
+
+Services that keep their state in a SQLite database (invoice index, jobs,
+idempotency keys, customer profiles) open it the same way: lazily on first
+use, in WAL mode, shared across threads behind one lock, with schema
+migrations applied in order and PRAGMA user_version recording progress.
+"""
+import os
+import sqlite3
+import threading
+from typing import Callable, Sequence, Union
+
+# A migration is an SQL script or a function applying it to the connection
+Migration = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+def migrate(conn: sqlite3.Connection, migrations: Sequence[Migration]) -> int:
+    """
+    Apply the migrations the database has not seen yet, each in its own transaction
+
+    Returns:
+        The schema version before migrating (0 for a new database)
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, script in enumerate(migrations[version:], start=version + 1):
+        with conn:
+            if callable(script):
+                script(conn)
+            else:
+                conn.executescript(script)
+            conn.execute(f"PRAGMA user_version = {number}")
+    return version
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Open a database for use from several threads, creating its directory"""
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SQLiteStore:
+    """
+    Base of services backed by one SQLite database
+
+    Statements run under ``with self._lock, conn:`` since the connection is
+    shared by request threads and workers.
+    """
+
+    # Schema migrations, applied in order
+    migrations: Sequence[Migration] = ()
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use and apply pending migrations"""
+        if self._conn is None:
+            created = False
+            with self._lock:
+                if self._conn is None:
+                    conn = connect(self.db_path)
+                    created = migrate(conn, self.migrations) == 0
+                    self._conn = conn
+            if created:
+                self._created()
+        return self._conn
+
+    def _created(self):
+        """Called once the database was created from scratch, outside the lock"""
+
+    def close(self):
+        """Close the connection; the next use opens the database again"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
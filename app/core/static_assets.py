@@ -0,0 +1,197 @@
+"""
+In-memory frontend assets
+
+Files in the static directory are read once, compressed ahead of time
+(gzip, plus brotli when the optional ``brotli`` package is installed) and
+served from memory. Each file is reloaded when its mtime changes. index.html
+is rewritten to point at content-hashed URLs (``/assets/style.<hash>.css``)
+that can be cached forever.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.core.http_cache import etag_matches
+
+try:
+    import brotli
+except ImportError:  # Optional dependency
+    brotli = None
+
+
+HASHED_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+# Smaller bodies are not worth compressing
+MIN_COMPRESS_SIZE = 256
+
+_STATIC_REF_RE = re.compile(r'(?P<attr>href|src)="/static/(?P<name>[^"?#/]+)"')
+
+# Referenced assets that get hashed URLs; HTML pages keep their address
+_HASHED_EXTENSIONS = {'.css', '.js', '.png', '.jpg', '.jpeg', '.svg', '.webp', '.ico', '.woff', '.woff2'}
+
+
+@dataclass
+class Asset:
+    """One file held in memory with its precompressed variants"""
+    name: str
+    mtime_ns: int
+    body: bytes
+    content_type: str
+    digest: str
+    encodings: Dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def hashed_name(self) -> str:
+        stem, ext = os.path.splitext(self.name)
+        return f"{stem}.{self.digest[:10]}{ext}"
+
+    @classmethod
+    def build(cls, name: str, body: bytes, mtime_ns: int) -> 'Asset':
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'image/svg+xml'):
+            content_type += '; charset=utf-8'
+        asset = cls(name, mtime_ns, body, content_type, hashlib.sha256(body).hexdigest())
+        if len(body) >= MIN_COMPRESS_SIZE and not content_type.startswith(('image/png', 'image/jpeg', 'image/webp', 'font/woff')):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                asset.encodings['gzip'] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    asset.encodings['br'] = compressed
+        return asset
+
+
+def _preferred_encoding(accept_encoding: str, available: Dict[str, bytes]) -> Optional[str]:
+    """Best available encoding the client accepts (brotli over gzip)"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip().lower()] = quality
+    for encoding in ('br', 'gzip'):
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+class StaticAssets:
+    """Serve a flat static directory from memory"""
+
+    def __init__(self, directory: str = 'static', url_prefix: str = '/assets'):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self._assets: Dict[str, Asset] = {}
+        self._index: Optional[Asset] = None
+        self._index_key = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Read and compress every file up front (application startup)"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            self.get(name)
+        self.index()
+
+    def get(self, name: str) -> Optional[Asset]:
+        """Asset by file name, reloaded if the file changed"""
+        path = os.path.join(self.directory, name)
+        if os.path.basename(name) != name or name.startswith('.'):
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._assets.pop(name, None)
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        asset = self._assets.get(name)
+        if asset is not None and asset.mtime_ns == stat.st_mtime_ns:
+            return asset
+
+        with self._lock:
+            asset = self._assets.get(name)
+            if asset is None or asset.mtime_ns != stat.st_mtime_ns:
+                with open(path, 'rb') as f:
+                    asset = Asset.build(name, f.read(), stat.st_mtime_ns)
+                self._assets[name] = asset
+        return asset
+
+    def by_hashed_name(self, hashed_name: str) -> Optional[Asset]:
+        """Asset by its content-hashed name, if the hash is still current"""
+        stem, ext = os.path.splitext(hashed_name)
+        name, _, digest = stem.rpartition('.')
+        asset = self.get(f"{name}{ext}") if name else None
+        if asset is None or not asset.digest.startswith(digest) or len(digest) < 10:
+            return None
+        return asset
+
+    def url(self, name: str) -> str:
+        """Content-hashed URL of a static file"""
+        asset = self.get(name)
+        if asset is None or os.path.splitext(name)[1].lower() not in _HASHED_EXTENSIONS:
+            return f"/static/{name}"
+        return f"{self.url_prefix}/{asset.hashed_name}"
+
+    def index(self) -> Optional[Asset]:
+        """index.html with static references rewritten to hashed URLs"""
+        source = self.get('index.html')
+        if source is None:
+            return None
+
+        html = source.body.decode('utf-8')
+        references = sorted(set(match.group('name') for match in _STATIC_REF_RE.finditer(html)))
+        key = (source.mtime_ns, tuple(self.url(name) for name in references))
+        if self._index is not None and self._index_key == key:
+            return self._index
+
+        rewritten = _STATIC_REF_RE.sub(
+            lambda m: f'{m.group("attr")}="{self.url(m.group("name"))}"', html
+        )
+        index = Asset.build('index.html', rewritten.encode('utf-8'), source.mtime_ns)
+        with self._lock:
+            self._index, self._index_key = index, key
+        return index
+
+
+def asset_response(request: Request, asset: Asset, cache_control: str) -> Response:
+    """Serve an asset, negotiating a precompressed encoding"""
+    encoding = _preferred_encoding(request.headers.get('accept-encoding', ''), asset.encodings)
+    etag = f'"{asset.digest[:32]}{"-" + encoding if encoding else ""}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': cache_control,
+        'Vary': 'Accept-Encoding',
+    }
+
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    body = asset.encodings[encoding] if encoding else asset.body
+    if request.method == 'HEAD':
+        headers['Content-Length'] = str(len(body))
+        body = b''
+    return Response(content=body, headers=headers, media_type=asset.content_type)
+
+
+# Frontend served by main_new
+frontend_assets = StaticAssets('static')
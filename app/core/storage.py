@@ -0,0 +1,182 @@
+"""
+Invoice storage backends
+
+A backend copies a finished invoice file to where it is kept long term under
+a key (its path relative to the output directory). ``LocalBackend`` keeps
+files on disk; ``S3Backend`` uploads to any S3-compatible object store (AWS,
+MinIO, Cloudflare R2, ...) with multipart uploads whose parts are sent in
+parallel.
+"""
+import contextlib
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, Optional
+
+from app.core.xlsx import atomic_write
+
+
+@contextlib.contextmanager
+def snapshot(file_path: str) -> Iterator[str]:
+    """
+    Path of a copy of file_path that later saves do not change, removed afterwards
+
+    Saves replace the file with os.replace(), so a hard link keeps the bytes
+    as they were; filesystems without hard links get a full copy.
+
+    Raises:
+        FileNotFoundError: file_path does not exist
+    """
+    copy_path = f"{file_path}.{os.getpid()}-{threading.get_ident()}.upload.tmp"
+    try:
+        try:
+            os.link(file_path, copy_path)
+        except OSError:
+            # Raises FileNotFoundError again if file_path is missing
+            shutil.copyfile(file_path, copy_path)
+        yield copy_path
+    finally:
+        if os.path.exists(copy_path):
+            os.remove(copy_path)
+
+
+class StorageBackend(ABC):
+    """Where invoice files are stored"""
+
+    name = 'base'
+
+    @abstractmethod
+    def upload(self, file_path: str, key: str) -> Dict[str, Any]:
+        """
+        Store a file under key, replacing any previous version
+
+        Returns:
+            Backend-specific details of the stored object
+
+        Raises:
+            FileNotFoundError: file_path does not exist
+            Exception: Any other error is treated as transient and retried
+        """
+
+    def status(self) -> Dict[str, Any]:
+        """Configuration summary (no credentials)"""
+        return {}
+
+
+class LocalBackend(StorageBackend):
+    """Files stay on local disk, optionally copied into a second directory"""
+
+    name = 'local'
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root: Directory to copy invoices into; files already under it
+                are left where they are
+        """
+        self.root = root
+
+    def upload(self, file_path: str, key: str) -> Dict[str, Any]:
+        destination = os.path.join(self.root, key)
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        if os.path.abspath(destination) != os.path.abspath(file_path):
+            os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+            with atomic_write(destination) as tmp_path:
+                shutil.copyfile(file_path, tmp_path)
+        return {'path': destination, 'size': os.path.getsize(destination)}
+
+    def status(self) -> Dict[str, Any]:
+        return {'root': self.root}
+
+
+class S3Backend(StorageBackend):
+    """S3-compatible object storage; boto3 is imported on first upload"""
+
+    name = 's3'
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = '',
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+        multipart_threshold: int = 8 * 1024 * 1024,
+        part_size: int = 8 * 1024 * 1024,
+        part_concurrency: int = 4
+    ):
+        """
+        Args:
+            bucket: Bucket name
+            prefix: Prepended to every key (e.g. 'invoices/')
+            endpoint_url: Non-AWS endpoint such as http://localhost:9000 for MinIO
+            region: Bucket region
+            access_key_id: Credentials; the usual AWS environment variables,
+                config files and instance roles are used when not given
+            secret_access_key: See access_key_id
+            multipart_threshold: Files from this size (bytes) use multipart uploads
+            part_size: Size of each multipart part (bytes, at least 5 MiB)
+            part_concurrency: Parts of one file uploaded in parallel
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url or None
+        self.region = region or None
+        self.access_key_id = access_key_id or None
+        self.secret_access_key = secret_access_key or None
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.part_concurrency = part_concurrency
+        self._client = None
+        self._transfer_config = None
+
+    @property
+    def client(self):
+        """boto3 S3 client, created on first use (thread-safe once created)"""
+        if self._client is None:
+            try:
+                import boto3
+                from boto3.s3.transfer import TransferConfig
+                from botocore.config import Config
+            except ImportError:
+                raise RuntimeError("S3 storage needs the boto3 package: pip install boto3")
+            self._transfer_config = TransferConfig(
+                multipart_threshold=self.multipart_threshold,
+                multipart_chunksize=self.part_size,
+                max_concurrency=self.part_concurrency,
+                use_threads=self.part_concurrency > 1,
+            )
+            self._client = boto3.client(
+                's3',
+                endpoint_url=self.endpoint_url,
+                region_name=self.region,
+                aws_access_key_id=self.access_key_id,
+                aws_secret_access_key=self.secret_access_key,
+                # Retries are left to the upload queue, which backs off longer
+                config=Config(retries={'max_attempts': 1}, max_pool_connections=max(10, self.part_concurrency * 4)),
+            )
+        return self._client
+
+    def upload(self, file_path: str, key: str) -> Dict[str, Any]:
+        client = self.client
+        object_key = f"{self.prefix}{key}"
+        # Parts are read by reopening the file, so they are taken from a
+        # snapshot: the master file may be saved again mid-upload
+        with snapshot(file_path) as stable_path:
+            # Splits files above the threshold into parts sent on parallel threads;
+            # a failed multipart upload is aborted so no orphaned parts are billed
+            client.upload_file(stable_path, self.bucket, object_key, Config=self._transfer_config)
+            size = os.path.getsize(stable_path)
+        return {'bucket': self.bucket, 'key': object_key, 'size': size}
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'bucket': self.bucket,
+            'prefix': self.prefix,
+            'endpoint_url': self.endpoint_url,
+            'multipart_threshold': self.multipart_threshold,
+            'part_size': self.part_size,
+        }
@@ -0,0 +1,176 @@
+"""
+Invoice tax engine
+
+The invoice template derives its tax lines from the GST-inclusive service
+amount in G18 with formulas (E18, F23, G23, F27-F29, F35). openpyxl saves
+those formulas without results, so until Excel recalculates the file every
+other reader (previews, mobile viewers, ``data_only`` loads) sees blanks.
+
+This module evaluates the same formulas with Decimal arithmetic. The results
+are written as the formula cells' cached values, stored in the index and
+ledger (rounded half-up to the paisa), and can be recomputed for any number
+of sheets or invoices (one at a time; app.core.audit checks the stored
+amounts of the whole index as arrays).
+"""
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, Iterator, Mapping
+
+from app.core.xlsx import cache_sheet_values, set_formula_values
+
+# Template tax rates: GST 5% split equally into CGST and SGST
+GST_RATE = Decimal('0.05')
+CGST_RATE = SGST_RATE = Decimal('0.025')
+
+PAISA = Decimal('0.01')
+
+# Formula cells of the invoice template, exactly as stored in the sheet
+TEMPLATE_FORMULAS = {
+    'E18': '=G18-(G18-(G18/(1+0.05)))',  # Taxable value (rate column)
+    'F23': '=F18',                       # Subtotal tax
+    'G23': '=G18',                       # Subtotal amount
+    'F27': '=E18',                       # Taxable amount
+    'F28': '=E18*0.025',                 # CGST
+    'F29': '=E18*0.025',                 # SGST
+    'F35': '=F33:G33-F34:G34',           # Balance
+}
+
+# Cells the formulas read, by InvoiceTax field
+INPUT_CELLS = {
+    'gross': 'G18',     # Service amount incl. GST
+    'tax': 'F18',       # Tax column of the service row (left empty)
+    'total': 'F33',     # Total amount
+    'received': 'F34',  # Received amount
+}
+
+
+def to_decimal(value: Any) -> Decimal:
+    """Decimal of a cell or JSON value; blanks and text count as zero like in Excel"""
+    if isinstance(value, Decimal):
+        return value
+    if value is None or isinstance(value, bool):
+        return Decimal(0)
+    try:
+        # str() first, so 0.1 is 0.1 and not its binary approximation
+        result = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        return Decimal(0)
+    return result if result.is_finite() else Decimal(0)
+
+
+def money(value: Any) -> Decimal:
+    """Round to the paisa, halves away from zero"""
+    return to_decimal(value).quantize(PAISA, rounding=ROUND_HALF_UP)
+
+
+@dataclass(frozen=True)
+class InvoiceTax:
+    """Inputs of one invoice sheet and the template's derived amounts"""
+    gross: Decimal
+    total: Decimal
+    received: Decimal = Decimal(0)
+    tax: Decimal = Decimal(0)
+
+    @property
+    def taxable(self) -> Decimal:
+        """E18 / F27"""
+        return self.gross / (1 + GST_RATE)
+
+    @property
+    def cgst(self) -> Decimal:
+        """F28"""
+        return self.taxable * CGST_RATE
+
+    @property
+    def sgst(self) -> Decimal:
+        """F29"""
+        return self.taxable * SGST_RATE
+
+    @property
+    def balance(self) -> Decimal:
+        """F35"""
+        return self.total - self.received
+
+    def cells(self) -> Dict[str, Decimal]:
+        """Unrounded value of each template formula cell, as Excel computes it"""
+        return {
+            'E18': self.taxable,
+            'F23': self.tax,
+            'G23': self.gross,
+            'F27': self.taxable,
+            'F28': self.cgst,
+            'F29': self.sgst,
+            'F35': self.balance,
+        }
+
+    def amounts(self) -> Dict[str, float]:
+        """Amounts as printed on the invoice (rounded to the paisa)"""
+        return {
+            'gross_amount': float(money(self.gross)),
+            'taxable_amount': float(money(self.taxable)),
+            'cgst': float(money(self.cgst)),
+            'sgst': float(money(self.sgst)),
+            'total_amount': float(money(self.total)),
+            'received_amount': float(money(self.received)),
+            'balance_amount': float(money(self.balance)),
+        }
+
+
+def compute(gross: Any, total: Any = None, received: Any = None) -> InvoiceTax:
+    """
+    Tax breakdown of one invoice
+
+    Args:
+        gross: Service amount including GST (G18)
+        total: Invoice total (F33); defaults to gross
+        received: Amount already paid (F34)
+    """
+    return InvoiceTax(
+        gross=to_decimal(gross),
+        total=to_decimal(gross if total is None else total),
+        received=to_decimal(received),
+    )
+
+
+def compute_many(rows: Iterable[Mapping[str, Any]]) -> Iterator[InvoiceTax]:
+    """
+    Tax breakdown of many invoices, computed row by row in Decimal
+
+    Meant for exact per-invoice results (ledger rebuilds, exports). To check
+    the stored amounts of many invoices at once, use
+    app.core.audit.audit_amounts, which works on whole columns.
+
+    Args:
+        rows: Mappings with gross_amount and optionally total_amount and
+            received_amount (ledger rows, index entries, ...)
+    """
+    for row in rows:
+        yield compute(row.get('gross_amount'), row.get('total_amount'), row.get('received_amount'))
+
+
+def from_cells(values: Mapping[str, Any]) -> InvoiceTax:
+    """InvoiceTax of a sheet, from its input cell values by reference"""
+    return InvoiceTax(**{field: to_decimal(values.get(ref)) for field, ref in INPUT_CELLS.items()})
+
+
+def cache_template_values(path: str) -> int:
+    """
+    Store computed results in every template formula cell of a workbook
+
+    Formulas are left in place (Excel still recalculates on open); sheets
+    whose formulas differ from the template are not touched.
+
+    Returns:
+        Number of sheets updated
+    """
+    return set_formula_values(
+        path, TEMPLATE_FORMULAS, INPUT_CELLS.values(), lambda values: from_cells(values).cells()
+    )
+
+
+def cache_sheet_xml(xml: str) -> str:
+    """Sheet XML with computed results in its template formula cells"""
+    expected = {ref: formula.lstrip('=') for ref, formula in TEMPLATE_FORMULAS.items()}
+    return cache_sheet_values(
+        xml, expected, set(INPUT_CELLS.values()), lambda values: from_cells(values).cells()
+    ) or xml
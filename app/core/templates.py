@@ -0,0 +1,197 @@
+"""
+Invoice template registry
+
+A template is an .xlsx workbook plus a declarative mapping of booking fields
+to cells, kept as ``<name>.json`` in the templates directory:
+
+    {
+        "template": "../inn sample.xlsx",
+        "cells": {"customer_name": "C10", "total_amount": "F33", ...},
+        "formula_cells": ["E18", "F35", ...]
+    }
+
+"template" is relative to the mapping file and defaults to ``<name>.xlsx``
+next to it. Compiling a template parses the workbook once: every mapped cell
+is resolved to the cell that actually holds its value (the top-left cell of
+a merged range) and the parsed sheet is kept to copy new invoice sheets
+from. The registry keeps one compiled template per name, so several branches
+or brands are served from one process; an edited mapping or workbook is
+compiled again on next use.
+"""
+import io
+import json
+import os
+import re
+import threading
+from functools import cached_property
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+# The template every invoice uses unless a booking names another one
+DEFAULT_TEMPLATE = 'hilldrive'
+
+_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+_CELL = re.compile(r'^[A-Z]{1,3}[1-9][0-9]{0,6}$')
+
+
+class TemplateError(ValueError):
+    """A template mapping is invalid"""
+
+
+class TemplateNotFoundError(TemplateError):
+    """No template is registered under the requested name"""
+
+
+def load_mapping(path: str) -> Dict[str, Any]:
+    """
+    Read and validate a mapping file
+
+    Returns:
+        The mapping with "cells" and "formula_cells" checked
+
+    Raises:
+        TemplateError: The file is not valid JSON or a cell reference is invalid
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            mapping = json.load(f)
+    except json.JSONDecodeError as e:
+        raise TemplateError(f"{path}: invalid JSON ({e})")
+
+    cells = mapping.get('cells') if isinstance(mapping, dict) else None
+    if not isinstance(cells, dict) or not cells:
+        raise TemplateError(f"{path}: 'cells' must map field names to cells")
+    formula_cells = mapping.get('formula_cells', [])
+    if not isinstance(formula_cells, list):
+        raise TemplateError(f"{path}: 'formula_cells' must be a list of cells")
+    for ref in [*cells.values(), *formula_cells]:
+        if not isinstance(ref, str) or not _CELL.match(ref):
+            raise TemplateError(f"{path}: invalid cell reference {ref!r}")
+    return mapping
+
+
+class CompiledTemplate:
+    """A parsed template workbook with its mapping resolved"""
+
+    def __init__(self, name: str, template_path: str, mapping: Dict[str, Any], data: bytes, worksheet):
+        self.name = name
+        self.template_path = template_path
+        self.cell_map: Dict[str, str] = dict(mapping['cells'])
+        self.formula_cells: FrozenSet[str] = frozenset(mapping.get('formula_cells', []))
+        # Cell written for each field: merged ranges hold their value in the top-left cell
+        self.anchors: Dict[str, str] = _resolve_anchors(worksheet, self.cell_map)
+        # Mapped cells covered by a merged range (their value lives in the anchor)
+        self.covered: FrozenSet[str] = frozenset(
+            ref for field, ref in self.cell_map.items() if self.anchors[field] != ref
+        )
+        self.data = data
+        # Parsed template sheet that new master sheets are copied from; read only
+        self.worksheet = worksheet
+
+    def load(self):
+        """A fresh workbook of the template, to fill in"""
+        import openpyxl
+        return openpyxl.load_workbook(io.BytesIO(self.data))
+
+    @cached_property
+    def xml_template(self):
+        """XlsxTemplate of the sheet for direct rendering, or None if it cannot be rendered that way"""
+        from app.core.xlsx_template import RenderError, XlsxTemplate
+        cells = (set(self.anchors.values()) | set(self.cell_map.values())) - self.covered - self.formula_cells
+        try:
+            return XlsxTemplate(self.data, cells)
+        except RenderError:
+            return None
+
+
+def _resolve_anchors(ws, cell_map: Dict[str, str]) -> Dict[str, str]:
+    from openpyxl.utils import get_column_letter
+
+    # Every merged cell of the sheet, pointing at its range's top-left cell
+    merged = {}
+    for merged_range in ws.merged_cells.ranges:
+        anchor = merged_range.start_cell.coordinate
+        for row, column in merged_range.cells:
+            merged[f"{get_column_letter(column)}{row}"] = anchor
+    return {field: merged.get(ref, ref) for field, ref in cell_map.items()}
+
+
+def compile_template(template_path: str, mapping: Dict[str, Any], name: str = '') -> CompiledTemplate:
+    """
+    Parse a template workbook and resolve its mapping
+
+    Args:
+        template_path: .xlsx template
+        mapping: Result of load_mapping()
+        name: Registry name
+
+    Raises:
+        FileNotFoundError: The workbook does not exist
+    """
+    import openpyxl
+
+    with open(template_path, 'rb') as f:
+        data = f.read()
+    ws = openpyxl.load_workbook(io.BytesIO(data)).active
+    return CompiledTemplate(name, template_path, mapping, data, ws)
+
+
+class TemplateRegistry:
+    """Compiled templates by name, one per tenant"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._compiled: Dict[str, Tuple[Tuple[int, int], CompiledTemplate]] = {}
+
+    def mapping_path(self, name: str) -> str:
+        """Mapping file of a template"""
+        if not _NAME.match(name or ''):
+            raise TemplateNotFoundError(f"Invalid template name: {name!r}")
+        return os.path.join(self.directory, f"{name}.json")
+
+    def names(self) -> List[str]:
+        """Names of all registered templates"""
+        try:
+            files = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(f[:-5] for f in files if f.endswith('.json') and _NAME.match(f[:-5]))
+
+    def get(self, name: str) -> CompiledTemplate:
+        """
+        Compiled template, parsed on first use and when its files change
+
+        Raises:
+            TemplateNotFoundError: No mapping file for name, or its workbook is missing
+            TemplateError: The mapping is invalid
+        """
+        mapping_path = self.mapping_path(name)
+        with self._lock:
+            cached = self._compiled.get(name)
+            if cached is not None and cached[0] == self._stamp(mapping_path, cached[1].template_path):
+                return cached[1]
+
+            if not os.path.exists(mapping_path):
+                raise TemplateNotFoundError(f"Unknown template: {name}")
+            mapping = load_mapping(mapping_path)
+            template_path = os.path.normpath(
+                os.path.join(os.path.dirname(mapping_path), mapping.get('template') or f"{name}.xlsx")
+            )
+            try:
+                compiled = compile_template(template_path, mapping, name)
+            except FileNotFoundError:
+                raise TemplateNotFoundError(f"Template {name}: workbook {template_path} not found")
+            self._compiled[name] = (self._stamp(mapping_path, template_path), compiled)
+            return compiled
+
+    def clear(self):
+        """Forget compiled templates (they are compiled again on next use)"""
+        with self._lock:
+            self._compiled.clear()
+
+    @staticmethod
+    def _stamp(mapping_path: str, template_path: str) -> Optional[Tuple[int, int]]:
+        try:
+            return os.stat(mapping_path).st_mtime_ns, os.stat(template_path).st_mtime_ns
+        except OSError:
+            return None
@@ -0,0 +1,573 @@
+"""
+Low-level xlsx package helpers
+
+Works on the zip parts directly, so a single sheet can be pulled out of a
+large master workbook without openpyxl loading every sheet and image,
+formula results can be filled in after openpyxl has saved a workbook, and
+write-only workbooks can be streamed to a client as they are zipped.
+"""
+import datetime
+import functools
+import hashlib
+import html
+import io
+import os
+import posixpath
+import queue
+import re
+import threading
+import zipfile
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from xml.etree import ElementTree
+
+
+REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+DOC_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+# Workbook relationships that belong to other sheets or to the whole
+# multi-sheet workbook and are dropped from a single-sheet extract
+_SHEET_SPECIFIC_RELS = {
+    'worksheet', 'chartsheet', 'dialogsheet', 'macrosheet', 'calcChain',
+    'externalLink', 'pivotCacheDefinition', 'connections', 'queryTable',
+}
+
+# Package parts that describe the workbook as a whole (sheet titles, counts,
+# last-modified time); both are optional and would make every extract unique
+_DROPPED_PACKAGE_RELS = {'extended-properties', 'core-properties'}
+
+_RELATIONSHIP_RE = re.compile(r'<Relationship\b[^>]*?/>')
+_OVERRIDE_RE = re.compile(r'<Override\b[^>]*?PartName="([^"]+)"[^>]*?/>')
+_SHEET_RE = re.compile(r'<sheet\b[^>]*?/>')
+_SHEETS_RE = re.compile(r'<sheets\b[^>]*>.*?</sheets>', re.DOTALL)
+_DEFINED_NAME_RE = re.compile(r'<definedName\b([^>]*)>(.*?)</definedName>', re.DOTALL)
+_SHARED_CELL_RE = re.compile(r'(<c\b[^>]*\bt="s"[^>]*>\s*<v>)(\d+)(</v>)')
+_SHARED_ITEM_RE = re.compile(r'<si\b[^>]*/>|<si\b[^>]*>.*?</si>', re.DOTALL)
+_CELL_RE = re.compile(r'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.DOTALL)
+_CELL_REF_RE = re.compile(r'\br="([A-Z]+[0-9]+)"')
+_CELL_TYPE_RE = re.compile(r'\st="([^"]*)"')
+_FORMULA_RE = re.compile(r'<f\b[^>]*?(?:/>|>(.*?)</f>)', re.DOTALL)
+_VALUE_RE = re.compile(r'<v\b[^>]*?(?:/>|>(.*?)</v>)', re.DOTALL)
+
+
+class SheetNotFoundError(KeyError):
+    """Raised when the requested sheet is not in the workbook"""
+
+
+def rels_path(part: str) -> str:
+    """Path of the relationships part belonging to a part"""
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', f"{name}.rels")
+
+
+def resolve_target(source_part: str, target: str) -> str:
+    """Zip member name of a relationship target (absolute or relative)"""
+    if target.startswith('/'):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+
+def read_relationships(zf: zipfile.ZipFile, part: str) -> List[Dict[str, str]]:
+    """Relationships of a part (empty if it has none)"""
+    try:
+        root = ElementTree.fromstring(zf.read(rels_path(part)))
+    except KeyError:
+        return []
+    relationships = []
+    for rel in root.iter(f"{REL_NS}Relationship"):
+        relationships.append({
+            'id': rel.get('Id'),
+            'type': rel.get('Type', '').rsplit('/', 1)[-1],
+            'target': rel.get('Target', ''),
+            'external': rel.get('TargetMode') == 'External',
+        })
+    return relationships
+
+
+def workbook_part(zf: zipfile.ZipFile) -> str:
+    """Zip member name of the workbook part"""
+    for rel in read_relationships(zf, ''):
+        if rel['type'] == 'officeDocument':
+            return resolve_target('', rel['target'])
+    return 'xl/workbook.xml'
+
+
+def list_sheets(zf: zipfile.ZipFile) -> List[Tuple[str, str, str]]:
+    """
+    Sheets of a workbook in tab order
+
+    Returns:
+        List of (sheet name, relationship id, zip member name)
+    """
+    book = workbook_part(zf)
+    targets = {
+        rel['id']: resolve_target(book, rel['target'])
+        for rel in read_relationships(zf, book)
+    }
+    root = ElementTree.fromstring(zf.read(book))
+    sheets = []
+    for sheet in root.iter(f"{MAIN_NS}sheet"):
+        rel_id = sheet.get(f"{DOC_REL_NS}id")
+        sheets.append((sheet.get('name'), rel_id, targets.get(rel_id)))
+    return sheets
+
+
+def _part_closure(zf: zipfile.ZipFile, start: str, members: Set[str]) -> Set[str]:
+    """A part plus every internal part reachable through its relationships"""
+    parts, pending = set(), [start]
+    while pending:
+        part = pending.pop()
+        if part in parts or part not in members:
+            continue
+        parts.add(part)
+        if rels_path(part) in members:
+            parts.add(rels_path(part))
+        for rel in read_relationships(zf, part):
+            if not rel['external']:
+                pending.append(resolve_target(part, rel['target']))
+    return parts
+
+
+def _filter_relationships(xml: str, keep_ids: Set[str], renumber: Set[str] = frozenset()) -> str:
+    """
+    Drop relationships not in keep_ids
+
+    Ids in renumber are rewritten to a stable sequence, so the output does
+    not depend on how many sheets the source workbook had.
+    """
+    counter = iter(range(1, len(keep_ids) + 1))
+
+    def keep(match):
+        rel_id = re.search(r'\bId="([^"]+)"', match.group(0))
+        if not rel_id or rel_id.group(1) not in keep_ids:
+            return ''
+        if rel_id.group(1) in renumber:
+            return match.group(0).replace(rel_id.group(0), f'Id="rIdPart{next(counter)}"')
+        return match.group(0)
+    return _RELATIONSHIP_RE.sub(keep, xml)
+
+
+def _single_sheet_workbook(xml: str, sheet_element: str, sheet_name: str, index: int) -> str:
+    """Workbook part listing only one sheet"""
+    xml = _SHEETS_RE.sub(lambda m: f"<sheets>{sheet_element}</sheets>", xml, count=1)
+
+    def defined_name(match):
+        attributes, value = match.group(1), match.group(2)
+        local = re.search(r'\blocalSheetId="(\d+)"', attributes)
+        if local:
+            if int(local.group(1)) != index:
+                return ''
+            attributes = attributes.replace(local.group(0), 'localSheetId="0"')
+        elif '!' in value and sheet_name not in value:
+            return ''
+        return f"<definedName{attributes}>{value}</definedName>"
+
+    xml = _DEFINED_NAME_RE.sub(defined_name, xml)
+    xml = re.sub(r'<(externalReferences|pivotCaches)\b.*?</\1>', '', xml, flags=re.DOTALL)
+    xml = re.sub(r'\b(activeTab|firstSheet)="\d+"', r'\1="0"', xml)
+
+    # calcChain is dropped, so let Excel rebuild it
+    if '<calcPr' in xml and 'fullCalcOnLoad' not in xml:
+        xml = xml.replace('<calcPr', '<calcPr fullCalcOnLoad="1"', 1)
+    return xml
+
+
+def _compact_shared_strings(sheet_xml: str, strings_xml: str) -> Tuple[str, str]:
+    """
+    Keep only the shared strings a sheet uses
+
+    The master's shared string table holds every customer's details, so it
+    is rebuilt with just this sheet's strings and the cell indices remapped.
+    """
+    items = _SHARED_ITEM_RE.findall(strings_xml)
+    mapping: Dict[int, int] = {}
+
+    def remap(match):
+        old = int(match.group(2))
+        if old not in mapping:
+            mapping[old] = len(mapping)
+        return f"{match.group(1)}{mapping[old]}{match.group(3)}"
+
+    sheet_xml = _SHARED_CELL_RE.sub(remap, sheet_xml)
+
+    used = [items[old] for old in sorted(mapping, key=mapping.get) if old < len(items)]
+    opening = re.search(r'<sst\b[^>]*?>', strings_xml)
+    opening_tag = opening.group(0) if opening else \
+        '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    opening_tag = re.sub(r'\s(count|uniqueCount)="\d+"', '', opening_tag)
+    opening_tag = opening_tag.replace('<sst', f'<sst count="{len(used)}" uniqueCount="{len(used)}"', 1)
+    prolog = strings_xml[:opening.start()] if opening else ''
+    return sheet_xml, f"{prolog}{opening_tag}{''.join(used)}</sst>"
+
+
+def extract_sheet(source: str, sheet_name: str, destination: str):
+    """
+    Write a single-sheet workbook holding one sheet of source
+
+    Only the sheet, the drawings/media it references and the shared workbook
+    parts (styles, theme) are copied; other sheets are never read.
+
+    Args:
+        source: Path of the multi-sheet workbook
+        sheet_name: Sheet to extract
+        destination: Path of the xlsx to write
+
+    Raises:
+        SheetNotFoundError: If the workbook has no such sheet
+    """
+    with zipfile.ZipFile(source) as zf:
+        members = set(zf.namelist())
+        book = workbook_part(zf)
+        sheets = list_sheets(zf)
+        matches = [i for i, (name, _, _) in enumerate(sheets) if name == sheet_name]
+        if not matches or sheets[matches[0]][2] not in members:
+            raise SheetNotFoundError(sheet_name)
+        index = matches[0]
+        _, sheet_rel_id, sheet_part = sheets[index]
+
+        # Workbook-level parts shared by all sheets
+        book_rels = read_relationships(zf, book)
+        keep_book_rels = {sheet_rel_id} | {
+            rel['id'] for rel in book_rels if rel['type'] not in _SHEET_SPECIFIC_RELS
+        }
+        package_rels = read_relationships(zf, '')
+        keep_package_rels = {
+            rel['id'] for rel in package_rels if rel['type'] not in _DROPPED_PACKAGE_RELS
+        }
+
+        parts = {'[Content_Types].xml', rels_path(''), book, rels_path(book)}
+        for rel in package_rels:
+            # The workbook itself is handled below; its closure is every sheet
+            if rel['type'] == 'officeDocument':
+                continue
+            if rel['id'] in keep_package_rels and not rel['external']:
+                parts |= _part_closure(zf, resolve_target('', rel['target']), members)
+        for rel in book_rels:
+            if rel['id'] in keep_book_rels and not rel['external']:
+                parts |= _part_closure(zf, resolve_target(book, rel['target']), members)
+        parts &= members
+
+        # Rewritten parts
+        strings_part = next(
+            (resolve_target(book, rel['target']) for rel in book_rels if rel['type'] == 'sharedStrings'),
+            None
+        )
+        sheet_xml = zf.read(sheet_part).decode('utf-8')
+        rewritten: Dict[str, str] = {}
+        if strings_part in parts:
+            sheet_xml, rewritten[strings_part] = _compact_shared_strings(
+                sheet_xml, zf.read(strings_part).decode('utf-8')
+            )
+        rewritten[sheet_part] = sheet_xml
+
+        book_xml = zf.read(book).decode('utf-8')
+        sheet_element = next(
+            (m.group(0) for m in _SHEET_RE.finditer(book_xml) if f'"{sheet_rel_id}"' in m.group(0)),
+            None
+        )
+        rewritten[book] = _single_sheet_workbook(book_xml, sheet_element, sheet_name, index)
+        # Styles/theme/sharedStrings are found by type, not referenced by id
+        rewritten[rels_path(book)] = _filter_relationships(
+            zf.read(rels_path(book)).decode('utf-8'), keep_book_rels,
+            renumber=keep_book_rels - {sheet_rel_id}
+        )
+        rewritten[rels_path('')] = _filter_relationships(
+            zf.read(rels_path('')).decode('utf-8'), keep_package_rels
+        )
+        rewritten['[Content_Types].xml'] = _OVERRIDE_RE.sub(
+            lambda m: m.group(0) if m.group(1).lstrip('/') in parts else '',
+            zf.read('[Content_Types].xml').decode('utf-8')
+        )
+
+        # Content types and package rels first, as Excel writes them
+        order = ['[Content_Types].xml', rels_path(''), book, rels_path(book)]
+        order += sorted(parts - set(order))
+
+        # Fixed timestamps keep the output byte-identical for identical sheets
+        with zipfile.ZipFile(destination, 'w', zipfile.ZIP_DEFLATED) as out:
+            for name in order:
+                member = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+                if name in rewritten:
+                    member.compress_type = zipfile.ZIP_DEFLATED
+                    out.writestr(member, rewritten[name].encode('utf-8'))
+                else:
+                    member.compress_type = zf.getinfo(name).compress_type
+                    out.writestr(member, zf.read(name))
+
+
+@contextmanager
+def atomic_write(path: str) -> Iterator[str]:
+    """
+    Temporary path to write a file to, moved over path once complete
+
+    The temporary file is flushed to disk and renamed over path only if the
+    block succeeds, so a crash or error part-way through a save never
+    replaces a good file with a truncated one.
+    """
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        yield tmp_path
+        with open(tmp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_media_writer():
+    """
+    openpyxl ExcelWriter that stores images with identical bytes once, or
+    None if the installed openpyxl is not a version it was written against
+    """
+    import openpyxl
+    # _write_drawing below replaces a private method of openpyxl 3.1
+    if not openpyxl.__version__.startswith('3.1.'):
+        return None
+
+    from openpyxl.packaging.relationship import get_rels_path
+    from openpyxl.writer.excel import ExcelWriter
+    from openpyxl.xml.functions import tostring
+
+    class SharedMediaWriter(ExcelWriter):
+        def __init__(self, workbook, archive):
+            super().__init__(workbook, archive)
+            self._media: Dict[bytes, Any] = {}
+
+        def _write_drawing(self, drawing):
+            # ExcelWriter._write_drawing (openpyxl 3.1), except that an image
+            # whose bytes were already written points at that media part
+            self._drawings.append(drawing)
+            drawing._id = len(self._drawings)
+            for chart in drawing.charts:
+                self._charts.append(chart)
+                chart._id = len(self._charts)
+            for img in drawing.images:
+                data = img._data()
+                digest = hashlib.sha256(data).digest()
+                shared = self._media.get(digest)
+                if shared is None:
+                    self._images.append(img)
+                    img._id = len(self._images)
+                    # _data() closes the image's buffer; _write_images needs the bytes again
+                    img._data = lambda data=data: data
+                    self._media[digest] = img
+                else:
+                    img._id = shared._id
+                    img.format = shared.format
+            rels_path = get_rels_path(drawing.path)[1:]
+            self._archive.writestr(drawing.path[1:], tostring(drawing._write()))
+            self._archive.writestr(rels_path, tostring(drawing._write_rels()))
+            self.manifest.append(drawing)
+
+    return SharedMediaWriter
+
+
+def save_workbook(wb, filename: str):
+    """
+    wb.save(filename), storing each distinct image once
+
+    openpyxl writes (and compresses) one media part per embedded image, so
+    the same document scan attached to twenty invoice sheets is stored
+    twenty times. Here every drawing showing the same image bytes
+    references a single shared part (with openpyxl 3.1; other versions save
+    the usual way).
+    """
+    writer = _shared_media_writer()
+    if writer is None:
+        wb.save(filename)
+        return
+    wb.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        writer(wb, archive).write_data()
+
+
+def sheet_names(path: str) -> List[str]:
+    """Sheet names of a workbook, read from workbook.xml only"""
+    with zipfile.ZipFile(path) as zf:
+        return [name for name, _, _ in list_sheets(zf)]
+
+
+def _xml_number(value: Any) -> str:
+    """Number as written in a <v> element (shortest round-trip form)"""
+    text = repr(float(value))
+    return text[:-2] if text.endswith('.0') else text
+
+
+def cache_sheet_values(
+    xml: str,
+    formulas: Dict[str, str],
+    inputs: Set[str],
+    evaluate: Callable[[Dict[str, str]], Dict[str, Any]]
+) -> Optional[str]:
+    """Sheet XML with results in its formula cells, or None if nothing to do"""
+    values: Dict[str, str] = {}
+    targets = []
+    for match in _CELL_RE.finditer(xml):
+        ref = _CELL_REF_RE.search(match.group(1))
+        if ref is None:
+            continue
+        ref = ref.group(1)
+        body = match.group(2) or ''
+        if ref in inputs:
+            value = _VALUE_RE.search(body)
+            if value and value.group(1):
+                cell_type = _CELL_TYPE_RE.search(match.group(1))
+                if cell_type and cell_type.group(1) != 'n':
+                    # Text in an input cell: Excel would show #VALUE!
+                    return None
+                values[ref] = value.group(1)
+        elif ref in formulas:
+            formula = _FORMULA_RE.search(body)
+            if formula and html.unescape(formula.group(1) or '') == formulas[ref]:
+                targets.append((ref, match, formula.group(0)))
+
+    if not targets:
+        return None
+    results = evaluate(values)
+    pieces, position = [], 0
+    for ref, match, formula in targets:
+        if results.get(ref) is None:
+            continue
+        attributes = _CELL_TYPE_RE.sub('', match.group(1))
+        pieces.append(xml[position:match.start()])
+        pieces.append(f'<c{attributes}>{formula}<v>{_xml_number(results[ref])}</v></c>')
+        position = match.end()
+    pieces.append(xml[position:])
+    return ''.join(pieces)
+
+
+def set_formula_values(
+    path: str,
+    formulas: Dict[str, str],
+    inputs: Iterable[str],
+    evaluate: Callable[[Dict[str, str]], Dict[str, Any]]
+) -> int:
+    """
+    Write cached results into formula cells of every sheet, in place
+
+    openpyxl saves formulas without a value, so readers that do not
+    recalculate show them empty. The formulas are kept; only their <v>
+    elements are filled in. Other zip members are copied unchanged.
+
+    Args:
+        path: Workbook to update
+        formulas: Formula per cell reference (with the leading '='); cells
+            holding any other formula are left alone
+        inputs: Cells whose numeric values evaluate() needs
+        evaluate: Called once per sheet with {reference: value text} of the
+            non-empty input cells; returns the result per formula cell
+
+    Returns:
+        Number of sheets updated
+    """
+    expected = {ref: formula.lstrip('=') for ref, formula in formulas.items()}
+    inputs = set(inputs)
+    with zipfile.ZipFile(path) as zf:
+        rewritten = {}
+        for _, _, part in list_sheets(zf):
+            if not part:
+                continue
+            xml = cache_sheet_values(zf.read(part).decode('utf-8'), expected, inputs, evaluate)
+            if xml is not None:
+                rewritten[part] = xml.encode('utf-8')
+    if not rewritten:
+        return 0
+
+    # The source is closed before the rewritten copy replaces it
+    with atomic_write(path) as tmp_path:
+        with zipfile.ZipFile(path) as zf, zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as out:
+            for info in zf.infolist():
+                out.writestr(info, rewritten.get(info.filename) or zf.read(info.filename))
+    return len(rewritten)
+
+
+class _StreamClosed(Exception):
+    """The consumer of a workbook stream went away"""
+
+
+class _QueueWriter(io.RawIOBase):
+    """Unseekable file that hands buffered chunks to a bounded queue"""
+
+    def __init__(self, chunks: queue.Queue, closed: threading.Event, chunk_size: int):
+        super().__init__()
+        self.chunks = chunks
+        self.consumer_closed = closed
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+        return len(data)
+
+    def _put(self, item):
+        # Blocks while the client is slower than the writer (back-pressure)
+        while True:
+            if self.consumer_closed.is_set():
+                raise _StreamClosed()
+            try:
+                self.chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self):
+        if self.buffer:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+
+
+def stream_workbook(fill: Callable, chunk_size: int = 64 * 1024, max_chunks: int = 16) -> Iterator[bytes]:
+    """
+    Build a write-only workbook and yield the xlsx bytes as they are written
+
+    fill(wb) receives an empty ``Workbook(write_only=True)`` and appends rows;
+    openpyxl keeps appended rows in temporary files, and the zip is written
+    straight into the response stream, so memory stays constant however many
+    rows there are. fill runs on a background thread.
+
+    Raises:
+        Whatever fill or openpyxl raised, at the point it happened
+    """
+    import openpyxl
+
+    chunks: queue.Queue = queue.Queue(maxsize=max_chunks)
+    closed = threading.Event()
+    done = object()
+
+    def produce():
+        writer = _QueueWriter(chunks, closed, chunk_size)
+        try:
+            wb = openpyxl.Workbook(write_only=True)
+            fill(wb)
+            wb.save(writer)
+            writer.finish()
+            writer._put(done)
+        except _StreamClosed:
+            pass
+        except Exception as e:
+            try:
+                writer._put(e)
+            except _StreamClosed:
+                pass
+
+    thread = threading.Thread(target=produce, name="xlsx-stream", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        closed.set()
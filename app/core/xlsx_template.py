@@ -0,0 +1,227 @@
+"""
+Direct XML rendering of single-sheet invoices
+
+Filling a few dozen cells through openpyxl parses and re-serializes the
+whole workbook, styles and drawings included. ``XlsxTemplate`` instead
+splits the template's sheet XML once into literal text and the cells that
+are filled in. Rendering an invoice substitutes those cells (strings as
+inline strings, so sharedStrings.xml is untouched) and appends the sheet to
+a prebuilt zip holding every other part of the template, copied unchanged.
+
+``SheetValues`` stands in for an openpyxl worksheet, so the same fill code
+records the values to write. Anything this renderer does not reproduce
+exactly as openpyxl would (formulas, dates, styles of visible cells) marks
+the values unsupported or raises ``RenderError``, and the caller falls back
+to openpyxl.
+"""
+import html
+import io
+import re
+import zipfile
+from decimal import Decimal
+from typing import Any, Dict, FrozenSet, Iterable, List, Tuple, Union
+
+from app.core.xlsx import _CELL_RE, _CELL_REF_RE, _CELL_TYPE_RE, _xml_number, list_sheets, workbook_part
+
+# Characters openpyxl refuses in cell text (openpyxl.cell.cell.ILLEGAL_CHARACTERS_RE)
+ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+
+_ACTIVE_TAB_RE = re.compile(r'<workbookView\b[^>]*\bactiveTab="(\d+)"')
+_SHARED_FORMULA_RE = re.compile(r'<f\b([^>]*\bt="shared"[^>]*?)(?:/>|>(.*?)</f>)', re.DOTALL)
+_SHARED_INDEX_RE = re.compile(r'\bsi="(\d+)"')
+
+
+class RenderError(ValueError):
+    """The template or a value cannot be rendered without openpyxl"""
+
+
+class _RecordedCell:
+    """Cell returned by SheetValues[ref]"""
+
+    def __init__(self, sheet: 'SheetValues', ref: str):
+        object.__setattr__(self, '_sheet', sheet)
+        object.__setattr__(self, '_ref', ref)
+
+    @property
+    def value(self):
+        return self._sheet.values.get(self._ref)
+
+    def __setattr__(self, name: str, value):
+        if name == 'value':
+            self._sheet[self._ref] = value
+        elif self._ref not in self._sheet.covered:
+            # openpyxl drops the style of cells covered by a merged range on
+            # load, so only those can be ignored
+            self._sheet.supported = False
+
+
+class SheetValues:
+    """Worksheet stand-in recording the values assigned to its cells"""
+
+    def __init__(self, covered: Iterable[str] = ()):
+        """
+        Args:
+            covered: Cells inside a merged range other than its top-left cell
+        """
+        self.values: Dict[str, Any] = {}
+        self.covered: FrozenSet[str] = frozenset(covered)
+        # False once something was written that only openpyxl can reproduce
+        self.supported = True
+
+    def __getitem__(self, ref: str) -> _RecordedCell:
+        return _RecordedCell(self, ref)
+
+    def __setitem__(self, ref: str, value):
+        if isinstance(value, str):
+            if ILLEGAL_CHARACTERS_RE.search(value):
+                # Same as openpyxl: the assignment fails and the cell keeps its value
+                raise ValueError(f"Illegal character in value for {ref}")
+            if value.startswith('='):
+                self.supported = False
+        elif value is not None and not isinstance(value, (bool, int, float, Decimal)):
+            self.supported = False
+        self.values[ref] = value
+
+
+def expand_shared_formulas(xml: str) -> str:
+    """
+    Sheet XML with shared formulas written out in every cell
+
+    openpyxl does the same on load, and the formula results are only cached
+    for cells whose formula is written out.
+    """
+    from openpyxl.formula.translate import Translator
+
+    masters: Dict[str, Tuple[str, str]] = {}
+    for cell in _CELL_RE.finditer(xml):
+        shared = _SHARED_FORMULA_RE.search(cell.group(2) or '')
+        index = _SHARED_INDEX_RE.search(shared.group(1)) if shared else None
+        if index and shared.group(2):
+            masters[index.group(1)] = (_CELL_REF_RE.search(cell.group(1)).group(1), html.unescape(shared.group(2)))
+
+    def expand(cell):
+        body = cell.group(2)
+        shared = _SHARED_FORMULA_RE.search(body or '')
+        index = _SHARED_INDEX_RE.search(shared.group(1)) if shared else None
+        if not index or index.group(1) not in masters:
+            return cell.group(0)
+        origin, formula = masters[index.group(1)]
+        ref = _CELL_REF_RE.search(cell.group(1)).group(1)
+        text = Translator(f"={formula}", origin=origin).translate_formula(ref)[1:]
+        return f'<c{cell.group(1)}>{body[:shared.start()]}<f>{html.escape(text, quote=False)}</f>{body[shared.end():]}</c>'
+
+    return _CELL_RE.sub(expand, xml)
+
+
+def _text_element(value: str) -> str:
+    text = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    # Leading or trailing whitespace is kept the way openpyxl marks it
+    stripped = value.strip()
+    space = ' xml:space="preserve"' if stripped and stripped != value else ''
+    return f'<is><t{space}>{text}</t></is>'
+
+
+def render_cell(attributes: str, value: Any) -> str:
+    """
+    <c> element holding value
+
+    Args:
+        attributes: Attributes of the template's element (reference, style);
+            any type attribute is replaced
+        value: str, bool, int, float, Decimal or None (empty cell)
+
+    Raises:
+        RenderError: Any other type
+    """
+    attributes = _CELL_TYPE_RE.sub('', attributes).rstrip()
+    # openpyxl saves empty strings as empty cells
+    if value is None or value == '':
+        return f'<c{attributes}/>'
+    if isinstance(value, str):
+        return f'<c{attributes} t="inlineStr">{_text_element(value)}</c>'
+    if isinstance(value, bool):
+        return f'<c{attributes} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, int):
+        return f'<c{attributes}><v>{value}</v></c>'
+    if isinstance(value, (float, Decimal)):
+        return f'<c{attributes}><v>{_xml_number(value)}</v></c>'
+    raise RenderError(f"Cannot render {type(value).__name__} values")
+
+
+class XlsxTemplate:
+    """A workbook whose active sheet is filled in by text substitution"""
+
+    def __init__(self, data: bytes, cells: Iterable[str]):
+        """
+        Args:
+            data: Template .xlsx contents
+            cells: References of every cell that may be filled in
+
+        Raises:
+            RenderError: A cell has no element in the sheet XML (Excel only
+                writes cells with a value or style), or the sheet is missing
+        """
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            sheets = list_sheets(zf)
+            active = _ACTIVE_TAB_RE.search(zf.read(workbook_part(zf)).decode('utf-8'))
+            index = int(active.group(1)) if active else 0
+            if index >= len(sheets) or sheets[index][2] not in zf.namelist():
+                raise RenderError("Template has no active sheet")
+            self.sheet_part = sheets[index][2]
+            self._sheet_info = zf.getinfo(self.sheet_part)
+            xml = expand_shared_formulas(zf.read(self.sheet_part).decode('utf-8'))
+
+            # Every part but the sheet, zipped once; each render appends the sheet
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as out:
+                for info in zf.infolist():
+                    if info.filename != self.sheet_part:
+                        out.writestr(info, zf.read(info.filename))
+            self._package = buffer.getvalue()
+
+        # Literal text alternating with (reference, attributes, element) of the filled cells
+        self.cells = frozenset(cells)
+        wanted = set(self.cells)
+        self._pieces: List[Union[str, Tuple[str, str, str]]] = []
+        position = 0
+        for match in _CELL_RE.finditer(xml):
+            ref = _CELL_REF_RE.search(match.group(1))
+            if ref is None or ref.group(1) not in wanted:
+                continue
+            self._pieces.append(xml[position:match.start()])
+            self._pieces.append((ref.group(1), match.group(1), match.group(0)))
+            position = match.end()
+            wanted.discard(ref.group(1))
+        self._pieces.append(xml[position:])
+        if wanted:
+            raise RenderError(f"Cells missing from the template sheet XML: {', '.join(sorted(wanted))}")
+
+    def fill(self, values: Dict[str, Any]) -> str:
+        """
+        Sheet XML with values substituted
+
+        Raises:
+            RenderError: A value is for a cell not given at construction, or
+                of a type that cannot be rendered
+        """
+        pieces = []
+        for piece in self._pieces:
+            if isinstance(piece, str):
+                pieces.append(piece)
+            elif piece[0] in values:
+                pieces.append(render_cell(piece[1], values[piece[0]]))
+            else:
+                pieces.append(piece[2])
+        unknown = set(values) - self.cells
+        if unknown:
+            raise RenderError(f"Cells not in the template: {', '.join(sorted(unknown))}")
+        return ''.join(pieces)
+
+    def save(self, sheet_xml: str, path: str):
+        """Write the workbook with sheet_xml as its active sheet"""
+        with open(path, 'wb') as f:
+            f.write(self._package)
+        with zipfile.ZipFile(path, 'a', zipfile.ZIP_DEFLATED) as zf:
+            info = zipfile.ZipInfo(self.sheet_part, date_time=self._sheet_info.date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, sheet_xml.encode('utf-8'))
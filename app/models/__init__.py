@@ -6,6 +6,7 @@ from .schemas import (
     OCRRequest,
     OCRResponse,
     InvoiceResponse,
+    JobResponse,
     HealthResponse,
     ErrorResponse,
     InvoiceListResponse,
@@ -17,6 +18,7 @@ __all__ = [
     'OCRRequest',
     'OCRResponse',
     'InvoiceResponse',
+    'JobResponse',
     'HealthResponse',
     'ErrorResponse',
     'InvoiceListResponse',
@@ -32,6 +32,7 @@ class BookingDataInput(BaseModel):
     other_charges: Optional[float] = None
     invoice_number: Optional[str] = None
     invoice_date: Optional[str] = None
+    template: Optional[str] = None  # Registered template name (templates/<name>.json)
 
 
 class OCRRequest(BaseModel):
@@ -61,7 +62,24 @@ class InvoiceResponse(BaseModel):
     confidence: Optional[str] = None
     calculation_verified: Optional[bool] = None
     processing_time_ms: Optional[int] = None
+    stage_timings_ms: Optional[Dict[str, float]] = None
     sheet_name: Optional[str] = None
+    amounts: Optional[Dict[str, float]] = None
+
+
+class JobResponse(BaseModel):
+    """Schema for background job status"""
+    success: bool
+    job_id: str
+    status: str
+    stage: Optional[str] = None
+    attempts: int = 0
+    created_at: str
+    updated_at: str
+    error: Optional[str] = None
+    result: Optional[InvoiceResponse] = None
+    status_url: str
+    events_url: str
 
 
 class HealthResponse(BaseModel):
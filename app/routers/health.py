@@ -1,10 +1,15 @@
 """
 Health check and status endpoints
 """
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime
+from typing import Optional
+import os
 from app.models import HealthResponse
-from app.services import extraction_service
+from app.services import extraction_service, excel_service, storage_service
+from app.core.integrity import check_workbook
+from app.core.templates import TemplateNotFoundError
 
 router = APIRouter(tags=["Health"])
 
@@ -24,6 +29,31 @@ async def health_check():
     }
 
 
+@router.get("/health/master")
+async def master_file_health(deep: bool = False, template: Optional[str] = None):
+    """
+    Integrity of the master workbook, checked without loading it
+
+    The quick check reads the zip directory and workbook part; deep=true
+    also reads every part (CRCs and XML). template selects the master file
+    of another template.
+    """
+    try:
+        master_path = excel_service.master_path(template)
+    except TemplateNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not os.path.exists(master_path):
+        return {"exists": False, "ok": True}
+    report = await run_in_threadpool(check_workbook, master_path, deep)
+    return {"exists": True, **report}
+
+
+@router.get("/health/storage")
+async def storage_health():
+    """Storage backend, upload queue length and invoice count per upload state"""
+    return await run_in_threadpool(storage_service.get_storage_status)
+
+
 @router.get("/test-static")
 async def test_static():
     """Test if static files are accessible"""
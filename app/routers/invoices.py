@@ -1,49 +1,184 @@
 """
 Invoice management endpoints
 """
-from fastapi import APIRouter, File, UploadFile, HTTPException, Form
-from fastapi.responses import FileResponse
-from datetime import datetime
-from typing import Optional
+from fastapi import APIRouter, File, UploadFile, HTTPException, Form, Request, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from datetime import datetime, date
+from typing import Optional, Dict, Any, List
+import asyncio
+import json
 import os
+import time
 
-from app.models import BookingDataInput, InvoiceResponse
+from app.models import BookingDataInput, InvoiceResponse, JobResponse
 from app.services import (
-    ocr_service,
     extraction_service,
     excel_service,
-    storage_service
+    storage_service,
+    index_service,
+    sheet_export_service,
+    job_service,
+    idempotency_service
 )
+from app.services.idempotency_service import (
+    fingerprint,
+    IdempotencyKeyInUseError,
+    IdempotencyKeyMismatchError,
+    MAX_KEY_LENGTH
+)
+from app.services.index_service import SORT_COLUMNS
+from app.services.invoice_pipeline import process_booking_image, OCRFailedError
+from app.services.excel_service import MasterInvoiceError
+from app.services.job_service import FINISHED_STATES
+from app.core.xlsx import SheetNotFoundError
+from app.core.templates import TemplateError, TemplateNotFoundError
+from app.core.http_cache import file_response
+from app.core.metrics import stage, stage_breakdown, invoice_duration, rounded
+from app.core.log import get_logger
 from config import settings
 
 router = APIRouter(prefix="/api/invoice", tags=["Invoices"])
+logger = get_logger(__name__)
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# How often job event streams check for progress (seconds)
+JOB_EVENT_INTERVAL = 0.5
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def _read_document_images(document_images: Optional[list[UploadFile]]) -> List[bytes]:
+    """Read uploaded document images, skipping ones over the size limit"""
+    contents = []
+    for doc_img in document_images or []:
+        try:
+            img_content = await doc_img.read()
+            if len(img_content) <= settings.max_file_size_bytes:
+                contents.append(img_content)
+            else:
+                logger.warning("Skipping large document image", extra={'upload': doc_img.filename})
+        except Exception as e:
+            logger.warning("Failed to read document image", extra={'error': str(e)})
+    return contents
+
+
+def _idempotency_begin(key: Optional[str], endpoint: str, request_fingerprint: str) -> Optional[JSONResponse]:
+    """Claim an Idempotency-Key; returns the stored response for a repeated request"""
+    if key is None:
+        return None
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"
+        )
+    try:
+        stored = idempotency_service.begin(key, endpoint, request_fingerprint)
+    except IdempotencyKeyMismatchError:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used with a different request"
+        )
+    except IdempotencyKeyInUseError:
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still being processed"
+        )
+    if stored is None:
+        return None
+    return JSONResponse(content=stored, headers={"Idempotent-Replayed": "true"})
+
+
+def _idempotency_complete(key: Optional[str], endpoint: str, response: InvoiceResponse):
+    if key:
+        idempotency_service.complete(key, endpoint, response.model_dump())
+
+
+def _idempotency_release(key: Optional[str], endpoint: str):
+    if key:
+        idempotency_service.release(key, endpoint)
+
+
+def _job_response(job: Dict[str, Any]) -> JobResponse:
+    """API representation of a background job"""
+    return JobResponse(
+        success=job['status'] != 'failed',
+        job_id=job['id'],
+        status=job['status'],
+        stage=job['stage'],
+        attempts=job['attempts'],
+        created_at=job['created_at'],
+        updated_at=job['updated_at'],
+        error=job['error'],
+        result=job['result'],
+        status_url=f"/api/invoice/jobs/{job['id']}",
+        events_url=f"/api/invoice/jobs/{job['id']}/events"
+    )
+
+
+def _invoice_summary(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """API representation of an invoice index entry"""
+    return {
+        'invoice_id': entry['id'],
+        'filename': os.path.basename(entry['file_path']),
+        'invoice_number': entry['invoice_number'],
+        'customer_name': entry['customer_name'],
+        'mobile_number': entry['mobile_number'],
+        'vehicle_name': entry['vehicle_name'],
+        'vehicle_number': entry['vehicle_number'],
+        'total_amount': entry['total_amount'],
+        'invoice_date': entry['invoice_date'],
+        'service_date': entry['service_date'],
+        'sheet_name': entry['sheet_name'],
+        'created_at': entry['created_at'],
+        'size_bytes': entry['size_bytes'],
+        'download_url': f"/api/invoice/download/{entry['id']}"
+    }
 
 
 @router.post("/create", response_model=InvoiceResponse)
-async def create_invoice_from_data(data: BookingDataInput):
+async def create_invoice_from_data(
+    data: BookingDataInput,
+    idempotency_key: Optional[str] = Header(None)
+):
     """
     Create invoice from manual booking data (no OCR)
     
-    Provide booking details directly as JSON
+    Provide booking details directly as JSON. Repeating a request with the
+    same `Idempotency-Key` header returns the first response.
     """
+    # Convert Pydantic model to dict
+    booking_data = data.model_dump(exclude_none=True)
+    
+    replay = _idempotency_begin(
+        idempotency_key, 'create', fingerprint(json.dumps(booking_data, sort_keys=True, default=str))
+    )
+    if replay is not None:
+        return replay
+    
     try:
         start_time = datetime.now()
         
-        # Convert Pydantic model to dict
-        booking_data = data.model_dump(exclude_none=True)
-        
-        # Create invoice
-        invoice_result = excel_service.create_invoice(booking_data)
-        
-        # Upload to cloud storage
-        storage_service.upload_invoice(invoice_result['file_path'])
+        with stage_breakdown() as timings:
+            # Create invoice
+            invoice_result = await run_in_threadpool(excel_service.create_invoice, booking_data)
+            
+            # Queue the upload to storage (runs in the background)
+            with stage('storage'):
+                storage_service.upload_invoice(invoice_result['file_path'], invoice_id=invoice_result['invoice_id'])
         
         # Calculate processing time
-        processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
+        elapsed = (datetime.now() - start_time).total_seconds()
+        invoice_duration.observe(elapsed, endpoint='create')
+        processing_time = int(elapsed * 1000)
         
         message = f"Invoice added as sheet '{invoice_result.get('sheet_name')}' in master file" if invoice_result['mode'] == 'master' else "Invoice created successfully"
         
-        return InvoiceResponse(
+        response = InvoiceResponse(
             success=True,
             message=message,
             invoice_id=invoice_result['invoice_id'],
@@ -53,14 +188,23 @@ async def create_invoice_from_data(data: BookingDataInput):
             confidence=booking_data.get('extraction_confidence', 'high'),
             calculation_verified=booking_data.get('calculation_verified', True),
             processing_time_ms=processing_time,
-            sheet_name=invoice_result.get('sheet_name')
+            stage_timings_ms=rounded(timings),
+            sheet_name=invoice_result.get('sheet_name'),
+            amounts=invoice_result.get('amounts')
         )
         
+    except TemplateError as e:
+        _idempotency_release(idempotency_key, 'create')
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        _idempotency_release(idempotency_key, 'create')
         raise HTTPException(
             status_code=500,
             detail=f"Invoice creation failed: {str(e)}"
         )
+    
+    _idempotency_complete(idempotency_key, 'create', response)
+    return response
 
 
 @router.post("/create-from-ocr", response_model=InvoiceResponse)
@@ -68,7 +212,8 @@ async def create_invoice_from_ocr(
     file: UploadFile = File(...),
     user_text: Optional[str] = Form(None),
     language: str = Form("eng"),
-    document_images: Optional[list[UploadFile]] = File(None)
+    document_images: Optional[list[UploadFile]] = File(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Create invoice from OCR image + optional user text + optional document images
@@ -77,11 +222,12 @@ async def create_invoice_from_ocr(
     - **user_text**: Additional booking details (optional)
     - **language**: OCR language code
     - **document_images**: Customer document images (Aadhaar, DL, etc.)
+    - **Idempotency-Key** (header): Repeats of the same upload with this key
+      return the first response without running OCR again
     """
     try:
         start_time = datetime.now()
         
-        # Step 1: Extract text from image
         file_content = await file.read()
         
         # Validate file
@@ -91,89 +237,190 @@ async def create_invoice_from_ocr(
                 detail=f"File size exceeds {settings.max_file_size_mb}MB limit"
             )
         
-        # Preprocess and OCR
-        processed_content = ocr_service.preprocess_image(file_content)
-        ocr_result = ocr_service.extract_text_from_file(
-            processed_content,
-            language=language
+        document_image_data = await _read_document_images(document_images)
+        
+        replay = _idempotency_begin(
+            idempotency_key,
+            'create-from-ocr',
+            fingerprint(file_content, user_text or "", language, *document_image_data)
         )
+        if replay is not None:
+            return replay
+        
+        # OCR, extraction and the workbook write block; keep them off the event loop
+        try:
+            result = await run_in_threadpool(
+                process_booking_image,
+                file_content,
+                user_text=user_text or "",
+                language=language,
+                document_images=document_image_data
+            )
+        except OCRFailedError as e:
+            _idempotency_release(idempotency_key, 'create-from-ocr')
+            raise HTTPException(status_code=500, detail=f"OCR failed: {e}")
+        except Exception:
+            _idempotency_release(idempotency_key, 'create-from-ocr')
+            raise
+        
+        invoice_duration.observe((datetime.now() - start_time).total_seconds(), endpoint='create-from-ocr')
+        response = InvoiceResponse(**result)
+        _idempotency_complete(idempotency_key, 'create-from-ocr', response)
+        return response
         
-        if not ocr_result['success']:
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Invoice creation failed: {str(e)}"
+        )
+
+
+@router.post("/jobs", response_model=JobResponse, status_code=202)
+async def submit_invoice_job(
+    file: UploadFile = File(...),
+    user_text: Optional[str] = Form(None),
+    language: str = Form("eng"),
+    document_images: Optional[list[UploadFile]] = File(None)
+):
+    """
+    Queue invoice creation from an OCR image and return immediately
+    
+    Takes the same fields as `/create-from-ocr`. Poll `status_url` or
+    subscribe to `events_url` (server-sent events) for the result.
+    """
+    try:
+        file_content = await file.read()
+        if len(file_content) > settings.max_file_size_bytes:
             raise HTTPException(
-                status_code=500,
-                detail=f"OCR failed: {ocr_result.get('error')}"
+                status_code=400,
+                detail=f"File size exceeds {settings.max_file_size_mb}MB limit"
             )
         
-        ocr_text = ocr_result['text']
-        
-        # Step 2: Extract booking data using AI
-        booking_data = extraction_service.extract_booking_data(ocr_text, user_text or "")
-        
-        # Step 3: Process document images if provided
-        document_image_data = []
-        if document_images:
-            for doc_img in document_images:
-                try:
-                    img_content = await doc_img.read()
-                    if len(img_content) <= settings.max_file_size_bytes:
-                        document_image_data.append(img_content)
-                    else:
-                        print(f"⚠️  Skipping large document image: {doc_img.filename}")
-                except Exception as e:
-                    print(f"⚠️  Failed to read document image: {e}")
-        
-        # Add document images to booking data
-        if document_image_data:
-            booking_data['document_images'] = document_image_data
-        
-        # Step 4: Generate invoice
-        invoice_result = excel_service.create_invoice(booking_data)
-        
-        # Step 5: Upload to cloud storage
-        storage_service.upload_invoice(invoice_result['file_path'])
-        
-        # Calculate processing time
-        processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
-        
-        # Remove binary data before returning
-        response_data = {k: v for k, v in booking_data.items() if k != 'document_images'}
-        if document_image_data:
-            response_data['document_count'] = len(document_image_data)
-        
-        message = f"Invoice added as sheet '{invoice_result.get('sheet_name')}' in master file" if invoice_result['mode'] == 'master' else "Invoice created successfully from OCR"
-        
-        return InvoiceResponse(
-            success=True,
-            message=message,
-            invoice_id=invoice_result['invoice_id'],
-            file_path=invoice_result['file_path'],
-            download_url=f"/api/invoice/download/{invoice_result['invoice_id']}",
-            extracted_data=response_data,
-            confidence=booking_data.get('extraction_confidence'),
-            calculation_verified=booking_data.get('calculation_verified'),
-            processing_time_ms=processing_time,
-            sheet_name=invoice_result.get('sheet_name')
+        document_image_data = await _read_document_images(document_images)
+        job = await run_in_threadpool(
+            job_service.submit,
+            'create-from-ocr',
+            {'user_text': user_text or "", 'language': language},
+            [file_content] + document_image_data
         )
+        return _job_response(job)
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Invoice creation failed: {str(e)}"
+            detail=f"Failed to queue invoice job: {str(e)}"
         )
 
 
-@router.get("/download/{invoice_id}")
-async def download_invoice(invoice_id: str):
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_invoice_job(job_id: str):
+    """Status of a queued invoice job, with the invoice once it is done"""
+    job = job_service.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return _job_response(job)
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_invoice_job(job_id: str):
+    """
+    Follow a job as server-sent events
+    
+    Emits a `status` event whenever the job's status or stage changes, then a
+    final `done` or `failed` event carrying the full job (or an `error` event
+    if the job is deleted meanwhile).
+    """
+    if job_service.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    
+    async def event_stream():
+        last = None
+        while True:
+            job = job_service.get(job_id)
+            if job is None:
+                yield _sse('error', {'job_id': job_id, 'error': f"Job {job_id} no longer exists"})
+                return
+            if job['status'] in FINISHED_STATES:
+                yield _sse(job['status'], _job_response(job).model_dump())
+                return
+            if (job['status'], job['stage']) != last:
+                last = (job['status'], job['stage'])
+                yield _sse('status', {'job_id': job_id, 'status': job['status'], 'stage': job['stage']})
+            await asyncio.sleep(JOB_EVENT_INTERVAL)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/extract-stream")
+async def stream_booking_extraction(
+    ocr_text: str = Form(""),
+    user_text: Optional[str] = Form(None),
+    stop_early: bool = Form(False)
+):
+    """
+    Stream extracted booking fields as server-sent events
+    
+    Emits a `field` event for each field as soon as the model has generated it,
+    then a `complete` event with the full booking data.
+    
+    - **ocr_text**: Text extracted from the booking image
+    - **user_text**: Additional booking details (optional)
+    - **stop_early**: Stop generating once all required fields have arrived
+    """
+    def event_stream():
+        try:
+            for event in extraction_service.stream_booking_data(
+                ocr_text,
+                user_text or "",
+                stop_early=stop_early
+            ):
+                yield _sse(event.pop('event'), event)
+        except Exception as e:
+            yield _sse('error', {'error': f"Extraction failed: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+@router.api_route("/download/{invoice_id}", methods=["GET", "HEAD"])
+async def download_invoice(invoice_id: str, request: Request, template: Optional[str] = None):
     """
     Download generated invoice by ID
     
     - **invoice_id**: Invoice identifier (or 'master' to download all invoices)
+    - **template**: With 'master', the template whose master file to download
+    
+    In master mode a single-sheet workbook with just that invoice is returned,
+    taken from the master file of the invoice's template.
+    Supports If-None-Match/If-Modified-Since (304) and Range requests.
     """
     try:
         if settings.use_master_file:
-            file_path = settings.master_file_path
+            if invoice_id == 'master':
+                file_path = excel_service.master_path(template)
+                entry = None
+            else:
+                # Invoice IDs map to sheets and master files through the index;
+                # sheet names of the default master also work
+                entry = index_service.get(invoice_id)
+                if entry and entry.get('mode') == 'master' and entry.get('file_path'):
+                    file_path = entry['file_path']
+                else:
+                    file_path = settings.master_file_path
             
             if not os.path.exists(file_path):
                 raise HTTPException(
@@ -181,10 +428,25 @@ async def download_invoice(invoice_id: str):
                     detail=f"Master invoice file not found. No invoices have been created yet."
                 )
             
-            return FileResponse(
-                path=file_path,
-                filename="all_invoices.xlsx",
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            if invoice_id == 'master':
+                filename = "all_invoices.xlsx" if file_path == settings.master_file_path else os.path.basename(file_path)
+                return file_response(request, file_path, filename, XLSX_MEDIA_TYPE)
+            
+            sheet_name = entry['sheet_name'] if entry and entry.get('sheet_name') else invoice_id
+            
+            try:
+                sheet_path = sheet_export_service.export(file_path, sheet_name)
+            except SheetNotFoundError:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Invoice {invoice_id} not found in master file"
+                )
+            
+            # Extracts are rebuilt whenever the master changes; hashing keeps
+            # the ETag stable while the invoice itself is unchanged
+            return file_response(
+                request, sheet_path, f"{sheet_name}.xlsx", XLSX_MEDIA_TYPE,
+                use_content_hash=True
             )
         else:
             filename = f"{invoice_id}.xlsx"
@@ -196,14 +458,12 @@ async def download_invoice(invoice_id: str):
                     detail=f"Invoice {invoice_id} not found"
                 )
             
-            return FileResponse(
-                path=file_path,
-                filename=filename,
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+            return file_response(request, file_path, filename, XLSX_MEDIA_TYPE, immutable=True)
         
     except HTTPException:
         raise
+    except TemplateNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -211,54 +471,84 @@ async def download_invoice(invoice_id: str):
         )
 
 
-@router.get("/list")
-async def list_invoices(limit: int = 50):
+@router.api_route("/ledger", methods=["GET", "HEAD"])
+async def download_ledger(request: Request, format: str = "xlsx", template: Optional[str] = None):
     """
-    List all generated invoices
+    Download the ledger of all master-file invoices
+    
+    One row per invoice: number, date, customer, taxable amount, CGST, SGST
+    and total. Maintained incrementally as invoices are added.
     
-    - **limit**: Maximum number of invoices to return
+    - **format**: `xlsx` (default) or `csv`
+    - **template**: Template whose master file to list (default template if omitted)
     """
+    if format not in ('xlsx', 'csv'):
+        raise HTTPException(status_code=400, detail="format must be 'xlsx' or 'csv'")
+    
     try:
-        if not os.path.exists(settings.output_dir):
-            return {"invoices": [], "count": 0}
+        ledger = await run_in_threadpool(excel_service.ledger, template)
+        if not ledger.exists():
+            raise HTTPException(
+                status_code=404,
+                detail="Ledger not found. No invoices have been added to the master file yet."
+            )
         
-        files = [
-            f for f in os.listdir(settings.output_dir)
-            if f.endswith('.xlsx')
-        ]
+        if format == 'csv':
+            return file_response(request, ledger.path, "invoice_ledger.csv", "text/csv; charset=utf-8")
+        path = await run_in_threadpool(ledger.xlsx)
+        return file_response(request, path, "invoice_ledger.xlsx", XLSX_MEDIA_TYPE)
         
-        # Sort by modification time (newest first)
-        files.sort(
-            key=lambda x: os.path.getmtime(
-                os.path.join(settings.output_dir, x)
-            ),
-            reverse=True
+    except HTTPException:
+        raise
+    except TemplateNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ledger download failed: {str(e)}"
         )
+
+
+@router.get("/list")
+async def list_invoices(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    sort: str = 'created_at',
+    order: str = 'desc'
+):
+    """
+    List generated invoices from the invoice index
+    
+    - **limit**: Maximum number of invoices to return (1-500)
+    - **cursor**: `next_cursor` from the previous page
+    - **sort**: created_at, invoice_number, customer_name or total_amount
+    - **order**: asc or desc
+    """
+    try:
+        if not 1 <= limit <= 500:
+            raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+        if sort not in SORT_COLUMNS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"sort must be one of: {', '.join(SORT_COLUMNS)}"
+            )
         
-        # Limit results
-        files = files[:limit]
+        try:
+            entries, next_cursor = index_service.list(limit=limit, cursor=cursor, sort=sort, order=order)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        invoices = []
-        for filename in files:
-            file_path = os.path.join(settings.output_dir, filename)
-            invoice_id = filename.replace('.xlsx', '')
-            
-            invoices.append({
-                'invoice_id': invoice_id,
-                'filename': filename,
-                'created_at': datetime.fromtimestamp(
-                    os.path.getmtime(file_path)
-                ).isoformat(),
-                'size_bytes': os.path.getsize(file_path),
-                'download_url': f"/api/invoice/download/{invoice_id}"
-            })
+        invoices = [_invoice_summary(entry) for entry in entries]
         
         return {
             'invoices': invoices,
             'count': len(invoices),
-            'total': len([f for f in os.listdir(settings.output_dir) if f.endswith('.xlsx')])
+            'total': index_service.count(),
+            'next_cursor': next_cursor
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -266,25 +556,85 @@ async def list_invoices(limit: int = 50):
         )
 
 
+@router.get("/search")
+async def search_invoices(
+    q: Optional[str] = None,
+    name: Optional[str] = None,
+    phone: Optional[str] = None,
+    vehicle: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None
+):
+    """
+    Search invoices (newest first); all given filters must match
+    
+    - **q**: Words matched as prefixes in customer name or address
+    - **name**: Words matched as prefixes in customer name
+    - **phone**: Phone number, exact (ignores +91, spaces and dashes)
+    - **vehicle**: Vehicle number, exact (ignores spaces, dashes and case)
+    - **date_from** / **date_to**: Service date range (YYYY-MM-DD), inclusive
+    - **min_amount** / **max_amount**: Total amount range, inclusive
+    - **cursor**: `next_cursor` from the previous page
+    """
+    try:
+        if not 1 <= limit <= 500:
+            raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+        
+        start = time.perf_counter()
+        try:
+            entries, next_cursor = index_service.search(
+                text=q,
+                name=name,
+                phone=phone,
+                vehicle=vehicle,
+                date_from=date_from.isoformat() if date_from else None,
+                date_to=date_to.isoformat() if date_to else None,
+                min_amount=min_amount,
+                max_amount=max_amount,
+                limit=limit,
+                cursor=cursor
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        invoices = [_invoice_summary(entry) for entry in entries]
+        
+        return {
+            'invoices': invoices,
+            'count': len(invoices),
+            'next_cursor': next_cursor,
+            'query_time_ms': round((time.perf_counter() - start) * 1000, 2)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Invoice search failed: {str(e)}"
+        )
+
+
 @router.delete("/delete/{invoice_id}")
 async def delete_invoice(invoice_id: str):
     """
     Delete an invoice by ID
     
     - **invoice_id**: Invoice identifier
+    
+    Invoices kept as sheets of the master file cannot be deleted (409).
     """
     try:
-        filename = f"{invoice_id}.xlsx"
-        file_path = os.path.join(settings.output_dir, filename)
-        
-        if not os.path.exists(file_path):
+        if not await run_in_threadpool(excel_service.delete_invoice, invoice_id):
             raise HTTPException(
                 status_code=404,
                 detail=f"Invoice {invoice_id} not found"
             )
         
-        os.remove(file_path)
-        
         return {
             'success': True,
             'message': f'Invoice {invoice_id} deleted successfully'
@@ -292,6 +642,8 @@ async def delete_invoice(invoice_id: str):
         
     except HTTPException:
         raise
+    except MasterInvoiceError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -0,0 +1,17 @@
+"""
+Prometheus metrics endpoint
+"""
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.core.metrics import registry
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-stage pipeline timings in Prometheus text format"""
+    return PlainTextResponse(
+        content=registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -4,6 +4,7 @@ OCR endpoints
 from fastapi import APIRouter, File, UploadFile, HTTPException, Form
 from app.models import OCRRequest, OCRResponse
 from app.services import ocr_service
+from app.core.metrics import stage
 from config import settings
 
 router = APIRouter(prefix="/api/ocr", tags=["OCR"])
@@ -38,13 +39,15 @@ async def extract_text_from_image(
             )
         
         # Preprocess image
-        processed_content = ocr_service.preprocess_image(file_content)
+        with stage('preprocess'):
+            processed_content = ocr_service.preprocess_image(file_content)
         
         # Perform OCR
-        result = ocr_service.extract_text_from_file(
-            processed_content,
-            language=language
-        )
+        with stage('ocr'):
+            result = ocr_service.extract_text_from_file(
+                processed_content,
+                language=language
+            )
         
         if not result['success']:
             raise HTTPException(
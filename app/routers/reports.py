@@ -0,0 +1,161 @@
+"""
+Report endpoints
+
+Reports are built from the invoice index (never by reopening invoice files)
+and streamed to the client as write-only workbooks.
+"""
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from datetime import date
+from typing import Tuple
+import calendar
+
+from app.services import index_service
+from app.core.audit import audit_amounts
+from app.core.tax import GST_RATE
+from app.core.xlsx import stream_workbook
+from .invoices import XLSX_MEDIA_TYPE
+
+router = APIRouter(prefix="/api/reports", tags=["Reports"])
+
+GST_COLUMNS = [
+    ('Invoice No.', 'invoice_number', 18),
+    ('Invoice Date', 'invoice_day', 12),
+    ('Customer', 'customer_name', 32),
+    ('Vehicle No.', 'vehicle_number', 14),
+    ('Taxable Amount', 'taxable_amount', 15),
+    ('CGST @ 2.5%', 'cgst', 12),
+    ('SGST @ 2.5%', 'sgst', 12),
+    ('Total', 'total_amount', 14),
+]
+
+EXPORT_COLUMNS = [
+    ('Invoice ID', 'id', 24),
+    ('Invoice No.', 'invoice_number', 18),
+    ('Invoice Date', 'invoice_day', 12),
+    ('Customer', 'customer_name', 32),
+    ('Mobile', 'mobile_number', 14),
+    ('Address', 'address', 40),
+    ('Vehicle', 'vehicle_name', 18),
+    ('Vehicle No.', 'vehicle_number', 14),
+    ('Start', 'start_datetime', 18),
+    ('End', 'end_datetime', 18),
+    ('Taxable Amount', 'taxable_amount', 15),
+    ('CGST', 'cgst', 12),
+    ('SGST', 'sgst', 12),
+    ('Total', 'total_amount', 14),
+    ('Sheet', 'sheet_name', 18),
+    ('Created At', 'created_at', 20),
+]
+
+_AMOUNT_FIELDS = ('taxable_amount', 'cgst', 'sgst', 'total_amount')
+
+
+def _month_range(month: str) -> Tuple[str, str]:
+    """First and last day (YYYY-MM-DD) of a YYYY-MM month"""
+    try:
+        year, number = (int(part) for part in month.split('-'))
+        last_day = calendar.monthrange(year, number)[1]
+        # date() also rejects years calendar accepts, such as 0000
+        first, last = date(year, number, 1), date(year, number, last_day)
+    except (ValueError, calendar.IllegalMonthError):
+        raise HTTPException(status_code=400, detail=f"Invalid month '{month}', expected YYYY-MM")
+    return first.isoformat(), last.isoformat()
+
+
+def _header(ws, columns):
+    """Bold heading row and column widths"""
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    bold = Font(bold=True)
+    ws.freeze_panes = 'A2'
+    cells = []
+    for number, (heading, _, width) in enumerate(columns, start=1):
+        ws.column_dimensions[get_column_letter(number)].width = width
+        cell = WriteOnlyCell(ws, value=heading)
+        cell.font = bold
+        cells.append(cell)
+    ws.append(cells)
+
+
+def _xlsx_response(fill, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        stream_workbook(fill),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@router.get("/gst")
+async def gst_report(month: str = Query(..., description="Month as YYYY-MM")):
+    """
+    GST summary for a month
+
+    One row per invoice dated in the month (taxable amount, CGST, SGST,
+    total), followed by the month's totals.
+    """
+    date_from, date_to = _month_range(month)
+
+    def fill(wb):
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+
+        ws = wb.create_sheet(f"GST {month}")
+        _header(ws, GST_COLUMNS)
+        totals = dict.fromkeys(_AMOUNT_FIELDS, 0.0)
+        count = 0
+        for entry in index_service.iter_by_invoice_date(date_from, date_to):
+            ws.append([entry.get(field) for _, field, _ in GST_COLUMNS])
+            for field in _AMOUNT_FIELDS:
+                totals[field] += entry.get(field) or 0
+            count += 1
+
+        bold = Font(bold=True)
+        row = []
+        for _, field, _ in GST_COLUMNS:
+            if field == 'invoice_number':
+                value = f"Total ({count} invoices)"
+            else:
+                value = round(totals[field], 2) if field in totals else None
+            cell = WriteOnlyCell(ws, value=value)
+            cell.font = bold
+            row.append(cell)
+        ws.append(row)
+
+    return _xlsx_response(fill, f"gst_report_{month}.xlsx")
+
+
+@router.get("/invoices")
+async def invoice_export(month: str = Query(..., description="Month as YYYY-MM")):
+    """Every indexed detail of the invoices dated in a month"""
+    date_from, date_to = _month_range(month)
+
+    def fill(wb):
+        ws = wb.create_sheet(f"Invoices {month}")
+        _header(ws, EXPORT_COLUMNS)
+        for entry in index_service.iter_by_invoice_date(date_from, date_to):
+            ws.append([entry.get(field) for _, field, _ in EXPORT_COLUMNS])
+
+    return _xlsx_response(fill, f"invoices_{month}.xlsx")
+
+
+@router.get("/audit")
+async def amount_audit(
+    gst_rate: float = Query(float(GST_RATE), ge=0, le=1, description="GST rate to check against"),
+    tolerance: float = Query(0.01, ge=0, description="Allowed difference in rupees"),
+    max_examples: int = Query(100, ge=0, le=10000, description="Invoice IDs listed per failed check")
+):
+    """
+    Recheck the GST breakdown of every indexed invoice
+
+    Returns the number of invoices failing each check (missing breakdown,
+    negative amounts, CGST/SGST not matching the rate, unequal split, tax
+    above the total) with example invoice IDs.
+    """
+    def audit():
+        return audit_amounts(index_service.amount_columns(), gst_rate, tolerance, max_examples)
+
+    return await run_in_threadpool(audit)
@@ -6,11 +6,25 @@ from .extraction_service import extraction_service
 from .excel_service import excel_service
 from .storage_service import storage_service
 from .counter_service import counter_service
+from .index_service import index_service
+from .customer_service import customer_service
+from .sheet_export_service import sheet_export_service
+from .job_service import job_service
+from .idempotency_service import idempotency_service
+from .backup_service import backup_service
+from .warmup import warm_up
 
 __all__ = [
     'ocr_service',
     'extraction_service',
     'excel_service',
     'storage_service',
-    'counter_service'
+    'counter_service',
+    'index_service',
+    'customer_service',
+    'sheet_export_service',
+    'job_service',
+    'idempotency_service',
+    'backup_service',
+    'warm_up'
 ]
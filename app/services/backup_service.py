@@ -0,0 +1,67 @@
+"""
+Scheduled Backups
+
+Takes an incremental snapshot of the generated invoices and the invoice
+counter every BACKUP_INTERVAL_MINUTES on a background thread (see
+local_backup.py for the format and the restore command). Snapshots read
+files that are replaced atomically on save, so invoice writes carry on
+while a backup runs.
+"""
+import threading
+from typing import Any, Dict, List, Optional
+
+from config import settings
+from app.core.log import get_logger
+from local_backup import LocalBackup
+
+logger = get_logger(__name__)
+
+
+class BackupService:
+    """Periodic snapshots of invoice files, pruned to the newest few"""
+
+    def __init__(self, backup_dir: str = None, sources: List[str] = None, interval_minutes: int = None, keep: int = None):
+        self.backup = LocalBackup(backup_dir or settings.backup_dir)
+        self.sources = sources or [settings.output_dir, 'invoice_counter.json']
+        self.interval_minutes = settings.backup_interval_minutes if interval_minutes is None else interval_minutes
+        self.keep = settings.backup_keep if keep is None else keep
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Take a snapshot now and prune old ones
+
+        Returns:
+            Snapshot ID and stats
+        """
+        manifest = self.backup.snapshot(self.sources)
+        if self.keep > 0:
+            self.backup.prune(self.keep)
+        return {'id': manifest['id'], 'created_at': manifest['created_at'], 'stats': manifest['stats']}
+
+    def _loop(self):
+        while not self._stopping.wait(self.interval_minutes * 60):
+            try:
+                self.run()
+            except Exception as e:
+                logger.warning("Backup failed", extra={'error': str(e)})
+
+    def start(self):
+        """Start the backup thread (unless disabled with an interval of 0)"""
+        if self._thread or self.interval_minutes <= 0:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._loop, name="backup", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 60.0):
+        """Stop the backup thread, letting a running snapshot finish"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+
+# Singleton instance
+backup_service = BackupService()
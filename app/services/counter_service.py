@@ -6,6 +6,8 @@ import os
 from datetime import datetime
 from typing import Dict, Any
 
+from app.core.xlsx import atomic_write
+
 
 class CounterService:
     """Manage invoice counter and numbering"""
@@ -79,9 +81,10 @@ class CounterService:
             }
     
     def _save_counter(self, counter_data: Dict[str, Any]):
-        """Save counter to file"""
-        with open(self.counter_file, 'w') as f:
-            json.dump(counter_data, f, indent=2)
+        """Save counter to file, replacing it atomically"""
+        with atomic_write(self.counter_file) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(counter_data, f, indent=2)
     
     def _get_current_financial_year(self) -> str:
         """Get current financial year in YYYY-YY format"""
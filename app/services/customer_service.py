@@ -0,0 +1,158 @@
+"""
+Customer Profiles
+
+Name, company, address and GSTIN of every customer an invoice was made for,
+keyed by normalized phone number and GSTIN. Returning customers are
+recognized from the phone number or GSTIN in a booking, so their details are
+filled in from the profile instead of being re-extracted by the LLM.
+"""
+import re
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from config import settings
+from app.core.log import get_logger
+from app.core.sqlite import SQLiteStore
+from .index_service import phone_key
+
+logger = get_logger(__name__)
+
+
+# Fields kept per customer, and filled in from a matching profile
+PROFILE_FIELDS = ('customer_name', 'company_name', 'address', 'gstin')
+
+# Fields a GSTIN-only match fills in (the company, not the person booking)
+COMPANY_FIELDS = ('company_name', 'address', 'gstin')
+
+_BASE_SCHEMA = """
+    CREATE TABLE customers (
+        id INTEGER PRIMARY KEY,
+        phone_key TEXT NOT NULL DEFAULT '',
+        gstin TEXT NOT NULL DEFAULT '',
+        customer_name TEXT NOT NULL DEFAULT '',
+        company_name TEXT NOT NULL DEFAULT '',
+        address TEXT NOT NULL DEFAULT '',
+        invoice_count INTEGER NOT NULL DEFAULT 0,
+        first_seen TEXT NOT NULL,
+        last_seen TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX idx_customers_phone_key ON customers (phone_key) WHERE phone_key != '';
+    CREATE INDEX idx_customers_gstin ON customers (gstin, last_seen) WHERE gstin != '';
+"""
+
+# Schema migrations, applied in order; PRAGMA user_version records progress
+MIGRATIONS = [
+    _BASE_SCHEMA,
+]
+
+
+def gstin_key(value: Any) -> str:
+    """GSTIN in upper case without spaces; empty unless 15 characters"""
+    key = re.sub(r'[^A-Z0-9]', '', str(value or '').upper())
+    return key if len(key) == 15 else ''
+
+
+class CustomerService(SQLiteStore):
+    """Customer profiles backed by SQLite"""
+
+    migrations = MIGRATIONS
+
+    def __init__(self, db_path: str = None):
+        super().__init__(db_path or settings.customer_db_path)
+
+    def lookup(self, phone: Any = None, gstin: Any = None) -> Optional[Dict[str, Any]]:
+        """
+        Profile of a known customer
+
+        Args:
+            phone: Phone number in any format (+91, spaces, dashes)
+            gstin: GSTIN; used when the phone number is unknown
+
+        Returns:
+            Profile fields plus 'match' ('phone' or 'gstin'), or None
+        """
+        keys = (('phone', 'phone_key', phone_key(phone)), ('gstin', 'gstin', gstin_key(gstin)))
+        conn = self.conn
+        for match, column, key in keys:
+            if not key:
+                continue
+            with self._lock:
+                row = conn.execute(
+                    f"SELECT * FROM customers WHERE {column} = ? ORDER BY last_seen DESC LIMIT 1", (key,)
+                ).fetchone()
+            if row is not None:
+                return {**dict(row), 'match': match}
+        return None
+
+    def remember(self, booking_data: Dict[str, Any]) -> bool:
+        """
+        Record or update the profile of an invoiced customer
+
+        Empty fields never overwrite stored ones.
+
+        Returns:
+            True if a profile was written (the booking has a phone number or
+            GSTIN and some customer details)
+        """
+        phone = phone_key(booking_data.get('mobile_number') or booking_data.get('phone_number'))
+        gstin = gstin_key(booking_data.get('gstin'))
+        values = {field: str(booking_data.get(field) or '').strip() for field in PROFILE_FIELDS}
+        values['gstin'] = gstin
+        if not (phone or gstin) or not (values['customer_name'] or values['company_name'] or values['address']):
+            return False
+
+        now = datetime.now().isoformat()
+        conn = self.conn
+        with self._lock, conn:
+            if phone:
+                row = conn.execute("SELECT id FROM customers WHERE phone_key = ?", (phone,)).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT id FROM customers WHERE gstin = ? AND phone_key = '' ORDER BY last_seen DESC LIMIT 1",
+                    (gstin,)
+                ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO customers (phone_key, gstin, customer_name, company_name, address, "
+                    "invoice_count, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, 1, ?, ?)",
+                    (phone, gstin, values['customer_name'], values['company_name'], values['address'], now, now)
+                )
+            else:
+                updates = ', '.join(f"{field} = CASE WHEN ? != '' THEN ? ELSE {field} END" for field in PROFILE_FIELDS)
+                params = [value for field in PROFILE_FIELDS for value in (values[field], values[field])]
+                conn.execute(
+                    f"UPDATE customers SET {updates}, invoice_count = invoice_count + 1, last_seen = ? WHERE id = ?",
+                    (*params, now, row['id'])
+                )
+        return True
+
+    def apply(self, data: Dict[str, Any], profile: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Fill empty customer fields of extracted booking data from a profile
+
+        Values extracted from the booking are kept, so changed details
+        replace the stored ones when the invoice is remembered.
+
+        Args:
+            data: Booking data, updated in place
+            profile: Result of lookup()
+
+        Returns:
+            data
+        """
+        fields = PROFILE_FIELDS if profile['match'] == 'phone' else COMPANY_FIELDS
+        for field in fields:
+            if profile.get(field) and not data.get(field):
+                data[field] = profile[field]
+        data['known_customer'] = True
+        return data
+
+    def count(self) -> int:
+        """Number of known customers"""
+        conn = self.conn
+        with self._lock:
+            return conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+
+
+# Singleton instance
+customer_service = CustomerService()
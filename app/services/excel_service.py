@@ -3,20 +3,87 @@ Excel Invoice Generation Service
 """
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+from functools import cached_property
+import os
+import threading
 import uuid
 from hilldrive_excel_mapper import HillDriveExcelWriter
+from app.core.ledger import Ledger
+from app.core.templates import DEFAULT_TEMPLATE, TemplateRegistry
 from config import settings
+from app.core.log import get_logger
+from .index_service import index_service
+from .customer_service import customer_service
+
+logger = get_logger(__name__)
+
+
+class MasterInvoiceError(RuntimeError):
+    """The invoice is a sheet of the master file, which is append-only"""
 
 
 class ExcelService:
     """Handle Excel invoice generation"""
     
     def __init__(self):
-        self.writer = HillDriveExcelWriter(
+        # Invoice numbers and the master workbook are read-modify-write;
+        # request threads and job workers must take turns
+        self._write_lock = threading.Lock()
+        # Writers of named templates, by name
+        self._writers: Dict[str, HillDriveExcelWriter] = {}
+    
+    @cached_property
+    def writer(self) -> HillDriveExcelWriter:
+        """Template writer, built on first use"""
+        return HillDriveExcelWriter(
             settings.template_path,
-            settings.master_file_path
+            settings.master_file_path,
+            settings.media_cache_dir,
+            renderer=settings.invoice_renderer,
+            media_max_bytes=settings.media_cache_max_mb * 1024 * 1024
         )
     
+    @cached_property
+    def templates(self) -> TemplateRegistry:
+        """Templates of other branches or brands, compiled on first use"""
+        return TemplateRegistry(settings.templates_dir)
+    
+    def master_path(self, template: Optional[str] = None) -> str:
+        """
+        Master file of a named template: all_invoices_<name>.xlsx next to the
+        configured master file, which the default template uses
+        
+        Raises:
+            TemplateNotFoundError: Invalid template name
+        """
+        if not template or template == DEFAULT_TEMPLATE:
+            return settings.master_file_path
+        self.templates.mapping_path(template)  # Rejects names that are not file-safe
+        root, ext = os.path.splitext(settings.master_file_path)
+        return f"{root}_{template}{ext}"
+    
+    def writer_for(self, template: Optional[str] = None) -> HillDriveExcelWriter:
+        """
+        Writer of a named template
+        
+        Each template has its own master file (see master_path()).
+        
+        Raises:
+            TemplateNotFoundError: No template of that name
+        """
+        if not template or template == DEFAULT_TEMPLATE:
+            return self.writer
+        compiled = self.templates.get(template)
+        writer = self._writers.get(template)
+        # A recompiled template (edited mapping or workbook) gets a new writer
+        if writer is None or writer.template is not compiled:
+            writer = HillDriveExcelWriter.from_template(
+                compiled, self.master_path(template), settings.media_cache_dir, settings.invoice_renderer,
+                settings.media_cache_max_mb * 1024 * 1024
+            )
+            self._writers[template] = writer
+        return writer
+    
     def create_invoice(
         self,
         booking_data: Dict[str, Any],
@@ -26,40 +93,91 @@ class ExcelService:
         Create Excel invoice from booking data
         
         Returns:
-            Dict with invoice_id, file_path, and other metadata
+            Dict with invoice_id, file_path, amounts (the invoice's tax
+            breakdown) and other metadata
+        
+        Raises:
+            TemplateNotFoundError: booking_data names an unknown 'template'
         """
         # Generate invoice ID if not provided
         if not invoice_id:
             invoice_id = self._generate_invoice_id()
         
         # Create invoice based on mode
-        if settings.use_master_file:
-            result = self._create_master_file_invoice(booking_data)
-            return {
-                'invoice_id': invoice_id,
-                'file_path': result['master_file'],
-                'sheet_name': result['sheet_name'],
-                'mode': 'master'
-            }
-        else:
-            file_path = self._create_separate_invoice(booking_data, invoice_id)
-            return {
-                'invoice_id': invoice_id,
-                'file_path': file_path,
-                'mode': 'separate'
-            }
+        with self._write_lock:
+            writer = self.writer_for(booking_data.get('template'))
+            if settings.use_master_file:
+                result = self._create_master_file_invoice(booking_data, writer)
+                invoice_result = {
+                    'invoice_id': invoice_id,
+                    'file_path': result['master_file'],
+                    'sheet_name': result['sheet_name'],
+                    'mode': 'master'
+                }
+            else:
+                file_path = self._create_separate_invoice(booking_data, invoice_id, writer)
+                invoice_result = {
+                    'invoice_id': invoice_id,
+                    'file_path': file_path,
+                    'mode': 'separate'
+                }
+        invoice_result['amounts'] = writer.invoice_amounts(booking_data)
+        
+        # The invoice file is already written; a failed index update must not lose it
+        try:
+            index_service.record_invoice(invoice_result, booking_data, invoice_result['amounts'])
+        except Exception as e:
+            logger.warning("Failed to index invoice", extra={'invoice_id': invoice_id, 'error': str(e)})
+        
+        if settings.customer_profiles:
+            try:
+                customer_service.remember(booking_data)
+            except Exception as e:
+                logger.warning("Failed to update customer profile", extra={'invoice_id': invoice_id, 'error': str(e)})
+        
+        return invoice_result
+    
+    def ledger(self, template: Optional[str] = None) -> Ledger:
+        """
+        Ledger of a template's master file (one row per invoice sheet)
+        
+        Raises:
+            TemplateNotFoundError: No template of that name
+        """
+        with self._write_lock:
+            return self.writer_for(template).ensure_ledger()
+    
+    def delete_invoice(self, invoice_id: str) -> bool:
+        """
+        Delete an invoice created in separate mode (its own file) and its index entry
+        
+        Returns:
+            True if the invoice existed
+        
+        Raises:
+            MasterInvoiceError: The invoice is a sheet of a master file; its
+                sheet and ledger row are kept, so it is not deleted either
+        """
+        entry = index_service.get(invoice_id)
+        if entry is not None and entry.get('mode') == 'master':
+            raise MasterInvoiceError(f"Invoice {invoice_id} is a sheet of the master file and cannot be deleted")
+        file_path = os.path.join(settings.output_dir, f"{invoice_id}.xlsx")
+        existed = os.path.exists(file_path)
+        if existed:
+            os.remove(file_path)
+        return index_service.remove(invoice_id) or existed
     
-    def _create_master_file_invoice(self, booking_data: Dict[str, Any]) -> Dict[str, str]:
+    def _create_master_file_invoice(self, booking_data: Dict[str, Any], writer: HillDriveExcelWriter) -> Dict[str, str]:
         """Add invoice as new sheet to master file"""
-        result = self.writer.write_to_master(booking_data)
+        result = writer.write_to_master(booking_data)
         return result
     
-    def _create_separate_invoice(self, booking_data: Dict[str, Any], invoice_id: str) -> str:
+    def _create_separate_invoice(self, booking_data: Dict[str, Any], invoice_id: str,
+                                 writer: HillDriveExcelWriter) -> str:
         """Create separate invoice file"""
-        import os
         output_filename = f"{invoice_id}.xlsx"
         output_path = os.path.join(settings.output_dir, output_filename)
-        self.writer.write(booking_data, output_path)
+        writer.write(booking_data, output_path)
         return output_path
     
     def _generate_invoice_id(self) -> str:
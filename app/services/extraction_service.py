@@ -1,11 +1,26 @@
 """
 Data Extraction Service - Coordinates AI and fallback extraction
+
+Bookings from known customers (recognized by phone number or GSTIN, see
+customer_service) take a shortcut: the LLM is skipped when pattern matching
+already found the booking essentials, or otherwise sent only the typed
+booking text. Details found in the current booking always win; the stored
+profile only fills the customer fields it leaves empty, so a customer who
+moved or renamed their company is invoiced with the new details.
 """
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, Optional, Tuple
 from config import settings
 from openrouter_service import openrouter_extractor
 from gemini_service import gemini_extractor
 from implementation_example import BookingDataExtractor
+from app.core.log import get_logger
+from .customer_service import customer_service
+
+logger = get_logger(__name__)
+
+
+# Fields pattern matching must find before a known customer's booking skips the LLM
+SHORTCUT_FIELDS = ('start_datetime', 'end_datetime', 'total_amount')
 
 
 class ExtractionService:
@@ -14,12 +29,73 @@ class ExtractionService:
     def __init__(self):
         self.fallback_extractor = BookingDataExtractor()
     
+    def _llm_enabled(self) -> bool:
+        return (settings.use_openrouter and openrouter_extractor.enabled) or \
+            (settings.use_gemini and gemini_extractor.enabled)
+    
+    def _known_customer(self, ocr_text: str, user_text: str) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Profile of the booking's customer, if known, and the pattern-matched data
+        
+        Returns:
+            (profile or None, pattern-matched booking data)
+        """
+        data = self.fallback_extractor.extract(ocr_text, user_text)
+        if not settings.customer_profiles:
+            return None, data
+        try:
+            profile = customer_service.lookup(data.get('mobile_number'), data.get('gstin'))
+        except Exception as e:
+            logger.warning("Customer lookup failed", extra={'error': str(e)})
+            profile = None
+        return profile, data
+    
+    def _profile_shortcut(self, profile: Optional[Dict[str, Any]], data: Dict[str, Any]) -> bool:
+        """True if the pattern-matched data of a known customer is complete enough to skip the LLM"""
+        return profile is not None and profile['match'] == 'phone' and settings.customer_profile_skip_llm \
+            and all(data.get(field) is not None for field in SHORTCUT_FIELDS)
+    
+    def _apply_profile(self, data: Dict[str, Any], profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Fill customer fields from the profile found before, or matching the LLM output"""
+        if profile is None and settings.customer_profiles:
+            try:
+                profile = customer_service.lookup(
+                    data.get('mobile_number') or data.get('phone_number'), data.get('gstin')
+                )
+            except Exception as e:
+                logger.warning("Customer lookup failed", extra={'error': str(e)})
+        return customer_service.apply(data, profile) if profile else data
+    
+    @staticmethod
+    def _with_known_data(data: Dict[str, Any], pattern_data: Dict[str, Any], profile: Dict[str, Any]) -> Dict[str, Any]:
+        """LLM output with the fields it left empty taken from pattern matching, then the profile"""
+        merged = dict(pattern_data)
+        merged.update((field, value) for field, value in data.items() if value is not None)
+        return customer_service.apply(merged, profile)
+    
     def extract_booking_data(self, ocr_text: str, user_text: str = "") -> Dict[str, Any]:
         """
         Extract booking data using best available method
         
-        Priority: OpenRouter → Gemini → Pattern Matching
+        Priority: Customer profile → OpenRouter → Gemini → Pattern Matching
         """
+        profile, pattern_data = self._known_customer(ocr_text, user_text)
+        if not self._llm_enabled():
+            return customer_service.apply(pattern_data, profile) if profile else pattern_data
+        if self._profile_shortcut(profile, pattern_data):
+            logger.info("Known customer; LLM extraction skipped", extra={'match': profile['match']})
+            return customer_service.apply(pattern_data, profile)
+        if profile is not None:
+            # The scanned document mostly repeats what the profile holds; what
+            # the LLM does not get from the typed text comes from pattern
+            # matching and the profile
+            data = self._extract_with_llm("", user_text, pattern_data)
+            return self._with_known_data(data, pattern_data, profile)
+        
+        return self._apply_profile(self._extract_with_llm(ocr_text, user_text, pattern_data), profile)
+    
+    def _extract_with_llm(self, ocr_text: str, user_text: str, pattern_data: Dict[str, Any]) -> Dict[str, Any]:
+        """OpenRouter, then Gemini; the pattern-matched data if both fail"""
         # Try OpenRouter first
         if settings.use_openrouter and openrouter_extractor.enabled:
             try:
@@ -27,7 +103,7 @@ class ExtractionService:
                 data = openrouter_extractor.enhance_extracted_data(data)
                 return data
             except Exception as e:
-                print(f"⚠️  OpenRouter extraction failed: {e}")
+                logger.warning("OpenRouter extraction failed", extra={'error': str(e)})
         
         # Try Gemini as fallback
         if settings.use_gemini and gemini_extractor.enabled:
@@ -36,10 +112,45 @@ class ExtractionService:
                 data = gemini_extractor.enhance_extracted_data(data)
                 return data
             except Exception as e:
-                print(f"⚠️  Gemini extraction failed: {e}")
+                logger.warning("Gemini extraction failed", extra={'error': str(e)})
         
         # Use pattern matching as last resort
-        return self.fallback_extractor.extract(ocr_text, user_text)
+        return pattern_data
+    
+    def stream_booking_data(
+        self,
+        ocr_text: str,
+        user_text: str = "",
+        stop_early: bool = False
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Extract booking data field by field as it becomes available
+        
+        Only OpenRouter streams; the other methods emit all fields at once.
+        
+        Yields:
+            'field' events for each extracted field, then one 'complete' event
+        """
+        if settings.use_openrouter and openrouter_extractor.enabled:
+            profile, pattern_data = self._known_customer(ocr_text, user_text)
+            if not self._profile_shortcut(profile, pattern_data):
+                try:
+                    llm_ocr_text = "" if profile is not None else ocr_text
+                    for event in openrouter_extractor.stream_invoice_data(llm_ocr_text, user_text, stop_early):
+                        if event['event'] == 'complete':
+                            data = openrouter_extractor.enhance_extracted_data(event['data'])
+                            event['data'] = self._with_known_data(data, pattern_data, profile) \
+                                if profile is not None else self._apply_profile(data, None)
+                        yield event
+                    return
+                except Exception as e:
+                    logger.warning("OpenRouter streaming failed", extra={'error': str(e)})
+        
+        data = self.extract_booking_data(ocr_text, user_text)
+        for field, value in data.items():
+            if value is not None:
+                yield {'event': 'field', 'field': field, 'value': value}
+        yield {'event': 'complete', 'data': data, 'stopped_early': False}
     
     def get_extraction_method(self) -> str:
         """Get the current extraction method being used"""
@@ -0,0 +1,146 @@
+"""
+Idempotency Keys for Invoice Creation
+
+Clients send an ``Idempotency-Key`` header with create requests. The first
+request with a key does the work and its response is stored; repeats with the
+same key and body get the stored response back without running OCR, the LLM
+or the invoice counter again.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Union
+
+from config import settings
+from app.core.log import get_logger
+from app.core.sqlite import SQLiteStore
+
+logger = get_logger(__name__)
+
+
+# A request still pending after this long is assumed to have died with its
+# process, and the key may be used again
+PENDING_TIMEOUT = timedelta(minutes=10)
+
+MAX_KEY_LENGTH = 255
+
+_BASE_SCHEMA = """
+    CREATE TABLE idempotency_keys (
+        key TEXT NOT NULL,
+        endpoint TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        response TEXT,
+        created_at TEXT NOT NULL,
+        expires_at TEXT NOT NULL,
+        PRIMARY KEY (endpoint, key)
+    );
+    CREATE INDEX idx_idempotency_expires ON idempotency_keys (expires_at);
+"""
+
+# Schema migrations, applied in order; PRAGMA user_version records progress
+MIGRATIONS = [
+    _BASE_SCHEMA,
+]
+
+
+class IdempotencyKeyInUseError(RuntimeError):
+    """Raised when a request with the same key is still being processed"""
+
+
+class IdempotencyKeyMismatchError(ValueError):
+    """Raised when a key is reused with a different request body"""
+
+
+def fingerprint(*parts: Union[bytes, str, None]) -> str:
+    """Hash of the request parts that make two requests the same request"""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = (part or '').encode('utf-8') if not isinstance(part, bytes) else part
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class IdempotencyService(SQLiteStore):
+    """Completed responses by idempotency key, kept for IDEMPOTENCY_TTL_HOURS"""
+
+    migrations = MIGRATIONS
+
+    def __init__(self, db_path: str = None, ttl_hours: int = None):
+        super().__init__(db_path or settings.idempotency_db_path)
+        self.ttl = timedelta(hours=settings.idempotency_ttl_hours if ttl_hours is None else ttl_hours)
+
+    def begin(self, key: str, endpoint: str, request_fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Claim a key before doing the work
+
+        Args:
+            key: Client-supplied Idempotency-Key
+            endpoint: Endpoint name; keys are scoped per endpoint
+            request_fingerprint: fingerprint() of the request
+
+        Returns:
+            The stored response if the request was already completed, else
+            None (the caller must then call complete() or release())
+
+        Raises:
+            IdempotencyKeyInUseError: The same request is still in progress
+            IdempotencyKeyMismatchError: The key was used for another request
+        """
+        now = datetime.now()
+        conn = self.conn
+        with self._lock, conn:
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE endpoint = ? AND key = ? "
+                "AND (expires_at < ? OR (response IS NULL AND created_at < ?))",
+                (endpoint, key, now.isoformat(), (now - PENDING_TIMEOUT).isoformat())
+            )
+            conn.execute(
+                "INSERT INTO idempotency_keys (key, endpoint, fingerprint, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(endpoint, key) DO NOTHING",
+                (key, endpoint, request_fingerprint, now.isoformat(), (now + self.ttl).isoformat())
+            )
+            claimed = conn.execute("SELECT changes()").fetchone()[0] == 1
+            row = conn.execute(
+                "SELECT fingerprint, response FROM idempotency_keys WHERE endpoint = ? AND key = ?",
+                (endpoint, key)
+            ).fetchone()
+
+        if claimed:
+            return None
+        if row['fingerprint'] != request_fingerprint:
+            raise IdempotencyKeyMismatchError(key)
+        if row['response'] is None:
+            raise IdempotencyKeyInUseError(key)
+        logger.info("Replaying idempotent response", extra={'endpoint': endpoint})
+        return json.loads(row['response'])
+
+    def complete(self, key: str, endpoint: str, response: Dict[str, Any]):
+        """Store the response of a claimed key"""
+        conn = self.conn
+        with self._lock, conn:
+            conn.execute(
+                "UPDATE idempotency_keys SET response = ? WHERE endpoint = ? AND key = ?",
+                (json.dumps(response, default=str), endpoint, key)
+            )
+
+    def release(self, key: str, endpoint: str):
+        """Give up a claimed key after a failure, so the client can retry"""
+        conn = self.conn
+        with self._lock, conn:
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE endpoint = ? AND key = ? AND response IS NULL",
+                (endpoint, key)
+            )
+
+    def purge(self) -> int:
+        """Delete expired keys; returns how many were removed"""
+        conn = self.conn
+        with self._lock, conn:
+            return conn.execute(
+                "DELETE FROM idempotency_keys WHERE expires_at < ?", (datetime.now().isoformat(),)
+            ).rowcount
+
+
+# Singleton instance
+idempotency_service = IdempotencyService()
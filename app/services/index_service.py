@@ -0,0 +1,579 @@
+"""
+Invoice Metadata Index
+
+SQLite table of generated invoices, kept up to date by ExcelService so that
+listings and searches never scan or stat the output directory. Customer name
+and address are also indexed in an FTS5 table for prefix/full-text search.
+"""
+import base64
+import json
+import os
+import re
+import sqlite3
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from config import settings
+from app.core.log import get_logger
+from app.core.sqlite import SQLiteStore
+from app.core.tax import compute
+
+logger = get_logger(__name__)
+
+
+# Columns that listings can be sorted by (each has a (column, id) index)
+SORT_COLUMNS = ('created_at', 'invoice_number', 'customer_name', 'total_amount')
+
+_BASE_SCHEMA = """
+    CREATE TABLE invoices (
+        id TEXT PRIMARY KEY,
+        invoice_number TEXT NOT NULL DEFAULT '',
+        customer_name TEXT NOT NULL DEFAULT '',
+        mobile_number TEXT NOT NULL DEFAULT '',
+        total_amount REAL NOT NULL DEFAULT 0,
+        invoice_date TEXT,
+        start_datetime TEXT,
+        end_datetime TEXT,
+        file_path TEXT NOT NULL,
+        sheet_name TEXT,
+        mode TEXT NOT NULL DEFAULT 'separate',
+        size_bytes INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX idx_invoices_created_at ON invoices (created_at, id);
+    CREATE INDEX idx_invoices_invoice_number ON invoices (invoice_number, id);
+    CREATE INDEX idx_invoices_customer_name ON invoices (customer_name, id);
+    CREATE INDEX idx_invoices_total_amount ON invoices (total_amount, id);
+
+    -- Row count maintained by triggers so totals do not need COUNT(*)
+    CREATE TABLE invoice_stats (total INTEGER NOT NULL);
+    INSERT INTO invoice_stats (total) VALUES (0);
+    CREATE TRIGGER invoices_count_insert AFTER INSERT ON invoices
+        BEGIN UPDATE invoice_stats SET total = total + 1; END;
+    CREATE TRIGGER invoices_count_delete AFTER DELETE ON invoices
+        BEGIN UPDATE invoice_stats SET total = total - 1; END;
+"""
+
+_SEARCH_COLUMNS = """
+    ALTER TABLE invoices ADD COLUMN address TEXT NOT NULL DEFAULT '';
+    ALTER TABLE invoices ADD COLUMN vehicle_name TEXT NOT NULL DEFAULT '';
+    ALTER TABLE invoices ADD COLUMN vehicle_number TEXT NOT NULL DEFAULT '';
+    ALTER TABLE invoices ADD COLUMN phone_key TEXT NOT NULL DEFAULT '';
+    ALTER TABLE invoices ADD COLUMN vehicle_key TEXT NOT NULL DEFAULT '';
+    ALTER TABLE invoices ADD COLUMN service_date TEXT;
+    CREATE INDEX idx_invoices_phone_key ON invoices (phone_key);
+    CREATE INDEX idx_invoices_vehicle_key ON invoices (vehicle_key);
+    CREATE INDEX idx_invoices_service_date ON invoices (service_date);
+"""
+
+# External-content FTS5 table; triggers keep it in step with invoices
+_SEARCH_FTS = """
+    CREATE VIRTUAL TABLE invoices_fts USING fts5(
+        customer_name, address,
+        content='invoices', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    CREATE TRIGGER invoices_fts_insert AFTER INSERT ON invoices BEGIN
+        INSERT INTO invoices_fts (rowid, customer_name, address)
+        VALUES (new.rowid, new.customer_name, new.address);
+    END;
+    CREATE TRIGGER invoices_fts_delete AFTER DELETE ON invoices BEGIN
+        INSERT INTO invoices_fts (invoices_fts, rowid, customer_name, address)
+        VALUES ('delete', old.rowid, old.customer_name, old.address);
+    END;
+    CREATE TRIGGER invoices_fts_update AFTER UPDATE OF customer_name, address ON invoices BEGIN
+        INSERT INTO invoices_fts (invoices_fts, rowid, customer_name, address)
+        VALUES ('delete', old.rowid, old.customer_name, old.address);
+        INSERT INTO invoices_fts (rowid, customer_name, address)
+        VALUES (new.rowid, new.customer_name, new.address);
+    END;
+    INSERT INTO invoices_fts (invoices_fts) VALUES ('rebuild');
+"""
+
+_TAX_COLUMNS = """
+    ALTER TABLE invoices ADD COLUMN taxable_amount REAL NOT NULL DEFAULT 0;
+    ALTER TABLE invoices ADD COLUMN cgst REAL NOT NULL DEFAULT 0;
+    ALTER TABLE invoices ADD COLUMN sgst REAL NOT NULL DEFAULT 0;
+    ALTER TABLE invoices ADD COLUMN invoice_day TEXT;
+    CREATE INDEX idx_invoices_invoice_day ON invoices (invoice_day, id);
+"""
+
+# Upload state is written by StorageService only, never by record()
+_UPLOAD_COLUMNS = """
+    ALTER TABLE invoices ADD COLUMN upload_state TEXT;
+    ALTER TABLE invoices ADD COLUMN upload_key TEXT;
+    ALTER TABLE invoices ADD COLUMN upload_attempts INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE invoices ADD COLUMN upload_error TEXT;
+    ALTER TABLE invoices ADD COLUMN uploaded_at TEXT;
+    CREATE INDEX idx_invoices_upload_state ON invoices (upload_state) WHERE upload_state IS NOT NULL;
+"""
+
+# Upload states: queued -> uploading -> uploaded | failed
+UPLOAD_STATES = ('queued', 'uploading', 'uploaded', 'failed')
+
+_FIELDS = (
+    'id', 'invoice_number', 'customer_name', 'mobile_number', 'total_amount',
+    'invoice_date', 'start_datetime', 'end_datetime', 'file_path', 'sheet_name',
+    'mode', 'size_bytes', 'created_at', 'address', 'vehicle_name', 'vehicle_number',
+    'phone_key', 'vehicle_key', 'service_date', 'taxable_amount', 'cgst', 'sgst',
+    'invoice_day'
+)
+
+_DATE_FORMATS = ('%d/%m/%Y %H:%M', '%d/%m/%Y', '%d/%m/%y', '%d-%m-%Y')
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def phone_key(value: Any) -> str:
+    """Last 10 digits of a phone number (drops +91, spaces and dashes)"""
+    return re.sub(r'\D', '', str(value or ''))[-10:]
+
+
+def vehicle_key(value: Any) -> str:
+    """Vehicle registration without spaces or dashes, upper case"""
+    return re.sub(r'[^A-Z0-9]', '', str(value or '').upper())
+
+
+def service_date(*values: Any) -> Optional[str]:
+    """ISO date of the first parseable value (booking start, invoice date, ...)"""
+    for value in values:
+        if not value:
+            continue
+        text = str(value).strip()
+        try:
+            return datetime.fromisoformat(text.replace('Z', '+00:00')).date().isoformat()
+        except ValueError:
+            pass
+        for fmt in _DATE_FORMATS:
+            try:
+                return datetime.strptime(text, fmt).date().isoformat()
+            except ValueError:
+                continue
+    return None
+
+
+def _fts_query(text: str, column: Optional[str] = None) -> Optional[str]:
+    """FTS5 query matching every word of text as a prefix"""
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        return None
+    prefix = f"{column} : " if column else ''
+    return ' AND '.join(f'{prefix}"{word}"*' for word in words)
+
+
+def _add_search_fields(conn: sqlite3.Connection):
+    """Migration 2: search columns, lookup keys and the FTS table"""
+    conn.executescript(_SEARCH_COLUMNS)
+    rows = conn.execute(
+        "SELECT rowid, mobile_number, start_datetime, invoice_date, created_at FROM invoices"
+    ).fetchall()
+    conn.executemany(
+        "UPDATE invoices SET phone_key = ?, service_date = ? WHERE rowid = ?",
+        [
+            (phone_key(row[1]), service_date(row[2], row[3], row[4]), row[0])
+            for row in rows
+        ]
+    )
+    conn.executescript(_SEARCH_FTS)
+
+
+def estimated_tax(total_amount: Any) -> Tuple[float, float, float]:
+    """
+    (taxable amount, CGST, SGST) of a GST-inclusive total
+
+    Used for entries recorded without their tax breakdown.
+    """
+    amounts = compute(total_amount).amounts()
+    return amounts['taxable_amount'], amounts['cgst'], amounts['sgst']
+
+
+def _add_tax_fields(conn: sqlite3.Connection):
+    """Migration 3: tax breakdown and invoice date for reports"""
+    conn.executescript(_TAX_COLUMNS)
+    rows = conn.execute("SELECT rowid, total_amount, invoice_date, created_at FROM invoices").fetchall()
+    conn.executemany(
+        "UPDATE invoices SET taxable_amount = ?, cgst = ?, sgst = ?, invoice_day = ? WHERE rowid = ?",
+        [(*estimated_tax(row[1]), service_date(row[2], row[3]), row[0]) for row in rows]
+    )
+
+
+# Schema migrations (SQL scripts or functions), applied in order;
+# PRAGMA user_version records progress
+MIGRATIONS = [
+    _BASE_SCHEMA,
+    _add_search_fields,
+    _add_tax_fields,
+    _UPLOAD_COLUMNS,
+]
+
+
+class IndexService(SQLiteStore):
+    """Persistent invoice index backed by SQLite"""
+
+    migrations = MIGRATIONS
+
+    def __init__(self, db_path: str = None, output_dir: str = None):
+        super().__init__(db_path or settings.index_db_path)
+        self.output_dir = output_dir or settings.output_dir
+
+    def _created(self):
+        self._backfill()
+
+    def _backfill(self):
+        """Index invoices that were generated before the index existed"""
+        if not os.path.isdir(self.output_dir):
+            return
+
+        master_name = os.path.basename(settings.master_file_path)
+        found = []
+        with os.scandir(self.output_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.xlsx') or entry.name == master_name:
+                    continue
+                stat = entry.stat()
+                found.append({
+                    'id': entry.name[:-len('.xlsx')],
+                    'file_path': entry.path,
+                    'size_bytes': stat.st_size,
+                    'created_at': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                })
+        if found:
+            self.record_many(found)
+            logger.info("Backfilled invoice index", extra={'invoices': len(found)})
+
+    @staticmethod
+    def _row(entry: Dict[str, Any]) -> Dict[str, Any]:
+        row = {field: entry.get(field) for field in _FIELDS}
+        for field in ('invoice_number', 'customer_name', 'mobile_number', 'address',
+                      'vehicle_name', 'vehicle_number'):
+            row[field] = str(row[field] or '')
+        row['total_amount'] = _to_float(row['total_amount'])
+        row['mode'] = row['mode'] or 'separate'
+        row['size_bytes'] = row['size_bytes'] or 0
+        row['created_at'] = row['created_at'] or datetime.now().isoformat()
+        row['phone_key'] = row['phone_key'] or phone_key(row['mobile_number'])
+        row['vehicle_key'] = row['vehicle_key'] or vehicle_key(row['vehicle_number'])
+        row['service_date'] = row['service_date'] or service_date(
+            row['start_datetime'], row['invoice_date'], row['created_at']
+        )
+        row['invoice_day'] = row['invoice_day'] or service_date(row['invoice_date'], row['created_at'])
+        if row['taxable_amount'] is None:
+            row['taxable_amount'], row['cgst'], row['sgst'] = estimated_tax(row['total_amount'])
+        return row
+
+    def record(self, entry: Dict[str, Any]):
+        """Insert or update an invoice entry"""
+        self.record_many([entry])
+
+    def record_many(self, entries: List[Dict[str, Any]]):
+        """Insert or update several entries in one transaction"""
+        columns = ', '.join(_FIELDS)
+        placeholders = ', '.join(f":{field}" for field in _FIELDS)
+        updates = ', '.join(f"{field} = excluded.{field}" for field in _FIELDS if field != 'id')
+        conn = self.conn
+        with self._lock, conn:
+            # Upsert (not REPLACE) so the row-count and FTS triggers stay accurate
+            conn.executemany(
+                f"INSERT INTO invoices ({columns}) VALUES ({placeholders}) "
+                f"ON CONFLICT(id) DO UPDATE SET {updates}",
+                [self._row(entry) for entry in entries]
+            )
+
+    def record_invoice(
+        self,
+        invoice_result: Dict[str, Any],
+        booking_data: Dict[str, Any],
+        amounts: Optional[Dict[str, float]] = None
+    ):
+        """
+        Index an invoice produced by ExcelService.create_invoice
+        
+        Args:
+            amounts: Amounts written to the invoice (total_amount,
+                taxable_amount, cgst, sgst); estimated from the booking's
+                total if not given
+        """
+        file_path = invoice_result['file_path']
+        amounts = amounts or {}
+        self.record({
+            'id': invoice_result['invoice_id'],
+            'invoice_number': booking_data.get('invoice_number'),
+            'customer_name': booking_data.get('customer_name') or booking_data.get('company_name'),
+            'mobile_number': booking_data.get('mobile_number') or booking_data.get('phone_number'),
+            'address': booking_data.get('address'),
+            'vehicle_name': booking_data.get('vehicle_name'),
+            'vehicle_number': booking_data.get('vehicle_number'),
+            # The invoice's own total: bookings priced from base_rent have none
+            'total_amount': amounts.get('total_amount', booking_data.get('total_amount')),
+            'invoice_date': booking_data.get('invoice_date'),
+            'start_datetime': booking_data.get('start_datetime'),
+            'end_datetime': booking_data.get('end_datetime'),
+            'file_path': file_path,
+            'sheet_name': invoice_result.get('sheet_name'),
+            'mode': invoice_result.get('mode'),
+            'size_bytes': os.path.getsize(file_path) if os.path.exists(file_path) else 0,
+            'taxable_amount': amounts.get('taxable_amount'),
+            'cgst': amounts.get('cgst'),
+            'sgst': amounts.get('sgst'),
+        })
+
+    def remove(self, invoice_id: str) -> bool:
+        """Delete an entry; returns True if it existed"""
+        conn = self.conn
+        with self._lock, conn:
+            cursor = conn.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
+        return cursor.rowcount > 0
+
+    def get(self, invoice_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch one entry by invoice ID"""
+        conn = self.conn
+        with self._lock:
+            row = conn.execute("SELECT * FROM invoices WHERE id = ?", (invoice_id,)).fetchone()
+        return dict(row) if row else None
+
+    def count(self) -> int:
+        """Number of indexed invoices"""
+        conn = self.conn
+        with self._lock:
+            return conn.execute("SELECT total FROM invoice_stats").fetchone()[0]
+
+    def list(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        sort: str = 'created_at',
+        order: str = 'desc'
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of invoices using keyset pagination
+
+        Args:
+            limit: Page size
+            cursor: Opaque cursor returned with the previous page
+            sort: One of SORT_COLUMNS
+            order: 'asc' or 'desc'
+
+        Returns:
+            (entries, next_cursor); next_cursor is None on the last page
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be 'asc' or 'desc'")
+
+        return self._page([], [], limit, cursor, sort, order)
+
+    def search(
+        self,
+        text: Optional[str] = None,
+        name: Optional[str] = None,
+        phone: Optional[str] = None,
+        vehicle: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        min_amount: Optional[float] = None,
+        max_amount: Optional[float] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Search invoices, newest first; all given filters must match
+
+        Args:
+            text: Words matched as prefixes in customer name or address
+            name: Words matched as prefixes in customer name only
+            phone: Phone number (exact, ignoring +91/spaces)
+            vehicle: Vehicle number (exact, ignoring spaces/dashes/case)
+            date_from: First service date (YYYY-MM-DD), inclusive
+            date_to: Last service date (YYYY-MM-DD), inclusive
+            min_amount: Minimum total amount, inclusive
+            max_amount: Maximum total amount, inclusive
+            limit: Page size
+            cursor: Opaque cursor returned with the previous page
+
+        Returns:
+            (entries, next_cursor)
+        """
+        clauses, params = [], []
+
+        match = ' AND '.join(
+            query for query in (_fts_query(text), _fts_query(name, 'customer_name')) if query
+        )
+        if match:
+            clauses.append("rowid IN (SELECT rowid FROM invoices_fts WHERE invoices_fts MATCH ?)")
+            params.append(match)
+        if phone:
+            clauses.append("phone_key = ?")
+            params.append(phone_key(phone))
+        if vehicle:
+            clauses.append("vehicle_key = ?")
+            params.append(vehicle_key(vehicle))
+        if date_from:
+            clauses.append("service_date >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("service_date <= ?")
+            params.append(date_to)
+        if min_amount is not None:
+            clauses.append("total_amount >= ?")
+            params.append(min_amount)
+        if max_amount is not None:
+            clauses.append("total_amount <= ?")
+            params.append(max_amount)
+
+        return self._page(clauses, params, limit, cursor, 'created_at', 'desc')
+
+    def iter_by_invoice_date(
+        self,
+        date_from: str,
+        date_to: str,
+        batch_size: int = 500
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Invoices dated date_from..date_to (inclusive, YYYY-MM-DD), oldest first
+        
+        Rows are fetched in keyset batches, so memory stays constant however
+        many invoices match and the lock is never held between batches.
+        """
+        position: Tuple[str, str] = ('', '')
+        conn = self.conn
+        while True:
+            with self._lock:
+                rows = conn.execute(
+                    "SELECT * FROM invoices WHERE invoice_day >= ? AND invoice_day <= ? "
+                    "AND (invoice_day, id) > (?, ?) ORDER BY invoice_day, id LIMIT ?",
+                    (date_from, date_to, *position, batch_size)
+                ).fetchall()
+            for row in rows:
+                yield dict(row)
+            if len(rows) < batch_size:
+                return
+            position = (rows[-1]['invoice_day'], rows[-1]['id'])
+
+    def amount_columns(self) -> Dict[str, List[Any]]:
+        """
+        ID and amount columns of every entry, for app.core.audit.audit_amounts
+        
+        Returns:
+            {'id': [...], 'total_amount': [...], 'taxable_amount': [...],
+            'cgst': [...], 'sgst': [...]}, in id order
+        """
+        names = ('id', 'total_amount', 'taxable_amount', 'cgst', 'sgst')
+        conn = self.conn
+        with self._lock:
+            # Plain tuples: building sqlite3.Row objects dominates at a million rows
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            rows = cursor.execute(f"SELECT {', '.join(names)} FROM invoices ORDER BY id").fetchall()
+        columns = zip(*rows) if rows else ([] for _ in names)
+        return {name: list(column) for name, column in zip(names, columns)}
+
+    def set_upload_state(
+        self,
+        invoice_ids: List[str],
+        state: str,
+        key: Optional[str] = None,
+        error: Optional[str] = None,
+        attempts: Optional[int] = None
+    ):
+        """
+        Record the storage upload state of invoices
+
+        Args:
+            invoice_ids: Invoices sharing the uploaded file
+            state: One of UPLOAD_STATES
+            key: Storage key of the file
+            error: Last upload error (cleared when not given)
+            attempts: Upload attempts so far (unchanged when not given)
+        """
+        if state not in UPLOAD_STATES:
+            raise ValueError(f"state must be one of {', '.join(UPLOAD_STATES)}")
+        uploaded_at = datetime.now().isoformat() if state == 'uploaded' else None
+        conn = self.conn
+        with self._lock, conn:
+            conn.executemany(
+                "UPDATE invoices SET upload_state = ?, upload_key = COALESCE(?, upload_key), "
+                "upload_error = ?, upload_attempts = COALESCE(?, upload_attempts), "
+                "uploaded_at = COALESCE(?, uploaded_at) WHERE id = ?",
+                [(state, key, error, attempts, uploaded_at, invoice_id) for invoice_id in invoice_ids]
+            )
+
+    def pending_uploads(self) -> List[Dict[str, Any]]:
+        """Invoices queued or mid-upload (id, file_path, upload_key), oldest first"""
+        conn = self.conn
+        with self._lock:
+            rows = conn.execute(
+                "SELECT id, file_path, upload_key FROM invoices "
+                "WHERE upload_state IN ('queued', 'uploading') ORDER BY created_at, id"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def upload_counts(self) -> Dict[str, int]:
+        """Number of invoices in each upload state"""
+        conn = self.conn
+        with self._lock:
+            rows = conn.execute(
+                "SELECT upload_state, COUNT(*) FROM invoices WHERE upload_state IS NOT NULL GROUP BY upload_state"
+            ).fetchall()
+        return {state: count for state, count in rows}
+
+    def _page(
+        self,
+        clauses: List[str],
+        params: List[Any],
+        limit: int,
+        cursor: Optional[str],
+        sort: str,
+        order: str
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Run a filtered keyset-paginated query"""
+        direction = 'DESC' if order == 'desc' else 'ASC'
+        comparison = '<' if order == 'desc' else '>'
+        clauses, params = list(clauses), list(params)
+        if cursor:
+            clauses.append(f"({sort}, id) {comparison} (?, ?)")
+            params.extend(self._decode_cursor(cursor, sort))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+
+        conn = self.conn
+        with self._lock:
+            rows = conn.execute(
+                f"SELECT * FROM invoices {where} ORDER BY {sort} {direction}, id {direction} LIMIT ?",
+                (*params, limit + 1)
+            ).fetchall()
+
+        entries = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = entries[-1]
+            next_cursor = self._encode_cursor(sort, last[sort], last['id'])
+        return entries, next_cursor
+
+    @staticmethod
+    def _encode_cursor(sort: str, value: Any, invoice_id: str) -> str:
+        payload = json.dumps([sort, value, invoice_id], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor: str, sort: str) -> Tuple[Any, str]:
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            cursor_sort, value, invoice_id = json.loads(base64.urlsafe_b64decode(padded))
+        except (ValueError, TypeError):
+            raise InvalidCursorError("Invalid cursor")
+        if cursor_sort != sort:
+            raise InvalidCursorError("Cursor was issued for a different sort")
+        return value, invoice_id
+
+
+# Singleton instance
+index_service = IndexService()
@@ -0,0 +1,94 @@
+"""
+OCR-to-Invoice Pipeline
+
+The image → OCR → extraction → workbook → storage sequence, shared by the
+synchronous create-from-ocr endpoint and the background job workers.
+"""
+import time
+from typing import Dict, Any, Callable, List, Optional
+
+from app.core.metrics import stage, stage_breakdown, rounded
+from .ocr_service import ocr_service
+from .extraction_service import extraction_service
+from .excel_service import excel_service
+from .storage_service import storage_service
+
+
+class OCRFailedError(RuntimeError):
+    """Raised when OCR.space could not read the booking image"""
+
+
+def process_booking_image(
+    file_content: bytes,
+    user_text: str = "",
+    language: str = "eng",
+    document_images: Optional[List[bytes]] = None,
+    progress: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Create an invoice from a booking image (blocking)
+    
+    Args:
+        file_content: Booking image bytes
+        user_text: Additional booking details
+        language: OCR language code
+        document_images: Customer document images to embed
+        progress: Called with each stage name as it starts
+        
+    Returns:
+        InvoiceResponse fields
+        
+    Raises:
+        OCRFailedError: If no text could be extracted from the image
+    """
+    report = progress or (lambda name: None)
+    start = time.perf_counter()
+    
+    with stage_breakdown() as timings:
+        report('ocr')
+        with stage('preprocess'):
+            processed_content = ocr_service.preprocess_image(file_content)
+        with stage('ocr'):
+            ocr_result = ocr_service.extract_text_from_file(processed_content, language=language)
+        
+        if not ocr_result['success']:
+            raise OCRFailedError(ocr_result.get('error'))
+        
+        report('extract')
+        with stage('extract'):
+            booking_data = extraction_service.extract_booking_data(ocr_result['text'], user_text or "")
+        
+        if document_images:
+            booking_data['document_images'] = document_images
+        
+        report('write')
+        invoice_result = excel_service.create_invoice(booking_data)
+        
+        report('storage')
+        with stage('storage'):
+            storage_service.upload_invoice(invoice_result['file_path'], invoice_id=invoice_result['invoice_id'])
+    
+    # Remove binary data before returning
+    response_data = {k: v for k, v in booking_data.items() if k != 'document_images'}
+    if document_images:
+        response_data['document_count'] = len(document_images)
+    
+    if invoice_result['mode'] == 'master':
+        message = f"Invoice added as sheet '{invoice_result.get('sheet_name')}' in master file"
+    else:
+        message = "Invoice created successfully from OCR"
+    
+    return {
+        'success': True,
+        'message': message,
+        'invoice_id': invoice_result['invoice_id'],
+        'file_path': invoice_result['file_path'],
+        'download_url': f"/api/invoice/download/{invoice_result['invoice_id']}",
+        'extracted_data': response_data,
+        'confidence': booking_data.get('extraction_confidence'),
+        'calculation_verified': booking_data.get('calculation_verified'),
+        'processing_time_ms': int((time.perf_counter() - start) * 1000),
+        'stage_timings_ms': rounded(timings),
+        'sheet_name': invoice_result.get('sheet_name'),
+        'amounts': invoice_result.get('amounts')
+    }
@@ -0,0 +1,329 @@
+"""
+Background Invoice Jobs
+
+Uploads accepted by POST /api/invoice/jobs are written to disk and queued in
+SQLite, and a small pool of worker threads turns them into invoices. Queued
+jobs survive restarts. A claimed job is leased to its process for
+JOB_LEASE_SECONDS and the lease is renewed while the job runs, so a job is
+queued again (up to MAX_ATTEMPTS runs) only once its process stopped
+renewing it, never while another process is still running it.
+"""
+import json
+import os
+import shutil
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, Callable, List, Optional
+
+from config import settings
+from app.core.metrics import invoice_duration
+from app.core.log import get_logger
+from app.core.sqlite import SQLiteStore
+from .invoice_pipeline import process_booking_image
+
+logger = get_logger(__name__)
+
+
+FINISHED_STATES = ('done', 'failed')
+
+# Runs per job; only jobs cut short by a restart are retried
+MAX_ATTEMPTS = 3
+
+# Idle workers re-check the queue this often (seconds), in case a job was
+# queued by another process
+POLL_INTERVAL = 2.0
+
+_BASE_SCHEMA = """
+    CREATE TABLE jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        stage TEXT,
+        params TEXT NOT NULL DEFAULT '{}',
+        file_count INTEGER NOT NULL DEFAULT 0,
+        result TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    CREATE INDEX idx_jobs_queue ON jobs (status, created_at);
+"""
+
+# Process running a job, and until when it holds the job unless renewed
+_LEASE_COLUMNS = """
+    ALTER TABLE jobs ADD COLUMN owner TEXT;
+    ALTER TABLE jobs ADD COLUMN lease_until TEXT;
+"""
+
+# Schema migrations, applied in order; PRAGMA user_version records progress
+MIGRATIONS = [
+    _BASE_SCHEMA,
+    _LEASE_COLUMNS,
+]
+
+# Job handler: (params, uploaded files, progress callback) -> result
+Handler = Callable[[Dict[str, Any], List[bytes], Callable[[str], None]], Dict[str, Any]]
+
+
+class JobService(SQLiteStore):
+    """Durable job queue backed by SQLite, processed by worker threads"""
+
+    migrations = MIGRATIONS
+
+    def __init__(self, db_path: str = None, upload_dir: str = None, workers: int = None,
+                 lease_seconds: int = None):
+        super().__init__(db_path or settings.job_db_path)
+        self.upload_dir = upload_dir or settings.job_upload_dir
+        self.workers = settings.job_workers if workers is None else workers
+        self.lease = timedelta(seconds=settings.job_lease_seconds if lease_seconds is None else lease_seconds)
+        # Identifies this process's leases among every process sharing the database
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.handlers: Dict[str, Handler] = {}
+        self._ready = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def register(self, kind: str, handler: Handler):
+        """Register the function that processes jobs of a kind"""
+        self.handlers[kind] = handler
+
+    def _job_dir(self, job_id: str) -> str:
+        return os.path.join(self.upload_dir, job_id)
+
+    def submit(self, kind: str, params: Dict[str, Any], files: List[bytes]) -> Dict[str, Any]:
+        """
+        Persist uploads and queue a job
+
+        Args:
+            kind: Registered job kind
+            params: JSON-serialisable job parameters
+            files: Uploaded file contents, handed to the handler in order
+
+        Returns:
+            The queued job
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job_id = uuid.uuid4().hex
+        job_dir = self._job_dir(job_id)
+        os.makedirs(job_dir)
+        for number, content in enumerate(files):
+            with open(os.path.join(job_dir, f"{number}.bin"), 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+
+        # The row is written last, so a crash never queues a job without its files
+        now = datetime.now().isoformat()
+        conn = self.conn
+        with self._lock, conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, params, file_count, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), len(files), now, now)
+            )
+        with self._ready:
+            self._ready.notify()
+        logger.info("Job queued", extra={'job_id': job_id, 'kind': kind})
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch a job with its parameters and result decoded"""
+        conn = self.conn
+        with self._lock:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status"""
+        conn = self.conn
+        with self._lock:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def _update(self, job_id: str, **fields):
+        fields['updated_at'] = datetime.now().isoformat()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        conn = self.conn
+        with self._lock, conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Mark the oldest queued job as running, leased to this process, and return it"""
+        now = datetime.now()
+        conn = self.conn
+        with self._lock, conn:
+            rows = conn.execute(
+                "UPDATE jobs SET status = 'running', stage = NULL, attempts = attempts + 1, "
+                "owner = ?, lease_until = ?, updated_at = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at, id LIMIT 1) "
+                "RETURNING id",
+                (self.owner, (now + self.lease).isoformat(), now.isoformat())
+            ).fetchall()
+        return self.get(rows[0]['id']) if rows else None
+
+    def renew(self) -> int:
+        """
+        Extend the leases of the jobs this process is running
+
+        Returns:
+            Number of leases renewed
+        """
+        conn = self.conn
+        with self._lock, conn:
+            return conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE status = 'running' AND owner = ?",
+                ((datetime.now() + self.lease).isoformat(), self.owner)
+            ).rowcount
+
+    def recover(self) -> int:
+        """
+        Requeue running jobs whose lease has lapsed (their process died)
+
+        Returns:
+            Number of jobs requeued
+        """
+        now = datetime.now().isoformat()
+        # Jobs claimed before leases existed have none
+        expired = "status = 'running' AND (lease_until IS NULL OR lease_until < ?)"
+        conn = self.conn
+        with self._lock, conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Interrupted too many times', owner = NULL, "
+                f"lease_until = NULL, updated_at = ? WHERE {expired} AND attempts >= ?",
+                (now, now, MAX_ATTEMPTS)
+            )
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = NULL, owner = NULL, lease_until = NULL, "
+                f"updated_at = ? WHERE {expired}",
+                (now, now)
+            ).rowcount
+        if requeued:
+            logger.info("Requeued interrupted jobs", extra={'jobs': requeued})
+            with self._ready:
+                self._ready.notify_all()
+        return requeued
+
+    def _process(self, job: Dict[str, Any]):
+        """Run one claimed job and record its outcome"""
+        job_id = job['id']
+        start = datetime.now()
+        try:
+            files = []
+            for number in range(job['file_count']):
+                with open(os.path.join(self._job_dir(job_id), f"{number}.bin"), 'rb') as f:
+                    files.append(f.read())
+            handler = self.handlers[job['kind']]
+            result = handler(job['params'], files, lambda stage: self._update(
+                job_id, stage=stage, lease_until=(datetime.now() + self.lease).isoformat()
+            ))
+        except Exception as e:
+            logger.warning("Job failed", extra={'job_id': job_id, 'kind': job['kind'], 'error': str(e)})
+            self._update(job_id, status='failed', error=str(e), lease_until=None)
+        else:
+            self._update(job_id, status='done', result=json.dumps(result, default=str), lease_until=None)
+            invoice_duration.observe((datetime.now() - start).total_seconds(), endpoint='job')
+            logger.info("Job done", extra={'job_id': job_id, 'kind': job['kind']})
+        shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+    def run_pending(self) -> int:
+        """
+        Process queued jobs on the calling thread until the queue is empty
+
+        Returns:
+            Number of jobs processed
+        """
+        processed = 0
+        while True:
+            job = self._claim()
+            if job is None:
+                return processed
+            self._process(job)
+            processed += 1
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            job = self._claim()
+            if job is not None:
+                self._process(job)
+                continue
+            with self._ready:
+                self._ready.wait(POLL_INTERVAL)
+
+    def _heartbeat(self):
+        """Renew this process's leases, and requeue jobs of processes that died"""
+        while not self._stopping.wait(max(self.lease.total_seconds() / 3, 1.0)):
+            try:
+                self.renew()
+                self.recover()
+            except Exception as e:
+                logger.warning("Job lease renewal failed", extra={'error': str(e)})
+
+    def start(self):
+        """Requeue interrupted jobs and start the worker threads"""
+        if self._threads:
+            return
+        self.recover()
+        self.purge()
+        self._stopping.clear()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self._threads:
+            thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 30.0):
+        """Stop the workers, letting running jobs finish"""
+        self._stopping.set()
+        with self._ready:
+            self._ready.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def purge(self, older_than_days: int = None) -> int:
+        """
+        Delete finished jobs (and any leftover uploads) past the retention period
+
+        Returns:
+            Number of jobs deleted
+        """
+        days = settings.job_retention_days if older_than_days is None else older_than_days
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        conn = self.conn
+        with self._lock, conn:
+            ids = [row[0] for row in conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ? RETURNING id",
+                (cutoff,)
+            ).fetchall()]
+        for job_id in ids:
+            shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+        return len(ids)
+
+
+def _create_from_ocr(params: Dict[str, Any], files: List[bytes], progress: Callable[[str], None]) -> Dict[str, Any]:
+    """Job handler: first file is the booking image, the rest are document images"""
+    return process_booking_image(
+        files[0],
+        user_text=params.get('user_text') or "",
+        language=params.get('language', 'eng'),
+        document_images=files[1:],
+        progress=progress
+    )
+
+
+# Singleton instance
+job_service = JobService()
+job_service.register('create-from-ocr', _create_from_ocr)
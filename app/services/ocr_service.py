@@ -3,7 +3,6 @@ OCR.space API Integration Service
 """
 import requests
 from typing import Dict, Any
-from PIL import Image
 import io
 from config import settings
 
@@ -14,6 +13,8 @@ class OCRService:
     def __init__(self):
         self.api_key = settings.ocr_space_api_key
         self.api_url = settings.ocr_space_api_url
+        # Shared session keeps connections alive and lets test harnesses mount adapters
+        self.session = requests.Session()
     
     def extract_text_from_file(
         self, 
@@ -37,7 +38,7 @@ class OCRService:
                 'file': ('image.jpg', file_content, 'image/jpeg')
             }
             
-            response = requests.post(
+            response = self.session.post(
                 self.api_url,
                 files=files,
                 data=payload,
@@ -92,7 +93,7 @@ class OCRService:
                 'OCREngine': 2
             }
             
-            response = requests.post(
+            response = self.session.post(
                 self.api_url,
                 data=payload,
                 timeout=30
@@ -130,6 +131,8 @@ class OCRService:
     
     def preprocess_image(self, file_content: bytes) -> bytes:
         """Preprocess image for better OCR results"""
+        from PIL import Image
+        
         try:
             image = Image.open(io.BytesIO(file_content))
             
@@ -0,0 +1,120 @@
+"""
+Single-Invoice Export Service
+
+Builds single-sheet workbooks from a master file (each template has its own)
+for per-invoice downloads and caches them until that master file changes. Extracts of earlier versions
+are removed only once they have not been added to for a while, since a
+download may have been handed one just before the master changed.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+from typing import Optional
+
+from config import settings
+from app.core.log import get_logger
+from app.core.xlsx import extract_sheet
+
+logger = get_logger(__name__)
+
+
+class SheetExportService:
+    """Extract and cache individual invoice sheets"""
+    
+    # Attempts when the master file is rewritten while a sheet is extracted
+    MAX_ATTEMPTS = 3
+    
+    # Seconds extracts of an earlier master version are kept for downloads in flight
+    STALE_SECONDS = 300
+    
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir or settings.sheet_cache_dir
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _signature(master_path: str) -> str:
+        """Identifies one version of the master file"""
+        stat = os.stat(master_path)
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    
+    def _master_dir(self, master_path: str) -> str:
+        """Cache directory of one master file (every template has its own)"""
+        key = hashlib.sha1(os.path.abspath(master_path).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, key)
+    
+    def _cache_path(self, master_path: str, signature: str, sheet_name: str) -> str:
+        key = hashlib.sha1(sheet_name.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self._master_dir(master_path), signature, f"{key}.xlsx")
+    
+    def _purge_stale(self, master_path: str, signature: str):
+        """Remove extracts of earlier versions of the master file last added to over STALE_SECONDS ago"""
+        master_dir = self._master_dir(master_path)
+        if not os.path.isdir(master_dir):
+            return
+        cutoff = time.time() - self.STALE_SECONDS
+        for entry in os.listdir(master_dir):
+            if entry == signature:
+                continue
+            path = os.path.join(master_dir, entry)
+            try:
+                if os.stat(path).st_mtime > cutoff:
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+    
+    def export(self, master_path: str, sheet_name: str) -> str:
+        """
+        Path of a single-sheet workbook holding one sheet of the master file
+        
+        Args:
+            master_path: Master workbook path
+            sheet_name: Invoice sheet to export
+            
+        Returns:
+            Path of the cached extract
+            
+        Raises:
+            SheetNotFoundError: If the master file has no such sheet
+        """
+        signature = self._signature(master_path)
+        path = self._cache_path(master_path, signature, sheet_name)
+        if os.path.exists(path):
+            return path
+        
+        with self._lock:
+            for _ in range(self.MAX_ATTEMPTS):
+                path = self._cache_path(master_path, signature, sheet_name)
+                if os.path.exists(path):
+                    return path
+                
+                self._purge_stale(master_path, signature)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                try:
+                    extract_sheet(master_path, sheet_name, tmp_path)
+                except Exception:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    # A half-written master can look corrupt; retry if it changed
+                    if self._signature(master_path) == signature:
+                        raise
+                    signature = self._signature(master_path)
+                    continue
+                
+                # Only cache extracts of a master that did not change meanwhile
+                current = self._signature(master_path)
+                if current == signature:
+                    os.replace(tmp_path, path)
+                    logger.debug("Cached invoice sheet extract", extra={'sheet': sheet_name})
+                    return path
+                os.remove(tmp_path)
+                signature = current
+        
+        raise RuntimeError(f"Master file kept changing while extracting '{sheet_name}'")
+
+
+# Singleton instance
+sheet_export_service = SheetExportService()
@@ -1,56 +1,272 @@
 """
-Cloud Storage Service - Local storage only
+Invoice Storage Service
+
+Finished invoice files are handed to a storage backend (app.core.storage:
+local disk or S3-compatible object storage) by background upload threads,
+so requests return as soon as the workbook is written. Failed uploads are
+retried with exponential backoff; each invoice's upload state is recorded
+in the invoice index, and invoices still queued when the server stops are
+queued again on the next start.
 """
-from typing import Optional
-from datetime import datetime
 import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+
+from config import settings
+from app.core.log import get_logger
+from app.core.metrics import upload_duration
+from app.core.storage import StorageBackend, LocalBackend, S3Backend
+from .index_service import index_service
+
+logger = get_logger(__name__)
+
+
+def create_backend() -> StorageBackend:
+    """Backend selected by STORAGE_BACKEND"""
+    if settings.storage_backend == 's3':
+        if not settings.s3_bucket:
+            raise ValueError("STORAGE_BACKEND=s3 needs S3_BUCKET")
+        part_size = settings.s3_part_size_mb * 1024 * 1024
+        return S3Backend(
+            bucket=settings.s3_bucket,
+            prefix=settings.s3_prefix,
+            endpoint_url=settings.s3_endpoint_url,
+            region=settings.s3_region,
+            access_key_id=settings.s3_access_key_id,
+            secret_access_key=settings.s3_secret_access_key,
+            multipart_threshold=part_size,
+            part_size=part_size,
+            part_concurrency=settings.s3_part_concurrency,
+        )
+    if settings.storage_backend != 'local':
+        raise ValueError(f"Unknown STORAGE_BACKEND '{settings.storage_backend}', expected 'local' or 's3'")
+    return LocalBackend(settings.storage_local_dir or settings.output_dir)
 
 
 class StorageService:
-    """Local storage service - saves invoices to disk"""
+    """Queues invoice files for upload to the storage backend"""
     
-    def __init__(self):
-        self.output_dir = "generated_invoices"
-        os.makedirs(self.output_dir, exist_ok=True)
+    def __init__(
+        self,
+        backend: StorageBackend = None,
+        output_dir: str = None,
+        index=None,
+        workers: int = None,
+        max_attempts: int = None,
+        retry_seconds: float = None
+    ):
+        self.output_dir = output_dir or settings.output_dir
+        self.index = index or index_service
+        self.workers = workers or settings.storage_upload_workers
+        self.max_attempts = max_attempts or settings.storage_max_attempts
+        self.retry_seconds = settings.storage_retry_seconds if retry_seconds is None else retry_seconds
+        self._backend = backend
+        self._lock = threading.Lock()
+        # Storage key -> file and invoices waiting for it; a key is queued once
+        # however many invoices (master file sheets) are waiting for it
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+    
+    @property
+    def backend(self) -> StorageBackend:
+        """Configured backend, created on first use"""
+        if self._backend is None:
+            self._backend = create_backend()
+        return self._backend
+    
+    def key_for(self, file_path: str) -> str:
+        """Storage key of a file: its path relative to the output directory"""
+        relative = os.path.relpath(os.path.abspath(file_path), os.path.abspath(self.output_dir))
+        if relative.startswith('..'):
+            relative = os.path.basename(file_path)
+        return relative.replace(os.sep, '/')
     
     def upload_invoice(
         self,
         file_path: str,
-        invoice_date: Optional[datetime] = None
+        invoice_date: Optional[datetime] = None,
+        invoice_id: Optional[str] = None
     ) -> dict:
         """
-        Save invoice locally
+        Queue an invoice file for upload; returns without waiting for it
+        
+        Args:
+            file_path: Invoice file (or the master file holding its sheet)
+            invoice_date: Unused; kept for existing callers
+            invoice_id: Indexed invoice whose upload state is tracked
         
         Returns:
-            Dict with save status and details
+            Dict with queue status and the file's storage key
         """
         result = {
             'uploaded': False,
-            'provider': 'local',
+            'queued': False,
+            'provider': self.backend.name,
             'file_id': None,
             'error': None,
             'file_path': file_path
         }
         
-        # Check if file exists
-        if os.path.exists(file_path):
-            result['uploaded'] = True
-            result['file_id'] = os.path.basename(file_path)
-            print(f"✅ Invoice saved locally: {file_path}")
-        else:
+        if not os.path.exists(file_path):
             result['error'] = "File not found"
-            print(f"❌ File not found: {file_path}")
+            logger.error("Invoice file not found", extra={'file_path': file_path})
+            return result
+        
+        key = self.key_for(file_path)
+        invoice_ids = [invoice_id] if invoice_id else []
+        self._record_state(invoice_ids, 'queued', key=key, attempts=0)
+        self._enqueue(key, file_path, invoice_ids)
+        self.start()
         
+        result['queued'] = True
+        result['file_id'] = key
+        logger.debug("Invoice queued for upload", extra={'file_path': file_path, 'key': key})
         return result
     
+    def _enqueue(self, key: str, file_path: str, invoice_ids: List[str]):
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending['invoice_ids'].update(invoice_ids)
+                return
+            self._pending[key] = {'file_path': file_path, 'invoice_ids': set(invoice_ids)}
+        self._queue.put(key)
+    
+    def _record_state(self, invoice_ids: List[str], state: str, **fields):
+        if not invoice_ids:
+            return
+        try:
+            self.index.set_upload_state(invoice_ids, state, **fields)
+        except Exception as e:
+            logger.warning("Failed to record upload state", extra={'state': state, 'error': str(e)})
+    
+    def _upload(self, key: str):
+        """Upload one queued file, retrying with exponential backoff"""
+        with self._lock:
+            job = self._pending.pop(key)
+        invoice_ids = sorted(job['invoice_ids'])
+        backend = self.backend
+        error = None
+        
+        for attempt in range(1, self.max_attempts + 1):
+            self._record_state(invoice_ids, 'uploading', attempts=attempt)
+            start = time.perf_counter()
+            try:
+                backend.upload(job['file_path'], key)
+            except FileNotFoundError:
+                # Deleted while queued; retrying cannot help
+                error = "File not found"
+                break
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                upload_duration.observe(time.perf_counter() - start, backend=backend.name, outcome='error')
+                logger.warning("Invoice upload failed", extra={'key': key, 'attempt': attempt, 'error': error})
+                if attempt == self.max_attempts:
+                    break
+                self._record_state(invoice_ids, 'queued', error=error, attempts=attempt)
+                # Full jitter spreads retries of uploads that failed together
+                delay = self.retry_seconds * 2 ** (attempt - 1)
+                if self._stopping.wait(random.uniform(delay / 2, delay)):
+                    # Left queued; picked up again on the next start
+                    return
+                continue
+            upload_duration.observe(time.perf_counter() - start, backend=backend.name, outcome='ok')
+            self._record_state(invoice_ids, 'uploaded', attempts=attempt)
+            logger.info("Invoice uploaded", extra={'key': key, 'backend': backend.name, 'attempts': attempt})
+            return
+        
+        self._record_state(invoice_ids, 'failed', error=error)
+        logger.error("Invoice upload gave up", extra={'key': key, 'error': error})
+    
+    def _worker(self):
+        while True:
+            key = self._queue.get()
+            try:
+                if key is None or self._stopping.is_set():
+                    return
+                self._upload(key)
+            except Exception as e:
+                logger.warning("Upload worker error", extra={'key': key, 'error': str(e)})
+            finally:
+                self._queue.task_done()
+    
+    def recover(self) -> int:
+        """
+        Queue uploads left unfinished by a previous run
+        
+        Returns:
+            Number of invoices queued again
+        """
+        entries = self.index.pending_uploads()
+        for entry in entries:
+            if os.path.exists(entry['file_path']):
+                self._enqueue(entry['upload_key'] or self.key_for(entry['file_path']), entry['file_path'], [entry['id']])
+            else:
+                self._record_state([entry['id']], 'failed', error="File not found")
+        return len(entries)
+    
+    def start(self):
+        """Start the upload threads, after queueing any unfinished uploads"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            threads = self._threads = [
+                threading.Thread(target=self._worker, name=f"upload-worker-{number}", daemon=True)
+                for number in range(self.workers)
+            ]
+        try:
+            self.recover()
+        except Exception as e:
+            logger.warning("Failed to recover unfinished uploads", extra={'error': str(e)})
+        for thread in threads:
+            thread.start()
+    
+    def stop(self, timeout: float = 30.0):
+        """Stop the upload threads; uploads not yet finished resume on the next start"""
+        self._stopping.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        with self._lock:
+            self._threads = []
+            self._pending.clear()
+        # Drop what the workers left behind; the index still has it queued
+        while True:
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+            except queue.Empty:
+                break
+    
+    def wait(self):
+        """Block until every queued upload has finished (or given up)"""
+        self._queue.join()
+    
     def get_storage_status(self) -> dict:
         """Get status of storage"""
+        backend = self.backend
+        try:
+            uploads = self.index.upload_counts()
+        except Exception as e:
+            uploads = {'error': str(e)}
         return {
-            'local': {
+            'backend': backend.name,
+            backend.name: {
                 'enabled': True,
                 'priority': 1,
-                'output_dir': self.output_dir
-            }
+                **backend.status()
+            },
+            'workers': self.workers,
+            'queued': len(self._pending),
+            'uploads': uploads
         }
 
 
@@ -0,0 +1,65 @@
+"""
+Optional start-up warm-up
+
+Heavy dependencies (openpyxl, Pillow, the Gemini SDK) are imported on first
+use so the app starts quickly. With WARM_UP_ON_STARTUP enabled they are
+loaded in the background right after start-up instead, so the first request
+does not pay for them either.
+"""
+import os
+import time
+
+from config import settings
+from gemini_service import gemini_extractor
+from app.core.log import get_logger
+from .index_service import index_service
+
+logger = get_logger(__name__)
+
+
+def _load_excel():
+    from openpyxl.drawing.image import Image  # noqa: F401
+    from .excel_service import excel_service
+    if os.path.exists(settings.template_path):
+        # Parses the template and resolves its cell mapping
+        excel_service.writer.template
+
+
+def _load_images():
+    from PIL import Image  # noqa: F401
+
+
+def _load_gemini():
+    if settings.use_gemini and gemini_extractor.enabled:
+        gemini_extractor.model
+
+
+STEPS = {
+    'excel': _load_excel,
+    'images': _load_images,
+    'index': lambda: index_service.count(),
+    'gemini': _load_gemini,
+}
+
+
+def warm_up() -> dict:
+    """
+    Load everything the first invoice request would load
+
+    A failed step is logged and skipped; the request that needs it later
+    retries the same work.
+
+    Returns:
+        Seconds taken per step (None for failed steps)
+    """
+    timings = {}
+    for name, step in STEPS.items():
+        start = time.perf_counter()
+        try:
+            step()
+            timings[name] = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            timings[name] = None
+            logger.warning("Warm-up step failed", extra={'step': name, 'error': str(e)})
+    logger.info("Warm-up complete", extra={'timings': timings})
+    return timings
@@ -0,0 +1,5 @@
+"""
+Performance benchmarks for Hill Drive Invoice Automation
+
+Run with ``python -m benchmarks.run``; see benchmarks/run.py for options.
+"""
@@ -0,0 +1,114 @@
+"""
+Minimal timing harness for the invoice pipeline benchmarks
+
+Results are plain dictionaries so a run can be written to JSON and compared
+against the run of another commit.
+"""
+import json
+import math
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of sorted samples"""
+    ordered = sorted(samples)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Summary statistics in milliseconds"""
+    ms = [s * 1000 for s in samples]
+    return {
+        'rounds': len(ms),
+        'min_ms': round(min(ms), 3),
+        'median_ms': round(statistics.median(ms), 3),
+        'mean_ms': round(statistics.fmean(ms), 3),
+        'p95_ms': round(_percentile(ms, 95), 3),
+        'max_ms': round(max(ms), 3),
+        'stdev_ms': round(statistics.stdev(ms), 3) if len(ms) > 1 else 0.0,
+    }
+
+
+def measure(
+    func: Callable[..., Any],
+    setup: Optional[Callable[[], tuple]] = None,
+    rounds: int = 10,
+    warmup: int = 1
+) -> Dict[str, float]:
+    """
+    Time a function
+
+    Args:
+        func: Function under test
+        setup: Called before every round; returns the positional args for func.
+            Its cost is excluded from the timing.
+        rounds: Number of timed calls
+        warmup: Untimed calls made first (import caches, file system caches)
+    """
+    samples = []
+    for i in range(warmup + rounds):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            samples.append(elapsed)
+    return summarize(samples)
+
+
+def run_metadata() -> Dict[str, Any]:
+    """Identify the code and machine a run was made on"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.10) -> List[Dict[str, Any]]:
+    """
+    Compare two runs by median time
+
+    Returns:
+        One row per benchmark present in both runs, with the relative change
+        and whether it exceeds the regression threshold
+    """
+    rows = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] if before['median_ms'] else 0.0
+        rows.append({
+            'name': name,
+            'baseline_ms': before['median_ms'],
+            'current_ms': result['median_ms'],
+            'change': round(change, 4),
+            'regression': change > threshold,
+        })
+    return rows
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_results(path: str, results: Dict[str, Any]):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,346 @@
+"""
+Benchmarks for the invoice pipeline hot paths
+
+- BookingDataExtractor.extract
+- HillDriveExcelWriter.write
+- HillDriveExcelWriter.write_to_master with 10/100/1000 existing sheets
+- HillDriveExcelWriter._embed_document_images with 1-6 images
+- POST /api/invoice/create-from-ocr with OCR.space and OpenRouter stubbed
+- IndexService.search over a 100k-invoice catalogue
+- audit_amounts over a million invoices' amount columns
+- Cold start: importing main_new in a fresh interpreter (see startup.py)
+"""
+import io
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, Iterator
+
+import openpyxl
+from PIL import Image
+
+from config import settings
+from app.core.audit import audit_amounts
+from app.services.index_service import IndexService
+from hilldrive_excel_mapper import HillDriveExcelWriter
+from implementation_example import BookingDataExtractor
+from .harness import measure
+from .startup import bench_startup
+
+
+SAMPLE_OCR_TEXT = """
+Bill To:
+Buen Manejo Del Campo India Pvt. Ltd.
+Office no.4, 2nd Floor, Anmol Pride,
+Baner, Pune - 411045
+GSTIN NO: 27AAHCB7551K1ZB
+"""
+
+SAMPLE_USER_TEXT = """
+Name- Buen manejo del Campo India pvt . Ltd
+Mobile - 8889302969
+Vehicle - Baleno
+Rent :-₹16200
+Kms-600km
+Extra km charged:-551×8:-4408
+Total:-20608
+Duration -6 days
+Start date and time - 25/01/2026 7am to 31/01/2026 7am
+"""
+
+SAMPLE_BOOKING = {
+    'invoice_number': 'HD/2026-27/BENCH',
+    'invoice_date': '25/01/26',
+    'customer_name': 'Buen Manejo Del Campo India Pvt. Ltd.',
+    'mobile_number': '8889302969',
+    'address': 'Office no.4, 2nd Floor, Anmol Pride, Baner, Pune - 411045',
+    'vehicle_name': 'Swift Dzire',
+    'vehicle_number': 'RJ14AB1234',
+    'start_datetime': '2026-01-25 07:00',
+    'end_datetime': '2026-01-31 07:00',
+    'duration_days': 6,
+    'base_rent': 16200,
+    'included_km': 600,
+    'extra_km_charge': 4408,
+    'total_amount': 20608,
+    'advance_paid': 10000,
+}
+
+COUNTER_FILE = 'invoice_counter.json'
+
+# Settings naming files the app writes; output_dir first
+PATH_SETTINGS = (
+    'output_dir', 'master_file_path', 'index_db_path', 'sheet_cache_dir', 'media_cache_dir',
+    'customer_db_path', 'job_db_path', 'job_upload_dir', 'idempotency_db_path',
+)
+
+# Services holding those paths from construction
+SERVICES = (
+    'excel_service', 'storage_service', 'index_service', 'customer_service',
+    'sheet_export_service', 'job_service', 'idempotency_service',
+)
+
+
+@contextmanager
+def isolated_paths(workdir: str) -> Iterator[None]:
+    """
+    Point every file the app writes (invoices, databases, caches, the invoice
+    counter) into workdir, restoring the settings and services afterwards
+    """
+    from app import services
+
+    saved_settings = {name: getattr(settings, name) for name in PATH_SETTINGS}
+    singletons = [getattr(services, name) for name in SERVICES]
+    saved_services = [(service, dict(vars(service))) for service in singletons]
+    try:
+        settings.output_dir = workdir
+        for name in PATH_SETTINGS[1:]:
+            setattr(settings, name, os.path.join(workdir, os.path.basename(saved_settings[name])))
+
+        services.index_service.db_path = settings.index_db_path
+        services.index_service.output_dir = workdir
+        services.customer_service.db_path = settings.customer_db_path
+        services.job_service.db_path = settings.job_db_path
+        services.job_service.upload_dir = settings.job_upload_dir
+        services.idempotency_service.db_path = settings.idempotency_db_path
+        services.storage_service.output_dir = workdir
+        services.sheet_export_service.cache_dir = settings.sheet_cache_dir
+        for service in singletons:
+            if '_conn' in vars(service):
+                service._conn = None
+        # Writers are rebuilt for the new master file and media directory
+        vars(services.excel_service).pop('writer', None)
+        services.excel_service._writers = {}
+
+        # Numbering continues from the real counter, which is left untouched
+        counter_file = os.path.join(workdir, COUNTER_FILE)
+        if os.path.exists(COUNTER_FILE):
+            shutil.copyfile(COUNTER_FILE, counter_file)
+        services.excel_service.writer.counter_file = counter_file
+        yield
+    finally:
+        for service, saved in saved_services:
+            if getattr(service, '_conn', None) is not None and service._conn is not saved.get('_conn'):
+                service._conn.close()
+            vars(service).clear()
+            vars(service).update(saved)
+        for name, value in saved_settings.items():
+            setattr(settings, name, value)
+
+
+def make_document_image(width: int = 1600, height: int = 1200, seed: int = 0) -> bytes:
+    """A photo-sized JPEG standing in for an Aadhaar/DL scan"""
+    image = Image.effect_noise((width, height), 40 + seed).convert('RGB')
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+def build_master(path: str, sheet_count: int, template_path: str = None):
+    """Build a master workbook holding sheet_count filled invoice sheets"""
+    template_path = template_path or settings.template_path
+    writer = HillDriveExcelWriter(template_path, path)
+    wb = openpyxl.load_workbook(template_path)
+    first = wb.active
+    first.title = 'HD-2026-27-0001'
+    writer._fill_sheet_data(first, dict(SAMPLE_BOOKING))
+
+    for i in range(2, sheet_count + 1):
+        ws = wb.copy_worksheet(first)
+        ws.title = f"HD-2026-27-{i:04d}"
+    wb.save(path)
+
+
+def bench_extract(rounds: int) -> Dict[str, Any]:
+    extractor = BookingDataExtractor()
+    return {
+        'extract': measure(lambda: extractor.extract(SAMPLE_OCR_TEXT, SAMPLE_USER_TEXT), rounds=rounds)
+    }
+
+
+def bench_write(rounds: int, workdir: str) -> Dict[str, Any]:
+    writer = HillDriveExcelWriter(settings.template_path)
+    xml_writer = HillDriveExcelWriter(settings.template_path, renderer='xml')
+    output_path = os.path.join(workdir, 'write.xlsx')
+    return {
+        'write': measure(lambda: writer.write(dict(SAMPLE_BOOKING), output_path), rounds=rounds),
+        'write[xml]': measure(lambda: xml_writer.write(dict(SAMPLE_BOOKING), output_path), rounds=rounds),
+    }
+
+
+def bench_fill(rounds: int) -> Dict[str, Any]:
+    """Cell writes alone, on a fresh copy of the template sheet"""
+    writer = HillDriveExcelWriter(settings.template_path)
+    writer.template
+
+    def setup():
+        return (writer.template.load().active, dict(SAMPLE_BOOKING))
+
+    return {'fill': measure(writer._fill_sheet_data, setup=setup, rounds=rounds)}
+
+
+def bench_write_to_master(rounds: int, workdir: str, sheet_counts: Iterable[int]) -> Dict[str, Any]:
+    results = {}
+    for count in sheet_counts:
+        seed_path = os.path.join(workdir, f'master_{count}_seed.xlsx')
+        master_path = os.path.join(workdir, f'master_{count}.xlsx')
+        build_master(seed_path, count)
+        writer = HillDriveExcelWriter(settings.template_path, master_path)
+
+        def setup():
+            shutil.copyfile(seed_path, master_path)
+            return (dict(SAMPLE_BOOKING),)
+
+        # Large masters take seconds per round; keep the total bounded
+        count_rounds = max(1, rounds // 5) if count >= 1000 else rounds
+        results[f'write_to_master[{count}]'] = measure(
+            writer.write_to_master, setup=setup, rounds=count_rounds
+        )
+    return results
+
+
+def bench_embed_images(rounds: int, image_counts: Iterable[int]) -> Dict[str, Any]:
+    writer = HillDriveExcelWriter(settings.template_path)
+    images = [make_document_image(seed=i) for i in range(max(image_counts))]
+    results = {}
+    for count in image_counts:
+        def setup():
+            ws = openpyxl.load_workbook(settings.template_path).active
+            return (ws, images[:count])
+
+        results[f'embed_images[{count}]'] = measure(
+            writer._embed_document_images, setup=setup, rounds=rounds
+        )
+    return results
+
+
+def bench_http_create_from_ocr(rounds: int, workdir: str) -> Dict[str, Any]:
+    """Full request path through FastAPI with OCR.space and OpenRouter stubbed"""
+    from fastapi.testclient import TestClient
+    from main_new import app
+    from app.services import ocr_service
+    from openrouter_service import openrouter_extractor
+    from tests.stubs import StubServer
+
+    image = make_document_image(800, 600)
+    saved_ocr_url = ocr_service.api_url
+    saved_openrouter = dict(vars(openrouter_extractor))
+    saved_settings = (settings.use_master_file, settings.use_openrouter, settings.customer_profiles)
+
+    with StubServer() as stub, isolated_paths(workdir):
+        settings.use_master_file = False
+        settings.use_openrouter = True
+        # Every round takes the same path; a remembered customer would skip the LLM
+        settings.customer_profiles = False
+        ocr_service.api_url = stub.ocr_space_url
+        openrouter_extractor.enabled = True
+        openrouter_extractor.api_key = 'stub'
+        openrouter_extractor.model = 'stub-model'
+        openrouter_extractor.api_url = stub.openrouter_url
+
+        client = TestClient(app)
+
+        def request():
+            response = client.post(
+                '/api/invoice/create-from-ocr',
+                files={'file': ('booking.jpg', image, 'image/jpeg')},
+                data={'user_text': SAMPLE_USER_TEXT}
+            )
+            response.raise_for_status()
+
+        try:
+            return {'http_create_from_ocr': measure(request, rounds=rounds)}
+        finally:
+            settings.use_master_file, settings.use_openrouter, settings.customer_profiles = saved_settings
+            ocr_service.api_url = saved_ocr_url
+            vars(openrouter_extractor).update(saved_openrouter)
+
+
+def build_catalogue(path: str, size: int) -> IndexService:
+    """An invoice index holding size synthetic invoices"""
+    first_names = ('Rahul', 'Priya', 'Amit', 'Neha', 'Vikram', 'Anita', 'Suresh', 'Kavita')
+    last_names = ('Sharma', 'Verma', 'Gupta', 'Singh', 'Rao', 'Jain', 'Mehta', 'Agarwal')
+    areas = ('Malviya Nagar', 'Vaishali Nagar', 'Mansarovar', 'C-Scheme', 'Baner', 'Andheri')
+    index = IndexService(path, os.path.dirname(path))
+    entries = []
+    for i in range(size):
+        entries.append({
+            'id': f"HD-BENCH-{i:06d}",
+            'invoice_number': f"HD/2026-27/{i:06d}",
+            'customer_name': f"{first_names[i % 8]} {last_names[(i // 8) % 8]} {i}",
+            'address': f"{i % 500} {areas[i % 6]}, Jaipur",
+            'mobile_number': f"9{i:09d}",
+            'vehicle_number': f"RJ14AB{i % 10000:04d}",
+            'total_amount': 1000 + (i * 37) % 50000,
+            'start_datetime': f"2026-{(i % 12) + 1:02d}-{(i % 28) + 1:02d} 09:00",
+            'file_path': f"HD-BENCH-{i:06d}.xlsx",
+            'created_at': f"2026-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}T{i % 24:02d}:00:{i % 60:02d}",
+        })
+        if len(entries) == 10000:
+            index.record_many(entries)
+            entries = []
+    if entries:
+        index.record_many(entries)
+    return index
+
+
+def bench_search(rounds: int, workdir: str, size: int = 100_000) -> Dict[str, Any]:
+    index = build_catalogue(os.path.join(workdir, 'search_index.db'), size)
+    queries = {
+        'text': {'text': 'sharma jaipur'},
+        'name_prefix': {'name': 'vik ra'},
+        'phone': {'phone': '+91 90000 12345'},
+        'vehicle': {'vehicle': 'rj14-ab-0042'},
+        'date_amount': {'date_from': '2026-03-01', 'date_to': '2026-03-31', 'min_amount': 20000},
+    }
+    return {
+        f'search[{name}]': measure(lambda filters=filters: index.search(**filters), rounds=rounds)
+        for name, filters in queries.items()
+    }
+
+
+def amount_columns(size: int) -> Dict[str, list]:
+    """Audit input for size invoices, every 1000th with a wrong CGST"""
+    columns = {'id': [], 'total_amount': [], 'taxable_amount': [], 'cgst': [], 'sgst': []}
+    for i in range(size):
+        total = 1000 + (i * 37) % 50000
+        taxable = round(total / 1.05, 2)
+        half = round(taxable * 0.025, 2)
+        columns['id'].append(f"HD-BENCH-{i:07d}")
+        columns['total_amount'].append(float(total))
+        columns['taxable_amount'].append(taxable)
+        columns['cgst'].append(half + 1 if i % 1000 == 0 else half)
+        columns['sgst'].append(half)
+    return columns
+
+
+def bench_audit(rounds: int, size: int = 1_000_000) -> Dict[str, Any]:
+    columns = amount_columns(size)
+    return {f'audit[{size}]': measure(lambda: audit_amounts(columns), rounds=rounds)}
+
+
+def run_all(rounds: int = 10, sheet_counts=(10, 100, 1000), image_counts=(1, 2, 3, 4, 5, 6),
+            only: Iterable[str] = None) -> Dict[str, Any]:
+    """Run every benchmark group, or only the named groups"""
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='hilldrive-bench-')
+    groups = {
+        'extract': lambda: bench_extract(rounds),
+        'write': lambda: bench_write(rounds, workdir),
+        'fill': lambda: bench_fill(rounds),
+        'write_to_master': lambda: bench_write_to_master(rounds, workdir, sheet_counts),
+        'embed_images': lambda: bench_embed_images(rounds, image_counts),
+        'http': lambda: bench_http_create_from_ocr(rounds, workdir),
+        'search': lambda: bench_search(rounds, workdir),
+        'audit': lambda: bench_audit(rounds),
+        'startup': lambda: bench_startup(rounds),
+    }
+    try:
+        for name, run in groups.items():
+            if only and name not in only:
+                continue
+            results.update(run())
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
@@ -0,0 +1,63 @@
+"""
+Run the invoice pipeline benchmarks and compare against a previous run
+
+Usage:
+    python -m benchmarks.run --output benchmarks/results/$(git rev-parse --short HEAD).json
+    python -m benchmarks.run --compare benchmarks/results/baseline.json --threshold 0.15
+    python -m benchmarks.run --only extract,write --rounds 20
+
+Exits with status 1 when any benchmark's median regresses past the threshold.
+"""
+import argparse
+import sys
+
+from .harness import compare, load_results, run_metadata, save_results
+from .pipeline import run_all
+
+
+def _int_list(value: str):
+    return tuple(int(v) for v in value.split(',') if v)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Invoice pipeline benchmarks")
+    parser.add_argument('--rounds', type=int, default=10, help="Timed rounds per benchmark")
+    parser.add_argument('--sheets', type=_int_list, default=(10, 100, 1000),
+                        help="Existing sheet counts for write_to_master (comma-separated)")
+    parser.add_argument('--images', type=_int_list, default=(1, 2, 3, 4, 5, 6),
+                        help="Image counts for embed_images (comma-separated)")
+    parser.add_argument('--only', type=lambda v: set(v.split(',')), default=None,
+                        help="Benchmark groups to run: extract,write,fill,write_to_master,embed_images,http,search,audit,startup")
+    parser.add_argument('--output', help="Write results JSON to this path")
+    parser.add_argument('--compare', help="Baseline results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Relative median slowdown counted as a regression (default 0.10)")
+    args = parser.parse_args(argv)
+
+    results = {
+        'meta': run_metadata(),
+        'results': run_all(args.rounds, args.sheets, args.images, args.only),
+    }
+
+    print(f"{'benchmark':<28}{'median ms':>12}{'p95 ms':>12}{'min ms':>12}")
+    for name, stats in results['results'].items():
+        print(f"{name:<28}{stats['median_ms']:>12.2f}{stats['p95_ms']:>12.2f}{stats['min_ms']:>12.2f}")
+
+    if args.output:
+        save_results(args.output, results)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        rows = compare(load_results(args.compare), results, args.threshold)
+        print(f"\n{'benchmark':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+        for row in rows:
+            flag = '  REGRESSION' if row['regression'] else ''
+            print(f"{row['name']:<28}{row['baseline_ms']:>12.2f}{row['current_ms']:>12.2f}{row['change']:>+10.1%}{flag}")
+        if any(row['regression'] for row in rows):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Cold-start benchmark
+
+Each round imports the application in a fresh interpreter under
+``python -X importtime``, so module caches from earlier rounds do not hide
+import costs.
+
+Usage:
+    python -m benchmarks.startup --top 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from .harness import summarize
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(output: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Parse ``-X importtime`` output
+
+    Returns:
+        Module name -> (self microseconds, cumulative microseconds)
+    """
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # Header line
+        modules[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return modules
+
+
+def import_once(module: str = 'main_new') -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    """Import a module in a fresh interpreter; returns wall seconds and import times"""
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return time.perf_counter() - start, parse_importtime(completed.stderr)
+
+
+def slowest(modules: Dict[str, Tuple[int, int]], top: int = 15) -> List[Tuple[str, int, int]]:
+    """Modules with the largest cumulative import time"""
+    ranked = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)
+    return [(name, own, cumulative) for name, (own, cumulative) in ranked[:top]]
+
+
+def bench_startup(rounds: int, module: str = 'main_new') -> Dict[str, Dict[str, float]]:
+    """Interpreter start plus application import, and the import alone"""
+    wall, imports = [], []
+    for _ in range(rounds):
+        seconds, modules = import_once(module)
+        wall.append(seconds)
+        imports.append(modules.get(module, (0, 0))[1] / 1_000_000)
+    return {
+        f'startup[{module}]': summarize(wall),
+        f'import[{module}]': summarize(imports),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Application import-time profile")
+    parser.add_argument('--module', default='main_new', help="Module to import (default main_new)")
+    parser.add_argument('--top', type=int, default=15, help="Number of slowest modules to list")
+    args = parser.parse_args(argv)
+
+    seconds, modules = import_once(args.module)
+    print(f"{'module':<48}{'self ms':>10}{'cumulative ms':>16}")
+    for name, own, cumulative in slowest(modules, args.top):
+        print(f"{name:<48}{own / 1000:>10.1f}{cumulative / 1000:>16.1f}")
+    print(f"\nWall time including interpreter start: {seconds * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
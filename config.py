@@ -26,6 +26,7 @@ class Settings(BaseSettings):
     # OpenRouter AI Configuration
     openrouter_api_key: str = ""
     openrouter_model: str = "google/gemini-2.0-flash-exp:free"
+    openrouter_api_url: str = "https://openrouter.ai/api/v1/chat/completions"
     use_openrouter: bool = True  # Enable/disable OpenRouter processing
     
     # File Upload Configuration
@@ -34,9 +35,59 @@ class Settings(BaseSettings):
     
     # Template Configuration
     template_path: str = "inn sample.xlsx"
+    templates_dir: str = "templates"  # Mapping files (<name>.json) of per-branch or per-brand templates
     output_dir: str = "generated_invoices"
     use_master_file: bool = True  # If True, all invoices go to one file as sheets
+    invoice_renderer: str = "xml"  # Separate invoice files: "xml" fills the sheet XML directly, "openpyxl" loads and saves the workbook
     master_file_path: str = "generated_invoices/all_invoices.xlsx"
+    index_db_path: str = "generated_invoices/invoice_index.db"
+    sheet_cache_dir: str = "generated_invoices/.sheet_cache"  # Per-invoice extracts of the master file
+    media_cache_dir: str = "generated_invoices/.media"  # Processed document images, by content hash
+    media_cache_max_mb: int = 512  # Least recently used images are removed above this (0: no limit)
+    
+    # Customer Profile Configuration
+    customer_profiles: bool = True  # Remember invoiced customers and fill in their details next time
+    customer_profile_skip_llm: bool = True  # Skip the LLM for known customers when pattern matching suffices
+    customer_db_path: str = "generated_invoices/customers.db"
+    
+    # Background Job Configuration
+    job_db_path: str = "generated_invoices/jobs.db"
+    job_upload_dir: str = "generated_invoices/jobs"  # Uploads waiting to be processed
+    job_workers: int = 2
+    job_retention_days: int = 7  # Finished jobs are deleted after this
+    job_lease_seconds: int = 60  # A running job whose worker stops renewing this long is requeued
+    
+    # Idempotency Configuration
+    idempotency_db_path: str = "generated_invoices/idempotency.db"
+    idempotency_ttl_hours: int = 24  # How long a repeated Idempotency-Key replays its response
+    
+    # Storage Configuration
+    storage_backend: str = "local"  # "local" or "s3" (any S3-compatible store: AWS, MinIO, R2)
+    storage_local_dir: str = ""  # Local backend copies invoices here; empty keeps them in output_dir
+    storage_upload_workers: int = 2  # Files uploaded in parallel
+    storage_max_attempts: int = 5  # Upload attempts before an invoice is marked failed
+    storage_retry_seconds: float = 2.0  # First retry delay; doubles on each attempt
+    s3_bucket: str = ""
+    s3_prefix: str = "invoices/"
+    s3_endpoint_url: str = ""  # e.g. http://localhost:9000 for MinIO; empty for AWS
+    s3_region: str = ""
+    s3_access_key_id: str = ""  # Empty uses the standard AWS credential chain
+    s3_secret_access_key: str = ""
+    s3_part_size_mb: int = 8  # Multipart part size; files above it are split
+    s3_part_concurrency: int = 4  # Parts of one file sent in parallel
+    
+    # Backup Configuration
+    backup_dir: str = "invoice_backup"
+    backup_interval_minutes: int = 0  # Snapshot generated invoices this often; 0 disables
+    backup_keep: int = 48  # Snapshots kept; older ones (and their unused chunks) are pruned
+    
+    # Logging Configuration
+    log_level: str = "INFO"
+    log_format: str = "text"  # "text" (key=value) or "json"
+    log_customer_data: bool = False  # Unmask customer details in DEBUG logs
+    
+    # Startup Configuration
+    warm_up_on_startup: bool = False  # Load openpyxl/Pillow/Gemini in the background at startup
     
     # CORS Configuration
     cors_origins: str = "http://localhost:3000,http://localhost:8080"
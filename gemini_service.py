@@ -3,24 +3,39 @@ Gemini AI Service for Semantic Data Extraction
 Uses Google's Gemini API to intelligently extract and structure invoice data
 """
 
-import google.generativeai as genai
 from typing import Dict, Any, Optional
 import json
 from config import settings
+from app.core.metrics import stage
+from app.core.log import get_logger
+
+logger = get_logger(__name__)
 
 
 class GeminiDataExtractor:
     """Extract structured invoice data using Gemini AI"""
     
     def __init__(self):
-        """Initialize Gemini API"""
+        """Check the Gemini configuration; the SDK is loaded on first use"""
+        self._model = None
         if settings.gemini_api_key and settings.gemini_api_key != "your_gemini_api_key_here":
-            genai.configure(api_key=settings.gemini_api_key)
-            self.model = genai.GenerativeModel(settings.gemini_model)
             self.enabled = True
         else:
             self.enabled = False
-            print("⚠️  Gemini API key not configured. Using basic extraction.")
+            logger.info("Gemini API key not configured. Using basic extraction.")
+    
+    @property
+    def model(self):
+        """Gemini model, created on first use (importing the SDK takes ~0.4s)"""
+        if self._model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=settings.gemini_api_key)
+            self._model = genai.GenerativeModel(settings.gemini_model)
+        return self._model
+    
+    @model.setter
+    def model(self, value):
+        self._model = value
     
     def extract_invoice_data(self, ocr_text: str, user_text: str = "") -> Dict[str, Any]:
         """
@@ -38,7 +53,8 @@ class GeminiDataExtractor:
         
         try:
             prompt = self._build_extraction_prompt(ocr_text, user_text)
-            response = self.model.generate_content(prompt)
+            with stage('provider'):
+                response = self.model.generate_content(prompt)
             
             # Parse JSON response
             result_text = response.text.strip()
@@ -60,7 +76,7 @@ class GeminiDataExtractor:
             return data
             
         except Exception as e:
-            print(f"⚠️  Gemini extraction failed: {e}")
+            logger.warning("Gemini extraction failed", extra={'error': str(e)})
             return self._fallback_extraction(ocr_text, user_text)
     
     def _build_extraction_prompt(self, ocr_text: str, user_text: str) -> str:
@@ -3,80 +3,71 @@ Hill Drive Invoice Template - Excel Automation
 Customized for 'inn sample.xlsx' template structure
 """
 
-import openpyxl
-from openpyxl.drawing.image import Image as XLImage
+import logging
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 import re
 import os
-from PIL import Image
 import io
 
+from app.core.metrics import stage
+from app.core.ledger import Ledger, ledger_entry
+from app.core import tax
+from app.core.xlsx import atomic_write, save_workbook
+from app.core.media import MediaStore, media_key, png_size
+from app.core.templates import CompiledTemplate, compile_template, load_mapping
+from app.core.xlsx_template import RenderError, SheetValues
+from app.core.log import get_logger, customer_fields
+
+logger = get_logger(__name__)
+
+# Processing applied by _document_png; change it when the processing changes
+DOCUMENT_IMAGE_VARIANT = 'rgb-800x600-png0-300dpi'
+
+# Cell mapping of 'inn sample.xlsx', the default template
+DEFAULT_MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'hilldrive.json')
+
+# Mapped fields copied into the master file's ledger
+LEDGER_FIELDS = ('invoice_number', 'invoice_date', 'customer_name', 'gross_amount', 'total_amount')
+
 
 class HillDriveExcelWriter:
     """Write booking data to Hill Drive invoice template"""
     
-    def __init__(self, template_path: str = 'inn sample.xlsx', master_file: str = None):
+    # Last invoice number allocated, per financial year
+    counter_file = 'invoice_counter.json'
+    
+    def __init__(self, template_path: str = 'inn sample.xlsx', master_file: str = None, media_dir: str = None,
+                 mapping: Dict[str, Any] = None, renderer: str = 'openpyxl', media_max_bytes: int = 0):
         self.template_path = template_path
         self.master_file = master_file or 'generated_invoices/all_invoices.xlsx'
-        
-        # Cells that contain formulas - DO NOT OVERWRITE
-        self.formula_cells = {
-            'E18',  # Tax calculation
-            'F23',  # Subtotal tax
-            'G23',  # Subtotal amount
-            'F27',  # Taxable amount (formula)
-            'F28',  # CGST (formula)
-            'F29',  # SGST (formula)
-            'F35',  # Balance (formula)
-        }
-        
-        # Cell mapping based on actual template structure from screenshot
-        self.cell_map = {
-            # Invoice header (Row 8)
-            'invoice_number': 'C8',      # HD/2026-27/001 (ONLY THIS ONE)
-            'invoice_number_old': 'D8',  # OLD number to clear
-            'invoice_date': 'F8',        # 02/02/26
-            
-            # Customer details
-            'customer_name': 'C10',      # NAME (Row 10) - Column C, not B
-            'license_no': 'D10',         # License No. (Row 10)
-            'address': 'C12',            # ADDRESS (Row 12) - Column C, not B11
-            'phone_number': 'C14',       # PHONE NO. (Row 14) - Column C
-            'place_of_supply': 'C15',    # PLACE OF SUPPLY (Row 15) - Column C
-            
-            # Delivery details
-            'delivery_address': 'F11',   # DELIVERY ADD. (Row 11)
-            'vehicle_number': 'F14',     # VEHICLE NO. (Row 14)
-            
-            # Service details (Row 18 - main service row)
-            'service_name': 'A18',       # SERVICES (e.g., "Vehicle - Self Drive")
-            'sac_code': 'B18',           # SAC code (996511)
-            'no_of_days': 'C18',         # NO OF DAYS
-            'quantity': 'D18',           # QTY (usually 1)
-            # E18 has formula - don't write to it
-            # F18, G18 have formulas - don't write to them
-            
-            # Additional charges
-            'km_limit': 'B22',           # KILOMETER LIMIT (Row 22)
-            
-            # Right side amounts (Column F)
-            'security_deposit': 'F25',   # Security Deposit (Row 25)
-            'pickup_drop': 'F26',        # Pick & Drop Charges (Row 26)
-            # F27, F28, F29 have formulas - don't write to them
-            'igst': 'F30',               # IGST @ 5% (Row 30)
-            
-            # Payment details
-            'payment_mode': 'B31',       # PAYMENT MODE (Row 31)
-            'round_off': 'F31',          # Round Off (Row 31)
-            'other_charges': 'F32',      # OTHER CHARGES (Row 32)
-            'total_amount': 'F33',       # Total Amount (Row 33)
-            'received_amount': 'F34',    # Received Amount (Row 34)
-            # F35 has formula - don't write to it
-            
-            # Booking details
-            'booking_datetime': 'B33',   # BOOKING DATE & TIME (Row 33)
-        }
+        # Processed document images by content hash (not kept when None)
+        self.media = MediaStore(media_dir, media_max_bytes) if media_dir else None
+        # 'xml' fills single invoices into the template's sheet XML directly
+        self.renderer = renderer
+        
+        # Field-to-cell mapping; formula cells are never overwritten
+        mapping = mapping or load_mapping(DEFAULT_MAPPING)
+        self.cell_map = dict(mapping['cells'])
+        self.formula_cells = set(mapping.get('formula_cells', []))
+        self._mapping = mapping
+        self._template = None
+    
+    @classmethod
+    def from_template(cls, template: CompiledTemplate, master_file: str = None, media_dir: str = None,
+                      renderer: str = 'openpyxl', media_max_bytes: int = 0) -> 'HillDriveExcelWriter':
+        """Writer for a template already compiled by a TemplateRegistry"""
+        mapping = {'cells': template.cell_map, 'formula_cells': sorted(template.formula_cells)}
+        writer = cls(template.template_path, master_file, media_dir, mapping, renderer, media_max_bytes)
+        writer._template = template
+        return writer
+    
+    @property
+    def template(self) -> CompiledTemplate:
+        """The parsed template with merged-cell anchors resolved, compiled on first use"""
+        if self._template is None:
+            self._template = compile_template(self.template_path, self._mapping)
+        return self._template
     
     def write(self, data: Dict[str, Any], output_path: str) -> str:
         """
@@ -89,9 +80,6 @@ class HillDriveExcelWriter:
         Returns:
             Path to the created file
         """
-        wb = openpyxl.load_workbook(self.template_path)
-        ws = wb.active
-        
         # Generate invoice number if not provided
         if not data.get('invoice_number'):
             data['invoice_number'] = self._generate_invoice_number()
@@ -100,17 +88,65 @@ class HillDriveExcelWriter:
         if not data.get('invoice_date'):
             data['invoice_date'] = datetime.now().strftime('%d/%m/%y')
         
+        if self.renderer == 'xml' and not data.get('document_images') and self._write_xml(data, output_path):
+            return output_path
+        
+        with stage('template_load'):
+            wb = self.template.load()
+            ws = wb.active
+        
         # Fill the sheet with data
-        self._fill_sheet_data(ws, data)
+        with stage('fill'):
+            self._fill_sheet_data(ws, data)
         
         # Embed document images if provided
         if data.get('document_images'):
-            self._embed_document_images(ws, data['document_images'])
-        
-        # Save the file
-        wb.save(output_path)
+            with stage('embed'):
+                self._embed_document_images(ws, data['document_images'])
+        
+        # Save the file (a failed save leaves any previous file in place)
+        with atomic_write(output_path) as tmp_path:
+            with stage('save'):
+                save_workbook(wb, tmp_path)
+            with stage('recalc'):
+                self._cache_formula_values(tmp_path)
         return output_path
     
+    def _write_xml(self, data: Dict[str, Any], output_path: str) -> bool:
+        """
+        Write a single invoice by filling the template's sheet XML
+        
+        Produces the same cells as the openpyxl path without loading or
+        re-saving the workbook; other parts of the template are copied as is.
+        
+        Returns:
+            False if the template or a value needs openpyxl (nothing written)
+        """
+        xml_template = self.template.xml_template
+        if xml_template is None:
+            return False
+        
+        sheet = SheetValues(self.template.covered)
+        with stage('fill'):
+            self._fill_sheet_data(sheet, data)
+            try:
+                sheet_xml = xml_template.fill(sheet.values) if sheet.supported else None
+            except RenderError:
+                sheet_xml = None
+        if sheet_xml is None:
+            logger.debug("Invoice needs openpyxl", extra={'invoice_number': data.get('invoice_number')})
+            return False
+        
+        with stage('recalc'):
+            try:
+                sheet_xml = tax.cache_sheet_xml(sheet_xml)
+            except Exception as e:
+                logger.warning("Failed to cache formula values", extra={'file': output_path, 'error': str(e)})
+        with atomic_write(output_path) as tmp_path:
+            with stage('save'):
+                xml_template.save(sheet_xml, tmp_path)
+        return True
+    
     def write_to_master(self, data: Dict[str, Any], sheet_name: str = None) -> Dict[str, str]:
         """
         Write booking data as a new sheet in the master Excel file
@@ -122,6 +158,8 @@ class HillDriveExcelWriter:
         Returns:
             Dictionary with master_file path and sheet_name
         """
+        import openpyxl
+        
         # Generate invoice number if not provided
         if not data.get('invoice_number'):
             data['invoice_number'] = self._generate_invoice_number()
@@ -134,78 +172,110 @@ class HillDriveExcelWriter:
         if not sheet_name:
             sheet_name = data['invoice_number'].replace('/', '-')
         
-        # Load or create master workbook
-        if os.path.exists(self.master_file):
-            # Load existing master file
-            master_wb = openpyxl.load_workbook(self.master_file)
-            print(f"📂 Loading existing master file: {self.master_file}")
-        else:
-            # Create new master file from template
-            master_wb = openpyxl.load_workbook(self.template_path)
-            # Rename the first sheet
-            master_wb.active.title = sheet_name
-            print(f"📂 Creating new master file: {self.master_file}")
-        
-        # Check if sheet name already exists
-        if sheet_name in master_wb.sheetnames:
-            # Add timestamp to make it unique
-            timestamp = datetime.now().strftime('%H%M%S')
-            sheet_name = f"{sheet_name}_{timestamp}"
-        
-        # Load template to copy from
-        template_wb = openpyxl.load_workbook(self.template_path)
-        template_ws = template_wb.active
-        
-        # Create new sheet in master workbook by copying template
-        if len(master_wb.sheetnames) == 1 and master_wb.active.max_row == 1:
-            # First sheet is empty, use it
-            ws = master_wb.active
-            ws.title = sheet_name
-        else:
-            # Copy template sheet to master workbook
-            ws = master_wb.create_sheet(title=sheet_name)
-            
-            # Copy all cells from template
-            for row in template_ws.iter_rows():
-                for cell in row:
-                    new_cell = ws[cell.coordinate]
-                    
-                    # Copy value
-                    if cell.value:
-                        new_cell.value = cell.value
-                    
-                    # Copy style
-                    if cell.has_style:
-                        new_cell.font = cell.font.copy()
-                        new_cell.border = cell.border.copy()
-                        new_cell.fill = cell.fill.copy()
-                        new_cell.number_format = cell.number_format
-                        new_cell.protection = cell.protection.copy()
-                        new_cell.alignment = cell.alignment.copy()
+        master_existed = os.path.exists(self.master_file)
+        
+        with stage('template_load'):
+            # Load or create master workbook
+            if master_existed:
+                # Load existing master file
+                master_wb = openpyxl.load_workbook(self.master_file)
+            else:
+                # Create new master file from template
+                master_wb = self.template.load()
+                # Rename the first sheet
+                master_wb.active.title = sheet_name
+                logger.info("Creating new master file", extra={'master_file': self.master_file})
             
-            # Copy row dimensions
-            for row_num, row_dim in template_ws.row_dimensions.items():
-                ws.row_dimensions[row_num].height = row_dim.height
+            # Check if sheet name already exists
+            if sheet_name in master_wb.sheetnames:
+                # Add timestamp to make it unique
+                timestamp = datetime.now().strftime('%H%M%S')
+                sheet_name = f"{sheet_name}_{timestamp}"
             
-            # Copy column dimensions
-            for col_letter, col_dim in template_ws.column_dimensions.items():
-                ws.column_dimensions[col_letter].width = col_dim.width
+            # Template sheet to copy from (parsed once per template)
+            template_ws = self.template.worksheet
             
-            # Copy merged cells
-            for merged_range in template_ws.merged_cells.ranges:
-                ws.merge_cells(str(merged_range))
+            # Create new sheet in master workbook by copying template
+            if len(master_wb.sheetnames) == 1 and master_wb.active.max_row == 1:
+                # First sheet is empty, use it
+                ws = master_wb.active
+                ws.title = sheet_name
+            else:
+                # Copy template sheet to master workbook
+                ws = master_wb.create_sheet(title=sheet_name)
+                
+                # Copy all cells from template
+                for row in template_ws.iter_rows():
+                    for cell in row:
+                        new_cell = ws[cell.coordinate]
+                        
+                        # Copy value
+                        if cell.value:
+                            new_cell.value = cell.value
+                        
+                        # Copy style
+                        if cell.has_style:
+                            new_cell.font = cell.font.copy()
+                            new_cell.border = cell.border.copy()
+                            new_cell.fill = cell.fill.copy()
+                            new_cell.number_format = cell.number_format
+                            new_cell.protection = cell.protection.copy()
+                            new_cell.alignment = cell.alignment.copy()
+                
+                # Copy row dimensions
+                for row_num, row_dim in template_ws.row_dimensions.items():
+                    ws.row_dimensions[row_num].height = row_dim.height
+                
+                # Copy column dimensions
+                for col_letter, col_dim in template_ws.column_dimensions.items():
+                    ws.column_dimensions[col_letter].width = col_dim.width
+                
+                # Copy merged cells
+                for merged_range in template_ws.merged_cells.ranges:
+                    ws.merge_cells(str(merged_range))
         
         # Now fill the data (same as write method)
-        self._fill_sheet_data(ws, data)
+        with stage('fill'):
+            self._fill_sheet_data(ws, data)
         
         # Embed document images if provided
         if data.get('document_images'):
-            self._embed_document_images(ws, data['document_images'])
+            with stage('embed'):
+                self._embed_document_images(ws, data['document_images'])
+        
+        ledger = Ledger.for_master(self.master_file)
+        ledger_cells = self._ledger_cells()
+        if master_existed and not ledger.exists():
+            # One-time scan of a master file written before the ledger existed
+            # (read before saving, so the new sheet is not counted twice)
+            with stage('ledger'):
+                self._safe_ledger(ledger.rebuild, self.master_file, ledger_cells)
         
         # Save the master file
-        master_wb.save(self.master_file)
+        # A crash mid-save must not truncate the file holding every invoice
+        with atomic_write(self.master_file) as tmp_path:
+            with stage('save'):
+                save_workbook(master_wb, tmp_path)
+            with stage('recalc'):
+                self._cache_formula_values(tmp_path)
+        
+        with stage('ledger'):
+            # Fields the template does not map are taken from the booking
+            amounts = self.invoice_amounts(data)
+            values = {
+                'invoice_number': data['invoice_number'],
+                'invoice_date': data['invoice_date'],
+                'customer_name': data.get('customer_name') or data.get('company_name'),
+                'gross_amount': amounts['gross_amount'],
+                'total_amount': amounts['total_amount'],
+            }
+            values.update((name, ws[ref].value) for name, ref in ledger_cells.items())
+            self._safe_ledger(ledger.append, ledger_entry(sheet_name=sheet_name, **values))
         
-        print(f"✅ Added sheet '{sheet_name}' to {self.master_file}")
+        logger.info(
+            "Added invoice sheet to master file",
+            extra={'sheet': sheet_name, 'master_file': self.master_file, 'sheet_count': len(master_wb.sheetnames)}
+        )
         
         return {
             'master_file': self.master_file,
@@ -213,32 +283,53 @@ class HillDriveExcelWriter:
             'invoice_number': data['invoice_number']
         }
     
+    def ensure_ledger(self) -> Ledger:
+        """The master file's ledger, built from the workbook if missing"""
+        ledger = Ledger.for_master(self.master_file)
+        if not ledger.exists() and os.path.exists(self.master_file):
+            rows = ledger.rebuild(self.master_file, self._ledger_cells())
+            logger.info("Rebuilt ledger from master file", extra={'rows': rows})
+        return ledger
+    
+    def _ledger_cells(self) -> Dict[str, str]:
+        """Cells holding the ledger values (top-left cell of merged ranges), for the fields the template maps"""
+        anchors = self.template.anchors
+        return {name: anchors[name] for name in LEDGER_FIELDS if name in anchors}
+    
+    def _cache_formula_values(self, path: str):
+        """Store the template formulas' results in a saved workbook"""
+        try:
+            tax.cache_template_values(path)
+        except Exception as e:
+            # Excel recalculates on open anyway; only other viewers miss out
+            logger.warning("Failed to cache formula values", extra={'file': path, 'error': str(e)})
+    
+    def _safe_ledger(self, operation, *args):
+        """Ledger updates must never fail an invoice that is already saved"""
+        try:
+            operation(*args)
+        except Exception as e:
+            logger.warning("Failed to update ledger", extra={'master_file': self.master_file, 'error': str(e)})
+    
     def _fill_sheet_data(self, ws, data: Dict[str, Any]):
         """Fill worksheet with booking data (extracted from write method)"""
         
-        # DEBUG: Print extracted data
-        print("\n" + "="*60)
-        print("📊 DATA BEING WRITTEN TO EXCEL:")
-        print("="*60)
-        print(f"Customer Name: {data.get('customer_name')}")
-        print(f"Company Name: {data.get('company_name')}")
-        print(f"Address: {data.get('address')}")
-        print(f"Mobile: {data.get('mobile_number')}")
-        print(f"Phone: {data.get('phone_number')}")
-        print("="*60 + "\n")
+        # Customer details are masked unless LOG_CUSTOMER_DATA is set
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Writing invoice data", extra=customer_fields(data))
+        
+        missing = []
         
         # Fill customer details
         customer_name = data.get('customer_name') or data.get('company_name')
         if customer_name:
             self._set_cell(ws, 'customer_name', customer_name)
-            print(f"✅ Set customer_name to C10: {customer_name}")
         else:
-            print("⚠️  WARNING: No customer name found!")
+            missing.append('customer_name')
         
         # Clear the old invoice number in D8
         try:
-            ws['D8'].value = None  # Clear old invoice number
-            print("✅ Cleared old invoice number in D8")
+            ws[self.cell_map['invoice_number_old']].value = None  # Clear old invoice number
         except:
             pass
         
@@ -248,19 +339,21 @@ class HillDriveExcelWriter:
             # If address is too long, it might need wrapping
             self._set_cell(ws, 'address', address)
             # Enable text wrapping for address cell
-            from openpyxl.styles import Alignment
-            ws[self.cell_map['address']].alignment = Alignment(wrap_text=True, vertical='top')
-            print(f"✅ Set address to C12: {address[:50]}...")
+            if 'address' in self.cell_map:
+                from openpyxl.styles import Alignment
+                ws[self.cell_map['address']].alignment = Alignment(wrap_text=True, vertical='top')
         else:
-            print("⚠️  WARNING: No address found!")
+            missing.append('address')
         
         # Try both mobile_number and phone_number
         phone = data.get('mobile_number') or data.get('phone_number')
         if phone:
             self._set_cell(ws, 'phone_number', phone)
-            print(f"✅ Set phone to C14: {phone}")
         else:
-            print("⚠️  WARNING: No phone number found!")
+            missing.append('phone_number')
+        
+        if missing:
+            logger.warning("Invoice is missing customer fields", extra={'missing': missing})
         
         self._set_cell(ws, 'place_of_supply', data.get('place_of_supply', 'Jaipur'))
         
@@ -276,17 +369,11 @@ class HillDriveExcelWriter:
         self._set_cell(ws, 'quantity', 1)
         
         # Calculate amounts
-        if data.get('total_amount'):
-            final_total = data.get('total_amount')
-            security = data.get('security_deposit') or 0
-            taxable_amount = final_total - security
-            amount_with_gst = taxable_amount
-        else:
-            taxable_amount = self._calculate_taxable_amount(data)
-            amount_with_gst = taxable_amount * 1.05
+        amounts = self.invoice_amounts(data)
         
         # Write to G18 - this will trigger all formula calculations
-        ws['G18'] = amount_with_gst
+        if 'gross_amount' in self.cell_map:
+            ws[self.cell_map['gross_amount']] = amounts['gross_amount']
         
         # Additional details
         self._set_cell(ws, 'km_limit', data.get('included_km') or 0)
@@ -300,13 +387,9 @@ class HillDriveExcelWriter:
         self._set_cell(ws, 'igst', 0)  # IGST is 0 for intra-state
         
         # Total amount and received amount
-        if data.get('total_amount'):
-            self._set_cell(ws, 'total_amount', data.get('total_amount'))
-        else:
-            total = amount_with_gst + (data.get('security_deposit') or 0)
-            self._set_cell(ws, 'total_amount', round(total, 2))
+        self._set_cell(ws, 'total_amount', amounts['total_amount'])
         
-        self._set_cell(ws, 'received_amount', data.get('advance_paid') or 0)
+        self._set_cell(ws, 'received_amount', amounts['received_amount'])
         
         # Booking date & time
         booking_dt = self._format_booking_datetime(data)
@@ -323,22 +406,13 @@ class HillDriveExcelWriter:
             # Don't overwrite formula cells
             if cell_ref not in self.formula_cells:
                 try:
-                    # Check if cell is part of a merged range
-                    cell = ws[cell_ref]
-                    if isinstance(cell, openpyxl.cell.cell.MergedCell):
-                        # Find the top-left cell of the merged range
-                        for merged_range in ws.merged_cells.ranges:
-                            if cell_ref in merged_range:
-                                # Get the top-left cell of the merged range
-                                top_left = merged_range.start_cell
-                                ws[top_left.coordinate] = value
-                                return
-                    else:
-                        ws[cell_ref] = value
+                    # Merged ranges hold their value in the top-left cell,
+                    # resolved once when the template was compiled
+                    ws[self.template.anchors.get(field_name, cell_ref)] = value
                 except Exception as e:
-                    print(f"⚠️  Failed to set {field_name} at {cell_ref}: {e}")
+                    logger.warning("Failed to set cell", extra={'field': field_name, 'cell': cell_ref, 'error': str(e)})
             else:
-                print(f"⚠️  Skipping {cell_ref} - contains formula")
+                logger.debug("Skipping formula cell", extra={'field': field_name, 'cell': cell_ref})
     
     def _format_service_name(self, data: Dict) -> str:
         """Format service name from vehicle and rental type"""
@@ -346,6 +420,27 @@ class HillDriveExcelWriter:
         rental_type = data.get('rental_type', 'Self Drive')
         return f"{vehicle} - {rental_type}"
     
+    def invoice_amounts(self, data: Dict[str, Any]) -> Dict[str, float]:
+        """
+        Amounts written to an invoice
+        
+        Returns:
+            gross_amount (service amount incl. GST, G18), total_amount (F33),
+            received_amount (F34) and what the template formulas derive from
+            them: taxable_amount, cgst, sgst and balance_amount
+        """
+        security = tax.to_decimal(data.get('security_deposit'))
+        if data.get('total_amount'):
+            total = tax.money(data.get('total_amount'))
+            amount_with_gst = total - security
+        else:
+            amount_with_gst = tax.money(
+                tax.to_decimal(self._calculate_taxable_amount(data)) * (1 + tax.GST_RATE)
+            )
+            total = tax.money(amount_with_gst + security)
+        
+        return tax.compute(amount_with_gst, total, data.get('advance_paid')).amounts()
+    
     def _calculate_taxable_amount(self, data: Dict) -> float:
         """
         Calculate taxable amount (before GST)
@@ -429,6 +524,8 @@ class HillDriveExcelWriter:
         if not image_paths:
             return
         
+        from openpyxl.drawing.image import Image as XLImage
+        
         current_row = start_row
         images_per_row = 2  # Show 2 images per row
         
@@ -446,65 +543,19 @@ class HillDriveExcelWriter:
                 if isinstance(img_path, bytes):
                     # Image is bytes
                     img_data = img_path
-                    pil_img = Image.open(io.BytesIO(img_data))
                 elif isinstance(img_path, str) and os.path.exists(img_path):
                     # Image is file path
-                    pil_img = Image.open(img_path)
+                    with open(img_path, 'rb') as f:
+                        img_data = f.read()
                 else:
-                    print(f"⚠️  Skipping invalid image: {img_path}")
+                    logger.warning("Skipping invalid document image", extra={'image_index': idx + 1})
                     continue
                 
-                # Convert to RGB if needed
-                if pil_img.mode in ('RGBA', 'LA', 'P'):
-                    background = Image.new('RGB', pil_img.size, (255, 255, 255))
-                    if pil_img.mode == 'P':
-                        pil_img = pil_img.convert('RGBA')
-                    if pil_img.mode == 'RGBA':
-                        background.paste(pil_img, mask=pil_img.split()[-1])
-                    else:
-                        background.paste(pil_img)
-                    pil_img = background
-                elif pil_img.mode != 'RGB':
-                    pil_img = pil_img.convert('RGB')
-                
-                # Get original dimensions
-                original_width, original_height = pil_img.size
-                
-                # Target dimensions for Excel (larger = better quality)
-                target_width = 800   # Increased from 600
-                target_height = 600  # Increased from 450
-                
-                # Calculate aspect ratio
-                aspect_ratio = original_width / original_height
-                
-                # Resize to target dimensions maintaining aspect ratio
-                if aspect_ratio > 1:  # Wider than tall
-                    new_width = target_width
-                    new_height = int(target_width / aspect_ratio)
-                else:  # Taller than wide
-                    new_height = target_height
-                    new_width = int(target_height * aspect_ratio)
-                
-                # Always resize to ensure consistent quality
-                # Use HIGHEST quality resampling
-                pil_img = pil_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                
-                # Save with MAXIMUM quality and explicit DPI
-                img_byte_arr = io.BytesIO()
-                
-                # Save as PNG with HIGH DPI to prevent Excel scaling
-                # Using 300 DPI (print quality) ensures Excel doesn't compress aggressively
-                pil_img.save(
-                    img_byte_arr, 
-                    format='PNG',
-                    compress_level=0,  # NO compression
-                    optimize=False,
-                    dpi=(300, 300)  # Print quality DPI - prevents Excel compression
-                )
-                img_byte_arr.seek(0)
+                png_data = self._document_png(img_data)
+                new_width, new_height = png_size(png_data)
                 
                 # Create Excel image
-                xl_img = XLImage(img_byte_arr)
+                xl_img = XLImage(io.BytesIO(png_data))
                 
                 # CRITICAL: Set explicit dimensions to prevent Excel auto-scaling
                 # Convert pixels to Excel units (pixels * 0.75 = points)
@@ -518,18 +569,91 @@ class HillDriveExcelWriter:
                 # Add to worksheet
                 ws.add_image(xl_img)
                 
-                print(f"✅ Embedded image {idx + 1} at {anchor}")
+                logger.debug("Embedded document image", extra={'image_index': idx + 1, 'anchor': anchor})
                 
             except Exception as e:
-                print(f"⚠️  Failed to embed image {idx + 1}: {e}")
+                logger.warning("Failed to embed document image", extra={'image_index': idx + 1, 'error': str(e)})
                 continue
     
+    def _document_png(self, img_data: bytes) -> bytes:
+        """
+        Document image flattened to RGB, resized to fit 800x600 and saved as PNG
+        
+        Results are kept in the media store by the hash of the original, so a
+        scan seen before is not decoded and resampled again.
+        """
+        key = media_key(img_data, DOCUMENT_IMAGE_VARIANT)
+        if self.media is not None:
+            cached = self.media.get(key)
+            if cached is not None:
+                return cached
+        
+        from PIL import Image
+        
+        pil_img = Image.open(io.BytesIO(img_data))
+        
+        # Convert to RGB if needed
+        if pil_img.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', pil_img.size, (255, 255, 255))
+            if pil_img.mode == 'P':
+                pil_img = pil_img.convert('RGBA')
+            if pil_img.mode == 'RGBA':
+                background.paste(pil_img, mask=pil_img.split()[-1])
+            else:
+                background.paste(pil_img)
+            pil_img = background
+        elif pil_img.mode != 'RGB':
+            pil_img = pil_img.convert('RGB')
+        
+        # Get original dimensions
+        original_width, original_height = pil_img.size
+        
+        # Target dimensions for Excel (larger = better quality)
+        target_width = 800   # Increased from 600
+        target_height = 600  # Increased from 450
+        
+        # Calculate aspect ratio
+        aspect_ratio = original_width / original_height
+        
+        # Resize to target dimensions maintaining aspect ratio
+        if aspect_ratio > 1:  # Wider than tall
+            new_width = target_width
+            new_height = int(target_width / aspect_ratio)
+        else:  # Taller than wide
+            new_height = target_height
+            new_width = int(target_height * aspect_ratio)
+        
+        # Always resize to ensure consistent quality
+        # Use HIGHEST quality resampling
+        pil_img = pil_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        
+        # Save with MAXIMUM quality and explicit DPI
+        img_byte_arr = io.BytesIO()
+        
+        # Save as PNG with HIGH DPI to prevent Excel scaling
+        # Using 300 DPI (print quality) ensures Excel doesn't compress aggressively
+        pil_img.save(
+            img_byte_arr, 
+            format='PNG',
+            compress_level=0,  # NO compression
+            optimize=False,
+            dpi=(300, 300)  # Print quality DPI - prevents Excel compression
+        )
+        png_data = img_byte_arr.getvalue()
+        
+        if self.media is not None:
+            try:
+                self.media.put(key, png_data)
+            except OSError as e:
+                logger.warning("Failed to store document image", extra={'error': str(e)})
+        return png_data
+    
     def _generate_invoice_number(self) -> str:
         """Generate sequential invoice number in HD/YYYY-YY/XXX format"""
         import json
         import os
         
-        counter_file = 'invoice_counter.json'
+        counter_file = self.counter_file
         
         # Load counter
         if os.path.exists(counter_file):
@@ -558,9 +682,10 @@ class HillDriveExcelWriter:
         counter_data['last_invoice_number'] += 1
         invoice_num = counter_data['last_invoice_number']
         
-        # Save counter
-        with open(counter_file, 'w') as f:
-            json.dump(counter_data, f, indent=2)
+        # Save counter (replaced atomically, like the workbooks)
+        with atomic_write(counter_file) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(counter_data, f, indent=2)
         
         # Format: HD/2025-26/036
         return f"HD/{current_fy}/{invoice_num:03d}"
@@ -7,8 +7,10 @@ import json
 import re
 from datetime import datetime
 from typing import Dict, Any, Optional
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+
+from app.core.log import get_logger
+
+logger = get_logger(__name__)
 
 class BookingDataExtractor:
     """Extract and normalize booking data from OCR and user text"""
@@ -121,11 +123,10 @@ class BookingDataExtractor:
                 # Only set if it looks like a valid address (has pincode and reasonable length)
                 if re.search(r'\d{6}', address) and len(address) > 15:
                     data['address'] = address
-                    print(f"✅ Extracted address: {address[:50]}...")
                     break
         
         if not data.get('address'):
-            print("⚠️  No address extracted from OCR")
+            logger.debug("No address extracted from OCR")
 
     def _extract_vehicle_info(self, user_text: str, data: Dict):
         """Extract vehicle details"""
@@ -420,7 +421,12 @@ class BookingDataExtractor:
 
 
 class ExcelWriter:
-    """Write extracted data to Excel template"""
+    """
+    Write extracted data to a simple example template
+    
+    Invoices are written by hilldrive_excel_mapper.HillDriveExcelWriter;
+    its layouts are mapping files in templates/.
+    """
     
     def __init__(self, template_path: str):
         self.template_path = template_path
@@ -435,6 +441,8 @@ class ExcelWriter:
 
     def write(self, data: Dict[str, Any], output_path: str) -> str:
         """Write data to Excel file"""
+        import openpyxl
+        
         wb = openpyxl.load_workbook(self.template_path)
         ws = wb.active
         
@@ -1,18 +1,466 @@
 """
-Local Backup with Month-wise Organization
+Local Backup of Generated Invoices
 No internet required - works offline
+
+Each snapshot records the invoice files, the master workbook, the SQLite
+databases and the invoice counter as a manifest of content-addressed chunks
+stored under the backup root:
+
+    invoice_backup/
+        chunks/ab/ab12...   one file per unique chunk (zstd or deflate)
+        snapshots/<id>.json manifest: files and the chunks they are made of
+
+Files unchanged since the previous snapshot are not read again, and chunks
+already stored are not written again. Snapshots and pruning hold a lock file
+in the backup root, so a prune run from the command line never deletes a
+chunk that the server's snapshot is counting on. Zip-based files (xlsx) are split at
+their member boundaries, so re-saving the master workbook only stores the
+sheets and parts whose bytes changed, not the whole file.
+
+Usage:
+    python local_backup.py snapshot [paths...]
+    python local_backup.py list
+    python local_backup.py restore latest --to restored/
+    python local_backup.py prune --keep 30
 """
+import argparse
+import base64
+import contextlib
+import hashlib
+import io
+import json
 import os
-import shutil
-from datetime import datetime
-from typing import Optional
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import uuid
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.log import get_logger
+from app.core.xlsx import atomic_write
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = get_logger(__name__)
+
+
+DEFAULT_SOURCES = ['generated_invoices', 'invoice_counter.json']
+
+# Files that are rebuilt on demand or only exist while being written
+EXCLUDED_DIRS = {'.sheet_cache', '.media', '__pycache__'}
+EXCLUDED_SUFFIXES = ('.tmp', '-wal', '-shm', '-journal')
+
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+ZIP_SUFFIXES = ('.xlsx', '.xlsm', '.zip')
+
+# Pieces larger than this are split into chunks
+CHUNK_SIZE = 1024 * 1024
+
+# Pieces up to this size (zip headers) are kept in the manifest itself
+INLINE_LIMIT = 512
+
+# First byte of a stored chunk: how its payload is encoded
+_RAW, _DEFLATE, _ZSTD = b'r', b'd', b'z'
+
+
+class SnapshotNotFoundError(KeyError):
+    """Raised when a snapshot ID is unknown"""
+
+
+def _compress(data: bytes) -> bytes:
+    """Encoded chunk; data that does not shrink (images, deflated xlsx parts) is stored raw"""
+    if zstandard is not None:
+        encoded = _ZSTD + zstandard.ZstdCompressor(level=3).compress(data)
+    else:
+        encoded = _DEFLATE + zlib.compress(data, 6)
+    return encoded if len(encoded) < len(data) + 1 else _RAW + data
+
+
+def _decompress(encoded: bytes) -> bytes:
+    kind, payload = encoded[:1], encoded[1:]
+    if kind == _RAW:
+        return payload
+    if kind == _DEFLATE:
+        return zlib.decompress(payload)
+    if kind == _ZSTD:
+        if zstandard is None:
+            raise RuntimeError("This backup was compressed with zstd; install the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"Unknown chunk encoding {kind!r}")
+
+
+def _fixed_pieces(data: bytes, offset: int, end: int) -> Iterator[Tuple[int, int]]:
+    for start in range(offset, end, CHUNK_SIZE):
+        yield start, min(start + CHUNK_SIZE, end)
+
+
+def _zip_pieces(data: bytes) -> Optional[List[Tuple[int, int]]]:
+    """
+    (start, end) pieces of a zip file cut at member boundaries
+
+    Each member's compressed data becomes its own piece, separate from the
+    local header (which holds a timestamp that changes on every save).
+    Returns None if data is not a readable zip.
+    """
+    try:
+        infos = sorted(zipfile.ZipFile(io.BytesIO(data)).infolist(), key=lambda info: info.header_offset)
+    except (zipfile.BadZipFile, ValueError):
+        return None
+
+    pieces, position = [], 0
+    for info in infos:
+        header = info.header_offset
+        if header < position or header + 30 > len(data):
+            return None
+        name_length, extra_length = struct.unpack_from('<HH', data, header + 26)
+        start = header + 30 + name_length + extra_length
+        end = start + info.compress_size
+        if end > len(data):
+            return None
+        pieces.append((position, start))
+        pieces.extend(_fixed_pieces(data, start, end))
+        position = end
+    pieces.extend(_fixed_pieces(data, position, len(data)))
+    return [(start, end) for start, end in pieces if end > start]
 
 
 class LocalBackup:
-    """Organize invoices locally in month-wise folders"""
-    
-    def __init__(self, backup_root: str = "invoice_backup"):
+    """Content-addressed, incremental snapshots of invoice files"""
+
+    def __init__(self, backup_root: str = "invoice_backup", workers: int = None):
         """
         Initialize local backup
- 
\ No newline at end of file
+
+        Args:
+            backup_root: Directory holding chunks and snapshot manifests
+            workers: Threads compressing and writing chunks (zlib and zstd
+                release the GIL); defaults to the CPU count
+        """
+        self.backup_root = backup_root
+        self.chunk_dir = os.path.join(backup_root, 'chunks')
+        self.snapshot_dir = os.path.join(backup_root, 'snapshots')
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the backup root's lock file, shared with other processes using it"""
+        os.makedirs(self.backup_root, exist_ok=True)
+        with self._lock, open(os.path.join(self.backup_root, '.lock'), 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:  # Gave up after 10 seconds; keep waiting
+                        continue
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def _store_chunk(self, data: bytes) -> Tuple[str, int]:
+        """Write a chunk unless already stored; returns (digest, bytes written)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        encoded = _compress(data)
+        with atomic_write(path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(encoded)
+        return digest, len(encoded)
+
+    def _read_chunk(self, digest: str) -> bytes:
+        with open(self._chunk_path(digest), 'rb') as f:
+            data = _decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} is corrupt")
+        return data
+
+    def _iter_files(self, sources: List[str]) -> Iterator[str]:
+        """Files under the sources, as given (relative paths stay relative)"""
+        for source in sources:
+            if os.path.isfile(source):
+                yield source
+                continue
+            for directory, subdirs, files in os.walk(source):
+                subdirs[:] = sorted(d for d in subdirs if d not in EXCLUDED_DIRS)
+                for name in sorted(files):
+                    if not name.endswith(EXCLUDED_SUFFIXES):
+                        yield os.path.join(directory, name)
+
+    def _read_file(self, path: str) -> bytes:
+        """File contents; SQLite databases are read through a consistent online backup"""
+        if path.endswith(SQLITE_SUFFIXES):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                copy_path = os.path.join(tmp_dir, 'copy.db')
+                source = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+                target = sqlite3.connect(copy_path)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                    source.close()
+                with open(copy_path, 'rb') as f:
+                    return f.read()
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _pieces(self, path: str, data: bytes) -> List[Tuple[int, int]]:
+        if path.endswith(ZIP_SUFFIXES):
+            pieces = _zip_pieces(data)
+            if pieces is not None:
+                return pieces
+        return list(_fixed_pieces(data, 0, len(data)))
+
+    def snapshot(self, sources: List[str] = None) -> Dict[str, Any]:
+        """
+        Record the current state of the sources
+
+        Invoice files and the master workbook are replaced atomically when
+        written, so each file is read either before or after a save, never
+        half-written; invoice writes are not blocked meanwhile.
+
+        Args:
+            sources: Files and directories to include (DEFAULT_SOURCES)
+
+        Returns:
+            The snapshot manifest, including stats on what was stored
+        """
+        sources = sources or DEFAULT_SOURCES
+        with self._locked():
+            previous = self._latest_manifest()
+            previous_files = {entry['path']: entry for entry in previous['files']} if previous else {}
+            stats = {'files': 0, 'bytes': 0, 'reused_files': 0, 'new_chunks': 0, 'stored_bytes': 0}
+            entries = []
+
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='backup') as pool:
+                for path in self._iter_files(sources):
+                    try:
+                        stat = os.stat(path)
+                        old = previous_files.get(path)
+                        if old and not path.endswith(SQLITE_SUFFIXES) \
+                                and (old['size'], old['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+                            entries.append(old)
+                            stats['reused_files'] += 1
+                            stats['files'] += 1
+                            stats['bytes'] += old['size']
+                            continue
+                        data = self._read_file(path)
+                    except (FileNotFoundError, sqlite3.Error) as e:
+                        # Removed (or mid-creation) since it was listed
+                        logger.warning("Skipped file in backup", extra={'path': path, 'error': str(e)})
+                        continue
+
+                    pieces = self._pieces(path, data)
+                    stored = [
+                        None if end - start <= INLINE_LIMIT else pool.submit(self._store_chunk, data[start:end])
+                        for start, end in pieces
+                    ]
+                    layout = []
+                    for (start, end), future in zip(pieces, stored):
+                        if future is None:
+                            layout.append(['i', base64.b64encode(data[start:end]).decode('ascii')])
+                        else:
+                            digest, written = future.result()
+                            layout.append(['c', digest])
+                            if written:
+                                stats['new_chunks'] += 1
+                                stats['stored_bytes'] += written
+                    entries.append({
+                        'path': path,
+                        'size': len(data),
+                        'mtime_ns': stat.st_mtime_ns,
+                        'sha256': hashlib.sha256(data).hexdigest(),
+                        'pieces': layout,
+                    })
+                    stats['files'] += 1
+                    stats['bytes'] += len(data)
+
+            now = datetime.now()
+            manifest = {
+                # Sorts in creation order
+                'id': f"{now.strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:6]}",
+                'created_at': now.isoformat(timespec='seconds'),
+                'sources': sources,
+                'stats': stats,
+                'files': entries,
+            }
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            with atomic_write(os.path.join(self.snapshot_dir, f"{manifest['id']}.json")) as tmp_path:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f)
+
+        logger.info("Backup snapshot written", extra={'snapshot': manifest['id'], **stats})
+        return manifest
+
+    def list_snapshots(self) -> List[Dict[str, Any]]:
+        """Snapshots, oldest first (without their file lists)"""
+        snapshots = []
+        for snapshot_id in self._snapshot_ids():
+            manifest = self.load(snapshot_id)
+            snapshots.append({key: manifest[key] for key in ('id', 'created_at', 'stats')})
+        return snapshots
+
+    def _snapshot_ids(self) -> List[str]:
+        if not os.path.isdir(self.snapshot_dir):
+            return []
+        return sorted(name[:-5] for name in os.listdir(self.snapshot_dir) if name.endswith('.json'))
+
+    def _latest_manifest(self) -> Optional[Dict[str, Any]]:
+        ids = self._snapshot_ids()
+        return self.load(ids[-1]) if ids else None
+
+    def load(self, snapshot_id: str) -> Dict[str, Any]:
+        """
+        Manifest of a snapshot
+
+        Args:
+            snapshot_id: Snapshot ID, or 'latest'
+        """
+        if snapshot_id == 'latest':
+            ids = self._snapshot_ids()
+            if not ids:
+                raise SnapshotNotFoundError(snapshot_id)
+            snapshot_id = ids[-1]
+        path = os.path.join(self.snapshot_dir, f"{os.path.basename(snapshot_id)}.json")
+        if not os.path.exists(path):
+            raise SnapshotNotFoundError(snapshot_id)
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def restore(self, snapshot_id: str, destination: str = '.', paths: List[str] = None) -> int:
+        """
+        Write the files of a snapshot under destination
+
+        Stop the server first when restoring over the live files.
+
+        Args:
+            snapshot_id: Snapshot ID, or 'latest'
+            destination: Directory the recorded relative paths are restored into
+            paths: Only restore these recorded paths
+
+        Returns:
+            Number of files restored
+
+        Raises:
+            SnapshotNotFoundError: Unknown snapshot
+            ValueError: A chunk or restored file fails its checksum
+        """
+        manifest = self.load(snapshot_id)
+        restored = 0
+        for entry in manifest['files']:
+            if paths and entry['path'] not in paths:
+                continue
+            relative = os.path.normpath(entry['path'].lstrip('/\\'))
+            if relative.startswith('..'):
+                raise ValueError(f"Refusing to restore outside the destination: {entry['path']}")
+            target = os.path.join(destination, relative)
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+
+            digest = hashlib.sha256()
+            with atomic_write(target) as tmp_path:
+                with open(tmp_path, 'wb') as f:
+                    for kind, value in entry['pieces']:
+                        data = base64.b64decode(value) if kind == 'i' else self._read_chunk(value)
+                        digest.update(data)
+                        f.write(data)
+                if digest.hexdigest() != entry['sha256']:
+                    raise ValueError(f"Restored {entry['path']} does not match its checksum")
+            os.utime(target, ns=(entry['mtime_ns'], entry['mtime_ns']))
+            restored += 1
+
+        logger.info("Backup restored", extra={'snapshot': manifest['id'], 'files': restored, 'destination': destination})
+        return restored
+
+    def prune(self, keep: int) -> Dict[str, int]:
+        """
+        Delete all but the newest keep snapshots, and chunks no longer used
+
+        Returns:
+            Number of snapshots and chunks deleted
+        """
+        with self._locked():
+            ids = self._snapshot_ids()
+            removed = ids[:-keep] if keep > 0 else ids
+            for snapshot_id in removed:
+                os.remove(os.path.join(self.snapshot_dir, f"{snapshot_id}.json"))
+
+            used = set()
+            for snapshot_id in self._snapshot_ids():
+                for entry in self.load(snapshot_id)['files']:
+                    used.update(value for kind, value in entry['pieces'] if kind == 'c')
+            chunks = 0
+            if os.path.isdir(self.chunk_dir):
+                for directory, _, files in os.walk(self.chunk_dir):
+                    for name in files:
+                        if name not in used and not name.endswith('.tmp'):
+                            os.remove(os.path.join(directory, name))
+                            chunks += 1
+        return {'snapshots': len(removed), 'chunks': chunks}
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Incremental local backups of generated invoices")
+    parser.add_argument('--root', default='invoice_backup', help="Backup directory (default: invoice_backup)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    snapshot = commands.add_parser('snapshot', help="Take a snapshot")
+    snapshot.add_argument('paths', nargs='*', help=f"Files and directories (default: {' '.join(DEFAULT_SOURCES)})")
+    commands.add_parser('list', help="List snapshots")
+    restore = commands.add_parser('restore', help="Restore a snapshot (stop the server first)")
+    restore.add_argument('snapshot', help="Snapshot ID or 'latest'")
+    restore.add_argument('--to', default='.', help="Destination directory (default: current directory)")
+    restore.add_argument('paths', nargs='*', help="Only restore these paths")
+    prune = commands.add_parser('prune', help="Delete old snapshots and unused chunks")
+    prune.add_argument('--keep', type=int, required=True, help="Snapshots to keep")
+    args = parser.parse_args(argv)
+
+    backup = LocalBackup(args.root)
+    if args.command == 'snapshot':
+        print(json.dumps(backup.snapshot(args.paths or None)['stats']))
+    elif args.command == 'list':
+        for entry in backup.list_snapshots():
+            stats = entry['stats']
+            print(f"{entry['id']}  {entry['created_at']}  {stats['files']} files, "
+                  f"{stats['bytes']} bytes, {stats['stored_bytes']} new")
+    elif args.command == 'restore':
+        try:
+            count = backup.restore(args.snapshot, args.to, args.paths or None)
+        except SnapshotNotFoundError:
+            print(f"No snapshot {args.snapshot}", file=sys.stderr)
+            return 1
+        print(f"Restored {count} files into {args.to}")
+    else:
+        print(json.dumps(backup.prune(args.keep)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,19 +2,47 @@
 Hill Drive Invoice Automation - Refactored FastAPI Backend
 Clean, modular architecture
 """
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-import os
+import threading
+import uuid
 
 from config import settings
+from app.core.log import get_logger, request_id_var
+from app.core.static_assets import (
+    frontend_assets,
+    asset_response,
+    HASHED_CACHE_CONTROL,
+    REVALIDATE_CACHE_CONTROL
+)
 from app.routers import (
     invoices_router,
     ocr_router,
     counter_router,
-    health_router
+    health_router,
+    metrics_router,
+    reports_router
 )
+from app.services import job_service, idempotency_service, storage_service, backup_service, warm_up
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the frontend and start the job, upload and backup threads; optionally warm up services"""
+    frontend_assets.load()
+    if settings.warm_up_on_startup:
+        # Runs alongside the first requests rather than delaying startup
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    job_service.start()
+    storage_service.start()
+    idempotency_service.purge()
+    backup_service.start()
+    yield
+    job_service.stop()
+    storage_service.stop()
+    backup_service.stop()
+
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -22,12 +50,10 @@ app = FastAPI(
     description="Automated invoice generation with OCR.space integration",
     version="2.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -37,19 +63,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+logger = get_logger(__name__)
+
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """Tag every log record of a request with its X-Request-ID"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
 # Include routers
 app.include_router(health_router)
 app.include_router(invoices_router)
 app.include_router(ocr_router)
 app.include_router(counter_router)
+app.include_router(metrics_router)
+app.include_router(reports_router)
 
 
 @app.get("/", response_class=HTMLResponse)
 @app.head("/")
-async def root():
-    """Serve the frontend"""
+async def root(request: Request):
+    """Serve the frontend (from memory, precompressed)"""
     try:
-        if not os.path.exists("static/index.html"):
+        index = frontend_assets.index()
+        if index is None:
             return HTMLResponse(
                 content="""
                 <html>
@@ -64,8 +109,7 @@ async def root():
                 status_code=500
             )
         
-        with open("static/index.html", "r", encoding="utf-8") as f:
-            return HTMLResponse(content=f.read())
+        return asset_response(request, index, REVALIDATE_CACHE_CONTROL)
     except Exception as e:
         return HTMLResponse(
             content=f"""
@@ -81,6 +125,24 @@ async def root():
         )
 
 
+@app.api_route("/assets/{filename}", methods=["GET", "HEAD"], include_in_schema=False)
+async def hashed_asset(filename: str, request: Request):
+    """Content-hashed frontend assets, cacheable forever"""
+    asset = frontend_assets.by_hashed_name(filename)
+    if asset is None:
+        raise HTTPException(status_code=404, detail=f"Asset {filename} not found")
+    return asset_response(request, asset, HASHED_CACHE_CONTROL)
+
+
+@app.api_route("/static/{filename}", methods=["GET", "HEAD"], include_in_schema=False)
+async def static_file(filename: str, request: Request):
+    """Static files at their plain URLs (revalidated on every use)"""
+    asset = frontend_assets.get(filename)
+    if asset is None:
+        raise HTTPException(status_code=404, detail=f"Static file {filename} not found")
+    return asset_response(request, asset, REVALIDATE_CACHE_CONTROL)
+
+
 # Error handlers
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
@@ -98,6 +160,7 @@ async def http_exception_handler(request, exc):
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
     """General exception handler"""
+    logger.error("Unhandled error", exc_info=exc, extra={'path': request.url.path})
     return JSONResponse(
         status_code=500,
         content={
@@ -4,9 +4,87 @@ Uses OpenRouter API to access multiple AI models
 """
 
 import requests
-from typing import Dict, Any
+from typing import Dict, Any, Iterator
 import json
 from config import settings
+from app.core.metrics import stage
+from app.core.log import get_logger
+
+logger = get_logger(__name__)
+
+
+# Fields the invoice cannot be built without; a stream may stop once all have arrived
+REQUIRED_FIELDS = (
+    'customer_name',
+    'mobile_number',
+    'vehicle_name',
+    'start_datetime',
+    'end_datetime',
+    'base_rent',
+    'total_amount',
+)
+
+_decoder = json.JSONDecoder()
+
+
+def _skip_whitespace(text: str, pos: int) -> int:
+    """Return the index of the next non-whitespace character"""
+    while pos < len(text) and text[pos] in ' \t\r\n':
+        pos += 1
+    return pos
+
+
+def parse_partial_json(text: str) -> Dict[str, Any]:
+    """
+    Parse the complete top-level fields of a JSON object that is still being generated
+
+    A value is only accepted once the character following it (a comma or the
+    closing brace) has arrived, so numbers and literals cut off mid-token are
+    never reported.
+
+    Args:
+        text: JSON text received so far (markdown fences are tolerated)
+
+    Returns:
+        Dictionary of the fields that are complete
+    """
+    fields = {}
+    pos = text.find('{')
+    if pos == -1:
+        return fields
+    pos += 1
+
+    while True:
+        pos = _skip_whitespace(text, pos)
+        if pos >= len(text) or text[pos] == '}':
+            return fields
+        if text[pos] == ',':
+            pos += 1
+            continue
+
+        try:
+            key, pos = _decoder.raw_decode(text, pos)
+        except ValueError:
+            return fields
+        if not isinstance(key, str):
+            return fields
+
+        pos = _skip_whitespace(text, pos)
+        if pos >= len(text) or text[pos] != ':':
+            return fields
+        pos = _skip_whitespace(text, pos + 1)
+
+        try:
+            value, end = _decoder.raw_decode(text, pos)
+        except ValueError:
+            return fields
+
+        end = _skip_whitespace(text, end)
+        if end >= len(text) or text[end] not in ',}':
+            return fields
+
+        fields[key] = value
+        pos = end
 
 
 class OpenRouterDataExtractor:
@@ -14,15 +92,18 @@ class OpenRouterDataExtractor:
     
     def __init__(self):
         """Initialize OpenRouter API"""
+        # Shared session keeps connections alive and lets test harnesses mount adapters
+        self.session = requests.Session()
+        
         if settings.openrouter_api_key and settings.openrouter_api_key != "your_openrouter_api_key_here":
             self.api_key = settings.openrouter_api_key
             self.model = settings.openrouter_model
-            self.api_url = "https://openrouter.ai/api/v1/chat/completions"
+            self.api_url = settings.openrouter_api_url
             self.enabled = True
-            print(f"✅ OpenRouter AI enabled with model: {self.model}")
+            logger.info("OpenRouter AI enabled", extra={'model': self.model})
         else:
             self.enabled = False
-            print("⚠️  OpenRouter API key not configured. Using basic extraction.")
+            logger.warning("OpenRouter API key not configured. Using basic extraction.")
     
     def extract_invoice_data(self, ocr_text: str, user_text: str = "") -> Dict[str, Any]:
         """
@@ -41,47 +122,20 @@ class OpenRouterDataExtractor:
         try:
             prompt = self._build_extraction_prompt(ocr_text, user_text)
             
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "http://localhost:8001",
-                "X-Title": "Hill Drive Invoice Automation"
-            }
-            
-            payload = {
-                "model": self.model,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.1,  # Low temperature for consistent extraction
-                "max_tokens": 1000  # Limit tokens to avoid credit issues
-            }
-            
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            
-            response.raise_for_status()
-            result = response.json()
+            with stage('provider'):
+                response = self.session.post(
+                    self.api_url,
+                    headers=self._build_headers(),
+                    json=self._build_payload(prompt),
+                    timeout=30
+                )
+                
+                response.raise_for_status()
+                result = response.json()
             
             # Extract the response text
-            result_text = result['choices'][0]['message']['content'].strip()
-            
-            # Remove markdown code blocks if present
-            if result_text.startswith("```json"):
-                result_text = result_text[7:]
-            if result_text.startswith("```"):
-                result_text = result_text[3:]
-            if result_text.endswith("```"):
-                result_text = result_text[:-3]
-            
-            data = json.loads(result_text.strip())
+            result_text = result['choices'][0]['message']['content']
+            data = json.loads(self._strip_code_fences(result_text))
             
             # Add metadata
             data['extraction_method'] = 'openrouter'
@@ -90,9 +144,128 @@ class OpenRouterDataExtractor:
             return data
             
         except Exception as e:
-            print(f"⚠️  OpenRouter extraction failed: {e}")
+            logger.warning("OpenRouter extraction failed", extra={'error': str(e)})
             return self._fallback_extraction(ocr_text, user_text)
     
+    def stream_invoice_data(
+        self,
+        ocr_text: str,
+        user_text: str = "",
+        stop_when_complete: bool = False
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Stream invoice fields as the model generates them
+        
+        Args:
+            ocr_text: Raw text from OCR
+            user_text: Additional user-provided text
+            stop_when_complete: Close the stream as soon as all REQUIRED_FIELDS have arrived
+            
+        Yields:
+            {'event': 'field', 'field': name, 'value': value} for every completed field,
+            then a single {'event': 'complete', 'data': {...}, 'stopped_early': bool}
+        """
+        if not self.enabled:
+            data = self._fallback_extraction(ocr_text, user_text)
+            for field, value in data.items():
+                if value is not None:
+                    yield {'event': 'field', 'field': field, 'value': value}
+            yield {'event': 'complete', 'data': data, 'stopped_early': False}
+            return
+        
+        prompt = self._build_extraction_prompt(ocr_text, user_text)
+        
+        response = self.session.post(
+            self.api_url,
+            headers=self._build_headers(),
+            json=self._build_payload(prompt, stream=True),
+            timeout=30,
+            stream=True
+        )
+        
+        fields = {}
+        buffer = ""
+        stopped_early = False
+        
+        try:
+            response.raise_for_status()
+            
+            for line in response.iter_lines(decode_unicode=True):
+                # SSE comments (": OPENROUTER PROCESSING") and blank keep-alives
+                if not line or not line.startswith('data:'):
+                    continue
+                
+                chunk = line[5:].strip()
+                if chunk == '[DONE]':
+                    break
+                
+                delta = json.loads(chunk)['choices'][0].get('delta', {}).get('content')
+                if not delta:
+                    continue
+                buffer += delta
+                
+                for field, value in parse_partial_json(buffer).items():
+                    if field not in fields:
+                        fields[field] = value
+                        yield {'event': 'field', 'field': field, 'value': value}
+                
+                if stop_when_complete and all(f in fields for f in REQUIRED_FIELDS):
+                    stopped_early = True
+                    break
+        finally:
+            response.close()
+        
+        data = dict(fields)
+        if not stopped_early:
+            try:
+                data = json.loads(self._strip_code_fences(buffer))
+            except ValueError:
+                # Truncated output - keep whatever fields completed
+                pass
+        
+        # Add metadata
+        data['extraction_method'] = 'openrouter'
+        data['extraction_confidence'] = 'high'
+        
+        yield {'event': 'complete', 'data': data, 'stopped_early': stopped_early}
+    
+    def _build_headers(self) -> Dict[str, str]:
+        """Build request headers for OpenRouter"""
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "http://localhost:8001",
+            "X-Title": "Hill Drive Invoice Automation"
+        }
+    
+    def _build_payload(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        """Build chat completion payload for OpenRouter"""
+        payload = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.1,  # Low temperature for consistent extraction
+            "max_tokens": 1000  # Limit tokens to avoid credit issues
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+    
+    def _strip_code_fences(self, result_text: str) -> str:
+        """Remove markdown code blocks if present"""
+        result_text = result_text.strip()
+        if result_text.startswith("```json"):
+            result_text = result_text[7:]
+        if result_text.startswith("```"):
+            result_text = result_text[3:]
+        if result_text.endswith("```"):
+            result_text = result_text[:-3]
+        return result_text.strip()
+    
     def _build_extraction_prompt(self, ocr_text: str, user_text: str) -> str:
         """Build the extraction prompt for OpenRouter"""
         
@@ -178,50 +178,7 @@ async function generateInvoice() {
     resultContainer.style.display = 'none';
     
     try {
-        let combinedOcrText = '';
-        
-        // Process multiple files
-        if (selectedFiles.length > 1) {
-            document.getElementById('progressText').textContent = `Processing ${selectedFiles.length} files...`;
-            
-            // Extract text from all files
-            for (let i = 0; i < selectedFiles.length; i++) {
-                document.getElementById('progressText').textContent = `Processing file ${i + 1} of ${selectedFiles.length}...`;
-                
-                const formData = new FormData();
-                formData.append('file', selectedFiles[i]);
-                formData.append('language', 'eng');
-                
-                const ocrResponse = await fetch(`${API_BASE_URL}/api/ocr/extract`, {
-                    method: 'POST',
-                    body: formData
-                });
-                
-                const ocrResult = await ocrResponse.json();
-                
-                if (ocrResult.success && ocrResult.text) {
-                    combinedOcrText += `\n--- From ${selectedFiles[i].name} ---\n${ocrResult.text}\n`;
-                }
-            }
-        } else {
-            // Single file
-            document.getElementById('progressText').textContent = 'Extracting text from image...';
-            
-            const formData = new FormData();
-            formData.append('file', selectedFiles[0]);
-            formData.append('language', 'eng');
-            
-            const ocrResponse = await fetch(`${API_BASE_URL}/api/ocr/extract`, {
-                method: 'POST',
-                body: formData
-            });
-            
-            const ocrResult = await ocrResponse.json();
-            
-            if (ocrResult.success && ocrResult.text) {
-                combinedOcrText = ocrResult.text;
-            }
-        }
+        const combinedOcrText = await collectOcrText();
         
         // Combine OCR text with user text
         const userText = document.getElementById('userText').value;
@@ -267,6 +224,137 @@ async function generateInvoice() {
     }
 }
 
+// Run OCR on every selected file and combine the text
+async function collectOcrText() {
+    let combinedOcrText = '';
+    
+    for (let i = 0; i < selectedFiles.length; i++) {
+        document.getElementById('progressText').textContent = selectedFiles.length > 1
+            ? `Processing file ${i + 1} of ${selectedFiles.length}...`
+            : 'Extracting text from image...';
+        
+        const formData = new FormData();
+        formData.append('file', selectedFiles[i]);
+        formData.append('language', 'eng');
+        
+        const ocrResponse = await fetch(`${API_BASE_URL}/api/ocr/extract`, {
+            method: 'POST',
+            body: formData
+        });
+        
+        const ocrResult = await ocrResponse.json();
+        
+        if (ocrResult.success && ocrResult.text) {
+            combinedOcrText += selectedFiles.length > 1
+                ? `\n--- From ${selectedFiles[i].name} ---\n${ocrResult.text}\n`
+                : ocrResult.text;
+        }
+    }
+    
+    return combinedOcrText;
+}
+
+// Manual form inputs filled from streamed extraction fields
+const STREAM_FIELD_INPUTS = {
+    customer_name: 'customerName',
+    mobile_number: 'mobileNumber',
+    vehicle_name: 'vehicleName',
+    vehicle_number: 'vehicleNumber',
+    start_datetime: 'startDate',
+    end_datetime: 'endDate',
+    duration_days: 'durationDays',
+    base_rent: 'baseRent',
+    included_km: 'includedKm',
+    extra_km: 'extraKm',
+    extra_km_rate: 'extraKmRate',
+    total_amount: 'totalAmount',
+    advance_paid: 'advancePaid',
+    address: 'address'
+};
+
+function fillManualField(field, value) {
+    const inputId = STREAM_FIELD_INPUTS[field];
+    if (!inputId || value === null || value === undefined) return;
+    
+    const input = document.getElementById(inputId);
+    if (input.type === 'datetime-local') {
+        // "YYYY-MM-DD HH:MM" -> "YYYY-MM-DDTHH:MM"
+        input.value = String(value).replace(' ', 'T').slice(0, 16);
+    } else {
+        input.value = value;
+    }
+}
+
+// Stream AI extraction into the manual entry form as fields arrive
+async function streamToManualForm() {
+    const fillBtn = document.getElementById('fillFormBtn');
+    const btnText = fillBtn.querySelector('.btn-text');
+    const btnLoader = fillBtn.querySelector('.btn-loader');
+    const progressContainer = document.getElementById('progressContainer');
+    
+    fillBtn.disabled = true;
+    btnText.style.display = 'none';
+    btnLoader.style.display = 'inline';
+    progressContainer.style.display = 'block';
+    
+    try {
+        const ocrText = await collectOcrText();
+        
+        // Show the form so it visibly fills in while the model generates
+        document.querySelector('[data-tab=manual]').click();
+        document.getElementById('progressText').textContent = 'Extracting booking details...';
+        
+        const formData = new FormData();
+        formData.append('ocr_text', ocrText);
+        formData.append('user_text', document.getElementById('userText').value);
+        
+        const response = await fetch(`${API_BASE_URL}/api/invoice/extract-stream`, {
+            method: 'POST',
+            body: formData
+        });
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                let eventName = 'message';
+                let data = '';
+                for (const line of rawEvent.split('\n')) {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                }
+                const payload = data ? JSON.parse(data) : {};
+                
+                if (eventName === 'field') {
+                    fillManualField(payload.field, payload.value);
+                } else if (eventName === 'complete') {
+                    Object.entries(payload.data || {}).forEach(([field, value]) => fillManualField(field, value));
+                } else if (eventName === 'error') {
+                    showError(payload.error, 'manualResultContainer');
+                }
+            }
+        }
+    } catch (error) {
+        showError('Network error: ' + error.message, 'manualResultContainer');
+    } finally {
+        fillBtn.disabled = false;
+        btnText.style.display = 'inline';
+        btnLoader.style.display = 'none';
+        progressContainer.style.display = 'none';
+    }
+}
+
 // Create Manual Invoice
 async function createManualInvoice(event) {
     event.preventDefault();
@@ -0,0 +1,74 @@
+"""
+Shared test fixtures
+"""
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_customer_profiles(tmp_path, monkeypatch):
+    """Give every test its own customer profile database
+
+    Invoices created by one test would otherwise make their customers known
+    to the next, changing how those bookings are extracted.
+    """
+    from app.services import customer_service
+    monkeypatch.setattr(customer_service, 'db_path', str(tmp_path / 'customers.db'))
+    monkeypatch.setattr(customer_service, '_conn', None)
+    yield customer_service
+    customer_service.close()
+
+
+@pytest.fixture(autouse=True)
+def isolated_output(tmp_path_factory, monkeypatch):
+    """Write every test's invoices, databases, caches and invoice counter to a temporary directory
+
+    Services read their paths from settings when they are built, so the
+    singletons are pointed at tmp_path too; their connections and writers are
+    opened again there and put back afterwards. The directory is not tmp_path,
+    which tests may expect to hold only their own files.
+    """
+    import os
+    from config import settings
+    from hilldrive_excel_mapper import HillDriveExcelWriter
+    from app import services
+
+    root = tmp_path_factory.mktemp('app')
+    output_dir = str(root / 'generated_invoices')
+    os.makedirs(output_dir)
+    paths = {
+        'output_dir': output_dir,
+        'master_file_path': os.path.join(output_dir, 'all_invoices.xlsx'),
+        'index_db_path': os.path.join(output_dir, 'invoice_index.db'),
+        'sheet_cache_dir': os.path.join(output_dir, '.sheet_cache'),
+        'media_cache_dir': os.path.join(output_dir, '.media'),
+        'job_db_path': os.path.join(output_dir, 'jobs.db'),
+        'job_upload_dir': os.path.join(output_dir, 'jobs'),
+        'idempotency_db_path': os.path.join(output_dir, 'idempotency.db'),
+    }
+    for name, path in paths.items():
+        monkeypatch.setattr(settings, name, path)
+
+    counter_file = str(root / 'invoice_counter.json')
+    monkeypatch.setattr(HillDriveExcelWriter, 'counter_file', counter_file)
+    monkeypatch.setattr(services.counter_service, 'counter_file', counter_file)
+
+    stores = (
+        (services.index_service, paths['index_db_path']),
+        (services.job_service, paths['job_db_path']),
+        (services.idempotency_service, paths['idempotency_db_path']),
+    )
+    for service, db_path in stores:
+        monkeypatch.setattr(service, 'db_path', db_path)
+        monkeypatch.setattr(service, '_conn', None)
+    monkeypatch.setattr(services.index_service, 'output_dir', output_dir)
+    monkeypatch.setattr(services.job_service, 'upload_dir', paths['job_upload_dir'])
+    monkeypatch.setattr(services.storage_service, 'output_dir', output_dir)
+    monkeypatch.setattr(services.storage_service, '_backend', None)
+    monkeypatch.setattr(services.sheet_export_service, 'cache_dir', paths['sheet_cache_dir'])
+    # Writers are built again from the settings above
+    if 'writer' in vars(services.excel_service):
+        monkeypatch.delitem(vars(services.excel_service), 'writer')
+    monkeypatch.setattr(services.excel_service, '_writers', {})
+    yield
+    for service, _ in stores:
+        service.close()
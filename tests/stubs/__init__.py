@@ -0,0 +1,24 @@
+"""
+Offline stand-ins for OCR.space and OpenRouter
+
+- ReplayAdapter / replaying: record real responses into tests/fixtures/ and replay them
+- StubServer / StubConfig: local HTTP server with latency, jitter and error injection
+
+Run ``python -m tests.stubs --help`` to start stub servers from the command line.
+"""
+from .fixtures import FIXTURE_DIR, FixtureStore, request_key, service_for
+from .replay import ReplayAdapter, FixtureNotFoundError, mount_replay, replaying
+from .servers import StubConfig, StubServer
+
+__all__ = [
+    'FIXTURE_DIR',
+    'FixtureStore',
+    'request_key',
+    'service_for',
+    'ReplayAdapter',
+    'FixtureNotFoundError',
+    'mount_replay',
+    'replaying',
+    'StubConfig',
+    'StubServer'
+]
@@ -0,0 +1,56 @@
+"""
+Start local OCR.space and OpenRouter stub servers
+
+Usage:
+    python -m tests.stubs --ocr-latency-ms 1500 --llm-latency-ms 3000 --jitter-ms 400 --error-rate 0.02
+"""
+import argparse
+import time
+
+from .servers import StubConfig, StubServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR.space / OpenRouter stub servers")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--ocr-port', type=int, default=8901)
+    parser.add_argument('--llm-port', type=int, default=8902)
+    parser.add_argument('--ocr-latency-ms', type=float, default=0.0)
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--token-delay-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    def config(latency_ms):
+        return StubConfig(
+            latency_ms=latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            error_status=args.error_status,
+            token_delay_ms=args.token_delay_ms,
+            seed=args.seed
+        )
+
+    ocr = StubServer(config(args.ocr_latency_ms), host=args.host, port=args.ocr_port).start()
+    llm = StubServer(config(args.llm_latency_ms), host=args.host, port=args.llm_port).start()
+
+    print("Stub servers running. Point the app at them with:")
+    print(f"  OCR_SPACE_API_URL={ocr.ocr_space_url}")
+    print(f"  OPENROUTER_API_URL={llm.openrouter_url}")
+    print("  OPENROUTER_API_KEY=stub")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ocr.stop()
+        llm.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Captured HTTP interactions for OCR.space and OpenRouter
+
+Each fixture is one JSON file holding the request key and the response:
+
+    {
+      "service": "ocr_space",
+      "request": {"method": "POST", "path": "/parse/image", "key": "..."},
+      "response": {"status": 200, "headers": {...}, "body": "..."}
+    }
+
+Only a hash of the request body is stored, so recorded fixtures never
+contain API keys or uploaded images.
+"""
+import hashlib
+import json
+import os
+import re
+from typing import Dict, Any, Optional
+from urllib.parse import urlsplit
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'fixtures')
+
+# Form fields that carry credentials and must not influence the request key
+_SECRET_FIELD = re.compile(rb'(name="apikey"\r\n\r\n)[^\r]*|(apikey=)[^&]*')
+
+
+def service_for(url: str) -> str:
+    """Map a request URL to the service whose fixtures answer it"""
+    path = urlsplit(url).path
+    if path.endswith('/parse/image'):
+        return 'ocr_space'
+    if path.endswith('/chat/completions'):
+        return 'openrouter'
+    return 'other'
+
+
+def request_key(method: str, url: str, body: Optional[bytes], content_type: str = '') -> str:
+    """
+    Build a stable key for a request
+
+    The host is ignored so fixtures recorded against the real APIs also answer
+    requests sent to the local stub server. Multipart boundaries and API keys
+    are normalised away.
+    """
+    body = body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+
+    if 'boundary=' in content_type:
+        boundary = content_type.split('boundary=', 1)[1].strip('"').encode('utf-8')
+        body = body.replace(boundary, b'BOUNDARY')
+    body = _SECRET_FIELD.sub(lambda m: m.group(1) or m.group(2), body)
+
+    digest = hashlib.sha256()
+    digest.update(f"{method.upper()} {urlsplit(url).path}\n".encode('utf-8'))
+    digest.update(body)
+    return digest.hexdigest()[:16]
+
+
+class FixtureStore:
+    """Load and save captured interactions under tests/fixtures/<service>/"""
+
+    def __init__(self, fixture_dir: str = FIXTURE_DIR):
+        self.fixture_dir = fixture_dir
+        self._cache: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def find(self, service: str, key: str) -> Optional[Dict[str, Any]]:
+        """Return the fixture recorded for this request key, if any"""
+        return self._load(service).get(key)
+
+    def default(self, service: str) -> Optional[Dict[str, Any]]:
+        """Return the first fixture of a service (used for unmatched requests)"""
+        fixtures = self._load(service)
+        if not fixtures:
+            return None
+        return fixtures[sorted(fixtures)[0]]
+
+    def save(self, service: str, key: str, method: str, url: str,
+             status: int, headers: Dict[str, str], body: str) -> str:
+        """Save a captured interaction and return its path"""
+        fixture = {
+            'service': service,
+            'request': {
+                'method': method.upper(),
+                'path': urlsplit(url).path,
+                'key': key
+            },
+            'response': {
+                'status': status,
+                'headers': {'Content-Type': headers.get('Content-Type', 'application/json')},
+                'body': body
+            }
+        }
+
+        service_dir = os.path.join(self.fixture_dir, service)
+        os.makedirs(service_dir, exist_ok=True)
+        path = os.path.join(service_dir, f"{key}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(fixture, f, indent=2, ensure_ascii=False)
+
+        self._load(service)[key] = fixture
+        return path
+
+    def _load(self, service: str) -> Dict[str, Dict[str, Any]]:
+        """Index the fixtures of a service by request key"""
+        if service not in self._cache:
+            fixtures = {}
+            service_dir = os.path.join(self.fixture_dir, service)
+            if os.path.isdir(service_dir):
+                for filename in sorted(os.listdir(service_dir)):
+                    if not filename.endswith('.json'):
+                        continue
+                    with open(os.path.join(service_dir, filename), 'r', encoding='utf-8') as f:
+                        fixture = json.load(f)
+                    fixtures[fixture['request']['key']] = fixture
+            self._cache[service] = fixtures
+        return self._cache[service]
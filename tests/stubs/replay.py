@@ -0,0 +1,117 @@
+"""
+Record/replay transport for OCRService and OpenRouterDataExtractor
+
+Both services send requests through a ``requests.Session``; mounting a
+ReplayAdapter on that session either captures live responses into
+tests/fixtures/ (mode='record') or answers from them without touching the
+network (mode='replay').
+"""
+import io
+from contextlib import contextmanager
+from typing import Iterator
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from .fixtures import FIXTURE_DIR, FixtureStore, request_key, service_for
+
+
+class FixtureNotFoundError(LookupError):
+    """Raised in strict replay mode when a request was never recorded"""
+
+
+class ReplayAdapter(BaseAdapter):
+    """Transport adapter that records or replays HTTP interactions"""
+
+    def __init__(self, fixture_dir: str = FIXTURE_DIR, mode: str = 'replay', strict: bool = False):
+        """
+        Args:
+            fixture_dir: Directory holding one sub-directory per service
+            mode: 'record' to call the real API and save responses, 'replay' to serve them
+            strict: In replay mode, fail on unrecorded requests instead of
+                answering with the service's default fixture
+        """
+        super().__init__()
+        if mode not in ('record', 'replay'):
+            raise ValueError("mode must be 'record' or 'replay'")
+
+        self.mode = mode
+        self.strict = strict
+        self.store = FixtureStore(fixture_dir)
+        self._live = HTTPAdapter()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        service = service_for(request.url)
+        key = request_key(
+            request.method,
+            request.url,
+            request.body,
+            request.headers.get('Content-Type', '')
+        )
+
+        if self.mode == 'record':
+            response = self._live.send(
+                request, stream=stream, timeout=timeout,
+                verify=verify, cert=cert, proxies=proxies
+            )
+            # Reading .content keeps the body available to the caller, streamed or not
+            self.store.save(
+                service, key, request.method, request.url,
+                response.status_code, response.headers, response.content.decode('utf-8')
+            )
+            return response
+
+        fixture = self.store.find(service, key)
+        if fixture is None and not self.strict:
+            fixture = self.store.default(service)
+        if fixture is None:
+            raise FixtureNotFoundError(f"No fixture recorded for {request.method} {request.url} ({key})")
+
+        return self._build_response(request, fixture['response'])
+
+    def close(self):
+        self._live.close()
+
+    def _build_response(self, request, recorded) -> requests.Response:
+        """Turn a recorded response into a requests.Response"""
+        response = requests.Response()
+        response.status_code = recorded['status']
+        response.headers = CaseInsensitiveDict(recorded['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(recorded['body'].encode('utf-8'))
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+
+def mount_replay(service, adapter: ReplayAdapter) -> ReplayAdapter:
+    """Route every request made by a service's session through the adapter"""
+    service.session.mount('http://', adapter)
+    service.session.mount('https://', adapter)
+    return adapter
+
+
+@contextmanager
+def replaying(*services, fixture_dir: str = FIXTURE_DIR, mode: str = 'replay',
+              strict: bool = False) -> Iterator[ReplayAdapter]:
+    """
+    Temporarily record or replay the HTTP traffic of the given services
+
+    Example:
+        with replaying(ocr_service, openrouter_extractor):
+            client.post('/api/invoice/create-from-ocr', ...)
+    """
+    adapter = ReplayAdapter(fixture_dir, mode=mode, strict=strict)
+    previous = [(service, service.session) for service in services]
+    for service in services:
+        service.session = requests.Session()
+        mount_replay(service, adapter)
+    try:
+        yield adapter
+    finally:
+        for service, session in previous:
+            service.session.close()
+            service.session = session
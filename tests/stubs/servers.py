@@ -0,0 +1,166 @@
+"""
+Local stub HTTP server for OCR.space and OpenRouter
+
+Answers ``/parse/image`` and ``/api/v1/chat/completions`` from the captured
+fixtures with configurable latency, jitter and error injection, so the invoice
+pipeline can be load-tested without network access or API quota.
+"""
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any
+
+from .fixtures import FIXTURE_DIR, FixtureStore, request_key, service_for
+
+
+@dataclass
+class StubConfig:
+    """Latency and failure behaviour of a stub server"""
+    latency_ms: float = 0.0       # Base delay before responding
+    jitter_ms: float = 0.0        # Uniform +/- variation added to the base delay
+    error_rate: float = 0.0       # Fraction of requests answered with error_status
+    error_status: int = 503
+    token_delay_ms: float = 0.0   # Delay between streamed completion chunks
+    chunk_size: int = 16          # Characters per streamed completion chunk
+    seed: Optional[int] = None    # Seed for reproducible jitter and errors
+
+    def delay_seconds(self, rng: random.Random) -> float:
+        """Draw the response delay for one request"""
+        jitter = rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server_version = 'HillDriveStub/1.0'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        self.server.stub.handle(self, body)
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+
+class StubServer:
+    """Threaded stub server serving OCR.space and OpenRouter responses"""
+
+    def __init__(self, config: Optional[StubConfig] = None, fixture_dir: str = FIXTURE_DIR,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.config = config or StubConfig()
+        self.store = FixtureStore(fixture_dir)
+        self.request_count = 0
+        self.error_count = 0
+
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def ocr_space_url(self) -> str:
+        return f"{self.url}/parse/image"
+
+    @property
+    def openrouter_url(self) -> str:
+        return f"{self.url}/api/v1/chat/completions"
+
+    def start(self) -> 'StubServer':
+        """Serve requests on a background thread"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Shut the server down"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> 'StubServer':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, handler: BaseHTTPRequestHandler, body: bytes):
+        """Answer one request after the configured delay"""
+        with self._lock:
+            self.request_count += 1
+            delay = self.config.delay_seconds(self._rng)
+            failed = self._rng.random() < self.config.error_rate
+            if failed:
+                self.error_count += 1
+
+        time.sleep(delay)
+
+        if failed:
+            self._send(handler, self.config.error_status, 'application/json',
+                       json.dumps({'error': {'message': 'Injected stub failure'}}))
+            return
+
+        service = service_for(handler.path)
+        key = request_key('POST', handler.path, body, handler.headers.get('Content-Type', ''))
+        fixture = self.store.find(service, key) or self.store.default(service)
+        if fixture is None:
+            self._send(handler, 404, 'application/json',
+                       json.dumps({'error': {'message': f'No fixture for {handler.path}'}}))
+            return
+
+        recorded = fixture['response']
+        if service == 'openrouter' and self._wants_stream(body):
+            self._send_stream(handler, recorded)
+        else:
+            self._send(handler, recorded['status'],
+                       recorded['headers'].get('Content-Type', 'application/json'),
+                       recorded['body'])
+
+    def _wants_stream(self, body: bytes) -> bool:
+        try:
+            return bool(json.loads(body or b'{}').get('stream'))
+        except ValueError:
+            return False
+
+    def _send(self, handler, status: int, content_type: str, body: str):
+        payload = body.encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def _send_stream(self, handler, recorded: Dict[str, Any]):
+        """Replay a completion as OpenRouter-style server-sent events"""
+        handler.send_response(recorded['status'])
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.end_headers()
+
+        if recorded['headers'].get('Content-Type', '').startswith('text/event-stream'):
+            # Captured from a streamed request - send it back verbatim
+            handler.wfile.write(recorded['body'].encode('utf-8'))
+            return
+
+        content = json.loads(recorded['body'])['choices'][0]['message']['content']
+        handler.wfile.write(b': OPENROUTER PROCESSING\n\n')
+
+        size = max(1, self.config.chunk_size)
+        for i in range(0, len(content), size):
+            chunk = {'choices': [{'index': 0, 'delta': {'content': content[i:i + size]}}]}
+            handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            handler.wfile.flush()
+            if self.config.token_delay_ms:
+                time.sleep(self.config.token_delay_ms / 1000)
+
+        handler.wfile.write(b'data: [DONE]\n\n')
@@ -4,6 +4,7 @@ Integration tests for API endpoints
 import pytest
 from fastapi.testclient import TestClient
 from main_new import app
+from app.routers.invoices import XLSX_MEDIA_TYPE
 
 client = TestClient(app)
 
@@ -22,6 +23,28 @@ class TestHealthEndpoints:
         assert 'ocr_service' in data
         assert 'ai_service' in data
     
+    def test_master_file_health(self, tmp_path, monkeypatch):
+        """The master workbook check reports missing and damaged files"""
+        from config import settings
+        
+        monkeypatch.setattr(settings, 'master_file_path', str(tmp_path / 'all.xlsx'))
+        assert client.get("/health/master").json() == {"exists": False, "ok": True}
+        
+        (tmp_path / 'all.xlsx').write_bytes(b'PK\x03\x04truncated')
+        data = client.get("/health/master", params={"deep": True}).json()
+        assert data['exists'] is True
+        assert data['ok'] is False
+        assert data['errors']
+    
+    def test_storage_health(self):
+        """The storage status lists the backend and upload states"""
+        response = client.get("/health/storage")
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data['backend'] == 'local'
+        assert isinstance(data['uploads'], dict)
+    
     def test_static_files_check(self):
         """Test /test-static endpoint"""
         response = client.get("/test-static")
@@ -31,6 +54,76 @@ class TestHealthEndpoints:
         assert 'static_folder_exists' in data
 
 
+class TestFrontendAssets:
+    """Test in-memory, precompressed frontend serving"""
+    
+    def test_index_uses_hashed_assets(self):
+        """index.html is compressed and links content-hashed assets"""
+        import re
+        response = client.get("/", headers={"Accept-Encoding": "gzip"})
+        
+        assert response.status_code == 200
+        assert response.headers['content-encoding'] == 'gzip'
+        assert response.headers['cache-control'] == 'public, no-cache'
+        assert '/static/style.css' not in response.text
+        assert re.search(r'href="/assets/style\.[0-9a-f]{10}\.css"', response.text)
+    
+    def test_hashed_asset_is_immutable(self):
+        """Hashed assets are cacheable forever and revalidate to 304"""
+        import re
+        url = re.search(r'src="(/assets/script\.[0-9a-f]{10}\.js)"', client.get("/").text).group(1)
+        
+        response = client.get(url)
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['cache-control']
+        assert 'streamToManualForm' in response.text
+        
+        cached = client.get(url, headers={"If-None-Match": response.headers['etag']})
+        assert cached.status_code == 304
+    
+    def test_stale_hash_and_plain_static(self):
+        """Outdated hashes 404; plain /static URLs still work"""
+        assert client.get("/assets/script.0000000000.js").status_code == 404
+        assert client.get("/static/car-viewer.html").status_code == 200
+        assert client.get("/static/../config.py").status_code == 404
+
+
+class TestMetricsEndpoint:
+    """Test Prometheus metrics endpoint"""
+    
+    def test_metrics_after_invoice(self):
+        """Stage histograms are exposed after an invoice is created"""
+        client.post("/api/invoice/create", json={
+            "customer_name": "Metrics Customer",
+            "mobile_number": "9999888877",
+            "total_amount": 1000
+        })
+        
+        response = client.get("/metrics")
+        
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/plain')
+        assert '# TYPE hilldrive_stage_duration_seconds histogram' in response.text
+        assert 'hilldrive_stage_duration_seconds_count{stage="fill"}' in response.text
+        assert 'hilldrive_stage_duration_seconds_bucket{stage="save",le="+Inf"}' in response.text
+
+
+class TestRequestId:
+    """Test request ID propagation"""
+    
+    def test_request_id_echoed(self):
+        """A client-supplied X-Request-ID is returned unchanged"""
+        response = client.get("/health", headers={"X-Request-ID": "req-42"})
+        
+        assert response.headers['X-Request-ID'] == 'req-42'
+    
+    def test_request_id_generated(self):
+        """Requests without an ID get one assigned"""
+        response = client.get("/health")
+        
+        assert response.headers['X-Request-ID']
+
+
 class TestCounterEndpoints:
     """Test invoice counter endpoints"""
     
@@ -58,6 +151,171 @@ class TestInvoiceEndpoints:
         assert 'count' in data
         assert isinstance(data['invoices'], list)
     
+    def test_list_invoices_paginated(self):
+        """Pages are linked by next_cursor"""
+        for name in ("Page Customer A", "Page Customer B"):
+            client.post("/api/invoice/create", json={"customer_name": name, "total_amount": 500})
+        
+        first = client.get("/api/invoice/list", params={"limit": 1}).json()
+        assert first['count'] == 1
+        assert first['total'] >= 2
+        assert first['next_cursor']
+        
+        second = client.get("/api/invoice/list", params={"limit": 1, "cursor": first['next_cursor']}).json()
+        assert second['invoices'][0]['invoice_id'] != first['invoices'][0]['invoice_id']
+    
+    def test_search_invoices(self):
+        """Created invoices can be found by name and phone"""
+        client.post("/api/invoice/create", json={
+            "customer_name": "Searchable Zephyr Travels",
+            "mobile_number": "+91 70000 12345",
+            "vehicle_number": "RJ 14 ZZ 9999",
+            "total_amount": 4321
+        })
+        
+        response = client.get("/api/invoice/search", params={"name": "zephyr", "phone": "7000012345"})
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data['count'] >= 1
+        assert data['invoices'][0]['customer_name'] == "Searchable Zephyr Travels"
+        assert data['invoices'][0]['vehicle_number'] == "RJ 14 ZZ 9999"
+        assert 'query_time_ms' in data
+    
+    def test_index_total_without_booking_total(self):
+        """An invoice priced from base_rent is indexed with the total it shows"""
+        from app.services import index_service
+        
+        response = client.post("/api/invoice/create", json={"customer_name": "Rent Only Customer", "base_rent": 3000})
+        entry = index_service.get(response.json()['invoice_id'])
+        
+        assert entry['total_amount'] > 0
+        assert entry['total_amount'] == pytest.approx(entry['taxable_amount'] + entry['cgst'] + entry['sgst'])
+    
+    def test_download_single_invoice_sheet(self, monkeypatch, tmp_path):
+        """In master mode a download holds only the requested invoice"""
+        import io
+        import openpyxl
+        from config import settings
+        from app.services import excel_service, sheet_export_service
+        
+        master = str(tmp_path / 'all_invoices.xlsx')
+        monkeypatch.setattr(settings, 'use_master_file', True)
+        monkeypatch.setattr(settings, 'master_file_path', master)
+        monkeypatch.setattr(excel_service.writer, 'master_file', master)
+        monkeypatch.setattr(sheet_export_service, 'cache_dir', str(tmp_path / 'cache'))
+        
+        ids = []
+        for name in ("Sheet Customer One", "Sheet Customer Two"):
+            response = client.post("/api/invoice/create", json={"customer_name": name, "total_amount": 700})
+            ids.append(response.json()['invoice_id'])
+        
+        response = client.get(f"/api/invoice/download/{ids[1]}")
+        assert response.status_code == 200
+        wb = openpyxl.load_workbook(io.BytesIO(response.content))
+        assert len(wb.sheetnames) == 1
+        
+        master_response = client.get("/api/invoice/download/master")
+        assert len(openpyxl.load_workbook(io.BytesIO(master_response.content)).sheetnames) >= 2
+        
+        assert client.get("/api/invoice/download/HD-unknown").status_code == 404
+    
+    def test_template_master_downloads(self, monkeypatch, tmp_path):
+        """Invoices of another template are served from that template's master file"""
+        import csv
+        import io
+        import json
+        import os
+        import openpyxl
+        from config import settings
+        from app.core.templates import TemplateRegistry
+        from app.services import excel_service, sheet_export_service
+        
+        mapping = json.load(open('templates/hilldrive.json'))
+        mapping['template'] = os.path.abspath('inn sample.xlsx')
+        (tmp_path / 'branch.json').write_text(json.dumps(mapping))
+        monkeypatch.setattr(excel_service, 'templates', TemplateRegistry(str(tmp_path)))
+        monkeypatch.setattr(excel_service, '_writers', {})
+        monkeypatch.setattr(settings, 'use_master_file', True)
+        monkeypatch.setattr(settings, 'master_file_path', str(tmp_path / 'all_invoices.xlsx'))
+        monkeypatch.setattr(excel_service.writer, 'master_file', str(tmp_path / 'all_invoices.xlsx'))
+        monkeypatch.setattr(sheet_export_service, 'cache_dir', str(tmp_path / 'cache'))
+        
+        response = client.post(
+            "/api/invoice/create", json={"customer_name": "Branch Customer", "total_amount": 800, "template": "branch"}
+        )
+        invoice_id = response.json()['invoice_id']
+        assert response.json()['file_path'].endswith('all_invoices_branch.xlsx')
+        
+        download = client.get(f"/api/invoice/download/{invoice_id}")
+        assert download.status_code == 200
+        assert len(openpyxl.load_workbook(io.BytesIO(download.content)).sheetnames) == 1
+        
+        master = client.get("/api/invoice/download/master", params={"template": "branch"})
+        assert master.status_code == 200
+        assert 'all_invoices_branch.xlsx' in master.headers['content-disposition']
+        
+        ledger = client.get("/api/invoice/ledger", params={"format": "csv", "template": "branch"})
+        assert [row['customer_name'] for row in csv.DictReader(io.StringIO(ledger.text))] == ["Branch Customer"]
+        assert client.get("/health/master", params={"template": "branch"}).json()['exists'] is True
+        
+        assert client.get("/api/invoice/ledger", params={"template": "no-such-branch"}).status_code == 404
+        assert client.get("/health/master", params={"template": "../etc"}).status_code == 404
+    
+    def test_delete_invoice(self, monkeypatch, tmp_path):
+        """Separate invoices are deleted; master-file sheets are refused"""
+        from config import settings
+        from app.services import excel_service
+        
+        monkeypatch.setattr(settings, 'use_master_file', False)
+        monkeypatch.setattr(settings, 'output_dir', str(tmp_path))
+        separate = client.post("/api/invoice/create", json={"customer_name": "Delete Me", "total_amount": 300})
+        invoice_id = separate.json()['invoice_id']
+        assert client.delete(f"/api/invoice/delete/{invoice_id}").status_code == 200
+        assert client.delete(f"/api/invoice/delete/{invoice_id}").status_code == 404
+        
+        master = str(tmp_path / 'all_invoices.xlsx')
+        monkeypatch.setattr(settings, 'use_master_file', True)
+        monkeypatch.setattr(settings, 'master_file_path', master)
+        monkeypatch.setattr(excel_service.writer, 'master_file', master)
+        sheet = client.post("/api/invoice/create", json={"customer_name": "Keep Me", "total_amount": 400})
+        invoice_id = sheet.json()['invoice_id']
+        
+        response = client.delete(f"/api/invoice/delete/{invoice_id}")
+        assert response.status_code == 409
+        assert client.get(f"/api/invoice/download/{invoice_id}").status_code == 200
+    
+    def test_download_ledger(self, monkeypatch, tmp_path):
+        """The ledger lists every master-file invoice"""
+        import csv
+        import io
+        from config import settings
+        from app.services import excel_service
+        
+        master = str(tmp_path / 'all_invoices.xlsx')
+        monkeypatch.setattr(settings, 'use_master_file', True)
+        monkeypatch.setattr(settings, 'master_file_path', master)
+        monkeypatch.setattr(excel_service.writer, 'master_file', master)
+        
+        assert client.get("/api/invoice/ledger").status_code == 404
+        for name in ("Ledger Customer One", "Ledger Customer Two"):
+            client.post("/api/invoice/create", json={"customer_name": name, "total_amount": 1050})
+        
+        response = client.get("/api/invoice/ledger", params={"format": "csv"})
+        assert response.status_code == 200
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [row['customer_name'] for row in rows] == ["Ledger Customer One", "Ledger Customer Two"]
+        assert rows[0]['cgst'] == '25.0'
+        
+        xlsx = client.get("/api/invoice/ledger")
+        assert xlsx.headers['content-type'] == XLSX_MEDIA_TYPE
+    
+    def test_list_invoices_invalid_sort(self):
+        """Unknown sort columns are rejected"""
+        response = client.get("/api/invoice/list", params={"sort": "file_path"})
+        
+        assert response.status_code == 400
+    
     def test_create_invoice_manual(self):
         """Test POST /api/invoice/create"""
         invoice_data = {
@@ -78,6 +336,222 @@ class TestInvoiceEndpoints:
         assert data['success'] == True
         assert 'invoice_id' in data
         assert 'download_url' in data
+        assert {'fill', 'save', 'storage'} <= set(data['stage_timings_ms'])
+
+    
+    def test_create_invoice_idempotent(self):
+        """A retried request with the same Idempotency-Key creates one invoice"""
+        import uuid
+        from app.services import index_service
+        
+        key = uuid.uuid4().hex
+        invoice_data = {"customer_name": "Double Tap Customer", "total_amount": 1500}
+        
+        first = client.post("/api/invoice/create", json=invoice_data, headers={"Idempotency-Key": key})
+        count = index_service.count()
+        retry = client.post("/api/invoice/create", json=invoice_data, headers={"Idempotency-Key": key})
+        
+        assert retry.status_code == 200
+        assert retry.headers['Idempotent-Replayed'] == 'true'
+        assert retry.json()['invoice_id'] == first.json()['invoice_id']
+        assert index_service.count() == count
+        
+        changed = client.post(
+            "/api/invoice/create",
+            json={**invoice_data, "total_amount": 1600},
+            headers={"Idempotency-Key": key}
+        )
+        assert changed.status_code == 422
+    
+    def test_create_invoice_unknown_template(self):
+        """Bookings naming an unregistered template are rejected"""
+        response = client.post(
+            "/api/invoice/create", json={"customer_name": "Branch Customer", "template": "no-such-branch"}
+        )
+        
+        assert response.status_code == 400
+        assert 'no-such-branch' in response.json()['error']
+    
+    def test_extract_stream(self):
+        """Test POST /api/invoice/extract-stream emits SSE events"""
+        response = client.post(
+            "/api/invoice/extract-stream",
+            data={"ocr_text": "Cx no: 9876543210", "user_text": ""}
+        )
+        
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/event-stream')
+        assert 'event: field' in response.text
+        assert 'event: complete' in response.text
+
+
+class TestInvoiceJobs:
+    """Test queued OCR-to-invoice jobs"""
+    
+    def test_job_lifecycle(self, monkeypatch, tmp_path):
+        """A job is accepted at once, then polled and streamed to completion"""
+        from config import settings
+        from app.routers import invoices
+        from app.services import ocr_service
+        from app.services.job_service import JobService, _create_from_ocr
+        
+        jobs = JobService(str(tmp_path / 'jobs.db'), str(tmp_path / 'uploads'), workers=0)
+        jobs.register('create-from-ocr', _create_from_ocr)
+        monkeypatch.setattr(invoices, 'job_service', jobs)
+        monkeypatch.setattr(settings, 'use_master_file', False)
+        monkeypatch.setattr(settings, 'output_dir', str(tmp_path))
+        monkeypatch.setattr(settings, 'use_openrouter', False)
+        monkeypatch.setattr(ocr_service, 'extract_text_from_file', lambda content, language='eng': {
+            'success': True, 'text': "Customer name: Job Customer\nCx no: 9876543210"
+        })
+        
+        response = client.post(
+            "/api/invoice/jobs",
+            files={"file": ("booking.jpg", b"not really an image", "image/jpeg")},
+            data={"user_text": "Total:-2500"}
+        )
+        assert response.status_code == 202
+        job = response.json()
+        assert job['status'] == 'queued'
+        
+        assert jobs.run_pending() == 1
+        
+        status = client.get(job['status_url']).json()
+        assert status['status'] == 'done'
+        assert status['result']['extracted_data']['mobile_number'] == "9876543210"
+        assert client.get(status['result']['download_url']).status_code == 200
+        
+        events = client.get(job['events_url'])
+        assert events.headers['content-type'].startswith('text/event-stream')
+        assert 'event: done' in events.text
+    
+    def test_job_stream_ends_when_job_deleted(self, monkeypatch, tmp_path):
+        """A stream whose job is purged meanwhile ends with an error event"""
+        from app.routers import invoices
+        from app.services.job_service import JobService
+        
+        jobs = JobService(str(tmp_path / 'jobs.db'), str(tmp_path / 'uploads'), workers=0)
+        jobs.register('echo', lambda params, files, progress: {})
+        job = jobs.submit('echo', {}, [b'x'])
+        lookups = iter([job, None])
+        monkeypatch.setattr(jobs, 'get', lambda job_id: next(lookups))
+        monkeypatch.setattr(invoices, 'job_service', jobs)
+        
+        events = client.get(f"/api/invoice/jobs/{job['id']}/events")
+        
+        assert events.status_code == 200
+        assert 'event: error' in events.text
+    
+    def test_unknown_job(self):
+        """Unknown job IDs are 404s"""
+        assert client.get("/api/invoice/jobs/nope").status_code == 404
+        assert client.get("/api/invoice/jobs/nope/events").status_code == 404
+
+
+class TestDownloadCaching:
+    """Test conditional and range requests on invoice downloads"""
+    
+    def _separate_invoice(self, monkeypatch, tmp_path):
+        from config import settings
+        monkeypatch.setattr(settings, 'use_master_file', False)
+        monkeypatch.setattr(settings, 'output_dir', str(tmp_path))
+        response = client.post("/api/invoice/create", json={"customer_name": "Cache Customer", "total_amount": 900})
+        return response.json()['invoice_id']
+    
+    def test_separate_invoice_is_immutable(self, monkeypatch, tmp_path):
+        """Separate invoices get a strong ETag and a long-lived cache policy"""
+        invoice_id = self._separate_invoice(monkeypatch, tmp_path)
+        
+        response = client.get(f"/api/invoice/download/{invoice_id}")
+        
+        assert response.status_code == 200
+        assert response.headers['etag'].startswith('"')
+        assert 'immutable' in response.headers['cache-control']
+        assert response.headers['accept-ranges'] == 'bytes'
+    
+    def test_if_none_match_returns_304(self, monkeypatch, tmp_path):
+        """A matching If-None-Match skips the body"""
+        invoice_id = self._separate_invoice(monkeypatch, tmp_path)
+        etag = client.get(f"/api/invoice/download/{invoice_id}").headers['etag']
+        
+        response = client.get(f"/api/invoice/download/{invoice_id}", headers={"If-None-Match": etag})
+        
+        assert response.status_code == 304
+        assert response.content == b''
+        assert response.headers['etag'] == etag
+    
+    def test_range_request(self, monkeypatch, tmp_path):
+        """Byte ranges are served for resumable downloads"""
+        invoice_id = self._separate_invoice(monkeypatch, tmp_path)
+        full = client.get(f"/api/invoice/download/{invoice_id}")
+        
+        response = client.get(
+            f"/api/invoice/download/{invoice_id}",
+            headers={"Range": "bytes=100-", "If-Range": full.headers['etag']}
+        )
+        
+        assert response.status_code == 206
+        assert response.content == full.content[100:]
+    
+    def test_master_extract_etag_stable(self, monkeypatch, tmp_path):
+        """Extract ETags survive unrelated master changes; the master must revalidate"""
+        from config import settings
+        from app.services import excel_service, sheet_export_service
+        master = str(tmp_path / 'all_invoices.xlsx')
+        monkeypatch.setattr(settings, 'use_master_file', True)
+        monkeypatch.setattr(settings, 'master_file_path', master)
+        monkeypatch.setattr(excel_service.writer, 'master_file', master)
+        monkeypatch.setattr(sheet_export_service, 'cache_dir', str(tmp_path / 'cache'))
+        
+        invoice_id = client.post("/api/invoice/create", json={"customer_name": "Stable", "total_amount": 1}).json()['invoice_id']
+        # openpyxl normalises a sheet the first time the master is re-saved
+        client.post("/api/invoice/create", json={"customer_name": "Another", "total_amount": 2})
+        before = client.get(f"/api/invoice/download/{invoice_id}")
+        client.post("/api/invoice/create", json={"customer_name": "Third", "total_amount": 3})
+        after = client.get(f"/api/invoice/download/{invoice_id}", headers={"If-None-Match": before.headers['etag']})
+        
+        assert after.status_code == 304
+        assert client.get("/api/invoice/download/master").headers['cache-control'] == 'private, no-cache'
+
+
+class TestReports:
+    """Test streamed report workbooks"""
+    
+    def test_gst_report(self):
+        """The month's invoices are listed with a totals row"""
+        import io
+        from datetime import date
+        import openpyxl
+        
+        client.post("/api/invoice/create", json={"customer_name": "GST Report Customer", "total_amount": 2100})
+        
+        response = client.get("/api/reports/gst", params={"month": date.today().strftime('%Y-%m')})
+        
+        assert response.status_code == 200
+        assert 'gst_report_' in response.headers['content-disposition']
+        rows = list(openpyxl.load_workbook(io.BytesIO(response.content)).active.values)
+        assert rows[0][:2] == ('Invoice No.', 'Invoice Date')
+        customer = next(row for row in rows if row[2] == "GST Report Customer")
+        assert customer[4:8] == (2000.0, 50.0, 50.0, 2100.0)
+        assert rows[-1][0].startswith('Total (')
+        assert rows[-1][7] == round(sum(row[7] for row in rows[1:-1]), 2)
+    
+    def test_invalid_month(self):
+        """Months must be YYYY-MM"""
+        assert client.get("/api/reports/gst", params={"month": "2026-13"}).status_code == 400
+        assert client.get("/api/reports/invoices", params={"month": "June"}).status_code == 400
+        assert client.get("/api/reports/gst", params={"month": "0000-01"}).status_code == 400
+    
+    def test_amount_audit(self):
+        """Indexed invoices pass the audit at the template's GST rate"""
+        client.post("/api/invoice/create", json={"customer_name": "Audit Customer", "total_amount": 2100})
+        
+        report = client.get("/api/reports/audit").json()
+        changed = client.get("/api/reports/audit", params={"gst_rate": 0.18}).json()
+        
+        assert report['checked'] >= 1
+        assert 'cgst' not in report['mismatches']
+        assert changed['mismatches']['cgst'] >= 1
 
 
 class TestOCREndpoints:
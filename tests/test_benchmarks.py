@@ -0,0 +1,52 @@
+"""
+Tests for the benchmark harness
+"""
+from benchmarks.harness import compare, measure, summarize
+from benchmarks.startup import parse_importtime, slowest
+
+
+class TestBenchmarkHarness:
+    """Test timing summaries and run comparison"""
+    
+    def test_summarize(self):
+        """Statistics are reported in milliseconds"""
+        stats = summarize([0.001, 0.002, 0.003, 0.004])
+        
+        assert stats['rounds'] == 4
+        assert stats['min_ms'] == 1.0
+        assert stats['median_ms'] == 2.5
+        assert stats['p95_ms'] == 4.0
+        assert stats['max_ms'] == 4.0
+    
+    def test_measure_excludes_setup(self):
+        """Setup runs before every round and feeds the function"""
+        calls = []
+        stats = measure(calls.append, setup=lambda: (len(calls),), rounds=3, warmup=1)
+        
+        assert stats['rounds'] == 3
+        assert calls == [0, 1, 2, 3]
+    
+    def test_compare_flags_regressions(self):
+        """Median slowdowns above the threshold are regressions"""
+        baseline = {'results': {'write': {'median_ms': 100.0}, 'extract': {'median_ms': 1.0}}}
+        current = {'results': {'write': {'median_ms': 125.0}, 'extract': {'median_ms': 1.05}, 'new': {'median_ms': 5.0}}}
+        
+        rows = {row['name']: row for row in compare(baseline, current, threshold=0.10)}
+        
+        assert rows['write']['regression'] is True
+        assert rows['extract']['regression'] is False
+        assert 'new' not in rows
+    
+    def test_parse_importtime(self):
+        """-X importtime lines map modules to self and cumulative microseconds"""
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |   encodings.utf_8\n"
+            "import time:      5195 |     631148 | main_new\n"
+            "unrelated stderr line\n"
+        )
+        
+        modules = parse_importtime(output)
+        
+        assert modules == {'encodings.utf_8': (120, 120), 'main_new': (5195, 631148)}
+        assert slowest(modules, top=1) == [('main_new', 5195, 631148)]
@@ -64,25 +64,1497 @@ class TestCounterService:
 
 
 class TestStorageService:
-    """Test cloud storage service"""
+    """Test storage backends and background uploads"""
     
     def test_get_storage_status(self):
         """Test storage status"""
         status = storage_service.get_storage_status()
         
-        assert 'telegram' in status
-        assert 'google_drive' in status
-        assert 'enabled' in status['telegram']
-        assert 'priority' in status['telegram']
+        assert status['backend'] == 'local'
+        assert status['local']['enabled'] is True
+        assert status['local']['priority'] == 1
+        assert 'uploads' in status
     
-    def test_storage_priority(self):
-        """Test storage priority order"""
-        status = storage_service.get_storage_status()
+    def _service(self, tmp_path, backend, **options):
+        from app.services.index_service import IndexService
+        from app.services.storage_service import StorageService
+        index = IndexService(str(tmp_path / 'index.db'), str(tmp_path))
+        for invoice_id in ('INV-1', 'INV-2', 'INV-3'):
+            (tmp_path / f'{invoice_id}.xlsx').write_bytes(invoice_id.encode() * 100)
+            index.record({'id': invoice_id, 'file_path': str(tmp_path / f'{invoice_id}.xlsx')})
+        options.setdefault('retry_seconds', 0)
+        return StorageService(backend, output_dir=str(tmp_path), index=index, **options), index
+    
+    def test_background_upload_records_state(self, tmp_path):
+        """Uploads run off the request path and are recorded in the index"""
+        from app.core.storage import LocalBackend
+        service, index = self._service(tmp_path, LocalBackend(str(tmp_path / 'copies')))
+        
+        result = service.upload_invoice(str(tmp_path / 'INV-1.xlsx'), invoice_id='INV-1')
+        service.wait()
+        service.stop()
+        
+        assert result['queued'] is True
+        assert result['file_id'] == 'INV-1.xlsx'
+        assert (tmp_path / 'copies' / 'INV-1.xlsx').read_bytes() == b'INV-1' * 100
+        entry = index.get('INV-1')
+        assert (entry['upload_state'], entry['upload_key'], entry['upload_attempts']) == ('uploaded', 'INV-1.xlsx', 1)
+        assert entry['uploaded_at'] is not None
+        assert index.upload_counts() == {'uploaded': 1}
+    
+    def test_retries_with_backoff(self, tmp_path):
+        """Transient failures are retried until the upload succeeds or gives up"""
+        from app.core.storage import StorageBackend
+        
+        class FlakyBackend(StorageBackend):
+            name = 'flaky'
+            failures = {'INV-1.xlsx': 2, 'INV-2.xlsx': 10}
+            
+            def upload(self, file_path, key):
+                if self.failures[key]:
+                    self.failures[key] -= 1
+                    raise ConnectionError("connection reset")
+                return {}
+        
+        service, index = self._service(tmp_path, FlakyBackend(), max_attempts=3)
+        service.upload_invoice(str(tmp_path / 'INV-1.xlsx'), invoice_id='INV-1')
+        service.upload_invoice(str(tmp_path / 'INV-2.xlsx'), invoice_id='INV-2')
+        service.wait()
+        service.stop()
+        
+        first, second = index.get('INV-1'), index.get('INV-2')
+        assert (first['upload_state'], first['upload_attempts'], first['upload_error']) == ('uploaded', 3, None)
+        assert (second['upload_state'], second['upload_attempts']) == ('failed', 3)
+        assert second['upload_error'] == "connection reset"
+    
+    def test_sheets_of_one_file_share_an_upload(self, tmp_path):
+        """Invoices queued for the same file while it waits are uploaded together"""
+        import threading
+        from app.core.storage import StorageBackend
+        started, release = threading.Event(), threading.Event()
+        
+        class SlowBackend(StorageBackend):
+            name = 'slow'
+            keys = []
+            
+            def upload(self, file_path, key):
+                self.keys.append(key)
+                started.set()
+                release.wait(5)
+                return {}
+        
+        backend = SlowBackend()
+        service, index = self._service(tmp_path, backend, workers=1)
+        master = str(tmp_path / 'INV-1.xlsx')
+        service.upload_invoice(master, invoice_id='INV-1')
+        assert started.wait(5)
+        service.upload_invoice(master, invoice_id='INV-2')
+        service.upload_invoice(master, invoice_id='INV-3')
+        release.set()
+        service.wait()
+        service.stop()
+        
+        assert backend.keys == ['INV-1.xlsx', 'INV-1.xlsx']
+        assert index.upload_counts() == {'uploaded': 3}
+    
+    def test_unfinished_uploads_resume_on_start(self, tmp_path):
+        """Invoices still queued when the server stopped are uploaded on the next start"""
+        from app.core.storage import LocalBackend
+        service, index = self._service(tmp_path, LocalBackend(str(tmp_path / 'copies')))
+        index.set_upload_state(['INV-2'], 'uploading', key='INV-2.xlsx', attempts=1)
+        index.set_upload_state(['INV-3'], 'queued', key='INV-3.xlsx')
+        (tmp_path / 'INV-3.xlsx').unlink()
+        
+        service.start()
+        service.wait()
+        service.stop()
+        
+        assert index.get('INV-2')['upload_state'] == 'uploaded'
+        assert (index.get('INV-3')['upload_state'], index.get('INV-3')['upload_error']) == ('failed', "File not found")
+        assert index.get('INV-1')['upload_state'] is None
+    
+    def test_s3_multipart_upload(self, tmp_path):
+        """Files above the part size reach S3 as a multipart upload"""
+        moto = pytest.importorskip('moto')
+        import boto3
+        from app.core.storage import S3Backend
+        part_size = 5 * 1024 * 1024
+        data = bytes(range(256)) * (part_size * 2 // 256 + 1000)
+        (tmp_path / 'all.xlsx').write_bytes(data)
+        
+        with moto.mock_aws():
+            s3 = boto3.client('s3', region_name='us-east-1')
+            s3.create_bucket(Bucket='invoices')
+            backend = S3Backend('invoices', prefix='hd/', region='us-east-1',
+                                multipart_threshold=part_size, part_size=part_size)
+            
+            result = backend.upload(str(tmp_path / 'all.xlsx'), 'all.xlsx')
+            
+            stored = s3.get_object(Bucket='invoices', Key='hd/all.xlsx')
+            assert result['key'] == 'hd/all.xlsx'
+            assert stored['Body'].read() == data
+            assert stored['ETag'].strip('"').endswith('-3')
+    
+    def test_s3_upload_survives_master_save(self, tmp_path):
+        """A save replacing the file mid-upload does not mix old and new parts"""
+        moto = pytest.importorskip('moto')
+        import os
+        import boto3
+        from app.core.storage import S3Backend
+        part_size = 5 * 1024 * 1024
+        master = tmp_path / 'all.xlsx'
+        data = b'a' * (part_size * 2)
+        master.write_bytes(data)
+        
+        with moto.mock_aws():
+            s3 = boto3.client('s3', region_name='us-east-1')
+            s3.create_bucket(Bucket='invoices')
+            backend = S3Backend('invoices', region='us-east-1', multipart_threshold=part_size, part_size=part_size)
+            upload_file = backend.client.upload_file
+            
+            def save_then_upload(path, *args, **kwargs):
+                # The master file is saved again as the upload starts
+                (tmp_path / 'new.xlsx').write_bytes(b'b' * (part_size * 3))
+                os.replace(tmp_path / 'new.xlsx', master)
+                return upload_file(path, *args, **kwargs)
+            
+            backend.client.upload_file = save_then_upload
+            result = backend.upload(str(master), 'all.xlsx')
+            
+            assert s3.get_object(Bucket='invoices', Key='all.xlsx')['Body'].read() == data
+            assert result['size'] == len(data)
+        assert sorted(os.listdir(tmp_path)) == ['all.xlsx']
+    
+    def test_storage_backend_is_abstract(self):
+        """Backends must implement upload"""
+        from app.core.storage import StorageBackend
+        
+        class Incomplete(StorageBackend):
+            name = 'incomplete'
+        
+        with pytest.raises(TypeError):
+            Incomplete()
+
+
+class TestStreamingExtraction:
+    """Test incremental parsing of streamed LLM output"""
+    
+    def test_partial_json_only_complete_fields(self):
+        """Fields are reported only once their value is terminated"""
+        from openrouter_service import parse_partial_json
+        
+        text = '```json\n{"customer_name": "John Doe", "mobile_number": "98765'
+        assert parse_partial_json(text) == {'customer_name': 'John Doe'}
+        
+        # A number is not complete until a delimiter follows it
+        assert parse_partial_json('{"base_rent": 32') == {}
+        assert parse_partial_json('{"base_rent": 3200, ') == {'base_rent': 3200}
+    
+    def test_partial_json_full_object(self):
+        """A complete object parses like json.loads"""
+        from openrouter_service import parse_partial_json
+        
+        text = '{"a": null, "b": true, "c": [1, 2], "d": {"e": 1}}'
+        assert parse_partial_json(text) == {'a': None, 'b': True, 'c': [1, 2], 'd': {'e': 1}}
+    
+    def test_stream_stops_when_required_fields_present(self, monkeypatch):
+        """Stream is closed as soon as every required field has arrived"""
+        import json
+        from openrouter_service import OpenRouterDataExtractor, REQUIRED_FIELDS
+        
+        body = json.dumps({field: 'x' for field in REQUIRED_FIELDS})[:-1] + ', "advance_paid": 500}'
+        
+        class FakeResponse:
+            closed = False
+            
+            def raise_for_status(self):
+                pass
+            
+            def iter_lines(self, decode_unicode=False):
+                yield ': OPENROUTER PROCESSING'
+                for i in range(0, len(body), 7):
+                    chunk = {'choices': [{'delta': {'content': body[i:i + 7]}}]}
+                    yield 'data: ' + json.dumps(chunk)
+                yield 'data: [DONE]'
+            
+            def close(self):
+                self.closed = True
+        
+        fake = FakeResponse()
+        
+        extractor = OpenRouterDataExtractor()
+        monkeypatch.setattr(extractor.session, 'post', lambda *args, **kwargs: fake)
+        extractor.enabled = True
+        extractor.api_key = 'test'
+        extractor.model = 'test'
+        extractor.api_url = 'http://localhost'
+        
+        events = list(extractor.stream_invoice_data('', '', stop_when_complete=True))
+        
+        fields = [e['field'] for e in events if e['event'] == 'field']
+        assert fields == list(REQUIRED_FIELDS)
+        assert events[-1]['event'] == 'complete'
+        assert events[-1]['stopped_early'] is True
+        assert 'advance_paid' not in events[-1]['data']
+        assert fake.closed
+    
+    def test_fallback_stream_emits_complete(self):
+        """Without an AI provider the stream still ends with the full data"""
+        events = list(extraction_service.stream_booking_data("Cx no: 9876543210", ""))
+        
+        assert events[-1]['event'] == 'complete'
+        assert events[-1]['data']['mobile_number'] == "9876543210"
+
+
+class TestStageMetrics:
+    """Test per-stage timing instrumentation"""
+    
+    def test_breakdown_accumulates_stages(self):
+        """Stages inside a breakdown are summed per name"""
+        from app.core.metrics import stage, stage_breakdown
+        
+        with stage_breakdown() as timings:
+            with stage('fill'):
+                pass
+            with stage('fill'):
+                pass
+            with stage('save'):
+                pass
+        
+        assert set(timings) == {'fill', 'save'}
+        
+        # Stages outside a breakdown are only recorded in the histograms
+        with stage('fill'):
+            pass
+        assert set(timings) == {'fill', 'save'}
+    
+    def test_histogram_rendering(self):
+        """Buckets are cumulative and end with +Inf"""
+        from app.core.metrics import Histogram
+        
+        histogram = Histogram('test_seconds', 'Test', labelnames=('stage',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage='ocr')
+        histogram.observe(0.5, stage='ocr')
+        histogram.observe(5, stage='ocr')
+        text = histogram.render()
+        
+        assert 'test_seconds_bucket{stage="ocr",le="0.1"} 1' in text
+        assert 'test_seconds_bucket{stage="ocr",le="1.0"} 2' in text
+        assert 'test_seconds_bucket{stage="ocr",le="+Inf"} 3' in text
+        assert 'test_seconds_sum{stage="ocr"} 5.55' in text
+        assert 'test_seconds_count{stage="ocr"} 3' in text
+
+
+class TestIndexService:
+    """Test the SQLite invoice index"""
+    
+    def _index(self, tmp_path, count=5):
+        from app.services.index_service import IndexService
+        index = IndexService(str(tmp_path / 'index.db'), str(tmp_path))
+        for i in range(count):
+            index.record({
+                'id': f'INV-{i}',
+                'invoice_number': f'HD/2026-27/{i:03d}',
+                'customer_name': f'Customer {i}',
+                'total_amount': 1000 * (count - i),
+                'file_path': str(tmp_path / f'INV-{i}.xlsx'),
+                'created_at': f'2026-01-{i + 10:02d}T10:00:00',
+            })
+        return index
+    
+    def test_keyset_pagination(self, tmp_path):
+        """Pages follow the cursor without gaps or repeats"""
+        index = self._index(tmp_path)
+        
+        page, cursor = index.list(limit=2)
+        seen = [entry['id'] for entry in page]
+        while cursor:
+            page, cursor = index.list(limit=2, cursor=cursor)
+            seen.extend(entry['id'] for entry in page)
+        
+        assert seen == ['INV-4', 'INV-3', 'INV-2', 'INV-1', 'INV-0']
+    
+    def test_sort_by_amount(self, tmp_path):
+        """Listings can be sorted ascending by total amount"""
+        index = self._index(tmp_path)
+        
+        page, cursor = index.list(limit=3, sort='total_amount', order='asc')
+        
+        assert [entry['total_amount'] for entry in page] == [1000, 2000, 3000]
+        page, _ = index.list(limit=3, cursor=cursor, sort='total_amount', order='asc')
+        assert [entry['total_amount'] for entry in page] == [4000, 5000]
+    
+    def test_iter_by_invoice_date(self, tmp_path):
+        """Date-range iteration crosses batch boundaries in date order"""
+        index = self._index(tmp_path)
+        index.record({'id': 'INV-X', 'file_path': 'x.xlsx', 'invoice_date': '05/02/26', 'total_amount': 1050})
+        
+        entries = list(index.iter_by_invoice_date('2026-01-11', '2026-02-28', batch_size=2))
+        
+        assert [entry['id'] for entry in entries] == ['INV-1', 'INV-2', 'INV-3', 'INV-4', 'INV-X']
+        assert (entries[-1]['taxable_amount'], entries[-1]['cgst']) == (1000.0, 25.0)
+    
+    def test_count_and_remove(self, tmp_path):
+        """Upserts do not double count and removals are reflected"""
+        index = self._index(tmp_path, count=3)
+        index.record({'id': 'INV-0', 'file_path': 'x.xlsx', 'customer_name': 'Renamed'})
+        
+        assert index.count() == 3
+        assert index.get('INV-0')['customer_name'] == 'Renamed'
+        assert index.remove('INV-1') is True
+        assert index.remove('INV-1') is False
+        assert index.count() == 2
+    
+    def test_invalid_cursor(self, tmp_path):
+        """Malformed or mismatched cursors are rejected"""
+        from app.services.index_service import InvalidCursorError
+        index = self._index(tmp_path)
+        _, cursor = index.list(limit=1)
+        
+        with pytest.raises(InvalidCursorError):
+            index.list(cursor='not-a-cursor')
+        with pytest.raises(InvalidCursorError):
+            index.list(cursor=cursor, sort='total_amount')
+    
+    def test_backfill_existing_files(self, tmp_path):
+        """Invoices created before the index existed are picked up once"""
+        from app.services.index_service import IndexService
+        (tmp_path / 'HD-OLD-1.xlsx').write_bytes(b'xlsx')
+        (tmp_path / 'notes.txt').write_text('ignored')
+        
+        index = IndexService(str(tmp_path / 'index.db'), str(tmp_path))
+        
+        assert index.count() == 1
+        assert index.get('HD-OLD-1')['size_bytes'] == 4
+    
+    def _catalogue(self, tmp_path):
+        from app.services.index_service import IndexService
+        index = IndexService(str(tmp_path / 'index.db'), str(tmp_path))
+        index.record_many([
+            {'id': 'A', 'customer_name': 'Buen Manejo Del Campo India Pvt. Ltd.',
+             'address': 'Office no.4, Anmol Pride, Baner, Pune', 'mobile_number': '+91 88893 02969',
+             'vehicle_number': 'RJ14 AB 1234', 'total_amount': 20608,
+             'start_datetime': '2026-01-25 07:00', 'file_path': 'A.xlsx', 'created_at': '2026-01-25T10:00:00'},
+            {'id': 'B', 'customer_name': 'Rahul Sharma', 'address': 'Malviya Nagar, Jaipur',
+             'mobile_number': '9876543210', 'vehicle_number': 'RJ14CD5678', 'total_amount': 3500,
+             'invoice_date': '10/02/26', 'file_path': 'B.xlsx', 'created_at': '2026-02-10T10:00:00'},
+            {'id': 'C', 'customer_name': 'Priya Sharma', 'address': 'Vaishali Nagar, Jaipur',
+             'mobile_number': '9123456789', 'total_amount': 8000,
+             'start_datetime': '2026-03-01T09:00:00', 'file_path': 'C.xlsx', 'created_at': '2026-03-01T10:00:00'},
+        ])
+        return index
+    
+    def _search_ids(self, index, **filters):
+        entries, _ = index.search(**filters)
+        return [entry['id'] for entry in entries]
+    
+    def test_search_full_text_and_prefix(self, tmp_path):
+        """Words match as prefixes in name and address"""
+        index = self._catalogue(tmp_path)
+        
+        assert self._search_ids(index, text='jaipur') == ['C', 'B']
+        assert self._search_ids(index, text='sharm vaish') == ['C']
+        assert self._search_ids(index, name='buen man') == ['A']
+        assert self._search_ids(index, name='pune') == []
+    
+    def test_search_exact_keys(self, tmp_path):
+        """Phone and vehicle numbers match regardless of formatting"""
+        index = self._catalogue(tmp_path)
+        
+        assert self._search_ids(index, phone='8889302969') == ['A']
+        assert self._search_ids(index, vehicle='rj14-ab-1234') == ['A']
+        assert self._search_ids(index, phone='98765') == []
+    
+    def test_search_ranges(self, tmp_path):
+        """Service dates and amounts filter inclusively"""
+        index = self._catalogue(tmp_path)
+        
+        assert self._search_ids(index, date_from='2026-02-01', date_to='2026-02-28') == ['B']
+        assert self._search_ids(index, min_amount=5000) == ['C', 'A']
+        assert self._search_ids(index, text='sharma', max_amount=5000) == ['B']
+    
+    def test_search_follows_updates_and_deletes(self, tmp_path):
+        """The full-text index tracks upserts and removals"""
+        index = self._catalogue(tmp_path)
+        index.record({'id': 'B', 'customer_name': 'Rohit Verma', 'file_path': 'B.xlsx'})
+        index.remove('C')
+        
+        assert self._search_ids(index, text='sharma') == []
+        assert self._search_ids(index, name='rohit') == ['B']
+    
+    def test_migrates_existing_index(self, tmp_path):
+        """Indexes created before search support are upgraded in place"""
+        import sqlite3
+        from app.services.index_service import IndexService, MIGRATIONS
+        
+        conn = sqlite3.connect(tmp_path / 'index.db')
+        conn.executescript(MIGRATIONS[0])
+        conn.execute(
+            "INSERT INTO invoices (id, customer_name, mobile_number, file_path, created_at) "
+            "VALUES ('OLD', 'Anita Rao', '98290 11111', 'OLD.xlsx', '2025-12-01T10:00:00')"
+        )
+        conn.execute("PRAGMA user_version = 1")
+        conn.commit()
+        conn.close()
+        
+        index = IndexService(str(tmp_path / 'index.db'), str(tmp_path))
+        
+        assert self._search_ids(index, name='anita', phone='9829011111') == ['OLD']
+        assert index.get('OLD')['service_date'] == '2025-12-01'
+
+
+class TestJobService:
+    """Test the durable background job queue"""
+    
+    def _jobs(self, tmp_path, handler=None, lease_seconds=None):
+        from app.services.job_service import JobService
+        jobs = JobService(str(tmp_path / 'jobs.db'), str(tmp_path / 'uploads'), workers=1, lease_seconds=lease_seconds)
+        jobs.register('echo', handler or (lambda params, files, progress: {'sizes': [len(f) for f in files], **params}))
+        return jobs
+    
+    def test_submit_and_run(self, tmp_path):
+        """Queued jobs get their files back and store the handler result"""
+        jobs = self._jobs(tmp_path)
+        job = jobs.submit('echo', {'user_text': 'hi'}, [b'abc', b'de'])
+        
+        assert job['status'] == 'queued'
+        assert jobs.run_pending() == 1
+        
+        done = jobs.get(job['id'])
+        assert done['status'] == 'done'
+        assert done['attempts'] == 1
+        assert done['result'] == {'sizes': [3, 2], 'user_text': 'hi'}
+        assert not (tmp_path / 'uploads' / job['id']).exists()
+    
+    def test_failure_is_recorded(self, tmp_path):
+        """Handler errors fail the job without stopping the queue"""
+        def handler(params, files, progress):
+            progress('ocr')
+            raise RuntimeError("OCR.space unavailable")
+        
+        jobs = self._jobs(tmp_path, handler)
+        job = jobs.submit('echo', {}, [b'x'])
+        jobs.run_pending()
+        
+        failed = jobs.get(job['id'])
+        assert failed['status'] == 'failed'
+        assert failed['stage'] == 'ocr'
+        assert failed['error'] == "OCR.space unavailable"
+    
+    def test_interrupted_jobs_survive_restart(self, tmp_path):
+        """Jobs left running by a dead process are requeued once their lease lapses"""
+        jobs = self._jobs(tmp_path, lease_seconds=0)
+        job = jobs.submit('echo', {}, [b'abc'])
+        assert jobs._claim()['id'] == job['id']  # Process dies mid-job
+        
+        restarted = self._jobs(tmp_path)
+        assert restarted.recover() == 1
+        assert restarted.run_pending() == 1
+        
+        done = restarted.get(job['id'])
+        assert done['status'] == 'done'
+        assert done['attempts'] == 2
+    
+    def test_leased_jobs_not_requeued(self, tmp_path):
+        """A job another live process is running stays with it"""
+        jobs = self._jobs(tmp_path)
+        job = jobs.submit('echo', {}, [b'abc'])
+        assert jobs._claim()['id'] == job['id']
+        
+        other = self._jobs(tmp_path)
+        assert other.recover() == 0
+        assert other.run_pending() == 0
+        assert jobs.renew() == 1
+        assert other.renew() == 0
+        
+        running = other.get(job['id'])
+        assert (running['status'], running['owner']) == ('running', jobs.owner)
+    
+    def test_workers_process_in_background(self, tmp_path):
+        """Worker threads pick up submitted jobs"""
+        import time
+        jobs = self._jobs(tmp_path)
+        jobs.start()
+        try:
+            job = jobs.submit('echo', {}, [b'abc'])
+            deadline = time.time() + 5
+            while jobs.get(job['id'])['status'] != 'done' and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            jobs.stop()
+        
+        assert jobs.get(job['id'])['status'] == 'done'
+
+
+class TestIdempotencyService:
+    """Test idempotency key storage"""
+    
+    def _store(self, tmp_path, ttl_hours=24):
+        from app.services.idempotency_service import IdempotencyService
+        return IdempotencyService(str(tmp_path / 'idempotency.db'), ttl_hours=ttl_hours)
+    
+    def test_completed_request_replays(self, tmp_path):
+        """The second request with a key gets the stored response"""
+        store = self._store(tmp_path)
+        
+        assert store.begin('key-1', 'create', 'hash-a') is None
+        store.complete('key-1', 'create', {'invoice_id': 'HD-1'})
+        
+        assert store.begin('key-1', 'create', 'hash-a') == {'invoice_id': 'HD-1'}
+        assert store.begin('key-1', 'create-from-ocr', 'hash-a') is None  # Scoped per endpoint
+    
+    def test_conflicts(self, tmp_path):
+        """In-flight and reused keys are rejected"""
+        from app.services.idempotency_service import IdempotencyKeyInUseError, IdempotencyKeyMismatchError
+        store = self._store(tmp_path)
+        store.begin('key-1', 'create', 'hash-a')
+        
+        with pytest.raises(IdempotencyKeyInUseError):
+            store.begin('key-1', 'create', 'hash-a')
+        with pytest.raises(IdempotencyKeyMismatchError):
+            store.begin('key-1', 'create', 'hash-b')
+    
+    def test_release_and_expiry(self, tmp_path):
+        """Failed requests free the key, and completed keys expire"""
+        store = self._store(tmp_path)
+        store.begin('key-1', 'create', 'hash-a')
+        store.release('key-1', 'create')
+        assert store.begin('key-1', 'create', 'hash-a') is None
+        
+        expired = self._store(tmp_path / 'expired', ttl_hours=0)
+        expired.begin('key-2', 'create', 'hash-a')
+        expired.complete('key-2', 'create', {'invoice_id': 'HD-2'})
+        assert expired.begin('key-2', 'create', 'hash-b') is None
+    
+    def test_fingerprint_separates_parts(self):
+        """Part boundaries are part of the fingerprint"""
+        from app.services.idempotency_service import fingerprint
+        
+        assert fingerprint(b'ab', 'c') != fingerprint(b'a', 'bc')
+        assert fingerprint(b'ab', 'c') == fingerprint(b'ab', 'c')
+
+
+class TestSheetExport:
+    """Test per-invoice extraction from the master file"""
+    
+    def _master(self, tmp_path, count=3):
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        from config import settings
+        master = str(tmp_path / 'master.xlsx')
+        writer = HillDriveExcelWriter(settings.template_path, master)
+        for i in range(count):
+            writer.write_to_master({
+                'invoice_number': f'HD/2026-27/{i + 1:03d}',
+                'invoice_date': '25/01/26',
+                'customer_name': f'Customer {i}',
+                'mobile_number': f'98765432{i:02d}',
+                'total_amount': 1000 + i
+            })
+        return master
+    
+    def test_extract_matches_master_sheet(self, tmp_path):
+        """The extract holds one sheet, cell-for-cell equal to the master's"""
+        import openpyxl
+        from app.core.xlsx import extract_sheet
+        master = self._master(tmp_path)
+        output = str(tmp_path / 'one.xlsx')
+        
+        extract_sheet(master, 'HD-2026-27-002', output)
+        
+        source = openpyxl.load_workbook(master)['HD-2026-27-002']
+        wb = openpyxl.load_workbook(output)
+        assert wb.sheetnames == ['HD-2026-27-002']
+        for row in source.iter_rows():
+            for cell in row:
+                assert wb.active[cell.coordinate].value == cell.value
+        assert set(map(str, wb.active.merged_cells.ranges)) == set(map(str, source.merged_cells.ranges))
+    
+    def test_missing_sheet(self, tmp_path):
+        """Unknown sheets raise SheetNotFoundError"""
+        from app.core.xlsx import extract_sheet, SheetNotFoundError
+        master = self._master(tmp_path, count=1)
+        
+        with pytest.raises(SheetNotFoundError):
+            extract_sheet(master, 'HD-2026-27-999', str(tmp_path / 'x.xlsx'))
+    
+    def test_shared_strings_compacted(self):
+        """Strings of other sheets are not carried into the extract"""
+        from app.core.xlsx import _compact_shared_strings
+        sheet = '<sheetData><row r="1"><c r="A1" t="s"><v>2</v></c><c r="B1" t="s"><v>0</v></c></row></sheetData>'
+        strings = ('<?xml version="1.0"?><sst xmlns="main" count="3" uniqueCount="3">'
+                   '<si><t>Invoice</t></si><si><t>Other Customer</t></si><si><t>This Customer</t></si></sst>')
+        
+        sheet, strings = _compact_shared_strings(sheet, strings)
+        
+        assert '<c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c>' in sheet
+        assert 'Other Customer' not in strings
+        assert strings.index('This Customer') < strings.index('Invoice')
+        assert 'count="2" uniqueCount="2"' in strings
+    
+    def test_cache_invalidated_when_master_changes(self, tmp_path):
+        """Extracts are reused until the master file is rewritten"""
+        import os
+        import time
+        from app.services.sheet_export_service import SheetExportService
+        master = self._master(tmp_path, count=2)
+        service = SheetExportService(str(tmp_path / 'cache'))
+        
+        first = service.export(master, 'HD-2026-27-001')
+        assert service.export(master, 'HD-2026-27-001') == first
+        
+        stat = os.stat(master)
+        os.utime(master, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        second = service.export(master, 'HD-2026-27-001')
+        
+        assert second != first
+        # A download handed the old extract just before the change can still open it
+        assert os.path.exists(first)
+        
+        old = time.time() - service.STALE_SECONDS - 1
+        os.utime(os.path.dirname(first), (old, old))
+        service.export(master, 'HD-2026-27-002')
+        assert not os.path.exists(first)
+        assert os.path.exists(second)
+
+
+class TestLedger:
+    """Test the incremental invoice ledger"""
+    
+    def _writer(self, tmp_path, count=3):
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        from config import settings
+        writer = HillDriveExcelWriter(settings.template_path, str(tmp_path / 'master.xlsx'))
+        for i in range(count):
+            writer.write_to_master({
+                'invoice_number': f'HD/2026-27/{i + 1:03d}',
+                'invoice_date': '25/01/26',
+                'customer_name': f'Customer {i}',
+                'total_amount': 1050 * (i + 1)
+            })
+        return writer
+    
+    def test_one_row_per_invoice(self, tmp_path):
+        """Each appended invoice adds a row with the GST split"""
+        from app.core.ledger import Ledger
+        writer = self._writer(tmp_path)
+        
+        rows = list(Ledger.for_master(writer.master_file).rows())
+        
+        assert [row['invoice_number'] for row in rows] == ['HD/2026-27/001', 'HD/2026-27/002', 'HD/2026-27/003']
+        assert rows[1]['customer_name'] == 'Customer 1'
+        assert rows[1]['taxable_amount'] == 2000.0
+        assert rows[1]['cgst'] == rows[1]['sgst'] == 50.0
+        assert rows[1]['total_amount'] == 2100.0
+    
+    def test_rebuild_for_existing_master(self, tmp_path):
+        """A master written before the ledger existed is scanned once"""
+        import os
+        from app.core.ledger import Ledger
+        writer = self._writer(tmp_path, count=2)
+        ledger = Ledger.for_master(writer.master_file)
+        before = [(row['sheet_name'], row['total_amount']) for row in ledger.rows()]
+        os.remove(ledger.path)
+        
+        writer.ensure_ledger()
+        
+        assert [(row['sheet_name'], row['total_amount']) for row in ledger.rows()] == before
+    
+    def test_xlsx_export(self, tmp_path):
+        """The workbook version is regenerated after new rows are appended"""
+        import openpyxl
+        from app.core.ledger import Ledger, ledger_entry
+        writer = self._writer(tmp_path, count=1)
+        ledger = Ledger.for_master(writer.master_file)
+        
+        ws = openpyxl.load_workbook(ledger.xlsx()).active
+        assert ws.max_row == 2
+        assert ws['A1'].value == 'Invoice No.'
+        
+        ledger.append(ledger_entry('HD/X', '26/01/26', 'HD-X', 'Late Customer', 1050, 1050))
+        assert openpyxl.load_workbook(ledger.xlsx()).active.max_row == 3
+
+
+class TestTaxEngine:
+    """Test the Python evaluation of the template's tax formulas"""
+    
+    def _evaluate(self, formula, values):
+        """Evaluate a template formula with Decimal cell values"""
+        import re
+        from decimal import Decimal
+        
+        def operand(match):
+            # A single-row range (F33:G33) resolves to its first cell in this row
+            if match.group(1):
+                return f"values.get('{match.group(1)}', Decimal(0))"
+            return f"Decimal('{match.group(2)}')"
+        
+        expression = re.sub(r'([A-Z]+\d+)(?::[A-Z]+\d+)?|(\d+(?:\.\d+)?)', operand, formula.lstrip('='))
+        return eval(expression, {'Decimal': Decimal, 'values': values})
+    
+    def test_formulas_match_template(self):
+        """The engine knows every formula cell of the template, verbatim"""
+        import openpyxl
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        from app.core.tax import TEMPLATE_FORMULAS
+        
+        ws = openpyxl.load_workbook('inn sample.xlsx').active
+        template_formulas = {
+            cell.coordinate: cell.value
+            for row in ws.iter_rows() for cell in row
+            if isinstance(cell.value, str) and cell.value.startswith('=')
+        }
+        
+        assert template_formulas == TEMPLATE_FORMULAS
+        assert HillDriveExcelWriter().formula_cells == set(TEMPLATE_FORMULAS)
+    
+    def test_cells_match_formulas(self):
+        """Each computed cell equals the template formula evaluated on the inputs"""
+        from decimal import Decimal
+        from app.core.tax import TEMPLATE_FORMULAS, compute
+        
+        for gross, total, received in [(1050, 1050, 0), ('2999.99', '5999.99', 1500), (0, 0, 0)]:
+            result = compute(gross, total, received)
+            values = {'G18': result.gross, 'F33': result.total, 'F34': result.received}
+            values.update(result.cells())
+            for ref, formula in TEMPLATE_FORMULAS.items():
+                assert self._evaluate(formula, values) == values[ref], ref
+    
+    def test_rounding(self):
+        """Printed amounts round half-up to the paisa"""
+        from app.core.tax import compute
+        
+        amounts = compute(1000, 1500, '200').amounts()
+        assert amounts['taxable_amount'] == 952.38
+        assert amounts['cgst'] == amounts['sgst'] == 23.81
+        assert amounts['balance_amount'] == 1300.0
+        # CGST of 0.005 exactly
+        assert compute('0.21').amounts()['cgst'] == 0.01
+    
+    def test_compute_many(self):
+        """Batch computation reads ledger/index style rows"""
+        from app.core.tax import compute_many
+        
+        rows = [{'gross_amount': 2100, 'total_amount': 2100}, {'gross_amount': None}, {'gross_amount': 'n/a'}]
+        results = [result.amounts()['taxable_amount'] for result in compute_many(rows)]
         
-        # Telegram should have priority 1
-        assert status['telegram']['priority'] == 1
-        # Google Drive should have priority 2
-        assert status['google_drive']['priority'] == 2
+        assert results == [2000.0, 0.0, 0.0]
+    
+    def test_written_invoice_has_cached_values(self, tmp_path):
+        """Formula cells keep their formulas and carry the computed results"""
+        import openpyxl
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        writer = HillDriveExcelWriter('inn sample.xlsx', str(tmp_path / 'all.xlsx'))
+        output = str(tmp_path / 'invoice.xlsx')
+        
+        writer.write({
+            'invoice_number': 'HD/2026-27/001', 'customer_name': 'Tax Customer',
+            'total_amount': 1050, 'advance_paid': 300
+        }, output)
+        
+        ws = openpyxl.load_workbook(output, data_only=True).active
+        assert ws['E18'].value == 1000
+        assert ws['F28'].value == ws['F29'].value == 25
+        assert ws['G23'].value == 1050
+        assert ws['F35'].value == 750
+        assert openpyxl.load_workbook(output).active['F35'].value == '=F33:G33-F34:G34'
+    
+    def test_master_sheets_keep_cached_values(self, tmp_path):
+        """Re-saving the master refills the results of the earlier sheets"""
+        import openpyxl
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        writer = HillDriveExcelWriter('inn sample.xlsx', str(tmp_path / 'all.xlsx'))
+        for number in range(2):
+            writer.write_to_master({
+                'invoice_number': f'HD/2026-27/00{number + 1}', 'customer_name': f'Customer {number}',
+                'total_amount': 2100 * (number + 1)
+            })
+        
+        wb = openpyxl.load_workbook(writer.master_file, data_only=True)
+        
+        assert [ws['F27'].value for ws in wb.worksheets[-2:]] == [2000, 4000]
+
+
+class TestAmountAudit:
+    """Test the batch audit of stored tax breakdowns"""
+    
+    COLUMNS = {
+        'id': ['OK', 'BAD-CGST', 'MISSING', 'NEGATIVE', 'OVER'],
+        'total_amount': [1050.0, 1050.0, 1050.0, -10.0, 100.0],
+        'taxable_amount': [1000.0, 1000.0, None, 0.0, 1000.0],
+        'cgst': [25.0, 24.0, None, 0.0, 25.0],
+        'sgst': [25.0, 25.0, None, 0.0, 25.0],
+    }
+    
+    def test_mismatches(self):
+        """Each failed check lists the invoices failing it"""
+        from app.core.audit import audit_amounts
+        
+        report = audit_amounts(self.COLUMNS)
+        
+        assert report['checked'] == 5
+        assert report['mismatches'] == {
+            'missing_breakdown': 1, 'negative': 1, 'cgst': 1, 'split': 1, 'exceeds_total': 2
+        }
+        assert report['examples']['cgst'] == ['BAD-CGST']
+        assert report['examples']['exceeds_total'] == ['NEGATIVE', 'OVER']
+    
+    def test_rate_change(self):
+        """Checking against another rate flags every taxed invoice"""
+        from app.core.audit import audit_amounts
+        
+        report = audit_amounts(self.COLUMNS, gst_rate=0.12, max_examples=1)
+        
+        assert report['mismatches']['cgst'] == 3
+        assert len(report['examples']['cgst']) == 1
+    
+    def test_numpy_matches_python(self, monkeypatch):
+        """The vectorized and row-by-row checks agree (numpy is a dev dependency)"""
+        from app.core import audit
+        
+        vectorized = audit.audit_amounts(self.COLUMNS)
+        monkeypatch.setattr(audit, 'numpy', None)
+        row_by_row = audit.audit_amounts(self.COLUMNS)
+        
+        assert (vectorized['engine'], row_by_row['engine']) == ('numpy', 'python')
+        assert vectorized['mismatches'] == row_by_row['mismatches']
+        assert vectorized['examples'] == row_by_row['examples']
+    
+    def test_index_columns(self, tmp_path):
+        """The index provides the audit's columns in id order"""
+        from app.core.audit import audit_amounts
+        from app.services.index_service import IndexService
+        index = IndexService(str(tmp_path / 'index.db'), str(tmp_path))
+        assert audit_amounts(index.amount_columns())['checked'] == 0
+        index.record({'id': 'INV-2', 'file_path': 'x.xlsx', 'total_amount': 2100})
+        index.record({'id': 'INV-1', 'file_path': 'y.xlsx', 'total_amount': 1050})
+        
+        columns = index.amount_columns()
+        
+        assert columns['id'] == ['INV-1', 'INV-2']
+        assert columns['cgst'] == [25.0, 50.0]
+        assert audit_amounts(columns)['mismatches'] == {}
+
+
+class TestWorkbookIntegrity:
+    """Test the master workbook checker, repair and atomic saves"""
+    
+    def _master(self, tmp_path, count=3):
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        writer = HillDriveExcelWriter('inn sample.xlsx', str(tmp_path / 'all.xlsx'))
+        for number in range(count):
+            writer.write_to_master({
+                'invoice_number': f'HD/2026-27/00{number + 1}', 'customer_name': f'Customer {number}',
+                'total_amount': 1000 + number
+            })
+        return writer
+    
+    def test_check_sound_workbook(self, tmp_path):
+        """A freshly saved master passes the quick and deep checks"""
+        from app.core.integrity import check_workbook
+        writer = self._master(tmp_path, count=2)
+        
+        for deep in (False, True):
+            report = check_workbook(writer.master_file, deep=deep)
+            assert report['ok'], report
+            assert len(report['sheets']) == 3
+    
+    def test_repair_truncated_workbook(self, tmp_path):
+        """A save cut short before the workbook part keeps every sheet's cells"""
+        import zipfile
+        import openpyxl
+        from app.core.integrity import check_workbook, repair_workbook
+        writer = self._master(tmp_path)
+        with zipfile.ZipFile(writer.master_file) as zf:
+            cut = zf.getinfo('xl/styles.xml').header_offset + 10
+        with open(writer.master_file, 'rb') as f:
+            (tmp_path / 'truncated.xlsx').write_bytes(f.read()[:cut])
+        assert not check_workbook(str(tmp_path / 'truncated.xlsx'))['ok']
+        
+        report = repair_workbook(str(tmp_path / 'truncated.xlsx'), str(tmp_path / 'repaired.xlsx'))
+        
+        assert report['rebuilt_structure'] is True
+        assert report['dropped'] == []
+        assert check_workbook(str(tmp_path / 'repaired.xlsx'))['ok']
+        wb = openpyxl.load_workbook(str(tmp_path / 'repaired.xlsx'))
+        assert [ws['F33'].value for ws in wb.worksheets[1:]] == [1000, 1001, 1002]
+    
+    def test_repair_drops_damaged_sheet(self, tmp_path):
+        """A sheet with malformed XML is dropped; the others keep their names"""
+        import zipfile
+        import openpyxl
+        from app.core.integrity import check_workbook, repair_workbook
+        writer = self._master(tmp_path, count=2)
+        damaged = str(tmp_path / 'damaged.xlsx')
+        with zipfile.ZipFile(writer.master_file) as zf, zipfile.ZipFile(damaged, 'w') as out:
+            for info in zf.infolist():
+                broken = info.filename == 'xl/worksheets/sheet3.xml'
+                out.writestr(info, b'<worksheet><sheetData>' if broken else zf.read(info))
+        names = openpyxl.load_workbook(writer.master_file, read_only=True).sheetnames
+        assert [sheet['ok'] for sheet in check_workbook(damaged)['sheets']] == [True, True, False]
+        
+        report = repair_workbook(damaged, str(tmp_path / 'repaired.xlsx'))
+        
+        assert report['dropped'] == [names[2]]
+        assert openpyxl.load_workbook(str(tmp_path / 'repaired.xlsx')).sheetnames == names[:2]
+    
+    def test_failed_save_keeps_master(self, tmp_path, monkeypatch):
+        """A save that fails part-way leaves the previous master in place"""
+        import os
+        import hilldrive_excel_mapper
+        writer = self._master(tmp_path, count=1)
+        with open(writer.master_file, 'rb') as f:
+            before = f.read()
+        
+        def broken_save(wb, filename):
+            with open(filename, 'wb') as f:
+                f.write(before[:100])
+            raise OSError("No space left on device")
+        monkeypatch.setattr(hilldrive_excel_mapper, 'save_workbook', broken_save)
+        
+        with pytest.raises(OSError):
+            writer.write_to_master({'invoice_number': 'HD/2026-27/009', 'customer_name': 'Lost', 'total_amount': 1})
+        
+        with open(writer.master_file, 'rb') as f:
+            assert f.read() == before
+        assert sorted(os.listdir(tmp_path)) == ['all.xlsx', 'all_ledger.csv']
+
+
+class TestDocumentImages:
+    """Test deduplication of embedded document images"""
+    
+    def _scan(self, seed):
+        import io
+        import random
+        from PIL import Image
+        rng = random.Random(seed)
+        img = Image.new('RGB', (1200, 900), (255, 255, 255))
+        img.putdata([(rng.randrange(256), 0, 0) for _ in range(1200 * 900)])
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG')
+        return buffer.getvalue()
+    
+    def test_repeat_images_share_media_part(self, tmp_path):
+        """A customer's scans attached to several sheets are stored once"""
+        import re
+        import zipfile
+        import openpyxl
+        from app.core.integrity import check_workbook
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        scans = [self._scan(1), self._scan(2)]
+        writer = HillDriveExcelWriter('inn sample.xlsx', str(tmp_path / 'all.xlsx'), str(tmp_path / 'media'))
+        for number in range(3):
+            writer.write_to_master({
+                'invoice_number': f'HD/2026-27/00{number + 1}', 'customer_name': 'Repeat Customer',
+                'total_amount': 1000, 'document_images': scans
+            })
+        
+        logos = len(openpyxl.load_workbook('inn sample.xlsx').active._images)
+        with zipfile.ZipFile(writer.master_file) as zf:
+            media = [name for name in zf.namelist() if name.startswith('xl/media/')]
+            targets = [
+                re.findall(r'Target="([^"]+)"', zf.read(name).decode())
+                for name in sorted(zf.namelist()) if name.startswith('xl/drawings/_rels/')
+            ]
+        assert len(media) == logos + 2
+        # The first sheet is the template itself, with its logos
+        assert len(targets[1]) == 2
+        assert targets[1] == targets[2] == targets[3]
+        assert check_workbook(writer.master_file)['ok']
+        wb = openpyxl.load_workbook(writer.master_file)
+        assert [len(ws._images) for ws in wb.worksheets] == [logos, 2, 2, 2]
+    
+    def test_media_store_skips_reprocessing(self, tmp_path, monkeypatch):
+        """A scan seen before is taken from the media store, not decoded again"""
+        import zipfile
+        import openpyxl
+        import PIL.Image
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        scan = self._scan(3)
+        writer = HillDriveExcelWriter('inn sample.xlsx', str(tmp_path / 'all.xlsx'), str(tmp_path / 'media'))
+        first = writer._document_png(scan)
+        
+        def no_decoding(*args, **kwargs):
+            raise AssertionError("image decoded again")
+        monkeypatch.setattr(PIL.Image.Image, 'resize', no_decoding)
+        
+        assert writer._document_png(scan) == first
+        assert writer.write(
+            {'invoice_number': 'HD/2026-27/001', 'total_amount': 1000, 'document_images': [scan, scan]},
+            str(tmp_path / 'single.xlsx')
+        )
+        logos = len(openpyxl.load_workbook('inn sample.xlsx').active._images)
+        with zipfile.ZipFile(tmp_path / 'single.xlsx') as zf:
+            assert len([name for name in zf.namelist() if name.startswith('xl/media/')]) == logos + 1
+
+    
+    def test_media_store_pruned_least_recently_used(self, tmp_path):
+        """Past its size limit the store drops the images unused the longest"""
+        import io
+        import os
+        import PIL.Image
+        from app.core.media import MediaStore
+        
+        def png(seed):
+            output = io.BytesIO()
+            PIL.Image.effect_noise((64, 64), 10 + seed).save(output, format='PNG', compress_level=0)
+            return output.getvalue()
+        
+        images = [png(i) for i in range(4)]
+        store = MediaStore(str(tmp_path / 'media'), max_bytes=int(len(images[0]) * 3.5))
+        for number, data in enumerate(images[:3]):
+            store.put(f"{number:02d}key", data)
+            path = store._path(f"{number:02d}key")
+            os.utime(path, (1_000_000 + number, 1_000_000 + number))
+        assert store.get('00key') == images[0]  # Now the most recently used
+        
+        store.put('03key', images[3])
+        
+        assert store.get('01key') is None
+        assert store.get('00key') == images[0]
+        assert store.get('03key') == images[3]
+    
+    def test_save_without_shared_media(self, tmp_path, monkeypatch):
+        """Other openpyxl versions save the usual way instead of through the private writer hook"""
+        import openpyxl
+        from app.core import xlsx
+        monkeypatch.setattr(openpyxl, '__version__', '3.2.0')
+        xlsx._shared_media_writer.cache_clear()
+        try:
+            wb = openpyxl.load_workbook('inn sample.xlsx')
+            xlsx.save_workbook(wb, str(tmp_path / 'plain.xlsx'))
+        finally:
+            xlsx._shared_media_writer.cache_clear()
+        
+        assert openpyxl.load_workbook(str(tmp_path / 'plain.xlsx')).sheetnames == wb.sheetnames
+
+class TestTemplateRegistry:
+    """Test per-tenant templates compiled from mapping files"""
+    
+    def _registry(self, tmp_path, cells):
+        import json
+        import os
+        from app.core.templates import TemplateRegistry
+        mapping = json.load(open('templates/hilldrive.json'))
+        mapping['template'] = os.path.abspath('inn sample.xlsx')
+        mapping['cells'].update(cells)
+        (tmp_path / 'branch.json').write_text(json.dumps(mapping))
+        return TemplateRegistry(str(tmp_path))
+    
+    def test_default_template_anchors(self):
+        """Merged cells are resolved to the top-left cell once, at compile time"""
+        from app.core.tax import TEMPLATE_FORMULAS
+        from app.core.templates import TemplateRegistry
+        registry = TemplateRegistry('templates')
+        template = registry.get('hilldrive')
+        
+        assert 'hilldrive' in registry.names()
+        assert registry.get('hilldrive') is template
+        assert template.anchors['customer_name'] == 'B10'
+        assert template.anchors['address'] == 'B11'
+        assert template.anchors['total_amount'] == 'F33'
+        assert template.anchors['invoice_number'] == 'C8'
+        assert template.formula_cells == set(TEMPLATE_FORMULAS)
+    
+    def test_anchors_match_merged_range_scan(self):
+        """Every field lands in the same cell as a scan of the merged ranges would pick"""
+        from openpyxl.cell.cell import MergedCell
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        writer = HillDriveExcelWriter()
+        
+        def scan_set_cell(ws, field_name, value):
+            ref = writer.cell_map[field_name]
+            if isinstance(ws[ref], MergedCell):
+                for merged_range in ws.merged_cells.ranges:
+                    if ref in merged_range:
+                        ws[merged_range.start_cell.coordinate] = value
+                        return
+            else:
+                ws[ref] = value
+        
+        def values(ws):
+            return {cell.coordinate: cell.value for row in ws.iter_rows() for cell in row}
+        
+        def clone(wb):
+            # New master sheets get the template's merged ranges (see write_to_master)
+            ws = wb.create_sheet()
+            for merged_range in wb.active.merged_cells.ranges:
+                ws.merge_cells(str(merged_range))
+            return ws
+        
+        compiled, scanned = writer.template.load(), writer.template.load()
+        pairs = [(compiled.active, scanned.active), (clone(compiled), clone(scanned))]
+        fields = [field for field, ref in writer.cell_map.items() if ref not in writer.formula_cells]
+        for ws_compiled, ws_scanned in pairs:
+            for field in fields:
+                writer._set_cell(ws_compiled, field, f"value of {field}")
+                scan_set_cell(ws_scanned, field, f"value of {field}")
+            assert values(ws_compiled) == values(ws_scanned)
+        
+        assert any(writer.template.anchors[field] != writer.cell_map[field] for field in fields)
+        assert compiled.active['B10'].value == scanned.active['B10'].value == "value of license_no"
+    
+    def test_tenant_layout(self, tmp_path):
+        """A tenant's mapping decides where fields are written"""
+        import os
+        import openpyxl
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        registry = self._registry(tmp_path, {'vehicle_number': 'A20'})
+        writer = HillDriveExcelWriter.from_template(registry.get('branch'), str(tmp_path / 'branch.xlsx'))
+        
+        writer.write_to_master({'invoice_number': 'BR/2026-27/001', 'customer_name': 'Branch Customer',
+                                'vehicle_number': 'RJ 14 AB 1234', 'total_amount': 1000})
+        ws = openpyxl.load_workbook(writer.master_file).worksheets[-1]
+        assert ws['A20'].value == 'RJ 14 AB 1234'
+        assert ws['F14'].value != 'RJ 14 AB 1234'
+        assert ws['B10'].value == 'Branch Customer'
+        
+        # An edited mapping is compiled again
+        compiled = registry.get('branch')
+        stat = os.stat(tmp_path / 'branch.json')
+        os.utime(tmp_path / 'branch.json', ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        assert registry.get('branch') is not compiled
+    
+    def test_minimal_mapping(self, tmp_path):
+        """Fields a tenant's mapping leaves out are skipped, and the ledger takes them from the booking"""
+        import json
+        import os
+        import openpyxl
+        from app.core.ledger import Ledger
+        from app.core.templates import TemplateRegistry
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        (tmp_path / 'branch.json').write_text(json.dumps({
+            'template': os.path.abspath('inn sample.xlsx'),
+            'cells': {'customer_name': 'C10', 'total_amount': 'F33'},
+        }))
+        template = TemplateRegistry(str(tmp_path)).get('branch')
+        booking = {'invoice_number': 'BR/2026-27/001', 'invoice_date': '25/01/26', 'customer_name': 'Branch Customer',
+                   'address': 'Baner, Pune', 'total_amount': 1050}
+        
+        for renderer in ('openpyxl', 'xml'):
+            writer = HillDriveExcelWriter.from_template(template, renderer=renderer)
+            writer.write(dict(booking), str(tmp_path / f'{renderer}.xlsx'))
+            assert openpyxl.load_workbook(tmp_path / f'{renderer}.xlsx').active['F33'].value == 1050
+        writer = HillDriveExcelWriter.from_template(template, str(tmp_path / 'branch.xlsx'))
+        writer.write_to_master(dict(booking))
+        
+        ws = openpyxl.load_workbook(writer.master_file).worksheets[-1]
+        assert (ws['B10'].value, ws['F33'].value) == ('Branch Customer', 1050)
+        [row] = Ledger.for_master(writer.master_file).rows()
+        assert (row['invoice_number'], row['customer_name'], row['total_amount']) == ('BR/2026-27/001', 'Branch Customer', 1050)
+        # A rebuild cannot find invoice sheets without their number's cell
+        os.remove(Ledger.for_master(writer.master_file).path)
+        assert list(writer.ensure_ledger().rows()) == []
+    
+    def test_invalid_templates(self, tmp_path):
+        """Unknown names and bad cell references are rejected"""
+        from app.core.templates import TemplateError, TemplateNotFoundError
+        registry = self._registry(tmp_path, {'customer_name': 'not-a-cell'})
+        
+        with pytest.raises(TemplateError):
+            registry.get('branch')
+        with pytest.raises(TemplateNotFoundError):
+            registry.get('unknown')
+        with pytest.raises(TemplateNotFoundError):
+            registry.get('../templates/hilldrive')
+
+
+class TestXmlRenderer:
+    """Test direct XML rendering of single invoice files"""
+    
+    BOOKINGS = [
+        {
+            'invoice_number': 'HD/2026-27/101', 'invoice_date': '25/01/26',
+            'customer_name': 'Buen Manejo Del Campo India Pvt. Ltd.', 'mobile_number': '8889302969',
+            'address': 'Office no.4, 2nd Floor, Anmol Pride, Baner, Pune - 411045',
+            'vehicle_name': 'Swift Dzire', 'vehicle_number': 'RJ14AB1234',
+            'start_datetime': '2026-01-25 07:00', 'end_datetime': '2026-01-31 07:00', 'duration_days': 6,
+            'included_km': 600, 'security_deposit': 2500.5, 'total_amount': 20608, 'advance_paid': 10000
+        },
+        {'invoice_number': 'HD/2026-27/102', 'invoice_date': '26/01/26'},
+        {
+            'invoice_number': 'HD/2026-27/103', 'invoice_date': '27/01/26',
+            'customer_name': '  A & B <Travels> "Co"  ', 'address': 'Line 1\nLine 2',
+            'vehicle_number': 'bad\x01chars', 'payment_mode': 'UPI', 'total_amount': 1050.75
+        },
+    ]
+    
+    def _cells(self, path, data_only):
+        from copy import copy
+        import openpyxl
+        ws = openpyxl.load_workbook(path, data_only=data_only).active
+        cells = {
+            cell.coordinate: (cell.value, cell.number_format, copy(cell.font), copy(cell.fill),
+                              copy(cell.border), copy(cell.alignment), copy(cell.protection))
+            for row in ws.iter_rows() for cell in row
+        }
+        return cells, sorted(str(r) for r in ws.merged_cells.ranges), len(ws._images)
+    
+    def test_matches_openpyxl_output(self, tmp_path):
+        """Every cell, formula result and style equals the openpyxl output"""
+        import zipfile
+        from app.core.integrity import check_workbook
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        reference = HillDriveExcelWriter('inn sample.xlsx')
+        writer = HillDriveExcelWriter('inn sample.xlsx', renderer='xml')
+        
+        for number, booking in enumerate(self.BOOKINGS):
+            expected, rendered = str(tmp_path / f'openpyxl_{number}.xlsx'), str(tmp_path / f'xml_{number}.xlsx')
+            reference.write(dict(booking), expected)
+            writer.write(dict(booking), rendered)
+            for data_only in (False, True):
+                assert self._cells(rendered, data_only) == self._cells(expected, data_only)
+            assert check_workbook(rendered)['ok']
+        
+        # Everything but the sheet is the template's, unchanged
+        sheet_part = writer.template.xml_template.sheet_part
+        with zipfile.ZipFile('inn sample.xlsx') as template, zipfile.ZipFile(rendered) as zf:
+            assert sorted(zf.namelist()) == sorted(template.namelist())
+            for name in template.namelist():
+                if name != sheet_part:
+                    assert zf.read(name) == template.read(name), name
+    
+    def test_falls_back_to_openpyxl(self, tmp_path):
+        """Values only openpyxl can write take the openpyxl path"""
+        import datetime
+        import zipfile
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        writer = HillDriveExcelWriter('inn sample.xlsx', renderer='xml')
+        booking = {'invoice_number': 'HD/2026-27/104', 'customer_name': 'Date Customer',
+                   'duration_days': datetime.date(2026, 1, 25)}
+        
+        writer.write(dict(booking), str(tmp_path / 'fallback.xlsx'))
+        HillDriveExcelWriter('inn sample.xlsx').write(dict(booking), str(tmp_path / 'expected.xlsx'))
+        
+        assert self._cells(tmp_path / 'fallback.xlsx', False) == self._cells(tmp_path / 'expected.xlsx', False)
+        with zipfile.ZipFile('inn sample.xlsx') as template, zipfile.ZipFile(tmp_path / 'fallback.xlsx') as zf:
+            assert zf.read('xl/styles.xml') != template.read('xl/styles.xml')
+
+
+class TestLocalBackup:
+    """Test incremental, deduplicated invoice backups"""
+    
+    def _sources(self, tmp_path, count=3):
+        import json
+        import sqlite3
+        from hilldrive_excel_mapper import HillDriveExcelWriter
+        invoices = tmp_path / 'invoices'
+        invoices.mkdir()
+        writer = HillDriveExcelWriter('inn sample.xlsx', str(invoices / 'all.xlsx'))
+        for number in range(count):
+            writer.write_to_master({
+                'invoice_number': f'HD/2026-27/00{number + 1}', 'customer_name': f'Customer {number}',
+                'total_amount': 1000 + number
+            })
+        conn = sqlite3.connect(invoices / 'index.db')
+        with conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE invoices (id TEXT)")
+            conn.execute("INSERT INTO invoices VALUES ('INV-1')")
+        (invoices / '.sheet_cache').mkdir()
+        (invoices / '.sheet_cache' / 'INV-1.xlsx').write_bytes(b'cached')
+        (tmp_path / 'counter.json').write_text(json.dumps({'last_invoice_number': count}))
+        return writer, conn, [str(invoices), str(tmp_path / 'counter.json')]
+    
+    def test_snapshot_and_restore(self, tmp_path, monkeypatch):
+        """A restored snapshot matches the files byte for byte, skipping caches"""
+        import sqlite3
+        from local_backup import LocalBackup
+        writer, conn, sources = self._sources(tmp_path)
+        backup = LocalBackup(str(tmp_path / 'backup'))
+        
+        manifest = backup.snapshot(sources)
+        restored = tmp_path / 'restored'
+        monkeypatch.chdir('/')
+        count = backup.restore('latest', str(restored))
+        
+        assert count == manifest['stats']['files'] == 4
+        with open(writer.master_file, 'rb') as f:
+            assert (restored / writer.master_file.lstrip('/')).read_bytes() == f.read()
+        assert (restored / sources[1].lstrip('/')).read_text() == '{"last_invoice_number": 3}'
+        copy = sqlite3.connect(restored / sources[0].lstrip('/') / 'index.db')
+        assert copy.execute("SELECT id FROM invoices").fetchall() == [('INV-1',)]
+        assert not (restored / sources[0].lstrip('/') / '.sheet_cache').exists()
+        conn.close()
+    
+    def test_incremental_snapshot_dedups_master(self, tmp_path):
+        """Adding a sheet stores the changed parts, not the whole master again"""
+        import os
+        from local_backup import LocalBackup
+        writer, conn, sources = self._sources(tmp_path, count=5)
+        backup = LocalBackup(str(tmp_path / 'backup'))
+        first = backup.snapshot(sources)['stats']
+        
+        unchanged = backup.snapshot(sources)['stats']
+        writer.write_to_master({'invoice_number': 'HD/2026-27/006', 'customer_name': 'New', 'total_amount': 7})
+        grown = backup.snapshot(sources)['stats']
+        
+        assert unchanged['reused_files'] == 3  # all but the database
+        assert unchanged['new_chunks'] == 0
+        assert grown['stored_bytes'] < os.path.getsize(writer.master_file) / 4
+        assert grown['stored_bytes'] < first['stored_bytes'] / 4
+        conn.close()
+    
+    def test_restore_detects_corrupt_chunk(self, tmp_path):
+        """A damaged chunk fails the restore instead of writing bad data"""
+        import os
+        from local_backup import LocalBackup
+        backup = LocalBackup(str(tmp_path / 'backup'))
+        (tmp_path / 'notes.txt').write_bytes(b'invoice notes ' * 1000)
+        backup.snapshot([str(tmp_path / 'notes.txt')])
+        for directory, _, files in os.walk(backup.chunk_dir):
+            for name in files:
+                with open(os.path.join(directory, name), 'r+b') as f:
+                    f.seek(5)
+                    f.write(b'XX')
+        
+        with pytest.raises(Exception):
+            backup.restore('latest', str(tmp_path / 'restored'))
+        assert not os.path.exists(tmp_path / 'restored' / str(tmp_path / 'notes.txt').lstrip('/'))
+    
+    def test_prune_removes_unused_chunks(self, tmp_path):
+        """Pruning keeps the newest snapshots and deletes chunks only they used"""
+        import os
+        from local_backup import LocalBackup
+        backup = LocalBackup(str(tmp_path / 'backup'))
+        source = tmp_path / 'notes.txt'
+        for text in (b'first ' * 1000, b'second ' * 1000, b'third ' * 1000):
+            source.write_bytes(text)
+            backup.snapshot([str(source)])
+        
+        result = backup.prune(keep=1)
+        
+        assert result == {'snapshots': 2, 'chunks': 2}
+        assert len(backup.list_snapshots()) == 1
+        backup.restore('latest', str(tmp_path / 'restored'))
+        assert (tmp_path / 'restored' / str(source).lstrip('/')).read_bytes() == b'third ' * 1000
+    
+    def test_prune_waits_for_lock_held_elsewhere(self, tmp_path):
+        """Another process holding the backup root's lock (a running snapshot) holds off pruning"""
+        import threading
+        fcntl = pytest.importorskip('fcntl')
+        from local_backup import LocalBackup
+        backup = LocalBackup(str(tmp_path / 'backup'))
+        (tmp_path / 'notes.txt').write_bytes(b'invoice notes ' * 1000)
+        backup.snapshot([str(tmp_path / 'notes.txt')])
+        
+        with open(tmp_path / 'backup' / '.lock', 'a+b') as held:
+            fcntl.flock(held.fileno(), fcntl.LOCK_EX)
+            pruning = threading.Thread(target=backup.prune, kwargs={'keep': 0})
+            pruning.start()
+            pruning.join(timeout=0.3)
+            assert pruning.is_alive()
+            assert len(backup.list_snapshots()) == 1
+            fcntl.flock(held.fileno(), fcntl.LOCK_UN)
+        pruning.join(timeout=5)
+        
+        assert not pruning.is_alive()
+        assert backup.list_snapshots() == []
+
+
+class TestStructuredLogging:
+    """Test structured log formatting and masking"""
+    
+    def _record(self, **extra):
+        import logging
+        record = logging.LogRecord('hilldrive.test', logging.INFO, __file__, 1, "Added %s", ('sheet',), None)
+        record.request_id = 'abc123'
+        record.__dict__.update(extra)
+        return record
+    
+    def test_json_format(self):
+        """JSON lines carry level, request ID and extra fields"""
+        import json
+        from app.core.log import StructuredFormatter
+        
+        entry = json.loads(StructuredFormatter('json').format(self._record(sheet_count=3)))
+        
+        assert entry['level'] == 'INFO'
+        assert entry['request_id'] == 'abc123'
+        assert entry['msg'] == 'Added sheet'
+        assert entry['sheet_count'] == 3
+    
+    def test_text_format(self):
+        """Text lines end with key=value fields"""
+        from app.core.log import StructuredFormatter
+        
+        line = StructuredFormatter('text').format(self._record(sheet='HD-0001'))
+        
+        assert '[abc123] Added sheet' in line
+        assert line.endswith("sheet='HD-0001'")
+    
+    def test_queue_handler_leaves_record_unchanged(self):
+        """The record queued for the listener is a copy; other handlers see the original"""
+        import queue
+        from app.core.log import _DeferredQueueHandler
+        
+        record = self._record()
+        queued = _DeferredQueueHandler(queue.Queue()).prepare(record)
+        
+        assert (queued.msg, queued.args) == ('Added sheet', None)
+        assert (record.msg, record.args) == ('Added %s', ('sheet',))
+    
+    def test_customer_fields_masked(self, monkeypatch):
+        """Customer details are masked unless explicitly enabled"""
+        from config import settings
+        from app.core.log import customer_fields
+        
+        monkeypatch.setattr(settings, 'log_customer_data', False)
+        fields = customer_fields({'customer_name': 'Rahul Sharma', 'mobile_number': '9876543210'})
+        assert fields['customer_name'] == 'Ra***ma'
+        assert fields['mobile_number'] == '98***10'
+        assert fields['address'] is None
+        
+        monkeypatch.setattr(settings, 'log_customer_data', True)
+        assert customer_fields({'customer_name': 'Rahul Sharma'})['customer_name'] == 'Rahul Sharma'
+
+
+class TestLazyStartup:
+    """Test that heavy dependencies are loaded on first use"""
+    
+    def test_services_import_skips_heavy_modules(self):
+        """Importing the services does not import openpyxl, Pillow or the Gemini SDK"""
+        import os
+        import subprocess
+        import sys
+        
+        code = (
+            "import sys, app.services; "
+            "print('loaded:' + ','.join(m for m in ('openpyxl', 'PIL', 'google.generativeai') if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True, text=True, check=True
+        )
+        
+        # Service start-up may log to stdout first
+        assert result.stdout.splitlines()[-1] == 'loaded:'
+    
+    def test_warm_up(self, monkeypatch):
+        """Warm-up reports per-step timings and skips Gemini when disabled"""
+        import sys
+        from config import settings
+        from app.services import warm_up
+        
+        monkeypatch.setattr(settings, 'use_gemini', False)
+        timings = warm_up()
+        
+        assert set(timings) == {'excel', 'images', 'index', 'gemini'}
+        assert all(seconds is not None for seconds in timings.values())
+        assert 'openpyxl' in sys.modules
+    
+    def test_warm_up_step_failure_is_logged(self, monkeypatch):
+        """A failing step is reported as None without stopping the others"""
+        from app.services import warmup
+        
+        def broken():
+            raise RuntimeError("template missing")
+        
+        monkeypatch.setitem(warmup.STEPS, 'excel', broken)
+        timings = warmup.warm_up()
+        
+        assert timings['excel'] is None
+        assert timings['index'] is not None
 
 
 # Sample data for testing
@@ -107,6 +1579,130 @@ Start date and time - 25/01/2026 7am to 31/01/2026 7am
 """
 
 
+class TestCustomerProfiles:
+    """Test customer profiles and the repeat-customer extraction shortcut"""
+    
+    PROFILE = {
+        'customer_name': 'Buen Manejo Del Campo India Pvt. Ltd.',
+        'company_name': 'Buen Manejo Del Campo India Pvt. Ltd.',
+        'mobile_number': '+91 88893 02969',
+        'gstin': '27aahcb7551k1zb',
+        'address': 'Office no.4, 2nd Floor, Anmol Pride, Baner, Pune - 411045',
+    }
+    
+    def _customers(self, tmp_path, monkeypatch):
+        import importlib
+        from app.services.customer_service import CustomerService
+        # The package attribute is the service instance, not its module
+        extraction_module = importlib.import_module('app.services.extraction_service')
+        customers = CustomerService(str(tmp_path / 'customers.db'))
+        monkeypatch.setattr(extraction_module, 'customer_service', customers)
+        return customers
+    
+    def _llm(self, monkeypatch, result):
+        from config import settings
+        from openrouter_service import openrouter_extractor
+        calls = []
+        
+        def extract(ocr_text, user_text=""):
+            calls.append(ocr_text)
+            return dict(result)
+        monkeypatch.setattr(settings, 'use_openrouter', True)
+        monkeypatch.setattr(openrouter_extractor, 'enabled', True)
+        monkeypatch.setattr(openrouter_extractor, 'extract_invoice_data', extract)
+        return calls
+    
+    def test_remember_and_lookup(self, tmp_path):
+        """Profiles are found by phone in any format, or by GSTIN alone"""
+        from app.services.customer_service import CustomerService
+        customers = CustomerService(str(tmp_path / 'customers.db'))
+        assert customers.remember(self.PROFILE)
+        assert customers.remember({**self.PROFILE, 'address': None})
+        assert not customers.remember({'customer_name': 'No Contact'})
+        
+        by_phone = customers.lookup('8889302969')
+        by_gstin = customers.lookup(gstin='27 AAHCB 7551K1ZB')
+        
+        assert by_phone['match'] == 'phone'
+        assert by_phone['address'] == self.PROFILE['address']
+        assert by_phone['invoice_count'] == 2
+        assert (by_gstin['match'], by_gstin['id']) == ('gstin', by_phone['id'])
+        assert customers.lookup('9999999999') is None
+    
+    def test_known_customer_skips_llm(self, tmp_path, monkeypatch):
+        """A returning customer's complete booking text needs no LLM call"""
+        customers = self._customers(tmp_path, monkeypatch)
+        customers.remember(self.PROFILE)
+        calls = self._llm(monkeypatch, {})
+        
+        data = extraction_service.extract_booking_data(SAMPLE_OCR_TEXT, SAMPLE_USER_TEXT)
+        
+        assert calls == []
+        assert data['known_customer'] is True
+        assert 'Anmol Pride' in data['address']
+        assert data['customer_name'].startswith('Buen Manejo')
+        assert data['total_amount'] == 20608
+    
+    def test_known_customer_with_new_details(self, tmp_path, monkeypatch):
+        """A returning customer's new company and address replace the stored ones"""
+        customers = self._customers(tmp_path, monkeypatch)
+        customers.remember({**self.PROFILE, 'customer_name': 'Old Co', 'company_name': 'Old Co', 'gstin': None})
+        calls = self._llm(monkeypatch, {})
+        ocr_text = "Bill To:\nNew Co Pvt Ltd\nPlot 12, Hinjewadi Phase 1,\nPune - 411057\n"
+        user_text = SAMPLE_USER_TEXT.replace("Buen manejo del Campo India pvt . Ltd", "New Co Pvt Ltd")
+        
+        data = extraction_service.extract_booking_data(ocr_text, user_text)
+        
+        assert calls == []
+        assert data['known_customer'] is True
+        assert data['customer_name'] == 'New Co Pvt Ltd'
+        assert 'Hinjewadi' in data['address'] and 'Anmol Pride' not in data['address']
+        
+        customers.remember(data)
+        profile = customers.lookup('8889302969')
+        assert (profile['customer_name'], profile['address']) == (data['customer_name'], data['address'])
+    
+    def test_known_customer_shortens_llm_call(self, tmp_path, monkeypatch):
+        """Without the booking essentials the LLM is still asked, without the OCR text"""
+        customers = self._customers(tmp_path, monkeypatch)
+        customers.remember(self.PROFILE)
+        calls = self._llm(monkeypatch, {'mobile_number': '8889302969', 'total_amount': 5000, 'address': None})
+        
+        data = extraction_service.extract_booking_data(SAMPLE_OCR_TEXT, "Mobile - 8889302969\nTotal:-5000")
+        
+        assert calls == [""]
+        assert data['total_amount'] == 5000
+        # Left empty by the LLM; pattern matching found it in the document
+        assert 'Anmol Pride' in data['address']
+    
+    def test_known_customer_keeps_pattern_data(self, tmp_path, monkeypatch):
+        """Fields the LLM misses without the OCR text still come from pattern matching"""
+        customers = self._customers(tmp_path, monkeypatch)
+        customers.remember({**self.PROFILE, 'mobile_number': '9876543210'})
+        # What a failed provider returns for the typed text alone
+        calls = self._llm(monkeypatch, {'mobile_number': None, 'total_amount': None})
+        
+        data = extraction_service.extract_booking_data("Cx no: 9876543210", "")
+        
+        assert calls == [""]
+        assert data['mobile_number'] == "9876543210"
+        assert data['address'] == self.PROFILE['address']
+    
+    def test_llm_output_matches_customer(self, tmp_path, monkeypatch):
+        """A customer recognized only from the LLM output gets the stored details"""
+        customers = self._customers(tmp_path, monkeypatch)
+        customers.remember(self.PROFILE)
+        calls = self._llm(monkeypatch, {'customer_name': 'Rahul', 'gstin': '27AAHCB7551K1ZB', 'total_amount': 900})
+        
+        data = extraction_service.extract_booking_data("scan without details", "Total 900")
+        
+        assert calls == ["scan without details"]
+        # A GSTIN match fills in the company, not the person booking
+        assert data['customer_name'] == 'Rahul'
+        assert data['company_name'] == self.PROFILE['company_name']
+        assert data['address'] == self.PROFILE['address']
+
+
 class TestFullExtraction:
     """Test complete extraction pipeline"""
     